@@ -1,9 +1,15 @@
 import boto3
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
 import hashlib
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import math
 import os
 import requests
+import sqlite3
+import threading
 import time
 from pathlib import Path
 import shutil
@@ -15,6 +21,7 @@ AWS_KEY_ID="" # ID ключа AWS
 AWS_SECRET_KEY="" # секретный ключ AWS
 BUCKET_NAME = "" # имя бакета
 REGION = "ru-central1" # регион бакета
+S3_ENDPOINT_URL = "https://storage.yandexcloud.net" # адрес S3 (для проверки можно указать локальный minio/moto)
 
 # Яндекс Диск конфигурация (OAuth токен организации)
 YANDEX_ORG_TOKEN = "" # токен с правами на доступ к Диску
@@ -32,9 +39,24 @@ LOG_FILE = None
 CSV_FILE = None
 LOG_PART = 1
 
+# Конвейерный режим: файл скачивается с Диска сразу частями в S3, без временного файла,
+# несколько файлов и частей передаются одновременно
+PIPELINED = True # False — прежний режим: по одному файлу через временную папку
+PIPELINE_FILE_WORKERS = 4 # сколько файлов скачивается одновременно
+PIPELINE_PART_WORKERS = 8 # сколько частей загружается в S3 одновременно
+PIPELINE_MAX_MEMORY = 256 * 1024 * 1024 # предел памяти под скачанные, но ещё не загруженные части
+SKIP_UNCHANGED = True # не загружать файлы, у которых md5 и размер совпадают с уже загруженными
+MANIFEST_DB = "backup_to_s3_manifest.sqlite3" # журнал загруженных файлов рядом со скриптом ("" — не вести)
+
+S3_MAX_PARTS = 10000
+
 # Константы API
 VIRTUAL_DISKS_API_BASE = "https://cloud-api.yandex.net/v1/disk/virtual-disks"
 
+output_lock = threading.RLock()
+stats_lock = threading.Lock()
+http_sessions = threading.local()
+
 
 def init_logging():
     """Инициализирует систему логирования"""
@@ -84,7 +106,7 @@ def init_csv():
 def write_csv_row(row_data):
     """Добавляет строку в CSV файл"""
     try:
-        with open(CSV_FILE, 'a', newline='', encoding='utf-8-sig') as f:
+        with output_lock, open(CSV_FILE, 'a', newline='', encoding='utf-8-sig') as f:
             writer = csv.writer(f)
             writer.writerow(row_data)
     except Exception as e:
@@ -106,13 +128,16 @@ def check_log_rotation():
 def log_message(message, skip_rotation_check=False):
     """Записывает сообщение в лог и выводит в консоль"""
     timestamp_msg = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | {message}"
-    print(timestamp_msg)
     
-    if not skip_rotation_check:
-        check_log_rotation()
-    
-    with open(LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(timestamp_msg + '\n')
+    # в конвейерном режиме пишут несколько потоков
+    with output_lock:
+        print(timestamp_msg)
+        
+        if not skip_rotation_check:
+            check_log_rotation()
+        
+        with open(LOG_FILE, 'a', encoding='utf-8') as f:
+            f.write(timestamp_msg + '\n')
 
 
 def calculate_md5(file_path):
@@ -195,7 +220,7 @@ def get_vd_metadata(vd_hash, inner_path, token, limit=1000, offset=0):
         'path': full_path,
         'limit': limit,
         'offset': offset,
-        'fields': '_embedded.items.name,_embedded.items.path,_embedded.items.type,_embedded.items.size,_embedded.items.created,_embedded.items.modified,_embedded.items.media_type,_embedded.total,name,path,type'
+        'fields': '_embedded.items.name,_embedded.items.path,_embedded.items.type,_embedded.items.size,_embedded.items.created,_embedded.items.modified,_embedded.items.media_type,_embedded.items.md5,_embedded.total,name,path,type'
     }
     
     headers = {
@@ -667,6 +692,492 @@ def process_vd_folder_recursive(vd_hash, inner_path, vd_name, s3_base_path, toke
     gc.collect()
 
 
+def http_session():
+    """Сессия requests своего потока: соединения с Диском переиспользуются"""
+    session = getattr(http_sessions, 'session', None)
+    if session is None:
+        session = requests.Session()
+        http_sessions.session = session
+    return session
+
+
+def add_stats(stats, **values):
+    """Потокобезопасно увеличивает счётчики статистики"""
+    with stats_lock:
+        for key, value in values.items():
+            stats[key] = stats.get(key, 0) + value
+
+
+class MemoryBudget:
+    """
+    Ограничение памяти под части файлов в конвейерном режиме
+
+    Поток, скачивающий файл, занимает место до чтения части и ждёт, пока
+    загруженные в S3 части его не освободят.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        with self.condition:
+            # часть больше всего предела пропускаем, когда память свободна
+            while self.used and self.used + size > self.limit:
+                self.condition.wait()
+            self.used += size
+
+    def release(self, size):
+        if not size:
+            return
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+class UploadManifest:
+    """
+    Журнал загруженных файлов (SQLite): ключ в S3 → md5 и размер файла на Диске
+
+    По нему повторный запуск пропускает неизменённые файлы без запросов к S3.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                bucket TEXT NOT NULL,
+                key TEXT NOT NULL,
+                md5 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                uploaded_at TEXT,
+                PRIMARY KEY (bucket, key)
+            )
+        """)
+        self.conn.commit()
+
+    def matches(self, key, md5, size):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT md5, size FROM uploads WHERE bucket = ? AND key = ?",
+                (BUCKET_NAME, key)
+            ).fetchone()
+        return row is not None and row[0] == md5 and row[1] == size
+
+    def record(self, key, md5, size, etag):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                (BUCKET_NAME, key, md5, size, etag, datetime.now().isoformat(timespec='seconds'))
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def is_unchanged_in_s3(s3_client, s3_object_path, disk_md5, size):
+    """
+    Проверяет, что в S3 уже лежит тот же файл
+
+    Сравнивается размер и md5 из метаданных объекта (disk-md5), а у объектов,
+    загруженных одним запросом без этих метаданных, — ETag.
+    """
+    try:
+        head = s3_client.head_object(Bucket=BUCKET_NAME, Key=s3_object_path)
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code not in ('404', 'NoSuchKey', 'NotFound'):
+            log_message(f"WARNING: Cannot check S3 object {s3_object_path}: {e}")
+        return False
+    
+    if head.get('ContentLength') != size:
+        return False
+    
+    if head.get('Metadata', {}).get('disk-md5') == disk_md5:
+        return True
+    
+    etag = head.get('ETag', '').strip('"')
+    return '-' not in etag and etag.lower() == disk_md5.lower()
+
+
+def get_part_size(file_size):
+    """Размер части: MULTIPART_CHUNK_SIZE, но не больше S3_MAX_PARTS частей на файл"""
+    part_size = MULTIPART_CHUNK_SIZE
+    if file_size > part_size * S3_MAX_PARTS:
+        mb = 1024 * 1024
+        part_size = math.ceil(file_size / S3_MAX_PARTS / mb) * mb
+    return part_size
+
+
+def read_part(stream, part_size):
+    """Читает из ответа до part_size байт (меньше — только в конце файла)"""
+    buffer = bytearray()
+    while len(buffer) < part_size:
+        chunk = stream.read(min(1024 * 1024, part_size - len(buffer)), decode_content=True)
+        if not chunk:
+            break
+        buffer += chunk
+    return buffer
+
+
+def upload_part_from_memory(s3_client, s3_object_path, upload_id, part_number, data, budget):
+    """Загружает одну часть multipart upload и освобождает её место в MemoryBudget"""
+    try:
+        part_md5 = base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')
+        response = s3_client.upload_part(
+            Bucket=BUCKET_NAME,
+            Key=s3_object_path,
+            PartNumber=part_number,
+            UploadId=upload_id,
+            Body=data,
+            ContentMD5=part_md5
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+    finally:
+        budget.release(len(data))
+
+
+def stream_file_to_s3(download_url, s3_object_path, s3_client, file_size, disk_md5, budget, part_pool):
+    """
+    Скачивает файл и сразу загружает его в S3, не сохраняя на диск
+
+    Файл читается частями по get_part_size(): пока одна часть загружается
+    в part_pool, скачивается следующая. Файл из одной части загружается
+    обычным put_object. Перед завершением multipart upload проверяется, что
+    размер и md5 скачанного совпали с данными Диска.
+
+    Возвращает (success, md5_hex, upload_method, error_message)
+    """
+    part_size = get_part_size(file_size)
+    metadata = {'disk-size': str(file_size)}
+    if disk_md5:
+        metadata['disk-md5'] = disk_md5
+    
+    md5_hash = hashlib.md5()
+    downloaded = 0
+    upload_id = None
+    part_number = 1
+    futures = []
+    
+    response = http_session().get(download_url, stream=True, timeout=60, allow_redirects=True)
+    try:
+        response.raise_for_status()
+        
+        while True:
+            budget.acquire(part_size)
+            try:
+                data = read_part(response.raw, part_size)
+            except Exception:
+                budget.release(part_size)
+                raise
+            budget.release(part_size - len(data))
+            
+            md5_hash.update(data)
+            downloaded += len(data)
+            
+            if upload_id is None and len(data) < part_size:
+                # весь файл поместился в одну часть
+                try:
+                    md5_hex = md5_hash.hexdigest()
+                    if file_size and downloaded != file_size:
+                        return False, md5_hex, "standard", f"Size mismatch: Disk {file_size}, downloaded {downloaded}"
+                    if disk_md5 and md5_hex != disk_md5:
+                        return False, md5_hex, "standard", f"MD5 mismatch: Disk {disk_md5}, downloaded {md5_hex}"
+                    put_response = s3_client.put_object(
+                        Bucket=BUCKET_NAME,
+                        Key=s3_object_path,
+                        Body=data,
+                        ContentMD5=base64.b64encode(md5_hash.digest()).decode('utf-8'),
+                        Metadata=metadata
+                    )
+                finally:
+                    budget.release(len(data))
+                etag = put_response['ETag'].strip('"')
+                if etag.lower() != md5_hex:
+                    return False, md5_hex, "standard", f"MD5 mismatch: expected {md5_hex}, got {etag}"
+                return True, md5_hex, "standard", ''
+            
+            if not data:
+                break
+            
+            try:
+                if upload_id is None:
+                    upload_id = s3_client.create_multipart_upload(
+                        Bucket=BUCKET_NAME,
+                        Key=s3_object_path,
+                        Metadata=metadata
+                    )['UploadId']
+                    log_message(f"  Multipart upload started: {s3_object_path} ({file_size/1024/1024:.2f} MB, parts of {part_size/1024/1024:.0f} MB)")
+                
+                futures.append(part_pool.submit(
+                    upload_part_from_memory, s3_client, s3_object_path, upload_id, part_number, data, budget
+                ))
+            except Exception:
+                # часть не ушла в part_pool — её место освобождаем сами
+                budget.release(len(data))
+                raise
+            del data
+            
+            if any(f.done() and f.exception() for f in futures):
+                break
+            if part_number % 10 == 0 and file_size:
+                log_message(f"  {s3_object_path}: {downloaded/1024/1024:.0f} MB / {file_size/1024/1024:.0f} MB")
+            part_number += 1
+        
+        # дожидаемся всех частей, в том числе при ошибке: abort должен быть последним
+        parts = []
+        part_error = None
+        for future in futures:
+            try:
+                parts.append(future.result())
+            except Exception as e:
+                part_error = part_error or e
+        futures = []
+        
+        md5_hex = md5_hash.hexdigest()
+        if part_error:
+            error_msg = f"Part upload failed: {part_error}"
+        elif file_size and downloaded != file_size:
+            error_msg = f"Size mismatch: Disk {file_size}, downloaded {downloaded}"
+        elif disk_md5 and md5_hex != disk_md5:
+            error_msg = f"MD5 mismatch: Disk {disk_md5}, downloaded {md5_hex}"
+        else:
+            error_msg = ''
+        
+        if error_msg:
+            s3_client.abort_multipart_upload(Bucket=BUCKET_NAME, Key=s3_object_path, UploadId=upload_id)
+            upload_id = None
+            return False, md5_hex, "multipart", error_msg
+        
+        s3_client.complete_multipart_upload(
+            Bucket=BUCKET_NAME,
+            Key=s3_object_path,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+        upload_id = None
+        return True, md5_hex, "multipart", ''
+    
+    finally:
+        response.close()
+        if upload_id is not None:
+            for future in futures:
+                future.exception()
+            try:
+                s3_client.abort_multipart_upload(Bucket=BUCKET_NAME, Key=s3_object_path, UploadId=upload_id)
+            except Exception as e:
+                log_message(f"WARNING: Cannot abort multipart upload {upload_id}: {e}")
+
+
+def write_file_csv_row(vd_name, vd_hash, item, s3_object_path, status_text, method, md5_value, start_time, error_msg):
+    """Строка CSV для файла в конвейерном режиме"""
+    item_size = item.get('size', 0)
+    write_csv_row([
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        vd_name,
+        vd_hash,
+        'file',
+        item.get('name'),
+        extract_inner_path(normalize_vd_path(item.get('path'))),
+        s3_object_path,
+        item_size,
+        f"{item_size/1024/1024:.2f}",
+        status_text,
+        method if method else '-',
+        md5_value if md5_value else '-',
+        f"{time.time() - start_time:.2f}",
+        error_msg
+    ])
+
+
+def pipeline_process_file(item, vd_name, vd_hash, s3_base_path, token, s3_client, manifest, budget, part_pool, stats):
+    """Переносит один файл в конвейерном режиме (выполняется в потоке PIPELINE_FILE_WORKERS)"""
+    start_time = time.time()
+    item_size = item.get('size', 0)
+    disk_md5 = item.get('md5')
+    item_path = normalize_vd_path(item.get('path'))
+    s3_object_path = normalize_s3_path(s3_base_path, vd_name, extract_inner_path(item_path).strip('/'))
+    
+    try:
+        if SKIP_UNCHANGED and disk_md5:
+            unchanged = manifest is not None and manifest.matches(s3_object_path, disk_md5, item_size)
+            if not unchanged and is_unchanged_in_s3(s3_client, s3_object_path, disk_md5, item_size):
+                unchanged = True
+                if manifest is not None:
+                    manifest.record(s3_object_path, disk_md5, item_size, None)
+            if unchanged:
+                log_message(f"  = Unchanged, skipped: {s3_object_path}")
+                add_stats(stats, files_skipped=1, bytes_skipped=item_size)
+                write_file_csv_row(vd_name, vd_hash, item, s3_object_path, 'Skipped (unchanged)',
+                                   None, disk_md5, start_time, '')
+                return
+        
+        download_link = get_vd_download_link(item_path, token)
+        if not download_link:
+            add_stats(stats, files_failed=1)
+            write_file_csv_row(vd_name, vd_hash, item, s3_object_path, 'Download link failed',
+                               None, None, start_time, 'Cannot get download link')
+            return
+        
+        success, md5_value, method, error_msg = stream_file_to_s3(
+            download_link, s3_object_path, s3_client, item_size, disk_md5, budget, part_pool
+        )
+    except Exception as e:
+        success, md5_value, method, error_msg = False, None, None, str(e)
+    
+    if success:
+        log_message(f"  ✓ Uploaded ({method}): {s3_object_path} ({item_size/1024/1024:.2f} MB, {time.time() - start_time:.2f} s)")
+        add_stats(stats, files_uploaded=1, bytes_uploaded=item_size)
+        if manifest is not None:
+            manifest.record(s3_object_path, md5_value, item_size, None)
+        status_text = 'Uploaded to S3'
+    else:
+        log_message(f"  ✗ FAILED: {s3_object_path}: {error_msg}")
+        add_stats(stats, files_failed=1)
+        status_text = 'S3 upload failed'
+    
+    write_file_csv_row(vd_name, vd_hash, item, s3_object_path, status_text,
+                       method, md5_value, start_time, error_msg)
+
+
+def get_vd_folder_items(vd_hash, inner_path, token, limit=1000):
+    """
+    Все элементы папки постранично (get_vd_metadata отдаёт не больше limit за раз)
+
+    Возвращает (метаданные папки, элементы) или (None, None) при ошибке.
+    """
+    metadata = None
+    items = []
+    offset = 0
+    while True:
+        page = get_vd_metadata(vd_hash, inner_path, token, limit=limit, offset=offset)
+        if not page:
+            return None, None
+        if metadata is None:
+            metadata = page
+        if page.get('type') != 'dir':
+            return metadata, []
+        
+        embedded = page.get('_embedded', {})
+        page_items = embedded.get('items', [])
+        items.extend(page_items)
+        offset += len(page_items)
+        if len(page_items) < limit or offset >= embedded.get('total', 0):
+            break
+    
+    metadata.pop('_embedded', None)
+    return metadata, items
+
+
+def process_vd_folder_pipelined(vd_hash, inner_path, vd_name, s3_base_path, token, submit_file, stats):
+    """
+    Обходит папку виртуального диска и отдаёт файлы в конвейер (submit_file)
+
+    Папки читаются в этом потоке, файлы переносятся параллельно.
+    """
+    relative_path = inner_path.strip('/')
+    s3_path = normalize_s3_path(s3_base_path, vd_name, relative_path)
+    folder_start_time = time.time()
+    
+    log_message(f"Processing VD folder: {inner_path}")
+    metadata, items = get_vd_folder_items(vd_hash, inner_path, token)
+    
+    if metadata is None:
+        log_message("ERROR: Cannot get metadata")
+        write_csv_row([
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            vd_name,
+            vd_hash,
+            'folder',
+            os.path.basename(inner_path) if inner_path != '/' else 'root',
+            inner_path,
+            s3_path,
+            0,
+            0,
+            'Metadata fetch failed',
+            '-',
+            '-',
+            f"{time.time() - folder_start_time:.2f}",
+            'Cannot get metadata'
+        ])
+        return
+    
+    if metadata.get('type') != 'dir':
+        log_message("ERROR: Not a directory")
+        return
+    
+    write_csv_row([
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        vd_name,
+        vd_hash,
+        'folder',
+        metadata.get('name', 'root'),
+        inner_path,
+        s3_path,
+        '-',
+        '-',
+        'Processed',
+        '-',
+        '-',
+        f"{time.time() - folder_start_time:.2f}",
+        ''
+    ])
+    
+    log_message(f"Found {len(items)} items in {inner_path}")
+    
+    for item in items:
+        if item.get('type') == 'dir':
+            add_stats(stats, folders=1)
+            item_inner_path = extract_inner_path(normalize_vd_path(item.get('path')))
+            process_vd_folder_pipelined(vd_hash, item_inner_path, vd_name, s3_base_path, token, submit_file, stats)
+        elif item.get('type') == 'file':
+            add_stats(stats, files_total=1)
+            submit_file(item)
+
+
+def sync_vd_pipelined(vd_hash, vd_name, s3_base_path, token, s3_client, stats):
+    """
+    Конвейерный перенос виртуального диска в S3
+
+    PIPELINE_FILE_WORKERS потоков скачивают файлы, PIPELINE_PART_WORKERS
+    потоков загружают части; в памяти одновременно не больше
+    PIPELINE_MAX_MEMORY байт частей. Очередь файлов ограничена, чтобы обход
+    большого Диска не уходил далеко вперёд передачи.
+    """
+    manifest = None
+    if MANIFEST_DB:
+        manifest_path = Path(__file__).parent.resolve() / MANIFEST_DB
+        manifest = UploadManifest(str(manifest_path))
+        log_message(f"Manifest:              {manifest_path}")
+    
+    budget = MemoryBudget(PIPELINE_MAX_MEMORY)
+    file_slots = threading.BoundedSemaphore(PIPELINE_FILE_WORKERS * 2)
+    
+    try:
+        with ThreadPoolExecutor(max_workers=PIPELINE_PART_WORKERS, thread_name_prefix='part') as part_pool, \
+                ThreadPoolExecutor(max_workers=PIPELINE_FILE_WORKERS, thread_name_prefix='file') as file_pool:
+            
+            def submit_file(item):
+                file_slots.acquire()
+                future = file_pool.submit(
+                    pipeline_process_file, item, vd_name, vd_hash, s3_base_path,
+                    token, s3_client, manifest, budget, part_pool, stats
+                )
+                future.add_done_callback(lambda f: file_slots.release())
+            
+            process_vd_folder_pipelined(vd_hash, '/', vd_name, s3_base_path, token, submit_file, stats)
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+
 def sync_virtual_disk_to_s3(vd_hash, vd_name, s3_base_folder=""):
     """
     Синхронизация виртуального диска в S3
@@ -682,7 +1193,12 @@ def sync_virtual_disk_to_s3(vd_hash, vd_name, s3_base_folder=""):
     log_message(f"VD Hash:               {vd_hash}")
     log_message(f"Destination:           s3://{BUCKET_NAME}/{s3_base_folder if s3_base_folder else '(root)'}")
     log_message(f"Temp directory:        {TEMP_DOWNLOAD_DIR}")
-    log_message(f"Multipart threshold:   {MULTIPART_THRESHOLD/1024/1024:.0f} MB")
+    if PIPELINED:
+        log_message(f"Mode:                  pipelined ({PIPELINE_FILE_WORKERS} files, {PIPELINE_PART_WORKERS} parts, {PIPELINE_MAX_MEMORY/1024/1024:.0f} MB in memory)")
+        log_message(f"Part size:             {MULTIPART_CHUNK_SIZE/1024/1024:.0f} MB")
+        log_message(f"Skip unchanged:        {SKIP_UNCHANGED}")
+    else:
+        log_message(f"Multipart threshold:   {MULTIPART_THRESHOLD/1024/1024:.0f} MB")
     log_message(f"Log directory:         {LOG_DIR}")
     log_message(f"CSV file:              {CSV_FILE}")
     
@@ -690,10 +1206,14 @@ def sync_virtual_disk_to_s3(vd_hash, vd_name, s3_base_folder=""):
         session = boto3.session.Session()
         s3_client = session.client(
             service_name='s3',
-            endpoint_url='https://storage.yandexcloud.net',
+            endpoint_url=S3_ENDPOINT_URL,
             aws_access_key_id=AWS_KEY_ID,
             aws_secret_access_key=AWS_SECRET_KEY,
-            region_name=REGION
+            region_name=REGION,
+            config=BotoConfig(
+                max_pool_connections=PIPELINE_PART_WORKERS + PIPELINE_FILE_WORKERS + 2,
+                retries={'max_attempts': 5, 'mode': 'standard'}
+            )
         )
         log_message("✓ S3 client initialized")
     except Exception as e:
@@ -706,22 +1226,27 @@ def sync_virtual_disk_to_s3(vd_hash, vd_name, s3_base_folder=""):
         'files_total': 0,
         'files_uploaded': 0,
         'files_failed': 0,
-        'bytes_uploaded': 0
+        'files_skipped': 0,
+        'bytes_uploaded': 0,
+        'bytes_skipped': 0
     }
     
     start_time = time.time()
     
     # Обрабатываем виртуальный диск начиная с корня
     try:
-        process_vd_folder_recursive(
-            vd_hash,
-            '/',  # Корень виртуального диска
-            vd_name,
-            s3_base_folder,
-            YANDEX_ORG_TOKEN,
-            s3_client,
-            stats
-        )
+        if PIPELINED:
+            sync_vd_pipelined(vd_hash, vd_name, s3_base_folder, YANDEX_ORG_TOKEN, s3_client, stats)
+        else:
+            process_vd_folder_recursive(
+                vd_hash,
+                '/',  # Корень виртуального диска
+                vd_name,
+                s3_base_folder,
+                YANDEX_ORG_TOKEN,
+                s3_client,
+                stats
+            )
     except Exception as e:
         log_message(f"ERROR: Unexpected error: {e}")
         import traceback
@@ -745,6 +1270,7 @@ def sync_virtual_disk_to_s3(vd_hash, vd_name, s3_base_folder=""):
     log_message(f"Files total:            {stats['files_total']}")
     log_message(f"Files uploaded:         {stats['files_uploaded']}")
     log_message(f"Files failed:           {stats['files_failed']}")
+    log_message(f"Files skipped:          {stats['files_skipped']} ({stats['bytes_skipped']/1024/1024:.2f} MB unchanged)")
     log_message(f"Bytes uploaded:         {stats['bytes_uploaded']:,} ({stats['bytes_uploaded']/1024/1024:.2f} MB)")
     log_message(f"Time elapsed:           {elapsed_time:.2f} seconds ({elapsed_time/60:.2f} minutes)")
     if stats['files_uploaded'] > 0 and elapsed_time > 0:
@@ -5,7 +5,8 @@
 
 ТРЕБОВАНИЯ:
 Python 3.7+
-Библиотека requests: pip install requests
+Библиотека aiohttp: pip install aiohttp
+Рядом со скриптом должен лежать disk_walker.py (общий обход папок)
 
 НАСТРОЙКА:
 Заполните секцию КОНФИГУРАЦИЯ ниже
@@ -15,8 +16,6 @@ python сompare__shared_disks.py
 '''
 
 import os
-import requests
-from requests.adapters import HTTPAdapter, Retry
 from datetime import datetime
 import csv
 import sys
@@ -24,7 +23,6 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock, Event
 import threading
 import time
-import queue
 import gc
 import signal
 import atexit
@@ -33,36 +31,10 @@ import socket
 import logging
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
-from typing import Optional, Any, Callable
+from typing import Optional
 import shutil
-import urllib3
-
-
-class RateLimiter:
-    def __init__(self, max_calls_per_second=40):
-        self.max_calls = max_calls_per_second
-        self.period = 1.0
-        self.calls = []
-        self.lock = Lock()
-
-    def acquire(self):
-        with self.lock:
-            now = time.time()
-            self.calls = [t for t in self.calls if now - t < self.period]
-            if len(self.calls) >= self.max_calls:
-                oldest_call = self.calls[0]
-                sleep_time = self.period - (now - oldest_call) + 0.01
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                    now = time.time()
-                    self.calls = [t for t in self.calls if now - t < self.period]
-            self.calls.append(now)
-
-    def get_current_rate(self):
-        with self.lock:
-            now = time.time()
-            self.calls = [t for t in self.calls if now - t < self.period]
-            return len(self.calls)
+
+from disk_walker import DiskWalker, ssl_from_verify, virtual_disk
 
 
 # ============================================================================
@@ -107,7 +79,9 @@ CUSTOM_CA_BUNDLE = ''
 # Параметры работы
 LIMIT_VD = 100
 MAX_WORKERS = 2  # По одному воркеру на каждый диск
-NUM_HELPERS_PER_DISK = 50
+MAX_RPS = 40  # Общий лимит запросов к /virtual-disks/resources
+WALK_CONCURRENCY = 50  # Одновременных запросов при обходе папок (на оба диска)
+REQUESTS_PER_DISK = 25  # Одновременных запросов к одному диску
 
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 LOGS_DIR = Path(__file__).parent / f'logs_{timestamp}'
@@ -120,7 +94,6 @@ LOG_FILE = LOGS_DIR / f'shared_disks_parser_{timestamp}.log'
 
 BATCH_WRITE_SIZE = 50
 MAX_RECURSION_DEPTH = 100
-GC_INTERVAL = 30
 
 # Параметры защиты от потери интернета
 INTERNET_CHECK_TIMEOUT = 10 * 60
@@ -140,18 +113,12 @@ csv_lock = Lock()
 stats_lock = Lock()
 internet_check_lock = Lock()
 
-resources_rate_limiter = RateLimiter(max_calls_per_second=40)
-
 stats = {
     'processed_disks': 0,
     'found_files_total': 0,
     'files_written': 0,
     'skipped_disks': 0,
-    'gc_collections': 0,
-    'total_api_calls': 0,
-    'helper_workers_created': 0,
-    'helper_tasks_processed': 0,
-    'rate_limited_calls': 0
+    'walk_errors': 0
 }
 
 internet_stats = {
@@ -162,7 +129,7 @@ internet_stats = {
 }
 
 shutdown_flag = Event()
-session_pool = threading.local()
+walker: Optional[DiskWalker] = None
 
 logger: Optional[logging.Logger] = None
 
@@ -173,7 +140,7 @@ logger: Optional[logging.Logger] = None
 
 def get_ssl_verify():
     """
-    Возвращает значение для параметра verify= в requests:
+    Возвращает значение verify (в стиле requests, переводится для aiohttp):
       - False              → SSL отключён
       - '/path/to/ca.crt'  → кастомный CA-bundle
       - True               → системный CA-bundle (по умолчанию)
@@ -194,15 +161,6 @@ def get_ssl_verify():
 SSL_VERIFY = get_ssl_verify()
 
 
-def apply_ssl_settings():
-    """Подавляет предупреждения urllib3, если SSL отключён."""
-    if DISABLE_SSL_VERIFICATION:
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        os.environ['PYTHONWARNINGS'] = (
-            'ignore:Unverified HTTPS request'
-        )
-
-
 # ============================================================================
 # ЛОГИРОВАНИЕ
 # ============================================================================
@@ -442,163 +400,10 @@ def wait_for_internet_connection(
         time.sleep(INTERNET_RETRY_INTERVAL)
 
 
-def network_request_with_retry(
-    func: Callable, *args,
-    max_retries: int = 3, retry_delay: int = 5, **kwargs
-) -> Any:
-    last_exception = None
-    for attempt in range(max_retries):
-        try:
-            return func(*args, **kwargs)
-        except requests.exceptions.RequestException as e:
-            last_exception = e
-            log_error(f'Ошибка HTTP '
-                      f'(попытка {attempt + 1}/{max_retries}): {str(e)}')
-            if isinstance(e, (requests.exceptions.ConnectionError,
-                              requests.exceptions.Timeout)):
-                if not check_internet_connection():
-                    if not wait_for_internet_connection():
-                        return None
-                    continue
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-        except (socket.error, OSError) as e:
-            last_exception = e
-            log_error(f'Ошибка сокета '
-                      f'(попытка {attempt + 1}/{max_retries}): {str(e)}')
-            if not check_internet_connection():
-                if not wait_for_internet_connection():
-                    return None
-                continue
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-
-    log_error(f'Все попытки исчерпаны. '
-              f'Последняя ошибка: {str(last_exception)}')
-    return None
-
-
-# ============================================================================
-# HTTP-СЕССИИ
-# ============================================================================
-
-def get_session():
-    if not hasattr(session_pool, 'session') or session_pool.session is None:
-        session = requests.Session()
-
-        # ── SSL настройки сессии ──
-        session.verify = SSL_VERIFY
-
-        retries = Retry(
-            total=5, backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            raise_on_status=False
-        )
-        adapter = HTTPAdapter(
-            max_retries=retries,
-            pool_connections=10,
-            pool_maxsize=20
-        )
-        session.mount('https://', adapter)
-        session.mount('http://', adapter)
-        session_pool.session = session
-    return session_pool.session
-
-
-def close_session():
-    if hasattr(session_pool, 'session') and session_pool.session is not None:
-        try:
-            session_pool.session.close()
-        except Exception:
-            pass
-        session_pool.session = None
-
-
-# ============================================================================
-# РАБОТА С ПУТЯМИ
-# ============================================================================
-
-def extract_relative_path(full_path, vd_hash):
-    if not full_path:
-        return '/'
-    if full_path.startswith('/') and not full_path.startswith('/disk'):
-        return full_path
-
-    pattern = r'vd:/[^/]+/disk(.*)$'
-    match = re.search(pattern, full_path)
-    if match:
-        relative = match.group(1)
-        return relative if relative else '/'
-
-    if full_path.startswith('disk:'):
-        return full_path.replace('disk:', '')
-
-    return full_path
-
-
-# ============================================================================
-# API ЯНДЕКС ДИСКА
-# ============================================================================
-
-def get_virtual_disk_resources(vd_hash, relative_path='/',
-                               limit=1000, offset=0):
-    """Получить содержимое папки на Общем Диске."""
-    if shutdown_flag.is_set():
-        return None
-    try:
-        resources_rate_limiter.acquire()
-        with stats_lock:
-            stats['rate_limited_calls'] += 1
-
-        session = get_session()
-        full_path = f'vd:{vd_hash}:disk:{relative_path}'
-
-        url = ('https://cloud-api.yandex.net'
-               '/v1/disk/virtual-disks/resources')
-        params = {
-            'path': full_path,
-            'limit': limit,
-            'offset': offset,
-            'fields': (
-                '_embedded.items.name,_embedded.items.path,'
-                '_embedded.items.type,_embedded.items.size,'
-                '_embedded.items.created,_embedded.items.modified,'
-                '_embedded.items.media_type,_embedded.total,'
-                'name,path,type'
-            )
-        }
-        headers = {
-            'Authorization': f'OAuth {TOKEN_ORG}',
-            'Accept': 'application/json'
-        }
-
-        # verify уже задан на уровне сессии (session.verify = SSL_VERIFY)
-        response = session.get(url, params=params, headers=headers, timeout=30)
-        with stats_lock:
-            stats['total_api_calls'] += 1
-
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 404:
-            return None
-        elif response.status_code == 403:
-            log_error(f'Доступ запрещён: {full_path}')
-            return None
-        else:
-            log_error(f'Ошибка {response.status_code} для {full_path}')
-            return None
-    except Exception as e:
-        if not shutdown_flag.is_set():
-            log_error(f'Исключение при запросе: {str(e)}')
-        return None
-
-
 def get_disk_name_from_api(vd_hash):
     """Попытка получить имя диска через API."""
     try:
-        response = network_request_with_retry(
-            get_virtual_disk_resources, vd_hash, '/', limit=1, offset=0
-        )
+        response = walker.get(virtual_disk(vd_hash, TOKEN_ORG))
         if response:
             return response.get('name', vd_hash)
     except Exception:
@@ -622,104 +427,12 @@ def write_to_csv_batch(writer, batch):
 
 
 # ============================================================================
-# ОБРАБОТКА ПАПОК (РЕКУРСИВНАЯ ЧЕРЕЗ ОЧЕРЕДЬ)
+# ОБХОД ДИСКА (ОБЩАЯ ОЧЕРЕДЬ disk_walker)
 # ============================================================================
 
-def process_folder_task(vd_hash, path, disk_name, csv_writer,
-                        files_count_ref, local_queue,
-                        active_tasks_counter):
+def get_files_with_walker(vd_hash, disk_name, csv_writer, start_path='/'):
+    """Обход диска начиная с start_path; все файлы — в csv_writer."""
     worker_id = threading.current_thread().name
-    batch = []
-
-    try:
-        log_info(f'[{worker_id}] Обработка папки: {path}')
-        offset = 0
-        limit = 1000
-        subdirs_found = []
-
-        while not shutdown_flag.is_set():
-            response = network_request_with_retry(
-                get_virtual_disk_resources, vd_hash, path, limit, offset
-            )
-            if not response:
-                break
-
-            embedded = response.get('_embedded', {})
-            items = embedded.get('items', [])
-            total = embedded.get('total', 0)
-
-            for item in items:
-                if shutdown_flag.is_set():
-                    break
-
-                item_type = item.get('type')
-                item_name = item.get('name', 'N/A')
-                item_path = item.get('path', 'N/A')
-
-                if item_type == 'file':
-                    relative_item_path = extract_relative_path(
-                        item_path, vd_hash
-                    )
-                    file_row = {
-                        'disk_name': disk_name,
-                        'vd_hash': vd_hash,
-                        'file_name': item_name,
-                        'file_path': relative_item_path,
-                        'file_size': item.get('size', 'N/A'),
-                        'file_created': item.get('created', 'N/A'),
-                        'file_modified': item.get('modified', 'N/A'),
-                        'media_type': item.get('media_type', 'N/A')
-                    }
-                    batch.append(file_row)
-                    files_count_ref['count'] += 1
-
-                    if len(batch) >= BATCH_WRITE_SIZE:
-                        if csv_writer:
-                            write_to_csv_batch(csv_writer, batch)
-                        batch = []
-                        if files_count_ref['count'] % GC_INTERVAL == 0:
-                            gc.collect()
-                            with stats_lock:
-                                stats['gc_collections'] += 1
-
-                elif item_type == 'dir':
-                    relative_subdir_path = extract_relative_path(
-                        item_path, vd_hash
-                    )
-                    subdirs_found.append(relative_subdir_path)
-
-            if len(items) < limit or offset + limit >= total:
-                break
-            offset += limit
-
-        if batch and csv_writer:
-            write_to_csv_batch(csv_writer, batch)
-
-        if subdirs_found:
-            log_info(f'[{worker_id}] Найдено '
-                     f'{len(subdirs_found)} подпапок в {path}')
-            with active_tasks_counter['lock']:
-                active_tasks_counter['count'] += len(subdirs_found)
-            for subdir_path in subdirs_found:
-                local_queue.put(subdir_path)
-
-        log_info(f'[{worker_id}] Завершена папка: {path} '
-                 f'(файлов: {files_count_ref["count"]}, '
-                 f'подпапок: {len(subdirs_found)})')
-
-    except Exception as e:
-        log_error(f'[{worker_id}] Ошибка папки {path}: {str(e)}')
-    finally:
-        with active_tasks_counter['lock']:
-            active_tasks_counter['count'] -= 1
-        gc.collect()
-
-
-def get_files_with_helpers(vd_hash, disk_name, csv_writer,
-                           start_path='/'):
-    """Обход диска начиная с start_path с helper-потоками."""
-    worker_id = threading.current_thread().name
-    ts = int(time.time())
 
     log_info('=' * 80)
     log_info(f'[{worker_id}] 🔍 Сканирование диска "{disk_name}"')
@@ -727,227 +440,46 @@ def get_files_with_helpers(vd_hash, disk_name, csv_writer,
     log_info(f'[{worker_id}]    Стартовый путь: {start_path}')
     log_info('=' * 80)
 
-    files_count_ref = {'count': 0}
-    active_tasks_counter = {'count': 0, 'lock': Lock()}
+    batch = []
 
-    try:
-        response = network_request_with_retry(
-            get_virtual_disk_resources, vd_hash, start_path,
-            limit=1000, offset=0
-        )
-        if not response:
-            log_error(f'Не удалось получить ресурсы для {start_path}')
-            return 0
-
-        emb = response.get('_embedded', {})
-        items = emb.get('items', [])
-        folders = []
-        batch = []
-
-        for item in items:
-            item_type = item.get('type')
-            item_name = item.get('name', 'N/A')
-            item_path = item.get('path', 'N/A')
-
-            if item_type == 'file':
-                relative_item_path = extract_relative_path(
-                    item_path, vd_hash
-                )
-                file_row = {
-                    'disk_name': disk_name,
-                    'vd_hash': vd_hash,
-                    'file_name': item_name,
-                    'file_path': relative_item_path,
-                    'file_size': item.get('size', 'N/A'),
-                    'file_created': item.get('created', 'N/A'),
-                    'file_modified': item.get('modified', 'N/A'),
-                    'media_type': item.get('media_type', 'N/A')
-                }
-                batch.append(file_row)
-                files_count_ref['count'] += 1
-
-            elif item_type == 'dir':
-                relative_path = extract_relative_path(item_path, vd_hash)
-                folders.append(relative_path)
-
-        # Пагинация стартовой папки
-        total_root = emb.get('total', 0)
-        root_offset = 1000
-        while root_offset < total_root and not shutdown_flag.is_set():
-            response = network_request_with_retry(
-                get_virtual_disk_resources, vd_hash, start_path,
-                1000, root_offset
-            )
-            if not response:
-                break
-            emb2 = response.get('_embedded', {})
-            items2 = emb2.get('items', [])
-            if not items2:
-                break
-            for item in items2:
-                item_type = item.get('type')
-                item_name = item.get('name', 'N/A')
-                item_path = item.get('path', 'N/A')
-                if item_type == 'file':
-                    relative_item_path = extract_relative_path(
-                        item_path, vd_hash
-                    )
-                    file_row = {
-                        'disk_name': disk_name,
-                        'vd_hash': vd_hash,
-                        'file_name': item_name,
-                        'file_path': relative_item_path,
-                        'file_size': item.get('size', 'N/A'),
-                        'file_created': item.get('created', 'N/A'),
-                        'file_modified': item.get('modified', 'N/A'),
-                        'media_type': item.get('media_type', 'N/A')
-                    }
-                    batch.append(file_row)
-                    files_count_ref['count'] += 1
-                elif item_type == 'dir':
-                    relative_path = extract_relative_path(
-                        item_path, vd_hash
-                    )
-                    folders.append(relative_path)
-            root_offset += 1000
-
-        if batch and csv_writer:
+    # вызывается в потоке обхода; batch трогает только он, пока идёт walk()
+    def on_file(item, source):
+        batch.append({
+            'disk_name': disk_name,
+            'vd_hash': vd_hash,
+            'file_name': item.get('name', 'N/A'),
+            'file_path': source.relative_path(item.get('path', 'N/A')),
+            'file_size': item.get('size', 'N/A'),
+            'file_created': item.get('created', 'N/A'),
+            'file_modified': item.get('modified', 'N/A'),
+            'media_type': item.get('media_type', 'N/A')
+        })
+        if len(batch) >= BATCH_WRITE_SIZE and csv_writer:
             write_to_csv_batch(csv_writer, batch)
 
-        log_info(f'[{worker_id}] Стартовый уровень ({start_path}): '
-                 f'{len(folders)} папок, '
-                 f'{files_count_ref["count"]} файлов')
-
-        if not folders:
-            return files_count_ref['count']
+    result = walker.walk(
+        virtual_disk(vd_hash, TOKEN_ORG, name=disk_name, root=start_path),
+        on_file
+    )
 
-        local_queue = queue.Queue()
-        with active_tasks_counter['lock']:
-            active_tasks_counter['count'] = len(folders)
-        for folder_path in folders:
-            local_queue.put(folder_path)
+    if batch and csv_writer:
+        write_to_csv_batch(csv_writer, batch)
 
-        log_info(f'[{worker_id}] Создаём {NUM_HELPERS_PER_DISK} '
-                 f'helper-воркеров для "{disk_name}"')
+    if result.errors:
         with stats_lock:
-            stats['helper_workers_created'] += NUM_HELPERS_PER_DISK
-
-        stop_helpers = Event()
-
-        def helper_worker(helper_id):
-            helper_name = f'Helper_{disk_name}_{ts}_{helper_id}'
-            threading.current_thread().name = helper_name
-            log_info(f'[{helper_name}] Запущен')
-            tasks_processed = 0
-            consecutive_empty = 0
-            max_consecutive_empty = 30
-
-            while not shutdown_flag.is_set() and not stop_helpers.is_set():
-                try:
-                    folder_path = local_queue.get(timeout=10.0)
-                    consecutive_empty = 0
-
-                    process_folder_task(
-                        vd_hash, folder_path, disk_name,
-                        csv_writer, files_count_ref,
-                        local_queue, active_tasks_counter
-                    )
-                    tasks_processed += 1
-                    with stats_lock:
-                        stats['helper_tasks_processed'] += 1
-                    local_queue.task_done()
-
-                except queue.Empty:
-                    consecutive_empty += 1
-                    with active_tasks_counter['lock']:
-                        active_count = active_tasks_counter['count']
-                        queue_size = local_queue.qsize()
-                    if active_count > 0 or queue_size > 0:
-                        consecutive_empty = 0
-                        time.sleep(1)
-                        continue
-                    if consecutive_empty >= max_consecutive_empty:
-                        log_info(f'[{helper_name}] Нет задач '
-                                 f'{consecutive_empty} раз, завершаю')
-                        break
-                    continue
-                except Exception as e:
-                    log_error(f'[{helper_name}] Ошибка: {str(e)}')
-                    continue
-
-            log_info(f'[{helper_name}] Завершён. '
-                     f'Обработано: {tasks_processed}')
-            return tasks_processed
-
-        with ThreadPoolExecutor(
-            max_workers=NUM_HELPERS_PER_DISK,
-            thread_name_prefix=f'HelperPool_{disk_name}_{ts}'
-        ) as helper_executor:
-
-            helper_futures = [
-                helper_executor.submit(helper_worker, i + 1)
-                for i in range(NUM_HELPERS_PER_DISK)
-            ]
-
-            main_tasks_processed = 0
-            consecutive_empty = 0
-            max_consecutive_empty = 30
-
-            while not shutdown_flag.is_set():
-                try:
-                    folder_path = local_queue.get(timeout=10.0)
-                    consecutive_empty = 0
-
-                    process_folder_task(
-                        vd_hash, folder_path, disk_name,
-                        csv_writer, files_count_ref,
-                        local_queue, active_tasks_counter
-                    )
-                    main_tasks_processed += 1
-                    local_queue.task_done()
-
-                except queue.Empty:
-                    consecutive_empty += 1
-                    with active_tasks_counter['lock']:
-                        active_count = active_tasks_counter['count']
-                        queue_size = local_queue.qsize()
-                    if active_count > 0 or queue_size > 0:
-                        consecutive_empty = 0
-                        time.sleep(1)
-                        continue
-                    if consecutive_empty >= max_consecutive_empty:
-                        break
-                    continue
-                except Exception as e:
-                    log_error(f'[{worker_id}] Ошибка: {str(e)}')
-                    continue
-
-            stop_helpers.set()
-
-            total_helper_tasks = 0
-            for future in as_completed(helper_futures, timeout=120):
-                try:
-                    tasks_done = future.result(timeout=30)
-                    total_helper_tasks += tasks_done
-                except Exception as e:
-                    log_error(f'[{worker_id}] Ошибка helper: {str(e)}')
-
-        log_info('=' * 80)
-        log_info(f'[{worker_id}] ✅ Диск "{disk_name}" завершён')
-        log_info(f'[{worker_id}]    Файлов: {files_count_ref["count"]}')
-        log_info(f'[{worker_id}]    Задач: '
-                 f'{main_tasks_processed + total_helper_tasks}')
-        log_info('=' * 80)
+            stats['walk_errors'] += result.errors
+        log_warning(f'[{worker_id}] ⚠ Не прочитано папок/страниц: '
+                    f'{result.errors}, например: '
+                    f'{", ".join(result.failed_paths[:5])}')
 
-        return files_count_ref['count']
+    log_info('=' * 80)
+    log_info(f'[{worker_id}] ✅ Диск "{disk_name}" завершён')
+    log_info(f'[{worker_id}]    Файлов: {result.files}')
+    log_info(f'[{worker_id}]    Папок: {result.folders}, '
+             f'страниц: {result.pages}')
+    log_info('=' * 80)
 
-    except Exception as e:
-        log_error(f'Ошибка обхода: {str(e)}')
-        import traceback
-        log_error(traceback.format_exc())
-        return files_count_ref.get('count', 0)
-    finally:
-        gc.collect()
+    return result.files
 
 
 # ============================================================================
@@ -980,7 +512,7 @@ def process_single_disk(vd_hash, disk_name, output_file, start_path='/'):
             )
             writer.writeheader()
 
-            files_count = get_files_with_helpers(
+            files_count = get_files_with_walker(
                 vd_hash=vd_hash,
                 disk_name=disk_name,
                 csv_writer=writer,
@@ -1023,7 +555,6 @@ def process_single_disk(vd_hash, disk_name, output_file, start_path='/'):
             stats['skipped_disks'] += 1
         return False, 0, output_file
     finally:
-        close_session()
         gc.collect()
 
 
@@ -1138,10 +669,9 @@ def cleanup():
         return
     log_info('Завершение работы...')
     shutdown_flag.set()
-    try:
-        close_session()
-    except Exception:
-        pass
+    if walker:
+        walker.stop()
+        walker.close()
     time.sleep(0.5)
     if logger:
         log_info('Закрытие лог-файла...')
@@ -1160,8 +690,7 @@ def signal_handler(signum, frame):
 # ============================================================================
 
 def main():
-    # ── Применяем SSL настройки до любых запросов ──
-    apply_ssl_settings()
+    global walker
 
     try:
         cleanup_old_logs()
@@ -1185,15 +714,16 @@ def main():
         )
 
     log_info('=' * 80)
-    log_info('🚀 АНАЛИЗ ДВУХ ОБЩИХ ДИСКОВ ЯНДЕКС 360 v11.1 + SSL OPTION')
+    log_info('🚀 АНАЛИЗ ДВУХ ОБЩИХ ДИСКОВ ЯНДЕКС 360 v12.0 ASYNC WALK + SSL OPTION')
     log_info('=' * 80)
     log_info(f'Формат пути: vd:{{vd_hash}}:disk:{{path}}')
     log_info(f'Организация: {ORGID}')
     log_info(f'Стартовый путь: {START_PATH}')
     log_info(f'Основных потоков: {MAX_WORKERS}')
-    log_info(f'Helper\'ов на диск: {NUM_HELPERS_PER_DISK}')
+    log_info(f'Запросов одновременно: {WALK_CONCURRENCY} '
+             f'(на диск: {REQUESTS_PER_DISK})')
     log_info(f'Батч-запись: {BATCH_WRITE_SIZE}')
-    log_info(f'🚦 Rate Limit: 40 RPS')
+    log_info(f'🚦 Rate Limit: {MAX_RPS} RPS')
     log_info(f'🔐 SSL проверка: {ssl_status_str}{ssl_verify_detail}')
     log_info(f'Защита от потери интернета: '
              f'{INTERNET_CHECK_TIMEOUT // 60} минут')
@@ -1223,6 +753,16 @@ def main():
     log_info('✅ Интернет-соединение активно')
     log_info('')
 
+    walker = DiskWalker(
+        rps=MAX_RPS,
+        workers=WALK_CONCURRENCY,
+        per_disk=REQUESTS_PER_DISK,
+        max_depth=MAX_RECURSION_DEPTH,
+        ssl_option=ssl_from_verify(SSL_VERIFY),
+        wait_online=wait_for_internet_connection,
+        logger=logger
+    )
+
     name_source = DISK_NAME_SOURCE
     name_destination = DISK_NAME_DESTINATION
 
@@ -1314,14 +854,13 @@ def main():
                          f'{r["files_count"]} файлов → '
                          f'{r["output_file"]}')
 
-        log_info(f'   🔧 API вызовов: {stats["total_api_calls"]}')
-        log_info(f'   🚦 Rate limited: {stats["rate_limited_calls"]}')
-        log_info(f'   👥 Helper\'ов: '
-                 f'{stats["helper_workers_created"]}')
-        log_info(f'   📦 Helper задач: '
-                 f'{stats["helper_tasks_processed"]}')
+        log_info(f'   🔧 API вызовов: {walker.stats["requests"]}')
+        log_info(f'   🔁 Повторов: {walker.stats["retries"]}, '
+                 f'из них 429: {walker.stats["throttled"]}')
+        log_info(f'   📂 Папок: {walker.stats["folders"]}, '
+                 f'страниц: {walker.stats["pages"]}')
+        log_info(f'   ⚠ Не прочитано папок/страниц: {stats["walk_errors"]}')
         log_info(f'   💾 Записано строк: {stats["files_written"]}')
-        log_info(f'   🗑 Сборок мусора: {stats["gc_collections"]}')
         log_info(f'   🔐 SSL: {ssl_status_str}')
 
         with internet_check_lock:
@@ -2,6 +2,10 @@ import requests
 import time
 from collections import deque
 
+# Рядом со скриптом должен лежать disk_listing_strategy.py (выбор метода подсчёта)
+from disk_listing_strategy import (DISK_INFO_URL, FLAT, RECURSIVE, DiskSignals,
+                                   ListingCostModel, ListingHistory, used_space_without_trash)
+
 orgId = ''  # ID организации
 org_token = ''  # токен OAuth приложения
 client_id = ''  # id сервисного приложения
@@ -22,6 +26,13 @@ MAX_FOLDER_DEPTH = 50   # Максимальная глубина вложенн
 # Время жизни токена
 TOKEN_LIFETIME = 55 * 60  # 55 минут в секундах
 
+# Выбор метода: занятое место, первая страница /files и итоги прошлых запусков
+HISTORY_FILE = 'files_count_history.json'  # пусто = без истории
+
+COST_MODEL = ListingCostModel(page_limit=FILES_LIMIT,
+                              flat_page_cap=FILES_MAX_OFFSET // FILES_LIMIT,
+                              recursive_concurrency=1)
+
 
 def get_user(user_id):
     url = f'https://api360.yandex.net/directory/v1/org/{orgId}/users/{user_id}'
@@ -106,6 +117,25 @@ class TokenManager:
         }
 
 
+def get_disk_info(token_manager):
+    """Информация о Диске (/v1/disk): занятое место и размер Корзины"""
+    params = {'fields': 'used_space,trash_size'}
+    
+    for attempt in range(MAX_RETRIES):
+        try:
+            token = token_manager.get_token()
+            headers = {'Authorization': f'OAuth {token}'}
+            response = requests.get(DISK_INFO_URL, params=params, headers=headers, timeout=30)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            if attempt < MAX_RETRIES - 1:
+                print(f"      ⚠️ Попытка {attempt + 1}/{MAX_RETRIES} не удалась: {type(e).__name__}")
+                time.sleep(RETRY_DELAY)
+            else:
+                raise
+
+
 def get_files_page(limit, offset, token_manager):
     """Получение одной страницы файлов через /files"""
     url = 'https://cloud-api.yandex.net/v1/disk/resources/files'
@@ -153,20 +183,28 @@ def get_folder_contents_page(path, token_manager, limit=1000, offset=0):
                 raise
 
 
-def count_files_flat(token_manager):
-    """Быстрый подсчёт через /files endpoint"""
+def count_files_flat(token_manager, signals=None):
+    """Быстрый подсчёт через /files endpoint.
+    Возвращает (число файлов, дошли ли до конца, была ли ошибка /files)"""
     print("  📋 Метод 1: Быстрый подсчёт через /files")
     total_count = 0
     offset = 0
+    pages = 0
+    plan = COST_MODEL.choose(signals) if signals is not None else None
     
     try:
         while offset < FILES_MAX_OFFSET:
+            if plan is not None and pages >= plan.max_flat_pages:
+                print(f"  ⚠️ Прочитано {pages} страниц, а файлы не кончаются (оценка: {plan.estimated_files})")
+                return total_count, False, False
+            
             response = get_files_page(FILES_LIMIT, offset, token_manager)
+            pages += 1
             items = response.get('items', [])
             
             if not items:
                 print(f"  ✅ Метод /files успешно завершён: {total_count} файлов")
-                return total_count, True
+                return total_count, True, False
             
             total_count += len(items)
             offset += len(items)
@@ -177,15 +215,24 @@ def count_files_flat(token_manager):
             
             if len(items) < FILES_LIMIT:
                 print(f"  ✅ Метод /files успешно завершён: {total_count} файлов")
-                return total_count, True
+                return total_count, True, False
+            
+            if pages == 1 and signals is not None:
+                # первая страница уточняет оценку: средний размер файла
+                signals.probe_files = len(items)
+                signals.probe_bytes = sum(item.get('size') or 0 for item in items)
+                plan = COST_MODEL.choose(signals)
+                if plan.mode == RECURSIVE:
+                    print(f"  🧭 После первой страницы: {plan.reason}")
+                    return total_count, False, False
         
         print(f"  ⚠️ Достигнут лимит offset={FILES_MAX_OFFSET}")
-        return total_count, False
+        return total_count, False, True
         
     except Exception as e:
         print(f"  ❌ Ошибка в методе /files: {type(e).__name__}: {e}")
         print(f"  ⚠️ Частично обработано: {total_count} файлов")
-        return total_count, False
+        return total_count, False, True
 
 
 def count_files_recursive(token_manager):
@@ -286,29 +333,52 @@ def count_files_recursive(token_manager):
     print(f"     • Ошибок: {errors_count}")
     print(f"     • Токен обновлялся: {stats['refresh_count']} раз")
     
-    return file_count
+    return file_count, folder_count
 
 
-def count_files(user_id, initial_token, force_recursive=False):
+def count_files(user_id, initial_token, force_recursive=False, history=None):
     """Главная функция подсчёта"""
     
     token_manager = TokenManager(user_id, initial_token)
     
     if force_recursive:
         print("  ⚙️ Принудительно используем рекурсивный метод\n")
-        count = count_files_recursive(token_manager)
+        count, _ = count_files_recursive(token_manager)
         return count, "recursive_forced"
     
-    count, success = count_files_flat(token_manager)
+    used_space = None
+    try:
+        used_space = used_space_without_trash(get_disk_info(token_manager))
+    except Exception as e:
+        print(f"  ⚠️ Не удалось получить занятое место: {type(e).__name__}")
+    
+    history_entry = history.get(user_id) if history else None
+    signals = DiskSignals(used_space=used_space, history=history_entry)
+    plan = COST_MODEL.choose(signals)
+    print(f"  🧭 Выбор метода: {plan.mode} — {plan.reason}")
+    
+    if plan.mode == RECURSIVE:
+        count, folders = count_files_recursive(token_manager)
+        if history:
+            history.record(user_id, count, RECURSIVE, folders=folders, used_space=used_space,
+                           flat_failed=bool((history_entry or {}).get('flat_failed')))
+        return count, "recursive_planned"
+    
+    count, success, flat_failed = count_files_flat(token_manager, signals)
     
     if not success:
         print(f"\n  🔄 Переключаемся на рекурсивный обход...")
         print(f"  💾 Промежуточный результат: {count} файлов\n")
         time.sleep(1)
         
-        recursive_count = count_files_recursive(token_manager)
+        recursive_count, folders = count_files_recursive(token_manager)
+        if history:
+            history.record(user_id, recursive_count, RECURSIVE, flat_failed=flat_failed,
+                           folders=folders, used_space=used_space)
         return recursive_count, "recursive_fallback"
     
+    if history:
+        history.record(user_id, count, FLAT, used_space=used_space)
     return count, "flat"
 
 
@@ -324,6 +394,8 @@ if __name__ == '__main__':
     FORCE_RECURSIVE = False
     FORCE_RECURSIVE_UIDS = set([])
 
+    history = ListingHistory(HISTORY_FILE) if HISTORY_FILE else None
+
     with open(file_path, 'w', encoding='utf-8') as file:
         file.write("user_id;total;status;method\n")
 
@@ -345,7 +417,7 @@ if __name__ == '__main__':
                     print(f"  ✓ Токен получен")
                     
                     force = FORCE_RECURSIVE or (uid in FORCE_RECURSIVE_UIDS)
-                    num, method = count_files(uid, token, force_recursive=force)
+                    num, method = count_files(uid, token, force_recursive=force, history=history)
                     
                     print(f'\n{"="*60}')
                     print(f'✅ Результат для {uid}:')
@@ -355,6 +427,8 @@ if __name__ == '__main__':
                     
                     file.write(f"{uid};{num};OK;{method}\n")
                     file.flush()
+                    if history:
+                        history.save()
                     
                 finally:
                     if not was_enabled:
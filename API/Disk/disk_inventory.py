@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Локальный индекс файлов Яндекс Диска (SQLite) для скриптов этой папки
+
+Используется скриптами:
+- personal_disk_file_searcher_script.py    (Диски сотрудников, ключ uid:<UID>)
+- parser_for_shared_disks.py               (Общие Диски, ключ vd:<hash>)
+
+Что хранится:
+- resources — файлы и папки каждого диска: путь, тип, имя, resource_id,
+  размер, md5, даты создания и изменения;
+- disks — когда начинался последний обход диска и закончился ли он без ошибок.
+
+Как обновляется (plan):
+- диск, которого нет в индексе или прошлый обход которого прервался, —
+  читается целиком (PLAN_FULL);
+- если переданы события аудит-лога Диска (audit_changed_owners с даты
+  oldest_start), диск владельца без событий после начала его прошлого
+  обхода не читается вовсе (PLAN_SKIP), с событиями — читается целиком;
+- без аудит-лога (и для Общих Дисков) диск читается целиком: modified
+  папки не меняется надёжно при изменениях глубже в её дереве, поэтому
+  отдельные папки не пропускаются.
+
+Каждый обход получает номер; всё, что он увидел, помечается этим
+номером. После обхода без ошибок строки диска с другим номером —
+удалённые файлы — стираются. Обход с ошибками ничего не удаляет и
+оставляет диск незаконченным: в следующий раз он читается целиком.
+
+Поиск (search) — запрос к индексу без обращения к API: подстрока имени
+без учёта регистра (в том числе для кириллицы).
+'''
+
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import requests
+
+AUDIT_DISK_URL = 'https://api360.yandex.net/security/v1/org/{org_id}/audit_log/disk'
+AUDIT_PAGE_SIZE = 100
+
+PLAN_FULL = 'full'
+PLAN_SKIP = 'skip'
+
+BATCH_SIZE = 1000
+
+RESOURCE_COLUMNS = ('disk', 'path', 'type', 'name', 'name_lower', 'resource_id',
+                    'size', 'md5', 'created', 'modified', 'media_type', 'crawl_id')
+
+
+def utc_now() -> str:
+    '''Текущее время в формате afterDate аудит-лога.'''
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+def parse_date(value: str) -> datetime:
+    '''Дата из API или индекса; нераспознанная считается самой поздней,
+    чтобы диск с таким событием точно перечитался.'''
+    try:
+        text = re.sub(r'(\.\d{6})\d+', r'\1', value.replace('Z', '+00:00'))
+        parsed = datetime.fromisoformat(text)
+    except (AttributeError, ValueError):
+        return datetime.max.replace(tzinfo=timezone.utc)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def audit_changed_owners(org_id, token: str, after_date: str,
+                         http_get: Callable = requests.get,
+                         page_size: int = AUDIT_PAGE_SIZE) -> Dict[str, datetime]:
+    '''Владельцы Дисков с событиями аудит-лога после after_date:
+    UID -> дата последнего события.
+
+    Нужен токен с правом ya360_security:audit_log_disk. Ошибки запроса
+    не перехватываются: без полного списка пропускать диски нельзя.'''
+    url = AUDIT_DISK_URL.format(org_id=org_id)
+    headers = {'Authorization': f'Bearer {token}'}
+    params = {'pageSize': page_size, 'afterDate': after_date}
+    owners: Dict[str, datetime] = {}
+
+    while True:
+        response = http_get(url, headers=headers, params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        for event in data.get('events') or []:
+            owner = event.get('ownerUid') or event.get('userUid')
+            if not owner:
+                continue
+            date = parse_date(event.get('date'))
+            owner = str(owner)
+            if owner not in owners or owners[owner] < date:
+                owners[owner] = date
+        page_token = data.get('nextPageToken')
+        if not page_token:
+            return owners
+        params['pageToken'] = page_token
+
+
+class DiskCrawl:
+    '''Один обход одного диска: складывает найденное в индекс пачками.
+
+    on_file и on_dir подходят для DiskWalker.walk(); для плоского списка
+    файлов (/resources/files) on_file вызывается без source.'''
+
+    def __init__(self, inventory: 'DiskInventory', disk: str, crawl_id: int):
+        self.inventory = inventory
+        self.disk = disk
+        self.crawl_id = crawl_id
+        self.failed = False
+        self.files = 0
+        self.dirs = 0
+        self._rows: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def _row(self, item: dict, source) -> tuple:
+        path = source.relative_path(item['path']) if source is not None else item['path']
+        name = item.get('name') or path.rstrip('/').rsplit('/', 1)[-1]
+        return (self.disk, path, item.get('type') or 'file', name, name.lower(),
+                item.get('resource_id'), item.get('size'), item.get('md5'),
+                item.get('created'), item.get('modified'), item.get('media_type'),
+                self.crawl_id)
+
+    def on_file(self, item: dict, source=None):
+        if not item.get('path'):
+            return
+        with self._lock:
+            self._rows.append(self._row(item, source))
+            self.files += 1
+            if len(self._rows) >= BATCH_SIZE:
+                self._flush_locked()
+
+    def on_dir(self, item: dict, source=None):
+        with self._lock:
+            self._rows.append(self._row(item, source))
+            self.dirs += 1
+            if len(self._rows) >= BATCH_SIZE:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        rows, self._rows = self._rows, []
+        self.inventory._write(self.disk, self.crawl_id, rows)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def finish(self, complete: Optional[bool] = None) -> int:
+        '''Дописывает остаток пачки и закрывает обход.
+        Возвращает число строк, удалённых из индекса как исчезнувшие.'''
+        if complete is None:
+            complete = not self.failed
+        self.flush()
+        return self.inventory._finish(self.disk, self.crawl_id, complete)
+
+
+class DiskInventory:
+    '''Индекс файлов в одном файле SQLite; потокобезопасен.
+
+    inventory = DiskInventory('disk_inventory.sqlite3')
+    plan = inventory.plan(f'uid:{uid}', owner=uid, changes=changes)
+    crawl = inventory.begin(f'uid:{uid}', 'personal', email, info={...})
+    walker.walk(source, crawl.on_file, on_dir=crawl.on_dir)
+    crawl.finish()
+    for row in inventory.search('отчёт', disk=f'uid:{uid}'): ...'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._init_schema()
+
+    def _init_schema(self):
+        with self.lock:
+            self.conn.executescript(
+                '''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS disks (
+                    disk       TEXT PRIMARY KEY,
+                    kind       TEXT NOT NULL,
+                    name       TEXT,
+                    info       TEXT,
+                    crawl_id   INTEGER NOT NULL DEFAULT 0,
+                    started_at TEXT,
+                    crawled_at TEXT,
+                    complete   INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS resources (
+                    disk        TEXT NOT NULL,
+                    path        TEXT NOT NULL,
+                    type        TEXT NOT NULL,
+                    name        TEXT,
+                    name_lower  TEXT,
+                    resource_id TEXT,
+                    size        INTEGER,
+                    md5         TEXT,
+                    created     TEXT,
+                    modified    TEXT,
+                    media_type  TEXT,
+                    crawl_id    INTEGER NOT NULL,
+                    PRIMARY KEY (disk, path)
+                ) WITHOUT ROWID;
+                '''
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # ---------- диски ----------
+
+    def disk_state(self, disk: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT kind, name, info, crawl_id, started_at, crawled_at, complete '
+                'FROM disks WHERE disk=?', (disk,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'kind': row[0],
+            'name': row[1],
+            'info': json.loads(row[2]) if row[2] else {},
+            'crawl_id': row[3],
+            'started_at': row[4],
+            'crawled_at': row[5],
+            'complete': bool(row[6]),
+        }
+
+    def list_disks(self, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = 'SELECT disk, kind, name, info, crawled_at, complete FROM disks'
+        params = ()
+        if kind:
+            sql += ' WHERE kind=?'
+            params = (kind,)
+        with self.lock:
+            rows = self.conn.execute(sql + ' ORDER BY disk', params).fetchall()
+        return [{'disk': row[0], 'kind': row[1], 'name': row[2],
+                 'info': json.loads(row[3]) if row[3] else {},
+                 'crawled_at': row[4], 'complete': bool(row[5])} for row in rows]
+
+    def forget(self, disk: str):
+        '''Убирает диск из индекса (например, Общий Диск удалён в организации).'''
+        with self.lock:
+            self.conn.execute('DELETE FROM resources WHERE disk=?', (disk,))
+            self.conn.execute('DELETE FROM disks WHERE disk=?', (disk,))
+            self.conn.commit()
+
+    def oldest_start(self, disks: Iterable[str]) -> Optional[str]:
+        '''Самое раннее начало прошлого обхода среди законченных дисков —
+        с этой даты нужен аудит-лог, чтобы решить судьбу каждого из них.'''
+        oldest = None
+        for disk in disks:
+            state = self.disk_state(disk)
+            if state and state['complete'] and state['started_at']:
+                if oldest is None or parse_date(state['started_at']) < parse_date(oldest):
+                    oldest = state['started_at']
+        return oldest
+
+    def plan(self, disk: str, owner: Optional[str] = None,
+             changes: Optional[Dict[str, datetime]] = None) -> str:
+        '''Как обновлять диск: PLAN_FULL или PLAN_SKIP.
+        changes — результат audit_changed_owners с даты не позже oldest_start
+        (None — аудит-лог не смотрели).'''
+        state = self.disk_state(disk)
+        if state is None or not state['complete']:
+            return PLAN_FULL
+        if changes is not None and owner is not None and state['started_at']:
+            last_event = changes.get(owner)
+            if last_event is None or last_event < parse_date(state['started_at']):
+                return PLAN_SKIP
+            return PLAN_FULL
+        # без аудит-лога неизвестно, что изменилось, — читаем целиком
+        return PLAN_FULL
+
+    def begin(self, disk: str, kind: str, name: str = '',
+              info: Optional[dict] = None) -> DiskCrawl:
+        '''Начинает обход: диск помечается незаконченным до finish().'''
+        with self.lock:
+            row = self.conn.execute('SELECT crawl_id FROM disks WHERE disk=?',
+                                    (disk,)).fetchone()
+            crawl_id = (row[0] if row else 0) + 1
+            self.conn.execute(
+                'INSERT INTO disks(disk, kind, name, info, crawl_id, started_at, complete) '
+                'VALUES(?, ?, ?, ?, ?, ?, 0) '
+                'ON CONFLICT(disk) DO UPDATE SET kind=excluded.kind, name=excluded.name, '
+                'info=excluded.info, crawl_id=excluded.crawl_id, '
+                'started_at=excluded.started_at, complete=0',
+                (disk, kind, name, json.dumps(info or {}, ensure_ascii=False), crawl_id,
+                 utc_now()))
+            self.conn.commit()
+        return DiskCrawl(self, disk, crawl_id)
+
+    def _write(self, disk: str, crawl_id: int, rows: List[tuple]):
+        placeholders = ','.join('?' * len(RESOURCE_COLUMNS))
+        with self.lock:
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO resources ({",".join(RESOURCE_COLUMNS)}) '
+                f'VALUES ({placeholders})', rows)
+            self.conn.commit()
+
+    def _finish(self, disk: str, crawl_id: int, complete: bool) -> int:
+        removed = 0
+        with self.lock:
+            if complete:
+                removed = self.conn.execute(
+                    'DELETE FROM resources WHERE disk=? AND crawl_id<>?',
+                    (disk, crawl_id)).rowcount
+            self.conn.execute(
+                'UPDATE disks SET crawled_at=?, complete=? WHERE disk=? AND crawl_id=?',
+                (utc_now(), int(complete), disk, crawl_id))
+            self.conn.commit()
+        return removed
+
+    # ---------- поиск ----------
+
+    def search(self, name: str = '', disk: Optional[str] = None,
+               kind: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        '''Файлы из индекса, в имени которых есть name (без учёта регистра).
+
+        Читает через отдельное соединение, поэтому не мешает обходам в
+        других потоках.'''
+        sql = ('SELECT r.disk, d.name, d.info, r.path, r.name, r.size, r.created, '
+               'r.modified, r.media_type, r.md5, r.resource_id '
+               "FROM resources r JOIN disks d ON d.disk = r.disk WHERE r.type='file'")
+        params: list = []
+        if name:
+            sql += ' AND instr(r.name_lower, ?) > 0'
+            params.append(name.lower())
+        if disk:
+            sql += ' AND r.disk=?'
+            params.append(disk)
+        if kind:
+            sql += ' AND d.kind=?'
+            params.append(kind)
+        sql += ' ORDER BY r.disk, r.path'
+
+        conn = sqlite3.connect(self.path)
+        try:
+            infos: Dict[str, dict] = {}
+            for row in conn.execute(sql, params):
+                info = infos.get(row[0])
+                if info is None:
+                    info = infos[row[0]] = json.loads(row[2]) if row[2] else {}
+                yield {
+                    'disk': row[0],
+                    'disk_name': row[1],
+                    'info': info,
+                    'path': row[3],
+                    'name': row[4],
+                    'size': row[5],
+                    'created': row[6],
+                    'modified': row[7],
+                    'media_type': row[8],
+                    'md5': row[9],
+                    'resource_id': row[10],
+                }
+        finally:
+            conn.close()
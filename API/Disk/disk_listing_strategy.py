@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Выбор способа получения списка файлов Диска сотрудника
+
+Используется скриптами:
+- personal_disk_file_searcher_script.py
+- count_files_and_folders_per_disk_some_users.py
+
+Способы:
+- плоский список /v1/disk/resources/files — страницы по 1000 файлов, только
+  по очереди (offset), на очень больших Дисках обрывается ошибками;
+- обход папок /v1/disk/resources — запрос на каждую папку, зато папки
+  читаются параллельно (DiskWalker).
+
+Что учитывается (ListingCostModel.choose):
+- занятое место из /v1/disk без Корзины;
+- первая страница плоского списка (probe): если она последняя — Диск уже
+  прочитан; средний размер файла на ней уточняет оценку числа файлов;
+- история прошлых запусков (ListingHistory): сколько было файлов и папок
+  и дошёл ли плоский список до конца.
+
+Оценка стоимости — в «последовательных запросах»: плоский список —
+число страниц, обход — (папки + страницы файлов) / параллельность.
+Плоскому списку выдаётся бюджет страниц (max_flat_pages): если оценка
+оказалась неверной и страницы не кончаются, скрипт переключается на
+обход, не выдавая повторно уже записанные файлы (SeenResources).
+'''
+
+import hashlib
+import json
+import math
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+FLAT = 'flat'
+RECURSIVE = 'recursive'
+
+DISK_INFO_URL = 'https://cloud-api.yandex.net/v1/disk'
+
+
+def used_space_without_trash(disk_info: Optional[dict]) -> Optional[int]:
+    '''Занятое место по ответу /v1/disk без Корзины (файлы в ней не перечисляются).'''
+    if not disk_info or disk_info.get('used_space') is None:
+        return None
+    return max(0, int(disk_info['used_space']) - int(disk_info.get('trash_size') or 0))
+
+
+@dataclass
+class DiskSignals:
+    used_space: Optional[int] = None   # байт без Корзины
+    probe_files: Optional[int] = None  # файлов на первой странице плоского списка
+    probe_bytes: int = 0               # их суммарный размер
+    probe_last: bool = False           # первая страница оказалась последней
+    history: Optional[dict] = None     # запись ListingHistory
+
+
+@dataclass
+class ListingPlan:
+    mode: str
+    estimated_files: Optional[int]
+    max_flat_pages: int
+    reason: str
+
+
+class ListingCostModel:
+    '''page_limit — файлов на странице; flat_page_cap — больше страниц
+    плоского списка скрипт не читает; recursive_concurrency — сколько
+    запросов к одному Диску идёт одновременно при обходе папок.'''
+
+    def __init__(self, page_limit: int = 1000, flat_page_cap: int = 1000,
+                 recursive_concurrency: int = 1, files_per_folder: float = 25.0,
+                 default_file_size: int = 2 * 1024 * 1024,
+                 flat_budget_factor: float = 2.0):
+        self.page_limit = page_limit
+        self.flat_page_cap = flat_page_cap
+        self.recursive_concurrency = max(1, recursive_concurrency)
+        self.files_per_folder = files_per_folder
+        self.default_file_size = default_file_size
+        self.flat_budget_factor = flat_budget_factor
+
+    def estimate_files(self, signals: DiskSignals) -> Optional[int]:
+        history = signals.history or {}
+        if history.get('files') is not None:
+            files = history['files']
+            # Диск вырос или уменьшился с прошлого раза — в той же пропорции
+            if signals.used_space is not None and history.get('bytes'):
+                files = files * signals.used_space / history['bytes']
+            return int(files)
+        if signals.used_space is None:
+            return None
+        if signals.probe_files:
+            average = max(1, signals.probe_bytes // signals.probe_files)
+        else:
+            average = self.default_file_size
+        return int(signals.used_space / average)
+
+    def flat_cost(self, files: int) -> float:
+        return max(1, math.ceil(files / self.page_limit))
+
+    def recursive_cost(self, files: int, folders: float) -> float:
+        # корень читается всегда, и меньше одного запроса обход не стоит
+        requests_total = folders + 1 + math.ceil(files / self.page_limit)
+        return max(1.0, requests_total / self.recursive_concurrency)
+
+    def choose(self, signals: DiskSignals) -> ListingPlan:
+        if signals.probe_last:
+            return ListingPlan(FLAT, signals.probe_files, 1, 'весь Диск на первой странице')
+
+        history = signals.history or {}
+        files = self.estimate_files(signals)
+
+        if history.get('flat_failed'):
+            return ListingPlan(RECURSIVE, files, 0,
+                               'в прошлый раз плоский список не дошёл до конца')
+        if files is None:
+            return ListingPlan(FLAT, None, self.flat_page_cap, 'нет данных для оценки')
+
+        flat = self.flat_cost(files)
+        if flat > self.flat_page_cap:
+            return ListingPlan(RECURSIVE, files, 0,
+                               f'~{files} файлов — больше {self.flat_page_cap} страниц')
+
+        folders = history.get('folders')
+        if folders is None:
+            folders = files / self.files_per_folder
+        recursive = self.recursive_cost(files, folders)
+        if recursive < flat:
+            return ListingPlan(RECURSIVE, files, 0,
+                               f'обход ~{recursive:.0f} против {flat:.0f} страниц подряд')
+
+        budget = min(self.flat_page_cap,
+                     max(math.ceil(flat * self.flat_budget_factor), flat + 2))
+        return ListingPlan(FLAT, files, budget,
+                           f'~{flat:.0f} страниц подряд против обхода ~{recursive:.0f}')
+
+
+class ListingHistory:
+    '''Итоги прошлых запусков по UID в JSON-файле рядом со скриптом.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data: Dict[str, dict] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError):
+                self.data = {}
+
+    def get(self, uid: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.data.get(str(uid))
+            return dict(entry) if entry else None
+
+    def record(self, uid: str, files: int, mode: str, flat_failed: bool = False,
+               folders: Optional[int] = None, used_space: Optional[int] = None):
+        entry = {
+            'files': files,
+            'mode': mode,
+            'flat_failed': flat_failed,
+            'updated': datetime.now().isoformat(timespec='seconds'),
+        }
+        if folders is not None:
+            entry['folders'] = folders
+        if used_space is not None:
+            entry['bytes'] = used_space
+        with self.lock:
+            previous = self.data.get(str(uid)) or {}
+            # число папок знает только обход — после плоского списка берём прошлое
+            if folders is None and 'folders' in previous:
+                entry['folders'] = previous['folders']
+            self.data[str(uid)] = entry
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+class SeenResources:
+    '''Файлы, уже выданные плоским списком: при переключении на обход
+    папок они пропускаются. Хранится 16-байтный blake2b от resource_id
+    (или пути) — короче самой строки, а совпадение у разных файлов
+    практически исключено.'''
+
+    def __init__(self):
+        self.keys = set()
+
+    @staticmethod
+    def _key(item: dict) -> bytes:
+        value = item.get('resource_id') or item.get('path') or ''
+        return hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+
+    def add(self, item: dict):
+        self.keys.add(self._key(item))
+
+    def __contains__(self, item: dict) -> bool:
+        return bool(self.keys) and self._key(item) in self.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
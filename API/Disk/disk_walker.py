@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Общий асинхронный обход дерева Яндекс Диска для скриптов этой папки
+
+Используется скриптами:
+- personal_disk_file_searcher_script.py    (Диски сотрудников, /v1/disk/resources)
+- parser_for_shared_disks.py               (Общие Диски, /v1/disk/virtual-disks/resources)
+- find_largest_file_per_shared_disks.py
+- compare_shared_disks.py
+
+Как устроено:
+- одна очередь задач на все диски: задача — страница одной папки;
+- не больше per_disk одновременных запросов к одному диску и не больше
+  workers запросов всего;
+- общий бюджет запросов в секунду (RateLimiter) — им же пользуются
+  синхронные запросы скрипта (токены, SCIM, списки дисков);
+- папка больше одной страницы (1000 элементов) после первого ответа
+  раскладывается на страницы, которые читаются параллельно;
+- 429 и 5xx повторяются с паузой (учитывается Retry-After), потеря
+  соединения — с ожиданием сети, если скрипт передал wait_online;
+- найденные файлы передаются в on_file(item, source), отдельно для
+  каждого диска; скрипт сам решает, что с ними делать (CSV, поиск
+  самого крупного файла, сравнение);
+- папки — в on_dir(item, source), если он передан (так disk_inventory.py
+  записывает папки в индекс); обход заходит во все папки.
+
+Цикл asyncio работает в отдельном потоке, поэтому walk() можно вызывать
+из обычных потоков скрипта: вызов ждёт окончания обхода своего диска,
+а запросы всех дисков идут через одну очередь и один бюджет.
+
+ТРЕБОВАНИЯ:
+Python 3.7+
+Библиотека aiohttp: pip install aiohttp
+'''
+
+import asyncio
+import logging
+import re
+import ssl
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Union
+
+import aiohttp
+
+RESOURCES_URL = 'https://cloud-api.yandex.net/v1/disk/resources'
+VD_RESOURCES_URL = 'https://cloud-api.yandex.net/v1/disk/virtual-disks/resources'
+
+PAGE_LIMIT = 1000
+ITEM_FIELDS = ('name', 'path', 'type', 'size', 'created', 'modified',
+               'media_type', 'md5', 'resource_id')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRY_DELAY = 60
+
+
+# ============================================================================
+# ОГРАНИЧЕНИЕ RPS
+# ============================================================================
+
+class RateLimiter:
+    """Общий бюджет запросов в секунду.
+
+    Каждый запрос получает свой момент отправки не раньше 1/rps после
+    предыдущего. Момент выдаётся под обычной блокировкой, поэтому одним
+    ограничителем пользуются и потоки (acquire), и корутины (acquire_async)."""
+
+    def __init__(self, max_rps: float):
+        self.max_rps = max_rps
+        self.interval = 1.0 / max_rps
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+        self.recent = deque()
+        self.total_requests = 0
+
+    def reserve(self) -> float:
+        """Занимает момент отправки. -> сколько секунд до него ждать."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+            self.recent.append(slot)
+            self.total_requests += 1
+            return slot - now
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def get_current_rate(self) -> int:
+        """Запросов за последнюю секунду."""
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and self.recent[0] < now - 1.0:
+                self.recent.popleft()
+            return sum(1 for slot in self.recent if slot <= now)
+
+
+# ============================================================================
+# ИСТОЧНИКИ ОБХОДА
+# ============================================================================
+
+def extract_relative_path(full_path, vd_hash=''):
+    """Путь внутри Общего Диска: 'vd:/<hash>/disk/a/b' -> '/a/b'."""
+    if not full_path:
+        return '/'
+
+    if full_path.startswith('/') and not full_path.startswith('/disk'):
+        return full_path
+
+    match = re.search(r'vd:/[^/]+/disk(.*)$', full_path)
+    if match:
+        relative = match.group(1)
+        return relative if relative else '/'
+
+    if full_path.startswith('disk:'):
+        return full_path.replace('disk:', '')
+
+    return full_path
+
+
+@dataclass
+class DiskSource:
+    """Диск для обхода.
+
+    token — строка или функция без аргументов, возвращающая действующий
+    токен (например, TokenManager.get_valid_token); функция вызывается в
+    отдельном потоке и может сама ходить за новым токеном.
+    context — любые данные скрипта, они возвращаются в on_file вместе с
+    источником (email, uid, имя диска и т.п.)."""
+
+    name: str
+    url: str
+    root: str
+    token: Union[str, Callable[[], Optional[str]]]
+    vd_hash: str = ''
+    context: Any = None
+
+    def request_path(self, path: str) -> str:
+        """Путь из ответа API -> путь для следующего запроса."""
+        if self.vd_hash:
+            return f'vd:{self.vd_hash}:disk:{extract_relative_path(path, self.vd_hash)}'
+        return path
+
+    def relative_path(self, path: str) -> str:
+        if self.vd_hash:
+            return extract_relative_path(path, self.vd_hash)
+        return path
+
+
+def personal_disk(name: str, token, root: str = 'disk:/', context: Any = None) -> DiskSource:
+    """Личный Диск сотрудника (/v1/disk/resources) с его токеном."""
+    return DiskSource(name=name, url=RESOURCES_URL, root=root, token=token,
+                      context=context)
+
+
+def virtual_disk(vd_hash: str, token, name: str = '', root: str = '/',
+                 context: Any = None) -> DiskSource:
+    """Общий Диск (/v1/disk/virtual-disks/resources), root — путь внутри диска."""
+    return DiskSource(name=name or vd_hash, url=VD_RESOURCES_URL,
+                      root=f'vd:{vd_hash}:disk:{root}', token=token,
+                      vd_hash=vd_hash, context=context)
+
+
+def ssl_from_verify(verify) -> Any:
+    """Параметр verify в стиле requests (True/False/путь к CA) -> ssl для aiohttp."""
+    if verify is False:
+        return False
+    if isinstance(verify, str):
+        return ssl.create_default_context(cafile=verify)
+    return None
+
+
+@dataclass
+class WalkResult:
+    """Итог обхода одного диска."""
+
+    files: int = 0
+    folders: int = 0
+    pages: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    failed_paths: List[str] = field(default_factory=list)
+    cancelled: bool = False
+
+
+class _DiskRun:
+    def __init__(self, source: DiskSource, on_file: Callable,
+                 on_dir: Optional[Callable], done: asyncio.Future):
+        self.source = source
+        self.on_file = on_file
+        self.on_dir = on_dir
+        self.done = done
+        self.pending = deque([(source.root, 0, 0)])
+        self.active = 0
+        self.scheduled = False
+        self.result = WalkResult()
+        self.started = time.monotonic()
+
+
+# ============================================================================
+# ОБХОД
+# ============================================================================
+
+class DiskWalker:
+    """Обход папок одного или нескольких Дисков через одну очередь.
+
+    walker = DiskWalker(rps=40, per_disk=10, logger=logger)
+    result = walker.walk(virtual_disk(vd_hash, TOKEN_ORG), on_file)
+    walker.close()
+
+    rate_limiter — уже созданный RateLimiter, если бюджет общий с другими
+    запросами скрипта; on_request вызывается после каждого запроса обхода
+    (для счётчиков скрипта).
+
+    on_file(item, source) вызывается в потоке обхода для каждого файла;
+    item — элемент _embedded.items ответа API. Если on_file возвращает
+    корутину, она дожидается. Долгие операции в on_file задерживают весь
+    обход — такие вещи лучше складывать в пачку и отдавать после walk().
+
+    on_dir(item, source) — так же для каждой папки."""
+
+    def __init__(self, *, rps: float = 40, workers: int = 50, per_disk: int = 10,
+                 page_limit: int = PAGE_LIMIT, max_depth: int = 100,
+                 max_retries: int = 5, timeout: float = 30,
+                 ssl_option: Any = None,
+                 wait_online: Optional[Callable[[], bool]] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 on_request: Optional[Callable[[], None]] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.limiter = rate_limiter or RateLimiter(rps)
+        self.workers = workers
+        self.per_disk = per_disk
+        self.page_limit = page_limit
+        self.max_depth = max_depth
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.ssl_option = ssl_option
+        self.wait_online = wait_online
+        self.on_request = on_request
+        self.log = logger or logging.getLogger('disk_walker')
+        self.fields = ','.join(['_embedded.total', 'name', 'path', 'type']
+                               + [f'_embedded.items.{name}' for name in ITEM_FIELDS])
+
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'throttled': 0,
+            'pages': 0,
+            'folders': 0,
+            'files': 0,
+            'errors': 0,
+        }
+        self.stats_lock = threading.Lock()
+
+        self._start_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ready: Optional[asyncio.Queue] = None
+        self._online_lock: Optional[asyncio.Lock] = None
+        self._tasks: List[asyncio.Task] = []
+        self._runs: List[_DiskRun] = []
+        self._stopping = False
+
+    # ---------- запуск и остановка ----------
+
+    def start(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=loop.run_forever,
+                                            name='DiskWalker', daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self._open(), loop).result()
+            self._loop = loop
+
+    async def _open(self):
+        connector_options = {'limit': self.workers}
+        if self.ssl_option is not None:
+            connector_options['ssl'] = self.ssl_option
+        connector = aiohttp.TCPConnector(**connector_options)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._ready = asyncio.Queue()
+        self._online_lock = asyncio.Lock()
+        self._tasks = [asyncio.ensure_future(self._worker())
+                       for _ in range(self.workers)]
+
+    def stop(self):
+        """Прекращает выдачу новых задач; идущие запросы дорабатывают,
+        незаконченные walk() возвращаются с cancelled=True."""
+        self._stopping = True
+
+    def close(self):
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        self._stopping = True
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), loop).result(timeout=30)
+        except Exception as e:
+            self.log.error(f'Ошибка остановки обхода: {e}')
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=10)
+        loop.close()
+
+    async def _close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for run in self._runs:
+            self._finish(run, cancelled=True)
+        if self._session is not None:
+            await self._session.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- публичные вызовы ----------
+
+    def walk(self, source: DiskSource, on_file: Callable,
+             on_dir: Optional[Callable] = None) -> WalkResult:
+        """Обходит диск целиком; блокирует вызывающий поток до конца обхода."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(
+            self.walk_async(source, on_file, on_dir), self._loop).result()
+
+    async def walk_async(self, source: DiskSource, on_file: Callable,
+                         on_dir: Optional[Callable] = None) -> WalkResult:
+        run = _DiskRun(source, on_file, on_dir,
+                       asyncio.get_event_loop().create_future())
+        self._runs.append(run)
+        self._schedule(run)
+        return await run.done
+
+    def get(self, source: DiskSource, path: Optional[str] = None,
+            limit: int = 1, offset: int = 0) -> Optional[dict]:
+        """Один запрос к ресурсу с теми же повторами и бюджетом (имя диска и т.п.)."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(
+            self._get(source, path or source.root, limit, offset),
+            self._loop).result()
+
+    def get_current_rate(self) -> int:
+        return self.limiter.get_current_rate()
+
+    # ---------- очередь ----------
+
+    def _schedule(self, run: _DiskRun):
+        if self._stopping:
+            run.pending.clear()
+        if run.pending and not run.scheduled and run.active < self.per_disk:
+            run.scheduled = True
+            self._ready.put_nowait(run)
+        elif not run.pending and run.active == 0:
+            self._finish(run)
+
+    def _finish(self, run: _DiskRun, cancelled: bool = False):
+        if run.done.done():
+            return
+        run.result.seconds = time.monotonic() - run.started
+        run.result.cancelled = cancelled or self._stopping
+        if run in self._runs:
+            self._runs.remove(run)
+        run.done.set_result(run.result)
+
+    async def _worker(self):
+        while True:
+            run = await self._ready.get()
+            run.scheduled = False
+            if not run.pending:
+                self._schedule(run)
+                continue
+            path, offset, depth = run.pending.popleft()
+            run.active += 1
+            self._schedule(run)
+            try:
+                await self._list_page(run, path, offset, depth)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                run.result.errors += 1
+                run.result.failed_paths.append(path)
+                self._count('errors')
+                self.log.error(f'Ошибка обхода {path} (offset {offset}): {e}')
+            finally:
+                run.active -= 1
+                self._schedule(run)
+
+    async def _list_page(self, run: _DiskRun, path: str, offset: int, depth: int):
+        source = run.source
+        data = await self._get(source, path, self.page_limit, offset)
+        if data is None:
+            run.result.errors += 1
+            run.result.failed_paths.append(path)
+            self._count('errors')
+            return
+
+        embedded = data.get('_embedded') or {}
+        items = embedded.get('items') or []
+        total = embedded.get('total') or 0
+        run.result.pages += 1
+        self._count('pages')
+
+        if offset == 0:
+            run.result.folders += 1
+            self._count('folders')
+            # страницы большой папки сразу в очередь — читаются параллельно
+            if total > len(items) and len(items) >= self.page_limit:
+                for next_offset in range(self.page_limit, total, self.page_limit):
+                    run.pending.append((path, next_offset, depth))
+
+        for item in items:
+            item_type = item.get('type')
+            if item_type == 'file':
+                run.result.files += 1
+                self._count('files')
+                outcome = run.on_file(item, source)
+                if asyncio.iscoroutine(outcome):
+                    await outcome
+            elif item_type == 'dir' and item.get('path'):
+                if run.on_dir is not None:
+                    outcome = run.on_dir(item, source)
+                    if asyncio.iscoroutine(outcome):
+                        await outcome
+                if depth < self.max_depth:
+                    run.pending.append((source.request_path(item['path']), 0, depth + 1))
+                else:
+                    self.log.warning(f'Превышена глубина {self.max_depth}: {item["path"]}')
+
+    # ---------- HTTP ----------
+
+    async def _token(self, source: DiskSource) -> Optional[str]:
+        if callable(source.token):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, source.token)
+        return source.token
+
+    async def _get(self, source: DiskSource, path: str, limit: int, offset: int) -> Optional[dict]:
+        params = {'path': path, 'limit': limit, 'offset': offset, 'fields': self.fields}
+        for attempt in range(self.max_retries + 1):
+            if self._stopping:
+                return None
+            token = await self._token(source)
+            if not token:
+                self.log.error(f'Нет токена для диска "{source.name}"')
+                return None
+
+            await self.limiter.acquire_async()
+            self._count('requests')
+            if self.on_request is not None:
+                self.on_request()
+            delay = min(2 ** attempt, MAX_RETRY_DELAY)
+            try:
+                async with self._session.get(
+                        source.url, params=params,
+                        headers={'Authorization': f'OAuth {token}',
+                                 'Accept': 'application/json'}) as resp:
+                    if resp.status == 200:
+                        return await resp.json(content_type=None)
+                    if resp.status == 404:
+                        return None
+                    if resp.status == 403:
+                        self.log.error(f'Доступ запрещён: {path}')
+                        return None
+                    if resp.status not in RETRY_STATUSES:
+                        self.log.error(f'Ошибка {resp.status} для {path}')
+                        return None
+                    if resp.status == 429:
+                        self._count('throttled')
+                    retry_after = resp.headers.get('Retry-After', '')
+                    if retry_after.isdigit():
+                        delay = min(int(retry_after), MAX_RETRY_DELAY)
+                    reason = f'HTTP {resp.status}'
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                reason = str(e) or type(e).__name__
+                if self.wait_online is not None and not await self._wait_online():
+                    self.log.error(f'Нет соединения, пропускаем {path}')
+                    return None
+
+            if attempt < self.max_retries:
+                self._count('retries')
+                self.log.warning(f'{reason} для {path} (offset {offset}), '
+                                 f'повтор {attempt + 1}/{self.max_retries} через {delay}с')
+                await asyncio.sleep(delay)
+
+        self.log.error(f'Все попытки исчерпаны для {path} (offset {offset})')
+        return None
+
+    async def _wait_online(self) -> bool:
+        # проверяет сеть один воркер, остальные ждут его результата
+        async with self._online_lock:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, self.wait_online)
+
+    def _count(self, key: str, value: int = 1):
+        with self.stats_lock:
+            self.stats[key] += value
@@ -18,7 +18,8 @@ https://yandex.ru/dev/disk-api/doc/ru/reference/shared-disks/shd-list-for-org
 
 ТРЕБОВАНИЯ:
 Python 3.7+
-Библиотека requests: pip install requests
+Библиотеки requests и aiohttp: pip install requests aiohttp
+Рядом со скриптом должен лежать disk_walker.py (общий обход папок)
 
 ЗАПУСК:
 python find_largest_file_per_shared_disks.py
@@ -34,11 +35,9 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock, Event
 import threading
 import time
-import queue
 import gc
 import signal
 import atexit
-import re
 import socket
 import logging
 from logging.handlers import RotatingFileHandler
@@ -46,34 +45,7 @@ from pathlib import Path
 from typing import Optional, Any, Callable, Dict, List
 import shutil
 
-class RateLimiter:
-    def __init__(self, max_calls_per_second=40):
-        self.max_calls = max_calls_per_second
-        self.period = 1.0
-        self.calls = []
-        self.lock = Lock()
-    
-    def acquire(self):
-        with self.lock:
-            now = time.time()
-            self.calls = [call_time for call_time in self.calls if now - call_time < self.period]
-            
-            if len(self.calls) >= self.max_calls:
-                oldest_call = self.calls[0]
-                sleep_time = self.period - (now - oldest_call) + 0.01
-                
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                    now = time.time()
-                    self.calls = [call_time for call_time in self.calls if now - call_time < self.period]
-            
-            self.calls.append(now)
-    
-    def get_current_rate(self):
-        with self.lock:
-            now = time.time()
-            self.calls = [call_time for call_time in self.calls if now - call_time < self.period]
-            return len(self.calls)
+from disk_walker import DiskWalker, virtual_disk
 
 # ============================================================================
 # КОНФИГУРАЦИЯ
@@ -94,8 +66,11 @@ VD_HASH_LIST = [
 
 # Параметры работы
 LIMIT_VD = 100
-MAX_WORKERS = 10 
-NUM_HELPERS_PER_DISK = 50
+MAX_WORKERS = 10  # Сколько дисков обходится одновременно
+MAX_RPS = 39  # Общий лимит запросов к /virtual-disks/resources
+WALK_CONCURRENCY = 50  # Одновременных запросов при обходе папок (на все диски)
+REQUESTS_PER_DISK = 10  # Одновременных запросов к одному диску
+MAX_RECURSION_DEPTH = 100
 
 # Создаём единую папку для всех результатов
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -108,7 +83,6 @@ SUMMARY_REPORT = RESULTS_DIR / f'summary_report.txt'
 LOG_FILE = RESULTS_DIR / f'execution.log'
 
 BATCH_WRITE_SIZE = 50
-GC_INTERVAL = 30
 
 # Параметры защиты от потери интернета
 INTERNET_CHECK_TIMEOUT = 10 * 60
@@ -129,18 +103,13 @@ stats_lock = Lock()
 internet_check_lock = Lock()
 results_lock = Lock()
 
-resources_rate_limiter = RateLimiter(max_calls_per_second=39)
-
 stats = {
     'processed_disks': 0,
     'found_files_total': 0,
     'files_written': 0,
     'skipped_disks': 0,
     'gc_collections': 0,
-    'total_api_calls': 0,
-    'helper_workers_created': 0,
-    'helper_tasks_processed': 0,
-    'rate_limited_calls': 0,
+    'walk_errors': 0,
     'empty_disks': 0
 }
 
@@ -156,6 +125,7 @@ largest_files_per_disk: Dict[str, dict] = {}
 
 shutdown_flag = Event()
 session_pool = threading.local()
+walker: Optional[DiskWalker] = None
 
 logger: Optional[logging.Logger] = None
 
@@ -533,25 +503,6 @@ def close_session():
         session_pool.session = None
 
 
-def extract_relative_path(full_path, vd_hash):
-    if not full_path:
-        return '/'
-    
-    if full_path.startswith('/') and not full_path.startswith('/disk'):
-        return full_path
-    
-    pattern = rf'vd:/[^/]+/disk(.*)$'
-    match = re.search(pattern, full_path)
-    if match:
-        relative = match.group(1)
-        return relative if relative else '/'
-    
-    if full_path.startswith('disk:'):
-        return full_path.replace('disk:', '')
-    
-    return full_path
-
-
 def disk_get_shared_disks(offset):
     try:
         session = get_session()
@@ -691,131 +642,9 @@ def get_disks_by_hash_list(hash_list: List[str]) -> List[dict]:
     return disks
 
 
-def get_virtual_disk_resources(vd_hash, relative_path='/', limit=1000, offset=0):
-    if shutdown_flag.is_set():
-        return None
-    
-    try:
-        resources_rate_limiter.acquire()
-        
-        with stats_lock:
-            stats['rate_limited_calls'] += 1
-        
-        session = get_session()
-        
-        full_path = f'vd:{vd_hash}:disk:{relative_path}'
-        
-        url = 'https://cloud-api.yandex.net/v1/disk/virtual-disks/resources'
-        params = {
-            'path': full_path,
-            'limit': limit,
-            'offset': offset,
-            'fields': '_embedded.items.name,_embedded.items.path,_embedded.items.type,_embedded.items.size,_embedded.items.created,_embedded.items.modified,_embedded.items.media_type,_embedded.total,name,path,type'
-        }
-        headers = {
-            'Authorization': f'OAuth {TOKEN_ORG}',
-            'Accept': 'application/json'
-        }
-        
-        response = session.get(url, params=params, headers=headers, timeout=30)
-        
-        with stats_lock:
-            stats['total_api_calls'] += 1
-        
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 404:
-            return None
-        elif response.status_code == 403:
-            log_error(f'Доступ запрещён: {full_path}')
-            return None
-        else:
-            log_error(f'Ошибка {response.status_code} для {full_path}')
-            return None
-        
-    except Exception as e:
-        if not shutdown_flag.is_set():
-            log_error(f'Исключение при запросе: {str(e)}')
-        return None
-
-
-def process_folder_task(vd_hash, path, disk_name, tracker: DiskLargestFileTracker, 
-                       local_queue, active_tasks_counter):
-    """Обработка папки для поиска самого крупного файла"""
-    worker_id = threading.current_thread().name
-    
-    try:
-        offset = 0
-        limit = 1000
-        subdirs_found = []
-        
-        while not shutdown_flag.is_set():
-            response = network_request_with_retry(
-                get_virtual_disk_resources, 
-                vd_hash, 
-                path, 
-                limit, 
-                offset
-            )
-            
-            if not response:
-                break
-            
-            embedded = response.get('_embedded', {})
-            items = embedded.get('items', [])
-            total = embedded.get('total', 0)
-            
-            for item in items:
-                if shutdown_flag.is_set():
-                    break
-                
-                item_type = item.get('type')
-                item_name = item.get('name', 'N/A')
-                item_path = item.get('path', 'N/A')
-                
-                if item_type == 'file':
-                    relative_item_path = extract_relative_path(item_path, vd_hash)
-                    
-                    file_info = {
-                        'disk_name': disk_name,
-                        'vd_hash': vd_hash,
-                        'file_name': item_name,
-                        'file_path': relative_item_path,
-                        'file_size': item.get('size', 'N/A'),
-                        'file_created': item.get('created', 'N/A'),
-                        'file_modified': item.get('modified', 'N/A'),
-                        'media_type': item.get('media_type', 'N/A')
-                    }
-                    
-                    tracker.update(file_info)
-                
-                elif item_type == 'dir':
-                    relative_subdir_path = extract_relative_path(item_path, vd_hash)
-                    subdirs_found.append(relative_subdir_path)
-            
-            if len(items) < limit or offset + limit >= total:
-                break
-            
-            offset += limit
-        
-        if subdirs_found:
-            with active_tasks_counter['lock']:
-                active_tasks_counter['count'] += len(subdirs_found)
-            
-            for subdir_path in subdirs_found:
-                local_queue.put(subdir_path)
-        
-    except Exception as e:
-        log_error(f'[{worker_id}] Ошибка при обработке папки {path}: {str(e)}')
-    finally:
-        with active_tasks_counter['lock']:
-            active_tasks_counter['count'] -= 1
-
-
 def scan_disk_for_largest_file(vd_hash: str, disk_name: str) -> Optional[dict]:
     """Сканирование диска для поиска самого крупного файла"""
     worker_id = threading.current_thread().name
-    timestamp_local = int(time.time())
     
     log_info('=' * 80)
     log_info(f'[{worker_id}] 🔍 Сканирование диска "{disk_name}"')
@@ -824,199 +653,26 @@ def scan_disk_for_largest_file(vd_hash: str, disk_name: str) -> Optional[dict]:
     
     tracker = DiskLargestFileTracker(vd_hash, disk_name)
     
-    active_tasks_counter = {
-        'count': 0,
-        'lock': Lock()
-    }
+    def on_file(item, source):
+        tracker.update({
+            'disk_name': disk_name,
+            'vd_hash': vd_hash,
+            'file_name': item.get('name', 'N/A'),
+            'file_path': source.relative_path(item.get('path', 'N/A')),
+            'file_size': item.get('size', 'N/A'),
+            'file_created': item.get('created', 'N/A'),
+            'file_modified': item.get('modified', 'N/A'),
+            'media_type': item.get('media_type', 'N/A')
+        })
     
     try:
-        response = network_request_with_retry(
-            get_virtual_disk_resources, 
-            vd_hash, 
-            '/', 
-            limit=1000, 
-            offset=0
-        )
-        
-        if not response:
-            log_error(f'Не удалось получить ресурсы для корня диска {disk_name}')
-            return None
-        
-        emb = response.get('_embedded', {})
-        items = emb.get('items', [])
-        
-        folders = []
-        
-        for item in items:
-            item_type = item.get('type')
-            item_name = item.get('name', 'N/A')
-            item_path = item.get('path', 'N/A')
-            
-            if item_type == 'file':
-                relative_item_path = extract_relative_path(item_path, vd_hash)
-                
-                file_info = {
-                    'disk_name': disk_name,
-                    'vd_hash': vd_hash,
-                    'file_name': item_name,
-                    'file_path': relative_item_path,
-                    'file_size': item.get('size', 'N/A'),
-                    'file_created': item.get('created', 'N/A'),
-                    'file_modified': item.get('modified', 'N/A'),
-                    'media_type': item.get('media_type', 'N/A')
-                }
-                
-                tracker.update(file_info)
-            
-            elif item_type == 'dir':
-                relative_path = extract_relative_path(item_path, vd_hash)
-                folders.append(relative_path)
-        
-        log_info(f'[{worker_id}] Корневой уровень: {len(folders)} папок')
-        
-        if not folders:
-            result = tracker.get_result()
-            files_count = tracker.get_files_count()
-            
-            if result['file_name']:
-                log_info(f'[{worker_id}] ✅ Диск "{disk_name}" обработан')
-                log_info(f'[{worker_id}]    Файлов: {files_count}')
-                log_info(f'[{worker_id}]    🏆 Крупнейший: {result["file_name"]} ({format_file_size(result["file_size"])})')
-            else:
-                log_info(f'[{worker_id}] ℹ️ Диск "{disk_name}" пуст')
-                with stats_lock:
-                    stats['empty_disks'] += 1
-            
-            return result
-        
-        local_queue = queue.Queue()
-        
-        with active_tasks_counter['lock']:
-            active_tasks_counter['count'] = len(folders)
-        
-        for folder_path in folders:
-            local_queue.put(folder_path)
-        
-        log_info(f'[{worker_id}] Создаём {NUM_HELPERS_PER_DISK} helper воркеров')
-        
-        with stats_lock:
-            stats['helper_workers_created'] += NUM_HELPERS_PER_DISK
-        
-        stop_helpers = Event()
-        
-        def helper_worker(helper_id):
-            helper_name = f'Helper_{disk_name[:10]}_{timestamp_local}_{helper_id}'
-            threading.current_thread().name = helper_name
-            
-            tasks_processed = 0
-            consecutive_empty = 0
-            max_consecutive_empty = 30
-            
-            while not shutdown_flag.is_set() and not stop_helpers.is_set():
-                try:
-                    folder_path = local_queue.get(timeout=10.0)
-                    consecutive_empty = 0
-                    
-                    process_folder_task(
-                        vd_hash, 
-                        folder_path, 
-                        disk_name, 
-                        tracker,
-                        local_queue,
-                        active_tasks_counter
-                    )
-                    
-                    tasks_processed += 1
-                    
-                    with stats_lock:
-                        stats['helper_tasks_processed'] += 1
-                    
-                    local_queue.task_done()
-                    
-                except queue.Empty:
-                    consecutive_empty += 1
-                    
-                    with active_tasks_counter['lock']:
-                        active_count = active_tasks_counter['count']
-                        queue_size = local_queue.qsize()
-                    
-                    if active_count > 0 or queue_size > 0:
-                        consecutive_empty = 0
-                        time.sleep(1)
-                        continue
-                    
-                    if consecutive_empty >= max_consecutive_empty:
-                        break
-                    
-                    continue
-                
-                except Exception as e:
-                    log_error(f'[{helper_name}] Ошибка: {str(e)}')
-                    continue
-            
-            return tasks_processed
+        walk_result = walker.walk(virtual_disk(vd_hash, TOKEN_ORG, name=disk_name), on_file)
         
-        with ThreadPoolExecutor(
-            max_workers=NUM_HELPERS_PER_DISK, 
-            thread_name_prefix=f'Helper_{disk_name[:10]}_{timestamp_local}'
-        ) as helper_executor:
-            
-            helper_futures = [
-                helper_executor.submit(helper_worker, i+1)
-                for i in range(NUM_HELPERS_PER_DISK)
-            ]
-            
-            main_tasks_processed = 0
-            consecutive_empty = 0
-            max_consecutive_empty = 30
-            
-            while not shutdown_flag.is_set():
-                try:
-                    folder_path = local_queue.get(timeout=10.0)
-                    consecutive_empty = 0
-                    
-                    process_folder_task(
-                        vd_hash, 
-                        folder_path, 
-                        disk_name, 
-                        tracker,
-                        local_queue,
-                        active_tasks_counter
-                    )
-                    
-                    main_tasks_processed += 1
-                    local_queue.task_done()
-                    
-                except queue.Empty:
-                    consecutive_empty += 1
-                    
-                    with active_tasks_counter['lock']:
-                        active_count = active_tasks_counter['count']
-                        queue_size = local_queue.qsize()
-                    
-                    if active_count > 0 or queue_size > 0:
-                        consecutive_empty = 0
-                        time.sleep(1)
-                        continue
-                    
-                    if consecutive_empty >= max_consecutive_empty:
-                        break
-                    
-                    continue
-                
-                except Exception as e:
-                    log_error(f'[{worker_id}] Ошибка: {str(e)}')
-                    continue
-            
-            stop_helpers.set()
-            
-            total_helper_tasks = 0
-            for future in as_completed(helper_futures, timeout=120):
-                try:
-                    tasks_done = future.result(timeout=30)
-                    total_helper_tasks += tasks_done
-                except Exception as e:
-                    log_error(f'[{worker_id}] Ошибка в helper: {str(e)}')
+        if walk_result.errors:
+            with stats_lock:
+                stats['walk_errors'] += walk_result.errors
+            log_warning(f'[{worker_id}] ⚠ Не прочитано папок/страниц: {walk_result.errors}, '
+                        f'например: {", ".join(walk_result.failed_paths[:5])}')
         
         result = tracker.get_result()
         files_count = tracker.get_files_count()
@@ -1024,6 +680,7 @@ def scan_disk_for_largest_file(vd_hash: str, disk_name: str) -> Optional[dict]:
         log_info('=' * 80)
         log_info(f'[{worker_id}] ✅ Диск "{disk_name}" завершён')
         log_info(f'[{worker_id}]    Просканировано файлов: {files_count}')
+        log_info(f'[{worker_id}]    Папок: {walk_result.folders}, страниц: {walk_result.pages}')
         
         if result['file_name']:
             log_info(f'[{worker_id}]    🏆 Самый крупный файл:')
@@ -1234,6 +891,10 @@ def cleanup():
     except:
         pass
     
+    if walker:
+        walker.stop()
+        walker.close()
+    
     time.sleep(0.5)
     
     if logger:
@@ -1249,6 +910,8 @@ def signal_handler(signum, frame):
 
 
 def main():
+    global walker
+    
     try:
         cleanup_old_results()
     except Exception as e:
@@ -1269,9 +932,9 @@ def main():
     log_info(f'   📋 Лог выполнения: {LOG_FILE.name}')
     log_info('-' * 80)
     log_info(f'Организация: {ORGID}')
-    log_info(f'Основных потоков: {MAX_WORKERS}')
-    log_info(f'Helper\'ов на диск: {NUM_HELPERS_PER_DISK}')
-    log_info(f'🚦 Rate Limit: 40 RPS')
+    log_info(f'Дисков одновременно: {MAX_WORKERS}')
+    log_info(f'Запросов одновременно: {WALK_CONCURRENCY} (на диск: {REQUESTS_PER_DISK})')
+    log_info(f'🚦 Rate Limit: {MAX_RPS} RPS')
     
     if VD_HASH_LIST:
         log_info(f'📋 РЕЖИМ: Конкретные диски ({len(VD_HASH_LIST)} шт.)')
@@ -1297,6 +960,14 @@ def main():
     log_info('')
     
     executor = None
+    walker = DiskWalker(
+        rps=MAX_RPS,
+        workers=WALK_CONCURRENCY,
+        per_disk=REQUESTS_PER_DISK,
+        max_depth=MAX_RECURSION_DEPTH,
+        wait_online=wait_for_internet_connection,
+        logger=logger
+    )
     
     try:
         with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8-sig', buffering=65536) as csvfile:
@@ -1346,7 +1017,8 @@ def main():
                         log_info(f'   ✅ Обработано: {stats["processed_disks"]}')
                         log_info(f'   ⏭ Пропущено: {stats["skipped_disks"]}')
                         log_info(f'   📭 Пустых дисков: {stats["empty_disks"]}')
-                        log_info(f'   🔧 API вызовов: {stats["total_api_calls"]}')
+                        log_info(f'   🔧 API вызовов: {walker.stats["requests"]} (текущая частота: {walker.get_current_rate()}/s)')
+                        log_info(f'   ⚠ Не прочитано папок/страниц: {stats["walk_errors"]}')
                         log_info('─' * 80)
                         log_info('')
                         
@@ -1368,6 +1040,8 @@ def main():
             log_info(f'   ✅ Обработано: {stats["processed_disks"]}')
             log_info(f'   ⏭ Пропущено: {stats["skipped_disks"]}')
             log_info(f'   📭 Пустых дисков: {stats["empty_disks"]}')
+            log_info(f'   🔧 API вызовов: {walker.stats["requests"]}, повторов: {walker.stats["retries"]}')
+            log_info(f'   ⚠ Не прочитано папок/страниц: {stats["walk_errors"]}')
             log_info('─' * 80)
             log_info(f'📁 Все результаты в папке: {RESULTS_DIR}')
             log_info('=' * 80)
@@ -5,7 +5,9 @@
 
 ТРЕБОВАНИЯ:
 Python 3.7+
-Библиотека requests: pip install requests
+Библиотеки requests и aiohttp: pip install requests aiohttp
+Рядом со скриптом должны лежать disk_walker.py (общий обход папок)
+и disk_inventory.py (локальный индекс файлов, если задан INVENTORY_DB)
 
 НАСТРОЙКА:
 Заполните секцию КОНФИГУРАЦИЯ ниже
@@ -24,11 +26,9 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock, Event
 import threading
 import time
-import queue
 import gc
 import signal
 import atexit
-import re
 import socket
 import logging
 from logging.handlers import RotatingFileHandler
@@ -36,35 +36,8 @@ from pathlib import Path
 from typing import Optional, Any, Callable
 import shutil
 
-class RateLimiter:
-    def __init__(self, max_calls_per_second=40):
-        self.max_calls = max_calls_per_second
-        self.period = 1.0
-        self.calls = []
-        self.lock = Lock()
-    
-    def acquire(self):
-        with self.lock:
-            now = time.time()
-            
-            self.calls = [call_time for call_time in self.calls if now - call_time < self.period]
-            
-            if len(self.calls) >= self.max_calls:
-                oldest_call = self.calls[0]
-                sleep_time = self.period - (now - oldest_call) + 0.01
-                
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                    now = time.time()
-                    self.calls = [call_time for call_time in self.calls if now - call_time < self.period]
-            
-            self.calls.append(now)
-    
-    def get_current_rate(self):
-        with self.lock:
-            now = time.time()
-            self.calls = [call_time for call_time in self.calls if now - call_time < self.period]
-            return len(self.calls)
+from disk_inventory import DiskInventory
+from disk_walker import DiskWalker, virtual_disk
 
 # ============================================================================
 # КОНФИГУРАЦИЯ
@@ -76,12 +49,18 @@ TOKEN_ORG = ''  # Токен c правами cloud_api:disk.info и cloud_api:d
 
 # Параметры работы
 LIMIT_VD = 100
-MAX_WORKERS = 10 
-NUM_HELPERS_PER_DISK = 50  # Количество helper'ов на диск
+MAX_WORKERS = 10  # Сколько дисков обходится одновременно
+MAX_RPS = 40  # Общий лимит запросов к /virtual-disks/resources
+WALK_CONCURRENCY = 50  # Одновременных запросов при обходе папок (на все диски)
+REQUESTS_PER_DISK = 10  # Одновременных запросов к одному диску
 
 # Поиск
 SEARCH_FILE_NAME = ''  # Имя файла для поиска (пустое = все файлы)
 
+# ЛОКАЛЬНЫЙ ИНДЕКС (disk_inventory.py)
+INVENTORY_DB = ''  # Файл индекса, например 'disk_inventory.sqlite3' (пусто = без индекса)
+INVENTORY_SEARCH_ONLY = False  # True = искать только по индексу, без обхода дисков
+
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 LOGS_DIR = Path(__file__).parent / f'logs_{timestamp}'
 LOGS_DIR.mkdir(exist_ok=True)
@@ -91,7 +70,6 @@ LOG_FILE = LOGS_DIR / f'shared_disks_parser_{timestamp}.log'
 
 BATCH_WRITE_SIZE = 50
 MAX_RECURSION_DEPTH = 100
-GC_INTERVAL = 30
 
 # Параметры защиты от потери интернета
 INTERNET_CHECK_TIMEOUT = 10 * 60  # 10 минут
@@ -111,18 +89,12 @@ csv_lock = Lock()
 stats_lock = Lock()
 internet_check_lock = Lock()
 
-resources_rate_limiter = RateLimiter(max_calls_per_second=40)
-
 stats = {
     'processed_disks': 0,
     'found_files_total': 0,
     'files_written': 0,
     'skipped_disks': 0,
-    'gc_collections': 0,
-    'total_api_calls': 0,
-    'helper_workers_created': 0,
-    'helper_tasks_processed': 0,
-    'rate_limited_calls': 0
+    'walk_errors': 0
 }
 
 internet_stats = {
@@ -134,6 +106,8 @@ internet_stats = {
 
 shutdown_flag = Event()
 session_pool = threading.local()
+walker: Optional[DiskWalker] = None
+inventory: Optional[DiskInventory] = None
 
 logger: Optional[logging.Logger] = None
 
@@ -453,25 +427,6 @@ def close_session():
         session_pool.session = None
 
 
-def extract_relative_path(full_path, vd_hash):
-    if not full_path:
-        return '/'
-    
-    if full_path.startswith('/') and not full_path.startswith('/disk'):
-        return full_path
-    
-    pattern = rf'vd:/[^/]+/disk(.*)$'
-    match = re.search(pattern, full_path)
-    if match:
-        relative = match.group(1)
-        return relative if relative else '/'
-    
-    if full_path.startswith('disk:'):
-        return full_path.replace('disk:', '')
-    
-    return full_path
-
-
 def disk_get_shared_disks(offset):
     try:
         session = get_session()
@@ -539,54 +494,6 @@ def get_all_shared_disks():
     return all_disks
 
 
-def get_virtual_disk_resources(vd_hash, relative_path='/', limit=1000, offset=0):
-    if shutdown_flag.is_set():
-        return None
-    
-    try:
-        resources_rate_limiter.acquire()
-        
-        with stats_lock:
-            stats['rate_limited_calls'] += 1
-        
-        session = get_session()
-        
-        full_path = f'vd:{vd_hash}:disk:{relative_path}'
-        
-        url = 'https://cloud-api.yandex.net/v1/disk/virtual-disks/resources'
-        params = {
-            'path': full_path,
-            'limit': limit,
-            'offset': offset,
-            'fields': '_embedded.items.name,_embedded.items.path,_embedded.items.type,_embedded.items.size,_embedded.items.created,_embedded.items.modified,_embedded.items.media_type,_embedded.total,name,path,type'
-        }
-        headers = {
-            'Authorization': f'OAuth {TOKEN_ORG}',
-            'Accept': 'application/json'
-        }
-        
-        response = session.get(url, params=params, headers=headers, timeout=30)
-        
-        with stats_lock:
-            stats['total_api_calls'] += 1
-        
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 404:
-            return None
-        elif response.status_code == 403:
-            log_error(f'Доступ запрещён: {full_path}')
-            return None
-        else:
-            log_error(f'Ошибка {response.status_code} для {full_path}')
-            return None
-        
-    except Exception as e:
-        if not shutdown_flag.is_set():
-            log_error(f'Исключение при запросе: {str(e)}')
-        return None
-
-
 def write_to_csv_batch(writer, batch):
     if not batch:
         return
@@ -601,335 +508,113 @@ def write_to_csv_batch(writer, batch):
     batch.clear()
 
 
-def process_folder_task(vd_hash, path, disk_name, search_name, csv_writer, files_count_ref, local_queue, active_tasks_counter):
-    worker_id = threading.current_thread().name
+def _value_or_na(value):
+    return 'N/A' if value is None else value
+
+
+def write_rows_from_inventory(csv_writer, search_name, disk=None):
+    '''Строки отчёта из индекса: один диск (disk='vd:<hash>') или все Общие Диски.'''
     batch = []
+    count = 0
     
-    try:
-        log_info(f'[{worker_id}] Обработка папки: {path}')
-        
-        offset = 0
-        limit = 1000
-        subdirs_found = []
-        
-        while not shutdown_flag.is_set():
-            response = network_request_with_retry(
-                get_virtual_disk_resources, 
-                vd_hash, 
-                path, 
-                limit, 
-                offset
-            )
-            
-            if not response:
-                break
-            
-            embedded = response.get('_embedded', {})
-            items = embedded.get('items', [])
-            total = embedded.get('total', 0)
-            
-            for item in items:
-                if shutdown_flag.is_set():
-                    break
-                
-                item_type = item.get('type')
-                item_name = item.get('name', 'N/A')
-                item_path = item.get('path', 'N/A')
-                
-                if item_type == 'file':
-                    if not search_name or search_name.lower() in item_name.lower():
-                        relative_item_path = extract_relative_path(item_path, vd_hash)
-                        
-                        file_row = {
-                            'disk_name': disk_name,
-                            'vd_hash': vd_hash,
-                            'file_name': item_name,
-                            'file_path': relative_item_path,
-                            'file_size': item.get('size', 'N/A'),
-                            'file_created': item.get('created', 'N/A'),
-                            'file_modified': item.get('modified', 'N/A'),
-                            'media_type': item.get('media_type', 'N/A')
-                        }
-                        
-                        batch.append(file_row)
-                        files_count_ref['count'] += 1
-                        
-                        if len(batch) >= BATCH_WRITE_SIZE:
-                            if csv_writer:
-                                write_to_csv_batch(csv_writer, batch)
-                            batch = []
-                            
-                            if files_count_ref['count'] % GC_INTERVAL == 0:
-                                gc.collect()
-                                with stats_lock:
-                                    stats['gc_collections'] += 1
-                
-                elif item_type == 'dir':
-                    relative_subdir_path = extract_relative_path(item_path, vd_hash)
-                    subdirs_found.append(relative_subdir_path)
-            
-            if len(items) < limit or offset + limit >= total:
-                break
-            
-            offset += limit
+    for entry in inventory.search(search_name, disk=disk, kind='shared'):
+        count += 1
+        if csv_writer is None:
+            continue
         
-        if batch and csv_writer:
+        batch.append({
+            'disk_name': entry['disk_name'],
+            'vd_hash': entry['info'].get('vd_hash', entry['disk'][3:]),
+            'file_name': entry['name'],
+            'file_path': entry['path'],
+            'file_size': _value_or_na(entry['size']),
+            'file_created': _value_or_na(entry['created']),
+            'file_modified': _value_or_na(entry['modified']),
+            'media_type': _value_or_na(entry['media_type'])
+        })
+        
+        if len(batch) >= BATCH_WRITE_SIZE:
             write_to_csv_batch(csv_writer, batch)
-        
-        if subdirs_found:
-            log_info(f'[{worker_id}] Найдено {len(subdirs_found)} подпапок в {path}, добавляю в очередь')
-            
-            with active_tasks_counter['lock']:
-                active_tasks_counter['count'] += len(subdirs_found)
-            
-            for subdir_path in subdirs_found:
-                local_queue.put(subdir_path)
-        
-        log_info(f'[{worker_id}] Завершена обработка папки: {path} (файлов: {files_count_ref["count"]}, подпапок: {len(subdirs_found)})')
-        
-    except Exception as e:
-        log_error(f'[{worker_id}] Ошибка при обработке папки {path}: {str(e)}')
-    finally:
-        with active_tasks_counter['lock']:
-            active_tasks_counter['count'] -= 1
-        gc.collect()
+    
+    if batch:
+        write_to_csv_batch(csv_writer, batch)
+    
+    return count
 
 
-def get_files_with_helpers(vd_hash, disk_name, search_name, csv_writer):
+def get_files_with_walker(vd_hash, disk_name, search_name, csv_writer):
     worker_id = threading.current_thread().name
-    timestamp = int(time.time())
     
     log_info('=' * 80)
-    log_info(f'[{worker_id}] 🔍 Начало сканирования диска "{disk_name}" с HELPER\'ами')
+    log_info(f'[{worker_id}] 🔍 Начало сканирования диска "{disk_name}"')
     log_info(f'[{worker_id}]    VD Hash: {vd_hash}')
     log_info('=' * 80)
     
-    files_count_ref = {'count': 0}
-    
-    active_tasks_counter = {
-        'count': 0,
-        'lock': Lock()
-    }
-    
-    try:
-        response = network_request_with_retry(
-            get_virtual_disk_resources, 
-            vd_hash, 
-            '/', 
-            limit=1000, 
-            offset=0
-        )
-        
-        if not response:
-            log_error(f'Не удалось получить ресурсы для корня')
-            return 0
-        
-        emb = response.get('_embedded', {})
-        items = emb.get('items', [])
+    needle = search_name.lower()
+    batch = []
+    found = {'count': 0}
+    
+    # с индексом обход только обновляет его, а строки отчёта берутся из индекса
+    crawl = None
+    if inventory is not None:
+        disk_key = f'vd:{vd_hash}'
+        crawl = inventory.begin(disk_key, 'shared', disk_name, info={'vd_hash': vd_hash})
+    
+    # вызывается в потоке обхода; batch трогает только он, пока идёт walk()
+    def on_file(item, source):
+        if crawl is not None:
+            crawl.on_file(item, source)
+            return
         
-        folders = []
-        batch = []
+        item_name = item.get('name', 'N/A')
+        if needle and needle not in item_name.lower():
+            return
         
-        for item in items:
-            item_type = item.get('type')
-            item_name = item.get('name', 'N/A')
-            item_path = item.get('path', 'N/A')
-            
-            if item_type == 'file':
-                if not search_name or search_name.lower() in item_name.lower():
-                    relative_item_path = extract_relative_path(item_path, vd_hash)
-                    
-                    file_row = {
-                        'disk_name': disk_name,
-                        'vd_hash': vd_hash,
-                        'file_name': item_name,
-                        'file_path': relative_item_path,
-                        'file_size': item.get('size', 'N/A'),
-                        'file_created': item.get('created', 'N/A'),
-                        'file_modified': item.get('modified', 'N/A'),
-                        'media_type': item.get('media_type', 'N/A')
-                    }
-                    batch.append(file_row)
-                    files_count_ref['count'] += 1
-            
-            elif item_type == 'dir':
-                relative_path = extract_relative_path(item_path, vd_hash)
-                folders.append(relative_path)
+        found['count'] += 1
+        # без файла отчёта строки только считаются, а не копятся в памяти
+        if csv_writer is None:
+            return
         
-        if batch and csv_writer:
+        batch.append({
+            'disk_name': disk_name,
+            'vd_hash': vd_hash,
+            'file_name': item_name,
+            'file_path': source.relative_path(item.get('path', 'N/A')),
+            'file_size': item.get('size', 'N/A'),
+            'file_created': item.get('created', 'N/A'),
+            'file_modified': item.get('modified', 'N/A'),
+            'media_type': item.get('media_type', 'N/A')
+        })
+        
+        if len(batch) >= BATCH_WRITE_SIZE:
             write_to_csv_batch(csv_writer, batch)
-        
-        log_info(f'[{worker_id}] Корневой уровень: {len(folders)} папок, {files_count_ref["count"]} файлов')
-        
-        if not folders:
-            return files_count_ref['count']
-        
-        local_queue = queue.Queue()
-        
-        with active_tasks_counter['lock']:
-            active_tasks_counter['count'] = len(folders)
-        
-        for folder_path in folders:
-            local_queue.put(folder_path)
-        
-        log_info(f'[{worker_id}] Создаем {NUM_HELPERS_PER_DISK} helper воркеров для диска "{disk_name}"')
-        
+    
+    result = walker.walk(virtual_disk(vd_hash, TOKEN_ORG, name=disk_name), on_file,
+                         on_dir=crawl.on_dir if crawl is not None else None)
+    
+    if batch:
+        write_to_csv_batch(csv_writer, batch)
+    
+    if crawl is not None:
+        removed = crawl.finish(complete=not (result.errors or result.cancelled))
+        found['count'] = write_rows_from_inventory(csv_writer, search_name, disk=crawl.disk)
+        log_info(f'[{worker_id}] 🗂 Индекс: файлов {crawl.files}, папок {crawl.dirs}, '
+                 f'удалено записей {removed}')
+    
+    if result.errors:
         with stats_lock:
-            stats['helper_workers_created'] += NUM_HELPERS_PER_DISK
-        
-        stop_helpers = Event()
-        
-        def helper_worker(helper_id):
-            helper_name = f'Helper_{disk_name}_{timestamp}_{helper_id}'
-            threading.current_thread().name = helper_name
-            
-            log_info(f'[{helper_name}] Запущен')
-            
-            tasks_processed = 0
-            consecutive_empty = 0
-            max_consecutive_empty = 30
-            
-            while not shutdown_flag.is_set() and not stop_helpers.is_set():
-                try:
-                    folder_path = local_queue.get(timeout=10.0)
-                    consecutive_empty = 0
-                    
-                    log_info(f'[{helper_name}] Взял задачу: {folder_path}')
-                    
-                    process_folder_task(
-                        vd_hash, 
-                        folder_path, 
-                        disk_name, 
-                        search_name, 
-                        csv_writer, 
-                        files_count_ref,
-                        local_queue,
-                        active_tasks_counter
-                    )
-                    
-                    tasks_processed += 1
-                    
-                    with stats_lock:
-                        stats['helper_tasks_processed'] += 1
-                    
-                    local_queue.task_done()
-                    
-                except queue.Empty:
-                    consecutive_empty += 1
-                    
-                    with active_tasks_counter['lock']:
-                        active_count = active_tasks_counter['count']
-                        queue_size = local_queue.qsize()
-                    
-                    if active_count > 0 or queue_size > 0:
-                        consecutive_empty = 0
-                        time.sleep(1)
-                        continue
-                    
-                    if consecutive_empty >= max_consecutive_empty:
-                        log_info(f'[{helper_name}] Нет задач {consecutive_empty} раз подряд, завершаю работу')
-                        break
-                    
-                    continue
-                
-                except Exception as e:
-                    log_error(f'[{helper_name}] Ошибка: {str(e)}')
-                    continue
-            
-            log_info(f'[{helper_name}] Завершён. Обработано задач: {tasks_processed}')
-            return tasks_processed
-        
-        with ThreadPoolExecutor(
-            max_workers=NUM_HELPERS_PER_DISK, 
-            thread_name_prefix=f'HelperPool_{disk_name}_{timestamp}'
-        ) as helper_executor:
-            
-            helper_futures = [
-                helper_executor.submit(helper_worker, i+1)
-                for i in range(NUM_HELPERS_PER_DISK)
-            ]
-            
-            log_info(f'[{worker_id}] Основной воркер также обрабатывает очередь')
-            
-            main_tasks_processed = 0
-            consecutive_empty = 0
-            max_consecutive_empty = 30
-            
-            while not shutdown_flag.is_set():
-                try:
-                    folder_path = local_queue.get(timeout=10.0)
-                    consecutive_empty = 0
-                    
-                    log_info(f'[{worker_id}] Взял задачу: {folder_path}')
-                    
-                    process_folder_task(
-                        vd_hash, 
-                        folder_path, 
-                        disk_name, 
-                        search_name, 
-                        csv_writer, 
-                        files_count_ref,
-                        local_queue,
-                        active_tasks_counter
-                    )
-                    
-                    main_tasks_processed += 1
-                    local_queue.task_done()
-                    
-                except queue.Empty:
-                    consecutive_empty += 1
-                    
-                    with active_tasks_counter['lock']:
-                        active_count = active_tasks_counter['count']
-                        queue_size = local_queue.qsize()
-                    
-                    if active_count > 0 or queue_size > 0:
-                        consecutive_empty = 0
-                        time.sleep(1)
-                        continue
-                    
-                    if consecutive_empty >= max_consecutive_empty:
-                        log_info(f'[{worker_id}] Очередь пуста {consecutive_empty} раз, завершаю обработку')
-                        break
-                    
-                    continue
-                
-                except Exception as e:
-                    log_error(f'[{worker_id}] Ошибка: {str(e)}')
-                    continue
-            
-            log_info(f'[{worker_id}] Основной воркер обработал {main_tasks_processed} задач')
-            log_info(f'[{worker_id}] Ожидание завершения helper\'ов...')
-            
-            stop_helpers.set()
-            
-            total_helper_tasks = 0
-            for future in as_completed(helper_futures, timeout=120):
-                try:
-                    tasks_done = future.result(timeout=30)
-                    total_helper_tasks += tasks_done
-                    log_info(f'[{worker_id}] Helper завершил {tasks_done} задач')
-                except Exception as e:
-                    log_error(f'[{worker_id}] Ошибка в helper: {str(e)}')
-            
-            log_info(f'[{worker_id}] Все helper\'ы завершены. Helper\'ы обработали: {total_helper_tasks} задач')
-        
-        log_info('=' * 80)
-        log_info(f'[{worker_id}] ✅ Диск "{disk_name}" завершён')
-        log_info(f'[{worker_id}]    Найдено файлов: {files_count_ref["count"]}')
-        log_info(f'[{worker_id}]    Всего задач обработано: {main_tasks_processed + total_helper_tasks}')
-        log_info('=' * 80)
-        log_info('')
-        
-        return files_count_ref['count']
-        
-    except Exception as e:
-        log_error(f'Ошибка при обходе с helper\'ами: {str(e)}')
-        import traceback
-        log_error(traceback.format_exc())
-        return files_count_ref.get('count', 0)
-    finally:
-        gc.collect()
+            stats['walk_errors'] += result.errors
+        log_warning(f'[{worker_id}] ⚠ Не прочитано папок/страниц: {result.errors}, '
+                    f'например: {", ".join(result.failed_paths[:5])}')
+    
+    log_info('=' * 80)
+    log_info(f'[{worker_id}] ✅ Диск "{disk_name}" завершён')
+    log_info(f'[{worker_id}]    Найдено файлов: {found["count"]} из {result.files}')
+    log_info(f'[{worker_id}]    Папок: {result.folders}, страниц: {result.pages}')
+    log_info('=' * 80)
+    log_info('')
+    
+    return found['count']
 
 
 def update_stats(processed=0, files_found=0, skipped=0):
@@ -955,7 +640,7 @@ def process_shared_disk(disk, writer):
             update_stats(skipped=1)
             return False, 0
         
-        files_count = get_files_with_helpers(
+        files_count = get_files_with_walker(
             vd_hash=vd_hash,
             disk_name=disk_name,
             search_name=SEARCH_FILE_NAME,
@@ -999,6 +684,28 @@ def process_shared_disk(disk, writer):
         gc.collect()
 
 
+def search_inventory_only():
+    '''Отчёт только по индексу: без токена и запросов к API.'''
+    disks = inventory.list_disks('shared')
+    incomplete = sum(1 for disk in disks if not disk['complete'])
+    log_info(f'🗂 Дисков в индексе: {len(disks)}')
+    if incomplete:
+        log_warning(f'⚠ Обход не закончен для {incomplete} дисков — данные по ним неполные')
+    
+    with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8-sig', buffering=65536) as csvfile:
+        field_names = [
+            'disk_name', 'vd_hash',
+            'file_name', 'file_path', 'file_size',
+            'file_created', 'file_modified', 'media_type'
+        ]
+        writer = csv.DictWriter(csvfile, field_names, extrasaction='ignore', delimiter=';')
+        writer.writeheader()
+        found = write_rows_from_inventory(writer, SEARCH_FILE_NAME)
+    
+    log_info(f'📄 Найдено файлов: {found}')
+    log_info(f'📄 CSV-отчет: {OUTPUT_FILE}')
+
+
 def cleanup():
     if shutdown_flag.is_set():
         return
@@ -1011,6 +718,13 @@ def cleanup():
     except:
         pass
     
+    if walker:
+        walker.stop()
+        walker.close()
+    
+    if inventory:
+        inventory.close()
+    
     time.sleep(0.5)
     
     if logger:
@@ -1026,6 +740,8 @@ def signal_handler(signum, frame):
 
 
 def main():
+    global walker, inventory
+    
     try:
         cleanup_old_logs()
     except Exception as e:
@@ -1038,22 +754,32 @@ def main():
     signal.signal(signal.SIGTERM, signal_handler)
     
     log_info('=' * 80)
-    log_info('🚀 АНАЛИЗ ОБЩИХ ДИСКОВ ЯНДЕКС 360 v10.8 LOGS IN FOLDERS + RATE LIMIT 40 RPS')
+    log_info(f'🚀 АНАЛИЗ ОБЩИХ ДИСКОВ ЯНДЕКС 360 v11.0 ASYNC WALK + RATE LIMIT {MAX_RPS} RPS')
     log_info('=' * 80)
     log_info(f'Формат пути: vd:{{vd_hash}}:disk:{{path}}')
     log_info(f'Организация: {ORGID}')
-    log_info(f'Основных потоков: {MAX_WORKERS}')
-    log_info(f'Helper\'ов на диск: {NUM_HELPERS_PER_DISK}')
+    log_info(f'Дисков одновременно: {MAX_WORKERS}')
+    log_info(f'Запросов одновременно: {WALK_CONCURRENCY} (на диск: {REQUESTS_PER_DISK})')
     log_info(f'Батч-запись: {BATCH_WRITE_SIZE}')
-    log_info(f'🚦 Rate Limit: 40 RPS (фиксировано для /virtual-disks/resources)')
+    log_info(f'🚦 Rate Limit: {MAX_RPS} RPS (для /virtual-disks/resources)')
     log_info(f'Защита от потери интернета: {INTERNET_CHECK_TIMEOUT // 60} минут')
     if SEARCH_FILE_NAME:
         log_info(f'🔍 Поиск: "{SEARCH_FILE_NAME}"')
     else:
         log_info('🔍 Режим: ВСЕ файлы')
+    if INVENTORY_DB:
+        log_info(f'🗂 Индекс: {INVENTORY_DB}' + (' (только поиск)' if INVENTORY_SEARCH_ONLY else ''))
     log_info('=' * 80)
     log_info('')
     
+    if INVENTORY_SEARCH_ONLY:
+        if not INVENTORY_DB or not os.path.exists(INVENTORY_DB):
+            log_error(f'❌ INVENTORY_SEARCH_ONLY: файл индекса не найден: {INVENTORY_DB}')
+            return
+        inventory = DiskInventory(INVENTORY_DB)
+        search_inventory_only()
+        return
+    
     if not all([ORGID, TOKEN_ORG]):
         log_error('❌ Не заполнены параметры: ORGID, TOKEN_ORG!')
         return
@@ -1068,6 +794,16 @@ def main():
     log_info('')
     
     executor = None
+    if INVENTORY_DB:
+        inventory = DiskInventory(INVENTORY_DB)
+    walker = DiskWalker(
+        rps=MAX_RPS,
+        workers=WALK_CONCURRENCY,
+        per_disk=REQUESTS_PER_DISK,
+        max_depth=MAX_RECURSION_DEPTH,
+        wait_online=wait_for_internet_connection,
+        logger=logger
+    )
     
     try:
         with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8-sig', buffering=65536) as csvfile:
@@ -1085,6 +821,13 @@ def main():
                 log_error('❌ Не удалось получить список дисков')
                 return
             
+            if inventory is not None:
+                current = {f'vd:{disk.get("vd_hash")}' for disk in all_disks}
+                for known in inventory.list_disks('shared'):
+                    if known['disk'] not in current:
+                        log_info(f'🗂 Диска "{known["name"]}" больше нет — убран из индекса')
+                        inventory.forget(known['disk'])
+            
             total_disks = len(all_disks)
             log_info('')
             log_info(f'📊 Дисков к обработке: {total_disks}')
@@ -1115,11 +858,10 @@ def main():
                         log_info(f'   ⏭ Пропущено: {stats["skipped_disks"]}')
                         log_info(f'   📄 Найдено файлов: {stats["found_files_total"]}')
                         log_info(f'   💾 Записано строк: {stats["files_written"]}')
-                        log_info(f'   🔧 API вызовов: {stats["total_api_calls"]}')
-                        log_info(f'   🚦 Rate limited: {stats["rate_limited_calls"]} (текущая частота: {resources_rate_limiter.get_current_rate()}/s)')
-                        log_info(f'   👥 Helper\'ов создано: {stats["helper_workers_created"]}')
-                        log_info(f'   📦 Helper задач: {stats["helper_tasks_processed"]}')
-                        log_info(f'   🗑 Сборок мусора: {stats["gc_collections"]}')
+                        log_info(f'   🔧 API вызовов: {walker.stats["requests"]} (текущая частота: {walker.get_current_rate()}/s)')
+                        log_info(f'   🔁 Повторов: {walker.stats["retries"]}, из них 429: {walker.stats["throttled"]}')
+                        log_info(f'   📂 Папок: {walker.stats["folders"]}, страниц: {walker.stats["pages"]}')
+                        log_info(f'   ⚠ Не прочитано: {stats["walk_errors"]}')
                         
                         with internet_check_lock:
                             if internet_stats['reconnect_attempts'] > 0:
@@ -1146,11 +888,10 @@ def main():
             log_info(f'   ⏭ Пропущено: {stats["skipped_disks"]}')
             log_info(f'   📄 Найдено файлов: {stats["found_files_total"]}')
             log_info(f'   💾 Записано строк: {stats["files_written"]}')
-            log_info(f'   🔧 API вызовов: {stats["total_api_calls"]}')
-            log_info(f'   🚦 Rate limited запросов: {stats["rate_limited_calls"]}')
-            log_info(f'   👥 Helper воркеров создано: {stats["helper_workers_created"]}')
-            log_info(f'   📦 Helper задач обработано: {stats["helper_tasks_processed"]}')
-            log_info(f'   🗑 Сборок мусора: {stats["gc_collections"]}')
+            log_info(f'   🔧 API вызовов: {walker.stats["requests"]}')
+            log_info(f'   🔁 Повторов: {walker.stats["retries"]}, из них 429: {walker.stats["throttled"]}')
+            log_info(f'   📂 Папок: {walker.stats["folders"]}, страниц: {walker.stats["pages"]}')
+            log_info(f'   ⚠ Не прочитано папок/страниц: {stats["walk_errors"]}')
             
             with internet_check_lock:
                 if internet_stats['reconnect_attempts'] > 0:
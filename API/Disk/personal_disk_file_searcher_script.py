@@ -4,7 +4,10 @@
 
 ТРЕБОВАНИЯ:
 Python 3.7+
-Библиотека requests. Установить её можно так: pip install requests
+Библиотеки requests и aiohttp. Установить их можно так: pip install requests aiohttp
+Рядом со скриптом должны лежать disk_walker.py (общий обход папок),
+disk_listing_strategy.py (выбор между плоским списком и обходом папок)
+и disk_inventory.py (локальный индекс файлов, если задан INVENTORY_DB)
 
 ДОСТУПЫ И ТОКЕНЫ:
 Токен OAuth приложения с правами directory:read_users
@@ -18,6 +21,12 @@ USE_UID_LIST = False или True, где False = вся организация,
 FILTER_DOMAIN_USERS_ONLY = False или True, где True = только доменные пользователи (uid > 1130000000000000)
 SEARCH_FILE_NAME = '', где можно указать имя файла с расширением или без, а пустая строка = все файлы
 MAX_WORKERS = 5, где указанное число = количество параллельных потоков. Настраивается индивидуально в зависимости от необходимой скорости и объёмов записей для поиска
+MAX_FLAT_PAGES = 1000, больше страниц плоского списка не читается — дальше обход папок
+LISTING_HISTORY_FILE = 'listing_history.json', итоги прошлых запусков для выбора способа (пусто = без истории)
+Способ получения списка файлов выбирается для каждого сотрудника заранее: по занятому месту
+(/v1/disk), первой странице плоского списка и истории. Огромные Диски сразу читаются обходом
+папок, а если плоский список затянулся дольше оценки, скрипт переключается на обход,
+не записывая повторно уже найденные файлы.
 URL для основного механизма функции disk_get_files_paginated_streaming можно конкретизировать.
 Если требуется искать документ, то указать ссылку можно так:
 url = f'https://cloud-api.yandex.net/v1/disk/resources/files?limit={DISK_LIMIT}&offset={offset}&media_type=document'
@@ -92,6 +101,15 @@ file_modified	Дата изменения
 
 Без SCIM токена: заблокированные пользователи будут пропущены
 
+ЛОКАЛЬНЫЙ ИНДЕКС (INVENTORY_DB):
+Если задан файл индекса, найденные файлы всех Дисков сохраняются в SQLite,
+а строки отчёта берутся из индекса.
+- При повторном запуске с AUDIT_TOKEN (права ya360_security:audit_log_disk)
+  Диски сотрудников, у которых с прошлого запуска не было событий в
+  аудит-логе Диска, не читаются — их файлы берутся из индекса.
+- INVENTORY_SEARCH_ONLY = True — отчёт только по индексу, за секунды и
+  без запросов к API (USE_UID_LIST и FILTER_DOMAIN_USERS_ONLY учитываются).
+
 ПРИ ПОТЕРЕ ИНТЕРНЕТ-СОЕДИНЕНИЯ:
 - Скрипт ждет восстановления до 10 минут
 - Проверяет доступность каждые 10 секунд
@@ -126,7 +144,6 @@ file_modified	Дата изменения
 Обработано пользователей: 195/200
 Пропущено пользователей: 5
 Записано файлов: 15234
-Сборок мусора: 45
 Результаты CSV: disk_report_20240115_103045.csv
 Лог-файл: logs/disk_parser_20240115_103045.log
 ========================================================================================
@@ -155,6 +172,7 @@ SEARCH_FILE_NAME = 'report_2024'  # найдет report_2024.xlsx, report_2024_f
 import os
 import requests  # type: ignore
 from requests.adapters import HTTPAdapter, Retry  # type: ignore
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool  # type: ignore
 from datetime import datetime
 import csv
 import sys
@@ -162,16 +180,19 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock, Event
 import threading
 import time
-from dataclasses import dataclass, field
-from typing import Optional, List, Dict, Set, Callable, Any
-import queue
+from typing import Optional, Dict, Set, Callable, Any
 import gc
 import socket
 import logging
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from collections import deque
-from functools import wraps
+
+from disk_inventory import PLAN_SKIP, DiskInventory, audit_changed_owners
+from disk_listing_strategy import (DISK_INFO_URL, FLAT, RECURSIVE, DiskSignals,
+                                   ListingCostModel, ListingHistory, SeenResources,
+                                   used_space_without_trash)
+from disk_walker import DiskWalker, RateLimiter, personal_disk
 
 # ============================================================================
 # КОНФИГУРАЦИЯ
@@ -192,6 +213,11 @@ UID_LIST_FILE = 'uid_list.txt'
 FILTER_DOMAIN_USERS_ONLY = True  # True - только uid > 1130000000000000
 SEARCH_FILE_NAME = ''  # Имя файла для поиска
 
+# Локальный индекс файлов (disk_inventory.py)
+INVENTORY_DB = ''  # Файл индекса, например 'disk_inventory.sqlite3' (пусто = без индекса)
+INVENTORY_SEARCH_ONLY = False  # True - только поиск по индексу, без обхода Дисков
+AUDIT_TOKEN = ''  # Токен с правами ya360_security:audit_log_disk (пусто = без аудит-лога)
+
 # Папка и файлы
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 LOGS_DIR = Path(__file__).parent / f'logs_{timestamp}'
@@ -205,19 +231,19 @@ SCIM_LOG_FILE = LOGS_DIR / f'scim_operations_{timestamp}.log'
 PERPAGE = 1000
 DISK_LIMIT = 1000
 MAX_WORKERS = 100
-MAX_HELPERS = 200
 MAX_RPS = 39
+WALK_CONCURRENCY = 100  # одновременных запросов при рекурсивном обходе (на всех пользователей)
+REQUESTS_PER_DISK = 10  # одновременных запросов к Диску одного пользователя
+SESSION_POOL_SIZE = 4  # keep-alive соединений с одним хостом в сессии потока
+MAX_FLAT_PAGES = 1000  # больше страниц плоского списка не читаем — дальше обход папок
+LISTING_HISTORY_FILE = 'listing_history.json'  # итоги прошлых запусков (пусто = без истории)
 TOKEN_LIFETIME = 50 * 60
-WORKER_IDLE_THRESHOLD = 30
 
 RPS_MONITOR_INTERVAL = 5
 RPS_LOG_INTERVAL = 30
 
-MAX_PATHS_CACHE = 20000
-PATHS_CLEANUP_THRESHOLD = 0.7
 BATCH_WRITE_SIZE = 50
 MAX_RECURSION_DEPTH = 100
-GC_INTERVAL = 30
 
 INTERNET_CHECK_TIMEOUT = 10 * 60
 INTERNET_RETRY_INTERVAL = 10
@@ -240,9 +266,12 @@ scim_lock = Lock()
 stats = {
     'processed_users': 0,
     'files_written': 0,
-    'gc_collections': 0,
     'skipped_users': 0,
     'http_requests': 0,
+    'inventory_reused': 0,
+    'listing_flat': 0,
+    'listing_recursive': 0,
+    'listing_switched': 0,
     'start_time': 0,
 }
 
@@ -262,10 +291,17 @@ scim_operations = {
 
 logger: Optional[logging.Logger] = None
 scim_logger: Optional[logging.Logger] = None
-rate_limiter: Optional['RateLimiter'] = None
+session_pool = threading.local()
+all_sessions = []
+all_sessions_lock = Lock()
+rate_limiter: Optional[RateLimiter] = None
 rps_monitor: Optional['RPSMonitor'] = None
-task_manager: Optional['TaskManager'] = None
-global_helpers_executor: Optional[ThreadPoolExecutor] = None
+walker: Optional[DiskWalker] = None
+inventory: Optional[DiskInventory] = None
+audit_changes: Optional[Dict[str, datetime]] = None
+listing_history: Optional[ListingHistory] = None
+cost_model = ListingCostModel(page_limit=DISK_LIMIT, flat_page_cap=MAX_FLAT_PAGES,
+                              recursive_concurrency=REQUESTS_PER_DISK)
 
 
 class RPSMonitor:
@@ -283,6 +319,9 @@ class RPSMonitor:
         self.total_requests = 0
         self.start_time = time.time()
         
+        self.pooled_requests = 0
+        self.new_connections = 0
+        
         self.interval_stats = []
         self.last_log_time = time.time()
         
@@ -336,6 +375,22 @@ class RPSMonitor:
             else:
                 self.other_requests.append(current_time)
     
+    def record_pooled_request(self):
+        with self.lock:
+            self.pooled_requests += 1
+    
+    def record_new_connection(self):
+        with self.lock:
+            self.new_connections += 1
+    
+    def get_connection_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'requests': self.pooled_requests,
+                'handshakes': self.new_connections,
+                'reused': max(0, self.pooled_requests - self.new_connections)
+            }
+    
     def _cleanup_old_requests(self, requests_queue: deque, current_time: float):
         cutoff_time = current_time - self.window_seconds
         while requests_queue and requests_queue[0] < cutoff_time:
@@ -401,6 +456,10 @@ class RPSMonitor:
         log_info(f'🎯 Лимит:              {MAX_RPS:>6} RPS')
         log_info(f'📦 Всего запросов:     {rps_data["total_count"]}')
         
+        connections = self.get_connection_stats()
+        log_info(f'🔌 Новых соединений:   {connections["handshakes"]} '
+                 f'(повторно использовано: {connections["reused"]} из {connections["requests"]})')
+        
         usage_percent = (rps_data["total"] / MAX_RPS * 100) if MAX_RPS > 0 else 0
         log_info(f'⚡ Использование:      {usage_percent:>6.1f}%')
         log_info('═' * 70)
@@ -409,7 +468,7 @@ class RPSMonitor:
 def make_http_request(request_func: Callable, request_type: str, *args, **kwargs):
 
     if rate_limiter:
-        rate_limiter.acquire(1)
+        rate_limiter.acquire()
     
     try:
         response = request_func(*args, **kwargs)
@@ -429,6 +488,71 @@ def make_http_request(request_func: Callable, request_type: str, *args, **kwargs
         raise e
 
 
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        if rps_monitor:
+            rps_monitor.record_new_connection()
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        if rps_monitor:
+            rps_monitor.record_new_connection()
+        return super()._new_conn()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    '''HTTPAdapter, который считает запросы и новые соединения (TLS-рукопожатия)
+    для RPSMonitor: запрос без нового соединения ушёл по keep-alive.'''
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool
+        }
+    
+    def send(self, request, **kwargs):
+        if rps_monitor:
+            rps_monitor.record_pooled_request()
+        return super().send(request, **kwargs)
+
+
+def get_session():
+    '''Сессия текущего потока: одна на воркер на всё время работы, поэтому
+    токены, SCIM, справочник и страницы Диска идут по уже открытым соединениям.'''
+    session = getattr(session_pool, 'session', None)
+    if session is None:
+        session = requests.Session()
+        api_adapter = CountingHTTPAdapter(
+            max_retries=Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]),
+            pool_maxsize=SESSION_POOL_SIZE
+        )
+        # плоский список файлов сам решает, что делать с 500 и 429 (fallback)
+        disk_adapter = CountingHTTPAdapter(
+            max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504]),
+            pool_maxsize=SESSION_POOL_SIZE
+        )
+        session.mount('https://', api_adapter)
+        session.mount('https://cloud-api.yandex.net/', disk_adapter)
+        session_pool.session = session
+        with all_sessions_lock:
+            all_sessions.append(session)
+    return session
+
+
+def close_sessions():
+    with all_sessions_lock:
+        sessions = all_sessions[:]
+        all_sessions.clear()
+    for session in sessions:
+        try:
+            session.close()
+        except Exception:
+            pass
+
+
 class CustomRotatingFileHandler(RotatingFileHandler):
     
     def __init__(self, filename, mode='a', maxBytes=0, backupCount=0, 
@@ -696,11 +820,7 @@ def get_user_by_uid(uid: str) -> Optional[Dict]:
     try:
         url = f'https://api360.yandex.net/directory/v1/org/{ORGID}/users/{uid}'
         headers = {'Authorization': f'OAuth {ORG_TOKEN}'}
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        session = requests.Session()
-        session.mount('https://', HTTPAdapter(max_retries=retries))
-        
-        response = make_http_request(session.get, 'directory', url, headers=headers, timeout=30)
+        response = make_http_request(get_session().get, 'directory', url, headers=headers, timeout=30)
         
         if response.status_code == 200:
             user_data = response.json()
@@ -820,11 +940,7 @@ def scim_enable_user(user_id: str, email: str = 'N/A'):
             "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
             "Operations": [{"op": "replace", "path": "active", "value": True}]
         }
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        session = requests.Session()
-        session.mount('https://', HTTPAdapter(max_retries=retries))
-        
-        response = make_http_request(session.patch, 'scim', url, json=body, headers=headers, timeout=30)
+        response = make_http_request(get_session().patch, 'scim', url, json=body, headers=headers, timeout=30)
         
         if response.status_code in [200, 204]:
             log_info(f'🔓 Пользователь {email} (UID: {user_id}) временно разблокирован')
@@ -861,11 +977,7 @@ def scim_disable_user(user_id: str, email: str = 'N/A'):
             "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
             "Operations": [{"op": "replace", "path": "active", "value": False}]
         }
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        session = requests.Session()
-        session.mount('https://', HTTPAdapter(max_retries=retries))
-        
-        response = make_http_request(session.patch, 'scim', url, json=body, headers=headers, timeout=30)
+        response = make_http_request(get_session().patch, 'scim', url, json=body, headers=headers, timeout=30)
         
         if response.status_code in [200, 204]:
             log_info(f'🔒 Пользователь {email} (UID: {user_id}) заблокирован обратно')
@@ -893,42 +1005,6 @@ def scim_disable_user(user_id: str, email: str = 'N/A'):
         
         return False
 
-class RateLimiter:
-    def __init__(self, max_rps: int):
-        self.max_rps = max_rps
-        self.tokens = max_rps
-        self.max_tokens = max_rps
-        self.last_update = time.time()
-        self.lock = Lock()
-        self.total_requests = 0
-    
-    def acquire(self, tokens: int = 1):
-        sleep_time = 0
-        
-        with self.lock:
-            now = time.time()
-            elapsed = now - self.last_update
-            self.tokens = min(self.max_tokens, self.tokens + elapsed * self.max_rps)
-            self.last_update = now
-            
-            if self.tokens < tokens:
-                sleep_time = (tokens - self.tokens) / self.max_rps
-            else:
-                self.tokens -= tokens
-                self.total_requests += tokens
-        
-        if sleep_time > 0:
-            time.sleep(sleep_time)
-            
-            with self.lock:
-                now = time.time()
-                elapsed = now - self.last_update
-                self.tokens = min(self.max_tokens, self.tokens + elapsed * self.max_rps)
-                self.last_update = now
-                self.tokens -= tokens
-                self.total_requests += tokens
-
-
 class TokenManager:
     def __init__(self, uid):
         self.uid = uid
@@ -948,315 +1024,6 @@ class TokenManager:
             return self.token
 
 
-@dataclass
-class WorkerActivity:
-    worker_id: str
-    last_activity: float
-    current_task: Optional[str] = None
-    is_busy: bool = False
-    
-    def update_activity(self, task: Optional[str] = None):
-        self.last_activity = time.time()
-        self.current_task = task
-        self.is_busy = task is not None
-    
-    def idle_time(self) -> float:
-        return time.time() - self.last_activity
-
-
-@dataclass
-class FolderTask:
-    path: str
-    token_manager: TokenManager
-    search_name: str
-    parent_task_id: str
-    depth: int = 0
-    user_email: str = 'N/A'
-    user_uid: str = 'N/A'
-    user_enabled: bool = True
-    csv_writer: Optional[object] = None
-    last_check_time: float = field(default_factory=time.time)
-
-
-class TaskManager:
-    
-    def __init__(self, max_workers: int, max_helpers: int):
-        self.max_workers = max_workers
-        self.max_helpers = max_helpers
-        self.workers: Dict[str, WorkerActivity] = {}
-        self.workers_lock = threading.RLock()
-        
-        self.folder_queue = queue.Queue()
-        self.completed_paths: Set[str] = set()
-        self.in_progress_paths: Set[str] = set()
-        self.queued_paths: Set[str] = set()
-        self.paths_lock = Lock()
-        
-        self.active_recursive_tasks: Dict[str, FolderTask] = {}
-        self.active_tasks_lock = Lock()
-        
-        self.user_tasks_count: Dict[str, int] = {}
-        self.user_tasks_lock = Lock()
-        
-        self.shutdown_event = Event()
-        self.helpers_active = 0
-        self.helpers_lock = Lock()
-        
-        self.worker_stats: Dict[str, Dict] = {}
-        self.worker_stats_lock = Lock()
-        
-        self.empty_monitor_iterations = 0
-        self.paths_added = 0
-    
-    def increment_user_tasks(self, user_uid: str):
-        with self.user_tasks_lock:
-            self.user_tasks_count[user_uid] = self.user_tasks_count.get(user_uid, 0) + 1
-            log_info(f'📊 [TASK_TRACK] UID {user_uid}: задач +1 = {self.user_tasks_count[user_uid]}')
-    
-    def decrement_user_tasks(self, user_uid: str):
-        with self.user_tasks_lock:
-            if user_uid in self.user_tasks_count:
-                self.user_tasks_count[user_uid] = max(0, self.user_tasks_count[user_uid] - 1)
-                log_info(f'📊 [TASK_TRACK] UID {user_uid}: задач -1 = {self.user_tasks_count[user_uid]}')
-                
-                if self.user_tasks_count[user_uid] == 0:
-                    del self.user_tasks_count[user_uid]
-                    log_info(f'✅ [TASK_TRACK] UID {user_uid}: все задачи завершены')
-    
-    def get_user_tasks_count(self, user_uid: str) -> int:
-        with self.user_tasks_lock:
-            return self.user_tasks_count.get(user_uid, 0)
-    
-    def wait_for_user_tasks(self, user_uid: str, timeout: int = 600, check_interval: int = 2):
-        start_time = time.time()
-        wait_iterations = 0
-        last_tasks_count = -1
-        stuck_iterations = 0
-    
-        while time.time() - start_time < timeout:
-            tasks_count = self.get_user_tasks_count(user_uid)
-        
-            if tasks_count == 0:
-                log_info(f'✅ [WAIT] UID {user_uid}: все задачи завершены за {int(time.time() - start_time)}с')
-                return True
-        
-            if tasks_count == last_tasks_count:
-                stuck_iterations += 1
-            else:
-                stuck_iterations = 0
-            last_tasks_count = tasks_count
-        
-            if stuck_iterations >= 30:
-                queue_size = self.folder_queue.qsize()
-            
-                with self.paths_lock:
-                    in_progress = len(self.in_progress_paths)
-                    queued = len(self.queued_paths)
-                    completed = len(self.completed_paths)
-            
-                with self.helpers_lock:
-                    helpers = self.helpers_active
-            
-                log_warning(f'⚠️ [WAIT] UID {user_uid}: DEADLOCK обнаружен!')
-                log_warning(f'    Счетчик задач: {tasks_count}')
-                log_warning(f'    Очередь: {queue_size}')
-                log_warning(f'    В обработке: {in_progress}')
-                log_warning(f'    В queued_paths: {queued}')
-                log_warning(f'    Завершено: {completed}')
-                log_warning(f'    Активных хелперов: {helpers}')
-            
-                if queue_size == 0 and in_progress == 0:
-                    log_warning(f'⚠️ [WAIT] UID {user_uid}: Очередь и in_progress пусты!')
-                    log_warning(f'⚠️ [WAIT] UID {user_uid}: Принудительный сброс {tasks_count} потерянных задач')
-                
-                    with self.user_tasks_lock:
-                        if user_uid in self.user_tasks_count:
-                            del self.user_tasks_count[user_uid]
-                
-                    return True
-            
-                if queue_size > 0 and helpers > 0:
-                    log_warning(f'⚠️ [WAIT] UID {user_uid}: Очередь={queue_size}, но задачи не берутся!')
-                    log_warning(f'⚠️ [WAIT] UID {user_uid}: Возможно, все пути в in_progress или completed')
-                
-                    with self.paths_lock:
-                        temp_tasks = []
-                        cleaned = 0
-                    
-                        try:
-                            while True:
-                                task = self.folder_queue.get_nowait()
-                            
-                                if task.path in self.completed_paths or task.path in self.in_progress_paths:
-                                    self.queued_paths.discard(task.path)
-                                    if task.user_uid:
-                                        self.decrement_user_tasks(task.user_uid)
-                                    cleaned += 1
-                                else:
-                                    temp_tasks.append(task)
-                        except queue.Empty:
-                            pass
-                    
-                        for task in temp_tasks:
-                            self.folder_queue.put(task)
-                    
-                        log_warning(f'🧹 [WAIT] UID {user_uid}: Очищено {cleaned} дубликатов из очереди')
-        
-            wait_iterations += 1
-        
-            if wait_iterations % 5 == 0:
-                elapsed = int(time.time() - start_time)
-                queue_size = self.folder_queue.qsize()
-                log_info(f'⏳ [WAIT] UID {user_uid}: осталось {tasks_count} задач, '
-                         f'прошло {elapsed}с, очередь={queue_size}, stuck={stuck_iterations}')
-        
-            time.sleep(check_interval)
-    
-        remaining = self.get_user_tasks_count(user_uid)
-        log_warning(f'⚠️ [WAIT] UID {user_uid}: timeout после {timeout}с, осталось {remaining} задач')
-    
-        with self.user_tasks_lock:
-            if user_uid in self.user_tasks_count:
-                del self.user_tasks_count[user_uid]
-    
-        return False
-
-    
-    def _cleanup_paths_cache(self):
-        with self.paths_lock:
-            total_paths = len(self.completed_paths)
-            if total_paths > MAX_PATHS_CACHE * PATHS_CLEANUP_THRESHOLD:
-                paths_to_keep = int(MAX_PATHS_CACHE * 0.4)
-                paths_list = list(self.completed_paths)
-                self.completed_paths = set(paths_list[-paths_to_keep:])
-                
-                removed = total_paths - len(self.completed_paths)
-                log_info(f'🧹 [CLEANUP] Очищено {removed} путей, осталось {len(self.completed_paths)}')
-                
-                gc.collect()
-                with stats_lock:
-                    stats['gc_collections'] += 1
-    
-    def register_worker(self, worker_id: str):
-        with self.workers_lock:
-            self.workers[worker_id] = WorkerActivity(worker_id=worker_id, last_activity=time.time())
-        with self.worker_stats_lock:
-            self.worker_stats[worker_id] = {
-                'tasks_completed': 0, 'files_found': 0, 'folders_processed': 0
-            }
-        log_info(f'⚙️ Воркер {worker_id} зарегистрирован')
-    
-    def update_worker_activity(self, worker_id: str, task: Optional[str] = None):
-        with self.workers_lock:
-            if worker_id in self.workers:
-                self.workers[worker_id].update_activity(task)
-    
-    def update_worker_stats(self, worker_id: str, **kwargs):
-        with self.worker_stats_lock:
-            if worker_id not in self.worker_stats:
-                self.worker_stats[worker_id] = {
-                    'tasks_completed': 0, 'files_found': 0, 'folders_processed': 0
-                }
-            for key, value in kwargs.items():
-                if key in self.worker_stats[worker_id]:
-                    self.worker_stats[worker_id][key] += value
-    
-    def get_idle_workers(self, threshold: float = WORKER_IDLE_THRESHOLD) -> List[str]:
-        idle = []
-        with self.workers_lock:
-            for worker_id, activity in self.workers.items():
-                if not activity.is_busy and activity.idle_time() >= threshold:
-                    idle.append(worker_id)
-        return idle
-    
-    def has_active_tasks(self) -> bool:
-        with self.active_tasks_lock:
-            return len(self.active_recursive_tasks) > 0
-    
-    def register_recursive_task(self, task_id: str, root_path: str, 
-                               token_manager: TokenManager, search_name: str,
-                               user_email: str = 'N/A', user_uid: str = 'N/A',
-                               user_enabled: bool = True, csv_writer: object = None):
-        with self.active_tasks_lock:
-            task = FolderTask(
-                path=root_path, token_manager=token_manager,
-                search_name=search_name, parent_task_id=task_id,
-                depth=0, user_email=user_email, user_uid=user_uid,
-                user_enabled=user_enabled, csv_writer=csv_writer
-            )
-            self.active_recursive_tasks[task_id] = task
-            log_info(f'🎯 Зарегистрирована задача: {task_id} для {root_path}')
-    
-    def unregister_recursive_task(self, task_id: str):
-        with self.active_tasks_lock:
-            if task_id in self.active_recursive_tasks:
-                del self.active_recursive_tasks[task_id]
-                log_info(f'✅ Задача {task_id} завершена')
-    
-    def add_folder_task(self, task: FolderTask):
-        added = False
-    
-        with self.paths_lock:
-            if (task.path not in self.completed_paths and 
-                task.path not in self.in_progress_paths and
-                task.path not in self.queued_paths):
-            
-                self.queued_paths.add(task.path)
-                added = True
-            else:
-                status = "completed" if task.path in self.completed_paths else \
-                         "in_progress" if task.path in self.in_progress_paths else "queued"
-                log_info(f'⚠️ [DUPLICATE_PREVENTED] {task.path}: {status}')
-    
-        if added:
-            if task.user_uid:
-                self.increment_user_tasks(task.user_uid)
-        
-            self.folder_queue.put(task)
-        
-            self.paths_added += 1
-            if self.paths_added % 1000 == 0:
-                self._cleanup_paths_cache()
-
-    
-    def mark_path_completed(self, path: str):
-        with self.paths_lock:
-            self.completed_paths.add(path)
-            self.in_progress_paths.discard(path)
-            self.queued_paths.discard(path)
-    
-    def get_folder_task(self, timeout: float = 2.0) -> Optional[FolderTask]:
-        try:
-            task = self.folder_queue.get(timeout=timeout)
-        
-            with self.paths_lock:
-                self.queued_paths.discard(task.path)
-            
-                skip_reason = None
-            
-                if task.path in self.completed_paths:
-                    skip_reason = "already_completed"
-                elif task.path in self.in_progress_paths:
-                    skip_reason = "in_progress"
-            
-                if skip_reason:
-                    if task.user_uid:
-                        self.decrement_user_tasks(task.user_uid)
-                        log_info(f'⚠️ [TASK_SKIP] {task.path}: {skip_reason} для UID {task.user_uid}')
-                    return None
-            
-                self.in_progress_paths.add(task.path)
-                return task
-            
-        except queue.Empty:
-            return None
-
-    
-    def shutdown(self):
-        log_info('⚙️ Остановка TaskManager...')
-        self.shutdown_event.set()
-
-
 def get_token(uid):
     try:
         url = 'https://oauth.yandex.ru/token'
@@ -1267,11 +1034,7 @@ def get_token(uid):
             'subject_token': uid,
             'subject_token_type': 'urn:yandex:params:oauth:token-type:uid'
         }
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        session = requests.Session()
-        session.mount('https://', HTTPAdapter(max_retries=retries))
-        
-        response = make_http_request(session.post, 'oauth', url, data=data, timeout=30)
+        response = make_http_request(get_session().post, 'oauth', url, data=data, timeout=30)
         
         if response.status_code == 200:
             return response.json().get('access_token')
@@ -1288,11 +1051,7 @@ def get_users(page):
     try:
         url = f'https://api360.yandex.net/directory/v1/org/{ORGID}/users?page={page}&perPage={PERPAGE}'
         headers = {'Authorization': f'OAuth {ORG_TOKEN}'}
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        session = requests.Session()
-        session.mount('https://', HTTPAdapter(max_retries=retries))
-        
-        response = make_http_request(session.get, 'directory', url, headers=headers, timeout=30)
+        response = make_http_request(get_session().get, 'directory', url, headers=headers, timeout=30)
         
         if response.status_code == 200:
             data = response.json()
@@ -1306,33 +1065,6 @@ def get_users(page):
         return None, None
 
 
-def disk_get_resources(token_manager, path, limit=1000, offset=0):
-    token = token_manager.get_valid_token()
-    if not token:
-        return None
-    
-    url = 'https://cloud-api.yandex.net/v1/disk/resources'
-    params = {
-        'path': path,
-        'fields': 'path,type,name,size,created,modified,_embedded.total,_embedded.items.path,_embedded.items.type,_embedded.items.name,_embedded.items.size,_embedded.items.created,_embedded.items.modified',
-        'limit': limit,
-        'offset': offset,
-    }
-    headers = {'Authorization': f'OAuth {token}'}
-    retries = Retry(total=5, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    session = requests.Session()
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    
-    try:
-        response = make_http_request(session.get, 'disk', url, params=params, headers=headers, timeout=30)
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except Exception as e:
-        log_error(f'❌ Ошибка disk_get_resources для {path}: {e}')
-        return None
-
-
 def write_to_csv_batch(writer, batch):
     if not batch or not writer:
         return
@@ -1355,188 +1087,119 @@ def update_stats(processed=0, skipped=0):
         stats['skipped_users'] += skipped
 
 
-def get_files_recursive_single_folder_streaming(token_manager, path, search_name='', 
-                                               user_email='N/A', user_uid='N/A', 
-                                               user_enabled=True, csv_writer=None, 
-                                               depth=0, files_count_ref=None):
-    worker_id = threading.current_thread().name
-    
-    batch = []
-    
-    if task_manager:
-        task_manager.update_worker_activity(worker_id, f'Обход: {path}')
-    
+def record_walk_request():
+    if rps_monitor:
+        rps_monitor.record_request('disk')
+    with stats_lock:
+        stats['http_requests'] += 1
+
+
+def get_disk_used_space(token_manager, user_email='N/A') -> Optional[int]:
+    '''Занятое место на Диске без Корзины; None, если узнать не удалось.'''
+    token = token_manager.get_valid_token()
+    if not token:
+        return None
     try:
-        log_info(f'📁 [ITER] {worker_id}: Обход {path} (глубина: {depth})')
-        
-        offset = 0
-        limit = 1000
-        subdirs_found = []
-        
-        while True:
-            response = network_request_with_retry(
-                disk_get_resources, token_manager, path, limit, offset
-            )
-            
-            if not response:
-                log_warning(f'⚠️ [ITER] {worker_id}: Нет ответа для {path}')
-                break
-            
-            emb = response.get('_embedded', {})
-            items = emb.get('items', [])
-            total = emb.get('total', 0)
-            
-            for item in items:
-                item_type = item.get('type')
-                
-                if item_type == 'file':
-                    if not search_name or search_name.lower() in item.get('name', '').lower():
-                        file_row = {
-                            'email': user_email,
-                            'uid': user_uid,
-                            'isEnabled': user_enabled,
-                            'file_name': item.get('name', 'N/A'),
-                            'file_path': item.get('path', 'N/A'),
-                            'file_size': item.get('size', 'N/A'),
-                            'file_created': item.get('created', 'N/A'),
-                            'file_modified': item.get('modified', 'N/A')
-                        }
-                        
-                        batch.append(file_row)
-                        
-                        if files_count_ref is not None:
-                            files_count_ref['count'] += 1
-                        
-                        if len(batch) >= BATCH_WRITE_SIZE:
-                            if csv_writer:
-                                write_to_csv_batch(csv_writer, batch)
-                            batch = []
-                            
-                            if files_count_ref and files_count_ref['count'] % GC_INTERVAL == 0:
-                                gc.collect()
-                                with stats_lock:
-                                    stats['gc_collections'] += 1
-                
-                elif item_type == 'dir':
-                    subdirs_found.append(item.get('path'))
-            
-            if len(items) < limit or offset + limit >= total:
-                break
-            
-            offset += limit
-            
-            if task_manager:
-                task_manager.update_worker_activity(worker_id, f'Обход: {path} ({offset}/{total})')
-        
-        if subdirs_found and task_manager and depth < MAX_RECURSION_DEPTH:
-            log_info(f'📁 [ITER] {worker_id}: Найдено {len(subdirs_found)} подпапок в {path}, добавляем в очередь')
-            
-            for subdir_path in subdirs_found:
-                folder_task = FolderTask(
-                    path=subdir_path,
-                    token_manager=token_manager,
-                    search_name=search_name,
-                    parent_task_id=f'recursive_{user_uid}_{int(time.time())}',
-                    depth=depth + 1,
-                    user_email=user_email,
-                    user_uid=user_uid,
-                    user_enabled=user_enabled,
-                    csv_writer=csv_writer
-                )
-                task_manager.add_folder_task(folder_task)
-        
-        if batch and csv_writer:
-            write_to_csv_batch(csv_writer, batch)
-        
-        if task_manager:
-            task_manager.mark_path_completed(path)
-        
-        log_info(f'📁 [ITER] {worker_id}: Завершен {path}, файлов: {files_count_ref["count"] if files_count_ref else 0}, подпапок: {len(subdirs_found)}')
-        
+        response = make_http_request(get_session().get, 'disk', DISK_INFO_URL,
+                                     headers={'Authorization': f'OAuth {token}'},
+                                     params={'fields': 'used_space,trash_size'}, timeout=30)
+        if response.status_code == 200:
+            return used_space_without_trash(response.json())
+        log_warning(f'⚠️ [{user_email}] /v1/disk: HTTP {response.status_code}')
     except Exception as e:
-        log_error(f'❌ [ITER] {worker_id}: Ошибка {path}: {e}')
-    finally:
-        if task_manager:
-            task_manager.update_worker_activity(worker_id, None)
-        gc.collect()
+        log_warning(f'⚠️ [{user_email}] /v1/disk: {e}')
+    return None
 
 
-def get_files_with_dynamic_distribution(token_manager, path='disk:/', search_name='',
-                                       user_email='N/A', user_uid='N/A', 
-                                       user_enabled=True, csv_writer=None):
+def get_files_recursive(token_manager, path='disk:/', search_name='',
+                        user_email='N/A', user_uid='N/A',
+                        user_enabled=True, csv_writer=None, crawl=None,
+                        seen=None, walk_totals=None):
+    needle = search_name.lower()
+    batch = []
+    found = {'count': 0}
+    
+    # вызывается в потоке обхода; batch трогает только он, пока идёт walk()
+    def on_file(item, source):
+        if crawl is not None:
+            crawl.on_file(item, source)
+            return
+        if needle and needle not in item.get('name', '').lower():
+            return
+        # уже записан плоским списком до переключения на обход
+        if seen is not None and item in seen:
+            return
+        batch.append({
+            'email': user_email, 'uid': user_uid, 'isEnabled': user_enabled,
+            'file_name': item.get('name', 'N/A'),
+            'file_path': item.get('path', 'N/A'),
+            'file_size': item.get('size', 'N/A'),
+            'file_created': item.get('created', 'N/A'),
+            'file_modified': item.get('modified', 'N/A')
+        })
+        found['count'] += 1
+        if len(batch) >= BATCH_WRITE_SIZE and csv_writer:
+            write_to_csv_batch(csv_writer, batch)
+    
     try:
-        response = network_request_with_retry(
-            disk_get_resources, token_manager, path, limit=1000, offset=0
+        result = walker.walk(
+            personal_disk(user_email, token_manager.get_valid_token, root=path),
+            on_file,
+            on_dir=crawl.on_dir if crawl is not None else None
         )
-        if not response:
-            return 0
-        
-        emb = response.get('_embedded', {})
-        items = emb.get('items', [])
-        
-        folders = []
-        files_count = 0
-        batch = []
-        
-        for item in items:
-            if item.get('type') == 'file':
-                if not search_name or search_name.lower() in item.get('name', '').lower():
-                    file_row = {
-                        'email': user_email, 'uid': user_uid, 'isEnabled': user_enabled,
-                        'file_name': item.get('name', 'N/A'),
-                        'file_path': item.get('path', 'N/A'),
-                        'file_size': item.get('size', 'N/A'),
-                        'file_created': item.get('created', 'N/A'),
-                        'file_modified': item.get('modified', 'N/A')
-                    }
-                    batch.append(file_row)
-                    files_count += 1
-            
-            elif item.get('type') == 'dir':
-                folders.append(item.get('path'))
-        
+    except Exception as e:
+        log_error(f'❌ Ошибка рекурсивного обхода для {user_email}: {e}')
+        if crawl is not None:
+            crawl.failed = True
+        return found['count']
+    finally:
         if batch and csv_writer:
             write_to_csv_batch(csv_writer, batch)
-        
-        log_info(f'📁 [FALLBACK] Найдено {len(folders)} папок, {files_count} файлов для {user_email}')
-        
-        if folders and task_manager:
-            log_info(f'📁 [FALLBACK] Добавление {len(folders)} папок для UID {user_uid}')
-            
-            for folder_path in folders:
-                folder_task = FolderTask(
-                    path=folder_path, token_manager=token_manager,
-                    search_name=search_name, parent_task_id=f'fallback_{user_uid}_{int(time.time())}',
-                    depth=1, user_email=user_email, user_uid=user_uid,
-                    user_enabled=user_enabled, csv_writer=csv_writer
-                )
-                task_manager.add_folder_task(folder_task)
-            
-            log_info(f'📁 [FALLBACK] ✅ Добавлено {len(folders)} папок в очередь для UID {user_uid}')
-        
-        return files_count
     
-    except Exception as e:
-        log_error(f'❌ Ошибка fallback для {user_email}: {e}')
-        return 0
+    if crawl is not None and (result.errors or result.cancelled):
+        crawl.failed = True
+    
+    if walk_totals is not None:
+        walk_totals.update(files=result.files, folders=result.folders,
+                           complete=not (result.errors or result.cancelled))
+    
+    if result.errors:
+        log_warning(f'⚠️ [{user_email}] Не прочитано папок/страниц: {result.errors}, '
+                    f'например: {", ".join(result.failed_paths[:5])}')
+    
+    log_info(f'📁 [RECURSIVE] {user_email}: папок {result.folders}, страниц {result.pages}, '
+             f'файлов {result.files}, найдено {found["count"]} за {int(result.seconds)}с')
+    
+    return found['count']
 
 
 def disk_get_files_paginated_streaming(token_manager, search_name='', 
                                        user_email='N/A', user_uid='N/A',
-                                       user_enabled=True, csv_writer=None):
+                                       user_enabled=True, csv_writer=None, crawl=None):
     offset = 0
     use_fallback = False
+    flat_failed = False
     error_count = 0
     files_count = 0
+    listed_count = 0
     batch = []
-    max_iterations = 1000
     iterations = 0
+    seen = SeenResources()
+    
+    history_entry = listing_history.get(user_uid) if listing_history else None
+    signals = DiskSignals(used_space=get_disk_used_space(token_manager, user_email),
+                          history=history_entry)
+    plan = cost_model.choose(signals)
+    log_info(f'🧭 [{user_email}] Способ: {plan.mode} — {plan.reason}')
+    if plan.mode == RECURSIVE:
+        use_fallback = True
     
     try:
-        while True:
+        while not use_fallback:
             iterations += 1
-            if iterations > max_iterations:
-                log_warning(f'⚠️ [{user_email}] Достигнут лимит итераций ({max_iterations}), переход на fallback')
+            if iterations > plan.max_flat_pages:
+                log_warning(f'⚠️ [{user_email}] Прочитано {plan.max_flat_pages} страниц, а файлы не кончаются '
+                            f'(оценка: {plan.estimated_files}), переход на обход папок')
                 use_fallback = True
                 break
             
@@ -1550,15 +1213,12 @@ def disk_get_files_paginated_streaming(token_manager, search_name='',
             headers = {'Authorization': f'OAuth {token}'}
             
             try:
-                retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-                session = requests.Session()
-                session.mount('https://', HTTPAdapter(max_retries=retries))
-                
-                response = make_http_request(session.get, 'disk', url, headers=headers, timeout=30)
+                response = make_http_request(get_session().get, 'disk', url, headers=headers, timeout=30)
                 
                 if not response:
                     log_warning(f'⚠️ [{user_email}] Нет ответа от API, переход на fallback')
                     use_fallback = True
+                    flat_failed = True
                     break
                 
                 error_count = 0
@@ -1570,6 +1230,7 @@ def disk_get_files_paginated_streaming(token_manager, search_name='',
                 if error_count >= 2:
                     log_warning(f'⚠️ [{user_email}] Слишком много ошибок, переход на fallback')
                     use_fallback = True
+                    flat_failed = True
                     break
                 time.sleep(3)
                 continue
@@ -1579,6 +1240,7 @@ def disk_get_files_paginated_streaming(token_manager, search_name='',
                 if error_count >= 2:
                     log_warning(f'⚠️ [{user_email}] HTTP 500, переход на fallback')
                     use_fallback = True
+                    flat_failed = True
                     break
                 time.sleep(2)
                 continue
@@ -1586,6 +1248,7 @@ def disk_get_files_paginated_streaming(token_manager, search_name='',
             if response.status_code != 200:
                 log_warning(f'⚠️ [{user_email}] HTTP {response.status_code}, переход на fallback')
                 use_fallback = True
+                flat_failed = True
                 break
             
             data = response.json()
@@ -1595,7 +1258,11 @@ def disk_get_files_paginated_streaming(token_manager, search_name='',
                 log_info(f'📄 [{user_email}] Нет больше файлов, завершение')
                 break
             
+            listed_count += len(items)
             for item in items:
+                if crawl is not None:
+                    crawl.on_file(item)
+                    continue
                 if not search_name or search_name.lower() in item.get('name', '').lower():
                     file_row = {
                         'email': user_email, 'uid': user_uid, 'isEnabled': user_enabled,
@@ -1606,6 +1273,7 @@ def disk_get_files_paginated_streaming(token_manager, search_name='',
                         'file_modified': item.get('modified', 'N/A')
                     }
                     batch.append(file_row)
+                    seen.add(item)
                     files_count += 1
                     
                     if len(batch) >= BATCH_WRITE_SIZE:
@@ -1617,112 +1285,126 @@ def disk_get_files_paginated_streaming(token_manager, search_name='',
                 log_info(f'📄 [{user_email}] Получено {len(items)} < {DISK_LIMIT}, завершение')
                 break
             
+            if iterations == 1:
+                # первая страница уточняет оценку: средний размер файла
+                signals.probe_files = len(items)
+                signals.probe_bytes = sum(item.get('size') or 0 for item in items)
+                plan = cost_model.choose(signals)
+                if plan.mode == RECURSIVE:
+                    log_info(f'🧭 [{user_email}] После первой страницы: {plan.reason}, переход на обход папок')
+                    use_fallback = True
+                    break
+            
             offset += DISK_LIMIT
             log_info(f'📄 [{user_email}] Обработано {offset} файлов, продолжение...')
-            
-            if offset % (DISK_LIMIT * 10) == 0:
-                gc.collect()
         
         if batch and csv_writer:
             write_to_csv_batch(csv_writer, batch)
         
         if use_fallback:
             log_info('═' * 60)
-            log_info(f'📁 FALLBACK для {user_email}: Рекурсивный обход')
+            log_info(f'📁 Обход папок для {user_email}'
+                     + (f' (уже записано плоским списком: {len(seen)})' if seen else ''))
             log_info('═' * 60)
             
-            fallback_count = get_files_with_dynamic_distribution(
+            walk_totals = {}
+            fallback_count = get_files_recursive(
                 token_manager, 'disk:/', search_name,
-                user_email, user_uid, user_enabled, csv_writer
+                user_email, user_uid, user_enabled, csv_writer, crawl,
+                seen=seen if seen else None, walk_totals=walk_totals
             )
             
             files_count += fallback_count
+            with stats_lock:
+                stats['listing_recursive'] += 1
+                if iterations:
+                    stats['listing_switched'] += 1
+            if listing_history and walk_totals.get('complete'):
+                listing_history.record(
+                    user_uid, walk_totals['files'], RECURSIVE,
+                    flat_failed=flat_failed or bool((history_entry or {}).get('flat_failed')),
+                    folders=walk_totals['folders'], used_space=signals.used_space)
         else:
             log_info(f'✅ [{user_email}] Получение файлов завершено без fallback, файлов: {files_count}')
+            with stats_lock:
+                stats['listing_flat'] += 1
+            if listing_history:
+                listing_history.record(user_uid, listed_count, FLAT,
+                                       used_space=signals.used_space)
         
         return files_count
         
     except Exception as e:
         log_error(f'❌ [{user_email}] Исключение при получении файлов: {e}')
+        if crawl is not None:
+            crawl.failed = True
         
         if batch and csv_writer:
             write_to_csv_batch(csv_writer, batch)
         
         return files_count
-    finally:
-        gc.collect()
 
 
-def global_helper_worker(helper_id: int):
-    worker_name = f'GlobalHelper_{helper_id}'
-    
-    if task_manager:
-        task_manager.register_worker(worker_name)
-        with task_manager.helpers_lock:
-            task_manager.helpers_active += 1
-    
-    log_info(f'🚀 [{worker_name}] Запущен')
-    
-    try:
-        tasks_processed = 0
-        consecutive_empty = 0
-        last_log_time = time.time()
-        
-        while True:
-            if task_manager and task_manager.shutdown_event.is_set():
-                queue_size = task_manager.folder_queue.qsize()
-                if queue_size == 0:
-                    log_info(f'✅ [{worker_name}] Shutdown + пустая очередь, выход')
-                    break
-            
-            folder_task = task_manager.get_folder_task(timeout=2.0) if task_manager else None
-            
-            if folder_task is None:
-                consecutive_empty += 1
-                
-                now = time.time()
-                if now - last_log_time >= 60 or consecutive_empty == 30:
-                    queue_size = task_manager.folder_queue.qsize() if task_manager else 0
-                    log_info(f'⏳ [{worker_name}] Пусто {consecutive_empty}, очередь={queue_size}')
-                    last_log_time = now
-                
-                continue
-            
-            consecutive_empty = 0
-            tasks_processed += 1
-            
-            log_info(f'📁 [{worker_name}] Взял задачу #{tasks_processed}: {folder_task.path}')
-            
-            try:
-                files_count_ref = {'count': 0}
-                get_files_recursive_single_folder_streaming(
-                    folder_task.token_manager, folder_task.path,
-                    folder_task.search_name, folder_task.user_email,
-                    folder_task.user_uid, folder_task.user_enabled,
-                    folder_task.csv_writer, depth=folder_task.depth,
-                    files_count_ref=files_count_ref
-                )
-                
-                log_info(f'✅ [{worker_name}] Завершил: {folder_task.path}, файлов: {files_count_ref["count"]}')
-                
-                if task_manager:
-                    task_manager.update_worker_stats(worker_name, 
-                        tasks_completed=1, files_found=files_count_ref['count'])
-                    
-            except Exception as e:
-                log_error(f'❌ [{worker_name}] Ошибка: {e}')
-            finally:
-                if task_manager and folder_task.user_uid:
-                    task_manager.decrement_user_tasks(folder_task.user_uid)
+def write_empty_user_row(writer, email, uid, is_enabled):
+    info = {
+        'email': email, 'uid': uid, 'isEnabled': is_enabled,
+        'file_name': 'N/A', 'file_path': 'N/A', 'file_size': 'N/A',
+        'file_created': 'N/A', 'file_modified': 'N/A'
+    }
+    with csv_lock:
+        writer.writerow(info)
+
+
+def write_rows_from_inventory(writer, disk, search_name='', user=None):
+    '''Строки отчёта из индекса по одному Диску; user — email/uid/isEnabled
+    из текущего списка пользователей (без него — сохранённые при обходе).'''
+    batch = []
+    count = 0
+    
+    for entry in inventory.search(search_name, disk=disk):
+        owner = user or entry['info']
+        batch.append({
+            'email': owner.get('email', 'N/A'), 'uid': owner.get('uid', 'N/A'),
+            'isEnabled': owner.get('isEnabled', 'N/A'),
+            'file_name': entry['name'],
+            'file_path': entry['path'],
+            'file_size': 'N/A' if entry['size'] is None else entry['size'],
+            'file_created': entry['created'] or 'N/A',
+            'file_modified': entry['modified'] or 'N/A'
+        })
+        count += 1
+        if len(batch) >= BATCH_WRITE_SIZE:
+            write_to_csv_batch(writer, batch)
+    
+    write_to_csv_batch(writer, batch)
+    return count
+
+
+def search_inventory_only(writer):
+    '''Отчёт только по индексу: без токенов и запросов к API.'''
+    uid_filter = load_uid_list(UID_LIST_FILE) if USE_UID_LIST else None
+    disks = inventory.list_disks('personal')
+    log_info(f'🗂 Дисков в индексе: {len(disks)}')
+    
+    total = 0
+    for disk in disks:
+        info = disk['info']
+        uid = str(info.get('uid', ''))
+        email = info.get('email', 'N/A')
+        if uid_filter is not None and uid not in uid_filter:
+            continue
+        if not should_process_user(uid, email):
+            continue
+        if not disk['complete']:
+            log_warning(f'⚠️ [{email}] Обход не закончен ({disk["crawled_at"] or "не было"}) — данные неполные')
         
-        log_info(f'🏁 [{worker_name}] Завершение, задач: {tasks_processed}')
+        files_count = write_rows_from_inventory(writer, disk['disk'], SEARCH_FILE_NAME)
+        if files_count == 0:
+            write_empty_user_row(writer, email, uid, info.get('isEnabled', 'N/A'))
+        update_stats(processed=1)
+        total += files_count
     
-    except Exception as e:
-        log_error(f'❌ [{worker_name}] Ошибка: {e}')
-    finally:
-        if task_manager:
-            with task_manager.helpers_lock:
-                task_manager.helpers_active -= 1
+    return total
 
 
 def process_user(user, writer):
@@ -1731,13 +1413,6 @@ def process_user(user, writer):
     
     log_info(f'🔵 [{worker_id}] ЗАПУСК process_user')
     
-    if task_manager:
-        with task_manager.workers_lock:
-            if worker_id not in task_manager.workers:
-                task_manager.register_worker(worker_id)
-                log_info(f'🆕 [{worker_id}] Воркер зарегистрирован впервые')
-        task_manager.update_worker_activity(worker_id, 'Обработка пользователя')
-    
     try:
         email = user.get('email', 'N/A')
         uid = str(user.get('id', ''))
@@ -1752,6 +1427,24 @@ def process_user(user, writer):
         
         log_info(f'👤 Обработка пользователя: {email} (UID: {uid})')
         
+        crawl = None
+        if inventory is not None:
+            disk_key = f'uid:{uid}'
+            owner = {'email': email, 'uid': uid, 'isEnabled': is_enabled}
+            plan = inventory.plan(disk_key, owner=uid, changes=audit_changes)
+            if plan == PLAN_SKIP:
+                files_count = write_rows_from_inventory(writer, disk_key, SEARCH_FILE_NAME, owner)
+                if files_count == 0:
+                    write_empty_user_row(writer, email, uid, is_enabled)
+                update_stats(processed=1)
+                with stats_lock:
+                    stats['inventory_reused'] += 1
+                log_info(f'🗂 [{email}] Событий в аудит-логе нет, файлы из индекса: {files_count}')
+                return True, files_count
+            # до SCIM и токена: если дальше что-то сорвётся, диск останется
+            # незаконченным и в следующий раз будет прочитан целиком
+            crawl = inventory.begin(disk_key, 'personal', email, info=owner)
+        
         ban_needed = False
         
         if not is_enabled:
@@ -1778,23 +1471,20 @@ def process_user(user, writer):
         
         files_count = disk_get_files_paginated_streaming(
             token_manager_user, SEARCH_FILE_NAME,
-            email, uid, is_enabled, writer
+            email, uid, is_enabled, writer if crawl is None else None, crawl
         )
         
-        if task_manager:
-            pending_tasks = task_manager.get_user_tasks_count(uid)
-            if pending_tasks > 0:
-                log_info(f'⏳ [{email}] Ожидание завершения {pending_tasks} задач fallback...')
-                task_manager.wait_for_user_tasks(uid, timeout=900, check_interval=2)
+        if crawl is not None:
+            removed = crawl.finish()
+            files_count = write_rows_from_inventory(writer, crawl.disk, SEARCH_FILE_NAME,
+                                                    {'email': email, 'uid': uid,
+                                                     'isEnabled': is_enabled})
+            log_info(f'🗂 [{email}] Индекс: файлов {crawl.files}, папок '
+                     f'{crawl.dirs}, удалено записей {removed}'
+                     + ('' if not crawl.failed else ' (обход с ошибками)'))
         
         if files_count == 0:
-            info = {
-                'email': email, 'uid': uid, 'isEnabled': is_enabled,
-                'file_name': 'N/A', 'file_path': 'N/A', 'file_size': 'N/A',
-                'file_created': 'N/A', 'file_modified': 'N/A'
-            }
-            with csv_lock:
-                writer.writerow(info)
+            write_empty_user_row(writer, email, uid, is_enabled)
         
         update_stats(processed=1)
         
@@ -1804,20 +1494,15 @@ def process_user(user, writer):
         elapsed_time = time.time() - start_time
         log_info(f'✅ Пользователь {email} обработан за {int(elapsed_time)}с, файлов: {files_count}')
         
-        gc.collect()
-        
         return True, files_count
         
     except Exception as e:
         log_error(f'❌ Ошибка при обработке {user.get("email", "N/A")}: {e}')
         return False, 0
-    finally:
-        if task_manager:
-            task_manager.update_worker_activity(worker_id, None)
 
 
 def main():
-    global task_manager, rate_limiter, rps_monitor, global_helpers_executor
+    global walker, rate_limiter, rps_monitor, inventory, audit_changes, listing_history
     
     cleanup_old_logs()
     setup_logging()
@@ -1825,9 +1510,10 @@ def main():
     log_info('═' * 80)
     log_info('🚀 ЗАПУСК СКРИПТА АНАЛИЗА ЯНДЕКС ДИСКА')
     log_info('═' * 80)
-    log_info(f'🔧 Потоков: {MAX_WORKERS}, Хелперов: {MAX_HELPERS}, RPS: {MAX_RPS}')
+    log_info(f'🔧 Потоков: {MAX_WORKERS}, RPS: {MAX_RPS}')
+    log_info(f'🔧 Рекурсивный обход: {WALK_CONCURRENCY} запросов одновременно, '
+             f'на пользователя: {REQUESTS_PER_DISK}')
     log_info(f'🔧 Батч-запись: {BATCH_WRITE_SIZE}, Макс. глубина: {MAX_RECURSION_DEPTH}')
-    log_info(f'🔧 Макс. кеш путей: {MAX_PATHS_CACHE}')
     
     if USE_UID_LIST:
         log_info(f'🎯 Режим: СПИСОК UID из {UID_LIST_FILE}')
@@ -1844,8 +1530,29 @@ def main():
     else:
         log_info('🎯 Поиск: ВСЕ файлы')
     
+    if INVENTORY_DB:
+        log_info(f'🗂 Индекс: {INVENTORY_DB}' + (' (только поиск)' if INVENTORY_SEARCH_ONLY else ''))
+    
     log_info('═' * 80)
     
+    if INVENTORY_SEARCH_ONLY:
+        if not INVENTORY_DB or not os.path.exists(INVENTORY_DB):
+            log_error(f'❌ INVENTORY_SEARCH_ONLY: файл индекса не найден: {INVENTORY_DB}')
+            return
+        inventory = DiskInventory(INVENTORY_DB)
+        try:
+            with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8-sig') as csvfile:
+                writer = csv.DictWriter(csvfile,
+                    ['email', 'uid', 'isEnabled', 'file_name', 'file_path', 'file_size', 'file_created', 'file_modified'],
+                    delimiter=';')
+                writer.writeheader()
+                found = search_inventory_only(writer)
+        finally:
+            inventory.close()
+        log_info(f'👥 Дисков в отчёте: {stats["processed_users"]}, найдено файлов: {found}')
+        log_info(f'💾 Результаты CSV: {OUTPUT_FILE}')
+        return
+    
     log_info('🌐 Проверка интернет-соединения...')
     if not check_internet_connection():
         log_error('❌ Нет подключения к интернету!')
@@ -1860,44 +1567,21 @@ def main():
     
     rate_limiter = RateLimiter(MAX_RPS)
     rps_monitor = RPSMonitor(window_seconds=10)
-    task_manager = TaskManager(MAX_WORKERS, MAX_HELPERS)
-    
-    log_info('🚀 Запуск глобальных хелперов...')
-
-    class NonDaemonThreadPoolExecutor(ThreadPoolExecutor):
-        def _adjust_thread_count(self):
-            def worker():
-                try:
-                    while True:
-                        work_item = self._work_queue.get(block=True)
-                        if work_item is not None:
-                            work_item.run()
-                            del work_item
-                        else:
-                            break
-                except BaseException:
-                    pass
-
-            num_threads = len(self._threads)
-            if num_threads < self._max_workers:
-                thread_name = f'{self._thread_name_prefix or self}_{num_threads}'
-                t = threading.Thread(name=thread_name, target=worker, daemon=False)
-                t.start()
-                self._threads.add(t)
-
-    global_helpers_executor = ThreadPoolExecutor(
-        max_workers=MAX_HELPERS, 
-        thread_name_prefix='GlobalHelper'
+    walker = DiskWalker(
+        workers=WALK_CONCURRENCY,
+        per_disk=REQUESTS_PER_DISK,
+        max_depth=MAX_RECURSION_DEPTH,
+        wait_online=wait_for_internet_connection,
+        rate_limiter=rate_limiter,
+        on_request=record_walk_request,
+        logger=logger
     )
-
-    for i in range(MAX_HELPERS):
-        global_helpers_executor.submit(global_helper_worker, i)
-        if i < MAX_HELPERS - 1:
-            time.sleep(0.01)
-
-    log_info(f'✅ Запущено {MAX_HELPERS} хелперов')
-
-
+    
+    if INVENTORY_DB:
+        inventory = DiskInventory(INVENTORY_DB)
+    if LISTING_HISTORY_FILE:
+        listing_history = ListingHistory(LISTING_HISTORY_FILE)
+    
     csvfile = None
     writer = None
     
@@ -1961,6 +1645,18 @@ def main():
             log_warning('⚠️ Нет пользователей для обработки!')
             return
         
+        if inventory is not None and AUDIT_TOKEN:
+            since = inventory.oldest_start(f'uid:{user.get("id", "")}' for user in all_users)
+            if since:
+                try:
+                    audit_changes = audit_changed_owners(
+                        ORGID, AUDIT_TOKEN, since,
+                        http_get=lambda *args, **kwargs: make_http_request(
+                            get_session().get, 'other', *args, **kwargs))
+                    log_info(f'🗂 Аудит-лог с {since}: события на {len(audit_changes)} Дисках')
+                except Exception as e:
+                    log_warning(f'⚠️ Аудит-лог недоступен, Диски читаются без него: {e}')
+        
         with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='Worker') as executor:
             log_info(f'🚀 Создание {len(all_users)} задач для {MAX_WORKERS} воркеров...')
     
@@ -1981,50 +1677,13 @@ def main():
                         log_info(f'📊 Прогресс: {completed_count}/{total_users}, '
                                f'обработано: {stats["processed_users"]}, '
                                f'пропущено: {stats["skipped_users"]}, '
-                               f'файлов записано: {stats["files_written"]}, '
-                               f'GC: {stats["gc_collections"]}')
-                        gc.collect()
+                               f'файлов записано: {stats["files_written"]}')
                 except Exception as e:
                     log_error(f'❌ Исключение при обработке {user.get("email", "N/A")}: {e}')
         
-        log_info('⏳ Пользователи обработаны, ожидание хелперов...')
-        
-        max_wait = 1800
-        wait_start = time.time()
-        stable_empty = 0
-        
-        while time.time() - wait_start < max_wait:
-            queue_size = task_manager.folder_queue.qsize()
-            with task_manager.paths_lock:
-                in_progress = len(task_manager.in_progress_paths)
-            with task_manager.helpers_lock:
-                helpers = task_manager.helpers_active
-            
-            log_info(f'⏳ Ожидание: очередь={queue_size}, в работе={in_progress}, хелперов={helpers}')
-            
-            if queue_size == 0 and in_progress == 0:
-                stable_empty += 1
-                if stable_empty >= 6:
-                    log_info('✅ Очередь стабильно пуста')
-                    break
-            else:
-                stable_empty = 0
-            
-            time.sleep(5)
-        
-        log_info('⚙️ Начало graceful shutdown...')
-        
-        if task_manager:
-            task_manager.shutdown()
-            log_info('✅ TaskManager остановлен')
-        
-        log_info('⏳ Ожидание завершения хелперов (10 сек)...')
-        time.sleep(10)
-        
-        if global_helpers_executor:
-            log_info('⚙️ Остановка GlobalHelpers executor...')
-            global_helpers_executor.shutdown(wait=True, cancel_futures=False)
-            log_info('✅ GlobalHelpers executor остановлен')
+        if walker:
+            walker.close()
+            log_info('✅ Обход папок остановлен')
         
         if rps_monitor:
             log_info('⚙️ Остановка RPS Monitor...')
@@ -2043,7 +1702,10 @@ def main():
         log_info(f'👥 Обработано пользователей: {stats["processed_users"]}/{total_users}')
         log_info(f'⏭️ Пропущено пользователей: {stats["skipped_users"]}')
         log_info(f'💾 Записано файлов в CSV: {stats["files_written"]}')
-        log_info(f'🧹 Сборок мусора: {stats["gc_collections"]}')
+        log_info(f'🧭 Плоский список: {stats["listing_flat"]}, обход папок: {stats["listing_recursive"]} '
+                 f'(из них переключились по ходу: {stats["listing_switched"]})')
+        if inventory is not None:
+            log_info(f'🗂 Диски из индекса без обхода: {stats["inventory_reused"]}')
         
         if rps_monitor:
             final_rps = rps_monitor.get_current_rps()
@@ -2052,6 +1714,9 @@ def main():
             log_info(f'   Всего HTTP запросов: {stats["http_requests"]}')
             log_info(f'   Средний RPS: {final_rps["average"]:.2f}')
             log_info(f'   Макс. лимит RPS: {MAX_RPS}')
+            connections = rps_monitor.get_connection_stats()
+            log_info(f'   Новых соединений (TLS): {connections["handshakes"]}')
+            log_info(f'   Запросов по keep-alive: {connections["reused"]} из {connections["requests"]}')
         
         with scim_lock:
             if scim_operations['unlocked_users'] or scim_operations['locked_users']:
@@ -2091,19 +1756,23 @@ def main():
             except Exception as e:
                 log_error(f'❌ Ошибка закрытия CSV: {e}')
         
-        if task_manager:
+        if walker:
             try:
-                task_manager.shutdown()
-            except Exception:
-                pass
+                walker.stop()
+                walker.close()
+            except Exception as e:
+                log_error(f'❌ Ошибка остановки обхода: {e}')
+        
+        if inventory is not None:
+            inventory.close()
         
-        if global_helpers_executor:
+        if listing_history is not None:
             try:
-                global_helpers_executor.shutdown(wait=False, cancel_futures=True)
-                log_info('✅ Executor остановлен принудительно')
+                listing_history.save()
             except Exception as e:
-                log_error(f'❌ Ошибка остановки executor: {e}')
+                log_error(f'❌ Ошибка сохранения истории: {e}')
         
+        close_sessions()
         gc.collect()
         
         if logger:
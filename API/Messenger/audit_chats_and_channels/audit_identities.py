@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-import json
 import logging
 
+from store import OBS_INITIATOR, OBS_PARTNER
+
 log = logging.getLogger("audit-id")
 
 
@@ -12,12 +13,9 @@ def harvest_identities_from_audit(store) -> dict[str, str]:
     pairs: dict[str, str] = {}
     conflicts = 0
 
-    cursor = store.conn.execute(
-        "SELECT uid, user_login, COUNT(*) AS cnt FROM raw_events "
-        "WHERE uid IS NOT NULL AND user_login IS NOT NULL "
-        "GROUP BY uid, user_login ORDER BY cnt DESC")
-    for row in cursor:
-        uid, login = str(row["uid"]), row["user_login"]
+    # uid_login_observations пополняется при записи событий, поэтому здесь
+    # чтение маленькой таблицы, а не проход по всему raw_events
+    for uid, login, _cnt in store.identity_observations(OBS_INITIATOR):
         if uid in pairs and pairs[uid] != login:
             conflicts += 1          # берём наиболее частый (ORDER BY cnt DESC)
             continue
@@ -31,14 +29,6 @@ def harvest_identities_from_audit(store) -> dict[str, str]:
 def harvest_partner_uids(store) -> dict[str, str]:
     """Дополнительно: partner_uid из приватных чатов, если рядом есть логин."""
     extra: dict[str, str] = {}
-    cursor = store.conn.execute(
-        "SELECT payload FROM raw_events WHERE type='messenger_chat.created'")
-    for row in cursor:
-        enriched = json.loads(row["payload"])
-        event = enriched.get("event") or {}
-        meta = event.get("meta") or {}
-        info = meta.get("chat_info") or {}
-        partner = info.get("partner_uid")
-        if partner and event.get("uid") and enriched.get("user_login"):
-            extra.setdefault(str(event["uid"]), enriched["user_login"])
+    for uid, login, _cnt in store.identity_observations(OBS_PARTNER):
+        extra.setdefault(uid, login)
     return extra
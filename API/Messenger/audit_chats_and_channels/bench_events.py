@@ -0,0 +1,105 @@
+"""Сравнение форматов базы событий: json и compact.
+
+Строит синтетический аудит-лог (по умолчанию 200 000 событий по 5 000
+чатам), складывает его в базу каждого формата и замеряет размер файла,
+скорость записи и скорость полного проигрывания (build_projection).
+
+    python bench_events.py
+    python bench_events.py --events 50000 --chats 1000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from projection import build_projection
+from store import STORAGE_COMPACT, STORAGE_JSON, EventStore
+
+
+def synthetic_events(count: int, chats: int, seed: int = 1) -> list[dict]:
+    rnd = random.Random(seed)
+    events: list[dict] = []
+    members: dict[int, set[str]] = {}
+    for index in range(count):
+        chat = rnd.randrange(chats)
+        chat_id = f"1/0/{chat:08d}-0000-0000-0000-000000000000"
+        current = members.setdefault(chat, set())
+        if not current:
+            etype = "messenger_chat.created"
+        else:
+            etype = rnd.choices(
+                ("messenger_chat.member.added", "messenger_chat.member.removed",
+                 "messenger_chat.member.role_changed",
+                 "messenger_chat.info_changed", "messenger_chat.group_added"),
+                weights=(70, 10, 8, 7, 5))[0]
+        meta: dict = {"chat_id": chat_id, "revision": str(index),
+                      "chat_info": {"name": f"Чат номер {chat}", "type": "group",
+                                    "description": "Рабочее обсуждение"}}
+        if etype == "messenger_chat.created":
+            current.add("0")
+        elif etype == "messenger_chat.member.added":
+            uid = str(rnd.randrange(10 ** 6))
+            current.add(uid)
+            meta.update(object_uid=uid, member_info={"role": "member",
+                                                     "is_robot": False})
+        elif etype in ("messenger_chat.member.removed",
+                       "messenger_chat.member.role_changed"):
+            uid = rnd.choice(sorted(current))
+            meta.update(object_uid=uid, member_info={"role": "admin"})
+            if etype.endswith("removed"):
+                current.discard(uid)
+        elif etype == "messenger_chat.group_added":
+            meta["group_id"] = str(rnd.randrange(500))
+        events.append({
+            "user_login": f"admin{chat % 50}@example.org",
+            "user_name": "Администратор Чатов",
+            "event": {"uid": 1130000000000000 + chat % 50, "org_id": 1,
+                      "occurred_at": f"2026-01-01T00:00:00.{index:06d}+00:00",
+                      "type": etype, "service": "Web",
+                      "idempotency_id": f"ev-{index:09d}", "status": "Success",
+                      "is_system": False, "ip": "10.0.0.1",
+                      "request_id": f"req-{index:09d}", "meta": meta}})
+    return events
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--chats", type=int, default=5_000)
+    args = parser.parse_args()
+
+    print(f"Готовим события: {args.events} по {args.chats} чатам…")
+    events = synthetic_events(args.events, args.chats)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (STORAGE_JSON, STORAGE_COMPACT):
+            path = os.path.join(tmp, f"events_{storage}.sqlite3")
+            store = EventStore(path, storage=storage)
+            try:
+                started = time.perf_counter()
+                store.upsert_events(events)
+                write = time.perf_counter() - started
+                store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                started = time.perf_counter()
+                chats = build_projection(store.iter_all_events_ordered())
+                replay = time.perf_counter() - started
+            finally:
+                store.close()
+            size = os.path.getsize(path)
+            results[storage] = (size, write, replay)
+            print(f"{storage:>8}: размер {size / 2 ** 20:8.1f} МБ, запись "
+                  f"{write:6.2f} с, проигрывание {replay:6.2f} с "
+                  f"({len(chats)} чатов)")
+    json_size, json_write, json_replay = results[STORAGE_JSON]
+    size, write, replay = results[STORAGE_COMPACT]
+    print(f"compact: меньше в {json_size / size:.1f} раза, проигрывание быстрее "
+          f"в {json_replay / max(replay, 1e-9):.1f} раза, запись "
+          f"{write / max(json_write, 1e-9):.1f}× от json.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,339 @@
+"""Замер пропускной способности всего конвейера на синтетической организации.
+
+Строит организацию (сотрудники, группы, подразделения), аудит-лог с
+типичной смесью событий за полгода и ручную таблицу Excel, затем гонит их
+через те же шаги, что и analyze: база событий, проигрывание, разворот
+групп, сведение с таблицей, запоминание состава и выгрузка отчётов. Для
+каждого шага печатает время, скорость (событий или участий в секунду) и
+пиковую память процесса к концу шага. Сеть не нужна: справочник заменён
+заглушкой в памяти.
+
+    python bench_pipeline.py
+    python bench_pipeline.py --users 5000 --chats 1000 --events 100000
+    python cli.py benchmark --bench-events 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from manual_import import load_manual
+from merge import merge_manual
+from profiling import StageTimer
+from projection import build_projection, expand_memberships
+from report import (export_bots, export_chats, export_members,
+                    export_unresolved_uids)
+from resolver import UserInfo
+from snapshots import SnapshotStore
+from store import EventStore
+
+# доли типов событий примерно как в живом аудит-логе
+EVENT_MIX = (
+    ("messenger_chat.member.added", 62),
+    ("messenger_chat.member.removed", 12),
+    ("messenger_chat.member.role_changed", 8),
+    ("messenger_chat.info_changed", 8),
+    ("messenger_chat.group_added", 4),
+    ("messenger_chat.group_removed", 1),
+    ("messenger_chat.department_added", 3),
+    ("messenger_chat.department_removed", 1),
+)
+HISTORY_DAYS = 183
+BASE_UID = 1130000000000000
+EXCEL_EPOCH = datetime(1899, 12, 30, tzinfo=timezone.utc)
+
+
+class SyntheticOrg:
+    """Сотрудники, группы и подразделения синтетической организации."""
+
+    def __init__(self, users: int, groups: int, departments: int, seed: int = 1):
+        rnd = random.Random(seed)
+        self.users: dict[str, UserInfo] = {}
+        for index in range(users):
+            uid = str(BASE_UID + index)
+            robot = index % 200 == 199
+            login = (f"yndx-mssngr-bench{index}-bot" if robot
+                     else f"user{index}@example.org")
+            self.users[uid] = UserInfo(
+                uid=uid, login=login, email=None if robot else login,
+                full_name=None if robot else f"Сотрудник {index}",
+                position=None if robot else rnd.choice(
+                    ("Инженер", "Аналитик", "Менеджер", "Юрист")),
+                is_robot=robot, source="directory")
+        self.uids = list(self.users)
+        self.uid_by_login = {info.login: uid for uid, info in self.users.items()}
+        self.groups = {str(index): rnd.sample(self.uids, min(len(self.uids),
+                                                             rnd.randint(5, 60)))
+                       for index in range(groups)}
+        self.departments = {str(index): rnd.sample(self.uids, min(len(self.uids),
+                                                                  rnd.randint(10, 120)))
+                            for index in range(departments)}
+
+
+class BenchResolver:
+    """Справочник в памяти с тем же набором методов, что DirectoryResolver
+    отдаёт проекции и сведению с таблицей."""
+
+    def __init__(self, org: SyntheticOrg):
+        self.org = org
+        self.learned: dict[str, str] = {}
+
+    def user_info(self, uid):
+        return self.org.users.get(str(uid)) if uid else None
+
+    def login_for_uid(self, uid):
+        info = self.user_info(uid)
+        return info.login if info else self.learned.get(str(uid))
+
+    def full_name_for_uid(self, uid):
+        info = self.user_info(uid)
+        return info.full_name if info else None
+
+    def position_for_uid(self, uid):
+        info = self.user_info(uid)
+        return info.position if info else None
+
+    def is_robot_uid(self, uid):
+        info = self.user_info(uid)
+        return bool(info and info.is_robot)
+
+    def resolve_identity(self, identity):
+        uid = self.org.uid_by_login.get(identity)
+        return (uid, "resolved:directory") if uid else (None, "not_found")
+
+    def learn_identity(self, uid, login, source="manual"):
+        self.learned[str(uid)] = login
+
+    def group_name(self, gid):
+        return f"Группа {gid}"
+
+    def department_name(self, did):
+        return f"Подразделение {did}"
+
+    def expand_group(self, gid):
+        return self.org.groups.get(str(gid), [])
+
+    def expand_department(self, did):
+        return self.org.departments.get(str(did), [])
+
+
+def _chat_id(index: int) -> str:
+    return f"1/0/{index:08d}-0000-0000-0000-000000000000"
+
+
+def synthetic_events(org: SyntheticOrg, chats: int, count: int,
+                     seed: int = 2) -> tuple[list[dict], dict[int, list[str]]]:
+    """События за HISTORY_DAYS дней и итоговый состав каждого чата."""
+    rnd = random.Random(seed)
+    types, weights = zip(*EVENT_MIX)
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    step = timedelta(days=HISTORY_DAYS) / max(count, 1)
+    members: dict[int, list[str]] = {}
+    positions: dict[int, dict[str, int]] = {}
+    linked: dict[int, dict[str, set[str]]] = {}
+    events: list[dict] = []
+    admins = org.uids[:50]
+
+    for index in range(count):
+        chat = rnd.randrange(chats)
+        current = members.get(chat)
+        if current is None:
+            etype = "messenger_chat.created"
+            current = members[chat] = []
+            positions[chat] = {}
+            linked[chat] = {"group": set(), "department": set()}
+        else:
+            etype = rnd.choices(types, weights)[0]
+        admin = admins[chat % len(admins)]
+        meta: dict = {"chat_id": _chat_id(chat), "revision": str(index),
+                      "chat_info": {"name": f"Чат номер {chat}",
+                                    "type": "channel" if chat % 7 == 0 else "group",
+                                    "description": "Рабочее обсуждение"}}
+
+        if etype == "messenger_chat.member.added" or (
+                etype in ("messenger_chat.member.removed",
+                          "messenger_chat.member.role_changed") and not current):
+            etype = "messenger_chat.member.added"
+            uid = rnd.choice(org.uids)
+            if uid not in positions[chat]:
+                positions[chat][uid] = len(current)
+                current.append(uid)
+            meta.update(object_uid=uid, member_info={
+                "role": "member", "is_robot": org.users[uid].is_robot})
+        elif etype in ("messenger_chat.member.removed",
+                       "messenger_chat.member.role_changed"):
+            uid = rnd.choice(current)
+            meta.update(object_uid=uid, member_info={"role": "admin"})
+            if etype.endswith("removed"):
+                # удаление за O(1): на место ушедшего ставим последнего
+                slot = positions[chat].pop(uid)
+                last = current.pop()
+                if last != uid:
+                    current[slot] = last
+                    positions[chat][last] = slot
+        elif etype.startswith(("messenger_chat.group_", "messenger_chat.department_")):
+            kind = "group" if "group_" in etype else "department"
+            pool = org.groups if kind == "group" else org.departments
+            attached = linked[chat][kind]
+            if etype.endswith("_removed") and attached:
+                ref = rnd.choice(sorted(attached))
+                attached.discard(ref)
+            else:
+                etype = f"messenger_chat.{kind}_added"
+                ref = rnd.choice(list(pool))
+                attached.add(ref)
+            meta[f"{kind}_id"] = ref
+        elif etype == "messenger_chat.info_changed":
+            meta["chat_info"]["name"] = f"Чат номер {chat}"
+
+        events.append({
+            "user_login": org.users[admin].login,
+            "user_name": "Администратор Чатов",
+            "event": {"uid": int(admin), "org_id": 1,
+                      "occurred_at": (started + step * index).isoformat(
+                          timespec="microseconds"),
+                      "type": etype, "service": "Web",
+                      "idempotency_id": f"bench-{index:09d}", "status": "Success",
+                      "is_system": False, "ip": "10.0.0.1",
+                      "request_id": f"req-{index:09d}", "meta": meta}})
+    return events, members
+
+
+def write_manual_xlsx(path: str, org: SyntheticOrg, members: dict[int, list[str]],
+                      share: float, seed: int = 3) -> int:
+    """Ручная таблица в формате выгрузки: строка на участника для доли share
+    чатов; часть адресов нарочно незнакома справочнику. Возвращает число строк."""
+    from openpyxl import Workbook
+
+    rnd = random.Random(seed)
+    book = Workbook(write_only=True)
+    sheet = book.create_sheet("Чаты")
+    sheet.append(["messenger_chat.created", "chat_name", "chat_description",
+                  "Тип", "Full name", "Job Position", "Email"])
+    serial = (datetime(2026, 1, 1, tzinfo=timezone.utc) - EXCEL_EPOCH).days
+    rows = 0
+    for chat, uids in members.items():
+        if rnd.random() >= share:
+            continue
+        chat_type = "Канал" if chat % 7 == 0 else "Групповой чат"
+        for uid in uids:
+            info = org.users[uid]
+            login = info.login if rnd.random() > 0.02 else f"gone{uid}@example.org"
+            sheet.append([serial + rnd.random() * HISTORY_DAYS, f"Чат номер {chat}",
+                          "Рабочее обсуждение", chat_type, info.full_name,
+                          info.position, login])
+            rows += 1
+    book.save(path)
+    return rows
+
+
+def run_benchmark(*, users: int = 20_000, chats: int = 5_000,
+                  events: int = 300_000, groups: int = 300, departments: int = 100,
+                  manual_share: float = 0.2, workdir: str | None = None,
+                  seed: int = 1) -> dict:
+    """Прогоняет конвейер на синтетике; возвращает замеры по шагам."""
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        timer = StageTimer()
+        volume: dict[str, tuple[int, str]] = {}
+
+        with timer.stage("generate"):
+            org = SyntheticOrg(users, groups, departments, seed=seed)
+            log_events, final = synthetic_events(org, chats, events, seed=seed + 1)
+            manual_path = os.path.join(tmp, "manual.xlsx")
+            manual_rows = write_manual_xlsx(manual_path, org, final, manual_share,
+                                            seed=seed + 2)
+        volume["generate"] = (len(log_events), "событий")
+
+        store = EventStore(os.path.join(tmp, "bench.sqlite3"))
+        try:
+            with timer.stage("store"):
+                store.upsert_events(log_events)
+            volume["store"] = (len(log_events), "событий")
+            del log_events
+
+            with timer.stage("replay"):
+                state = build_projection(store.iter_all_events_ordered())
+            volume["replay"] = (store.count(), "событий")
+        finally:
+            store.close()
+
+        resolver = BenchResolver(org)
+        with timer.stage("expand"):
+            expand_memberships(state, resolver)
+        memberships = sum(len(chat.members) for chat in state.values())
+        volume["expand"] = (memberships, "участий")
+
+        with timer.stage("manual"):
+            manual = load_manual(manual_path)
+            merge_manual(state, manual, resolver)
+        volume["manual"] = (manual_rows, "строк таблицы")
+
+        memberships = sum(len(chat.members) for chat in state.values())
+        snapshots = SnapshotStore(os.path.join(tmp, "bench.sqlite3"))
+        try:
+            with timer.stage("snapshot"):
+                snapshots.apply_run(state, include_private=False,
+                                    scopes=("audit", "expansion", "manual"))
+        finally:
+            snapshots.close()
+        volume["snapshot"] = (memberships, "участий")
+
+        out_dir = os.path.join(tmp, "report")
+        with timer.stage("export"):
+            export_chats(out_dir, state, False)
+            export_members(out_dir, state, False)
+            export_bots(out_dir, state, False)
+            export_unresolved_uids(out_dir, state)
+        volume["export"] = (memberships, "участий")
+
+    report = timer.report()
+    for stage in report["stages"]:
+        amount, unit = volume[stage["stage"]]
+        stage["items"] = amount
+        stage["unit"] = unit
+        stage["per_second"] = round(amount / max(stage["wall_s"], 1e-9))
+    report["params"] = {"users": users, "chats": chats, "events": events,
+                        "groups": groups, "departments": departments,
+                        "manual_share": manual_share, "seed": seed}
+    return report
+
+
+def print_benchmark(report: dict) -> None:
+    params = report["params"]
+    print(f"\nСинтетика: сотрудников {params['users']}, чатов {params['chats']}, "
+          f"событий {params['events']}")
+    print(f"{'шаг':10}  {'время, с':>9}  {'процессор':>9}  {'объём':>10}  "
+          f"{'в секунду':>11}  {'память, МБ':>10}")
+    for stage in report["stages"]:
+        memory = stage.get("peak_rss_mb")
+        print(f"{stage['stage']:10}  {stage['wall_s']:9.2f}  {stage['cpu_s']:9.2f}  "
+              f"{stage['items']:>10}  {stage['per_second']:>11}  "
+              f"{'—' if memory is None else f'{memory:.0f}':>10}  {stage['unit']}")
+    print(f"Всего: {report['wall_s']:.1f} с. Память — пик процесса к концу шага.\n")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--chats", type=int, default=5_000)
+    parser.add_argument("--events", type=int, default=300_000)
+    parser.add_argument("--manual-share", type=float, default=0.2,
+                        help="доля чатов, попадающих в ручную таблицу")
+    parser.add_argument("--json", help="дополнительно сохранить замеры в файл")
+    args = parser.parse_args()
+
+    report = run_benchmark(users=args.users, chats=args.chats, events=args.events,
+                           manual_share=args.manual_share)
+    print_benchmark(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
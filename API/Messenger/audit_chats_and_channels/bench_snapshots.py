@@ -0,0 +1,109 @@
+"""Сравнение построчного и пакетного запоминания состава (SnapshotStore).
+
+Строит синтетический прогон (по умолчанию 50 000 чатов и 1 000 000
+участников), запоминает его в пустую базу, затем запоминает второй прогон
+с небольшой долей изменений — так, как это происходит при обычном
+ежедневном запуске. Каждый путь работает со своей базой во временной папке.
+
+    python bench_snapshots.py
+    python bench_snapshots.py --chats 5000 --members 100000 --churn 0.02
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from projection import ChatState, MemberState
+from snapshots import SnapshotStore
+
+
+def synthetic_run(chats: int, members: int, seed: int = 1) -> dict[str, ChatState]:
+    rnd = random.Random(seed)
+    result: dict[str, ChatState] = {}
+    per_chat = max(1, members // chats)
+    for index in range(chats):
+        key = f"chat{index:06d}"
+        chat = ChatState(chat_id_raw=f"1/0/{key}", chat_key=key,
+                         type=rnd.choice(("group", "channel")),
+                         name=f"Чат {index}")
+        for offset in range(per_chat):
+            uid = str(index * per_chat + offset)
+            chat.members[uid] = MemberState(
+                uid=uid, login=f"user{uid}@example.org",
+                role="admin" if offset == 0 else "member",
+                added_at="2026-01-01T00:00:00+00:00",
+                source="audit_projection", confidence="high")
+        result[key] = chat
+    return result
+
+
+def mutate(chats: dict[str, ChatState], churn: float, seed: int = 2) -> None:
+    """Удаляет, добавляет и меняет роль примерно у доли churn участников."""
+    rnd = random.Random(seed)
+    next_uid = 10 ** 9
+    for chat in chats.values():
+        if rnd.random() < churn:
+            chat.name = f"{chat.name} (переименован)"
+        for uid in list(chat.members):
+            roll = rnd.random()
+            if roll < churn / 3:
+                del chat.members[uid]
+            elif roll < churn * 2 / 3:
+                chat.members[uid].role = "admin"
+            elif roll < churn:
+                next_uid += 1
+                chat.members[str(next_uid)] = MemberState(
+                    uid=str(next_uid), role="member",
+                    source="audit_projection", confidence="high")
+
+
+def _timed(store: SnapshotStore, chats: dict, bulk: bool) -> tuple[float, dict]:
+    started = time.perf_counter()
+    diff = store.apply_run(chats, include_private=False, bulk=bulk)
+    return time.perf_counter() - started, diff.counts()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=50_000)
+    parser.add_argument("--members", type=int, default=1_000_000)
+    parser.add_argument("--churn", type=float, default=0.01,
+                        help="доля изменённых участников во втором прогоне")
+    parser.add_argument("--rowwise", action=argparse.BooleanOptionalAction,
+                        default=True, help="замерять и построчный путь")
+    args = parser.parse_args()
+
+    print(f"Готовим прогон: чатов {args.chats}, участников {args.members}…")
+    first = synthetic_run(args.chats, args.members)
+    second = synthetic_run(args.chats, args.members)
+    mutate(second, args.churn)
+
+    paths = [True, False] if args.rowwise else [True]
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for bulk in paths:
+            store = SnapshotStore(os.path.join(tmp, f"bench_{bulk}.sqlite3"))
+            try:
+                initial = _timed(store, first, bulk)
+                repeat = _timed(store, second, bulk)
+            finally:
+                store.close()
+            results[bulk] = (initial, repeat)
+            title = "пачкой" if bulk else "по одной записи"
+            print(f"{title:>16}: первый прогон {initial[0]:8.2f} с, "
+                  f"повторный {repeat[0]:8.2f} с  {repeat[1]}")
+        if len(results) == 2:
+            for bulk in (True, False):
+                results[bulk][1][1].pop("scopes", None)
+            assert results[True][1][1] == results[False][1][1], \
+                "пути дали разные изменения"
+            speedup = results[False][1][0] / max(results[True][1][0], 1e-9)
+            print(f"Повторный прогон пачкой быстрее в {speedup:.1f} раза.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,38 +1,54 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+import copy
 import csv
+import json
 import logging
 import os
 import sys
 import tempfile
-from datetime import datetime, timedelta, timezone
+import time
+from collections import Counter
+from datetime import datetime, timezone
 
-from audit_identities import harvest_identities_from_audit
+from audit_identities import harvest_identities_from_audit, harvest_partner_uids
 from clients import Api360Client, AuditLogClient, DirectoryClient
+from collector import SLICE_PREFIX, SlicedCollector, collect_window
 from compare_runs import compare_runs, export_compare, print_compare
 from config import Config
+from directory_store import DirectoryStore, SnapshotDirectory
+from http_base import HTTP_STATS, HttpError
 from human import (chat_type_ru, chat_type_short_ru, confidence_ru, counters,
-                   coverage_ru, date_human, dt_human, evidence_ru, plural,
+                   coverage_ru, date_human, dt_human, duration, evidence_ru, plural,
                    quality_ru, role_ru, share, source_ru)
 from identity_store import IdentityStore
+from manual_cache import load_manual_cached
 from manual_import import (ManualChat, ManualImportResult, ManualRow,
                            classify_identity, excel_serial_to_dt, load_manual,
                            make_manual_key, normalize_identity,
                            resolve_manual_path)
 from merge import load_manual_map, merge_manual
+from prefetch import PrefetchedDirectory, collect_and_prefetch
+from profiling import PROFILE_DIR, StageTimer
 from projection import (CHAT_EVENT_TYPES, ChatState, MemberState, build_projection,
                         expand_memberships, normalize_chat_id)
+from projection_store import ProjectionStore, chat_to_json, event_time
+from query_api import QueryApi, QueryServer
 from report import (export_bots, export_chats, export_discrepancies,
                     export_manual_issues, export_members, export_quality,
                     export_readme, export_run_diff, export_summary,
                     export_unresolved_uids)
-from resolver import DirectoryResolver, DirectoryUnavailableError
-from run_layout import (COMPARE_DIR, create_run_dir, file_fingerprint, list_runs,
+from resolver import DirectoryResolver, DirectoryUnavailableError, UserInfo
+from run_index import RUN_INDEX, RunIndex
+from run_layout import (BENCH_DIR, COMPARE_DIR, create_run_dir, file_fingerprint, list_runs,
                         prune_runs, resolve_run, update_latest, write_manifest)
-from snapshots import SnapshotStore
-from store import EventStore
+from snapshots import SnapshotStore, member_key
+from store import (LAYOUT_MONTHLY, STORAGE_COMPACT, STORAGE_JSON, EventStore,
+                   partitions_dir)
 from text_utils import clean_text, looks_like_messenger_bot_login
+from watch import ChangeWatcher, JsonlSink, MembershipChange, WebhookSink
 
 logging.basicConfig(
     level=logging.INFO,
@@ -44,44 +60,76 @@ log = logging.getLogger("cli")
 # ============================== collect ==============================
 def cmd_collect(cfg: Config) -> None:
     """Забирает из аудит-лога новые события и складывает их в локальную базу."""
-    store = EventStore(cfg.db_path)
+    store = EventStore(cfg.db_path, layout=cfg.events_layout)
     audit = AuditLogClient(cfg.audit_base, cfg.audit_token)
+    collector = SlicedCollector(audit, store, cfg.org_id,
+                                workers=cfg.collect_workers,
+                                slice_hours=cfg.slice_hours)
     try:
+        inserted = 0
+        if collector.pending_plan():
+            inserted += collector.resume()
+            newest = store.max_occurred_at()
+            if newest:
+                store.set_checkpoint(newest)
+
         now = datetime.now(timezone.utc)
-        checkpoint = store.get_checkpoint()
-        if checkpoint is None:
-            started = now - timedelta(days=cfg.backfill_days)
-            log.info("Первый запуск: забираем всю доступную историю, "
-                     "начиная с %s (%s дней назад). "
-                     "Дальше будем брать только новое.",
-                     date_human(started), cfg.backfill_days)
-        else:
-            started = checkpoint - timedelta(minutes=cfg.overlap_minutes)
-            log.info("Забираем события с %s. Взяли запас в %s минут назад, "
-                     "чтобы не пропустить те, что пришли с задержкой.",
-                     dt_human(started), cfg.overlap_minutes)
-
-        inserted = store.upsert_events(audit.iter_events(
-            cfg.org_id, started.isoformat(), now.isoformat(), CHAT_EVENT_TYPES))
-        newest = store.max_occurred_at()
-        if newest:
-            store.set_checkpoint(newest)
-
-        if inserted:
-            log.info("Получено новых событий: %s. Всего в базе: %s. "
-                     "В следующий раз начнём с %s.",
-                     inserted, store.count(), dt_human(newest))
-        else:
-            log.info("Новых событий нет — с прошлого запуска в чатах ничего "
-                     "не менялось. Всего в базе: %s.", store.count())
+        started = collect_window(cfg, store, now)
+        inserted += collector.collect(started, now, CHAT_EVENT_TYPES)
+        _finish_collect(store, inserted)
     finally:
         audit.close()
         store.close()
 
 
+def _finish_collect(store: EventStore, inserted: int) -> None:
+    newest = store.max_occurred_at()
+    if newest:
+        store.set_checkpoint(newest)
+
+    if inserted:
+        log.info("Получено новых событий: %s. Всего в базе: %s. "
+                 "В следующий раз начнём с %s.",
+                 inserted, store.count(), dt_human(newest))
+    else:
+        log.info("Новых событий нет — с прошлого запуска в чатах ничего "
+                 "не менялось. Всего в базе: %s.", store.count())
+
+
 # ============================== analyze ==============================
-def cmd_analyze(cfg: Config) -> None:
-    """Собирает отчёты в отдельную папку и сравнивает их с прошлым запуском."""
+def cmd_collect_async(cfg: Config) -> PrefetchedDirectory:
+    """collect для команды run с --async-http: пока листается аудит-лог,
+    параллельно загружается справочник для следующего analyze, а при
+    EXPAND_GROUPS — и составы групп, которые analyze затем берёт из кэша."""
+    store = EventStore(cfg.db_path, layout=cfg.events_layout)
+    directory_store = DirectoryStore(cfg.db_path)
+    try:
+        # свежую локальную копию справочника заново не загружаем
+        def stale(*kinds: str) -> bool:
+            return cfg.refresh_directory or not all(
+                directory_store.snapshot_fresh(cfg.org_id, kind, cfg.directory_ttl_hours)
+                for kind in kinds)
+
+        users = (bool(cfg.resolve_uids or cfg.manual_path)
+                 and cfg.directory_source in ("auto", "cloud") and stale("users"))
+        groups = cfg.expand_groups and stale("groups", "departments")
+        fresh_groups = (directory_store.fresh_group_ids(
+            cfg.org_id, cfg.group_cache_ttl_hours) if cfg.expand_groups else None)
+        inserted, directory = asyncio.run(collect_and_prefetch(
+            cfg, store, users=users, groups=groups, fresh_groups=fresh_groups))
+        for gid, body in directory.group_members.items():
+            directory_store.put_group_members(cfg.org_id, gid, body)
+        directory_store.commit()
+        _finish_collect(store, inserted)
+    finally:
+        directory_store.close()
+        store.close()
+    return directory
+
+
+def cmd_analyze(cfg: Config, directory=None) -> None:
+    """Собирает отчёты в отдельную папку и сравнивает их с прошлым запуском.
+    directory — заранее загруженный справочник (см. cmd_collect_async)."""
     if cfg.manual_path:
         cfg.manual_path = resolve_manual_path(cfg.manual_path)
 
@@ -93,11 +141,20 @@ def cmd_analyze(cfg: Config) -> None:
 
     run = create_run_dir(cfg.results_dir, command="analyze", tag=cfg.run_tag)
     out_dir = run.path
+    timer = StageTimer(os.path.join(out_dir, PROFILE_DIR) if cfg.profile else None,
+                       http_stats=HTTP_STATS)
 
     store = EventStore(cfg.db_path)
-    directory = DirectoryClient(cfg.directory_base, cfg.directory_token)
-    api360 = Api360Client(cfg.api360_base, cfg.directory_token)
     identity_store = IdentityStore(cfg.db_path)
+    directory_store = DirectoryStore(cfg.db_path)
+    directory = SnapshotDirectory(
+        directory or DirectoryClient(cfg.directory_base, cfg.directory_token),
+        directory_store, ttl_hours=cfg.directory_ttl_hours,
+        refresh=cfg.refresh_directory, allow_empty=cfg.allow_empty_directory)
+    api360 = SnapshotDirectory(
+        Api360Client(cfg.api360_base, cfg.directory_token), directory_store,
+        ttl_hours=cfg.directory_ttl_hours, refresh=cfg.refresh_directory,
+        prefix="api360_", allow_empty=cfg.allow_empty_directory)
     manual = None
     merge_rep = None
     diff = None
@@ -108,7 +165,14 @@ def cmd_analyze(cfg: Config) -> None:
 
     try:
         # --- 1. восстанавливаем состояние чатов по событиям ---
-        chats = build_projection(store.iter_all_events_ordered())
+        projections = ProjectionStore(cfg.db_path,
+                                      checkpoint_every=cfg.checkpoint_every,
+                                      replay_workers=cfg.replay_workers)
+        try:
+            with timer.stage("replay"):
+                chats = projections.refresh(store, full_replay=cfg.full_replay)
+        finally:
+            projections.close()
         log.info("Восстановили состояние %s по %s событиям аудит-лога.",
                  plural(len(chats), "чата", "чатов", "чатов"), store.count())
         if not chats:
@@ -119,12 +183,16 @@ def cmd_analyze(cfg: Config) -> None:
         resolver = DirectoryResolver(
             directory, api360, cfg.org_id,
             identity_store=identity_store,
+            directory_store=directory_store,
             source_mode=cfg.directory_source,
             fail_on_empty=not cfg.allow_empty_directory,
+            expand_workers=cfg.expand_workers,
+            group_ttl_hours=cfg.group_cache_ttl_hours,
         )
         if cfg.resolve_uids or cfg.manual_path:
             try:
-                resolver.preload_users(store=store)
+                with timer.stage("directory"):
+                    resolver.preload_users(store=store)
             except DirectoryUnavailableError as exc:
                 status = "failed"
                 errors.append(str(exc))
@@ -132,27 +200,30 @@ def cmd_analyze(cfg: Config) -> None:
                 raise SystemExit(2) from exc
             load_report = resolver.load_report
 
-            for chat in chats.values():
-                for member in chat.members.values():
-                    if member.uid and not member.login:
-                        member.login = resolver.login_for_uid(member.uid)
-                    info = resolver.user_info(member.uid)
-                    if info:
-                        if not member.full_name and info.full_name:
-                            member.full_name = info.full_name
-                            member.fio_source = "directory"
-                        if not member.position and info.position:
-                            member.position = info.position
-                        if info.is_robot and not member.is_bot:
-                            member.is_bot = True
-                            member.bot_evidence = "directory"
+            with timer.stage("resolve"):
+                for chat in chats.values():
+                    for member in chat.members.values():
+                        if member.uid and not member.login:
+                            member.login = resolver.login_for_uid(member.uid)
+                        info = resolver.user_info(member.uid)
+                        if info:
+                            if not member.full_name and info.full_name:
+                                member.full_name = info.full_name
+                                member.fio_source = "directory"
+                            if not member.position and info.position:
+                                member.position = info.position
+                            if info.is_robot and not member.is_bot:
+                                member.is_bot = True
+                                member.bot_evidence = "directory"
 
         # --- 3. разворачиваем группы и подразделения в людей ---
         if cfg.expand_groups:
             before = sum(len(chat.members) for chat in chats.values())
-            resolver.preload_departments()
-            resolver.preload_groups()
-            expand_memberships(chats, resolver)
+            with timer.stage("expand"):
+                resolver.preload_departments()
+                resolver.preload_groups()
+                resolver.plan_expansion(chats)
+                expand_memberships(chats, resolver)
             after = sum(len(chat.members) for chat in chats.values())
             log.info("Развернули группы и подразделения в конкретных людей: "
                      "было %s участников, стало %s.", before, after)
@@ -163,34 +234,43 @@ def cmd_analyze(cfg: Config) -> None:
             scopes.append("expansion")
 
         if cfg.manual_path:
-            manual = load_manual(cfg.manual_path, sheet=cfg.manual_sheet,
-                                 tz_offset=cfg.manual_tz,
-                                 date_semantics=cfg.manual_date_semantics)
-            export_manual_issues(out_dir, manual)
-            export_quality(out_dir, manual)
-            merge_rep = merge_manual(
-                chats, manual, resolver,
-                date_tolerance_days=cfg.date_tolerance_days,
-                manual_map=load_manual_map(cfg.manual_map_path))
-            export_discrepancies(out_dir, merge_rep)
-            identity_store.commit()
+            with timer.stage("manual"):
+                manual = _load_manual(cfg)
+                export_manual_issues(out_dir, manual)
+                export_quality(out_dir, manual)
+                merge_rep = merge_manual(
+                    chats, manual, resolver,
+                    date_tolerance_days=cfg.date_tolerance_days,
+                    manual_map=load_manual_map(cfg.manual_map_path))
+                export_discrepancies(out_dir, merge_rep)
+                identity_store.commit()
             scopes.append("manual")
         else:
             log.info("Ручная таблица не передана. Сведения из прошлых таблиц "
                      "сохраняются — они не будут помечены как удалённые.")
 
         # --- 5. отчёты ---
-        export_chats(out_dir, chats, cfg.include_private)
-        export_members(out_dir, chats, cfg.include_private)
-        export_bots(out_dir, chats, cfg.include_private)
-        export_unresolved_uids(out_dir, chats)
-        export_readme(out_dir)
+        with timer.stage("export"):
+            # рядом с CSV — те же чаты и участники в SQLite для compare
+            run_index = RunIndex.create(out_dir)
+            try:
+                export_chats(out_dir, chats, cfg.include_private,
+                             xlsx=cfg.report_xlsx, index=run_index)
+                export_members(out_dir, chats, cfg.include_private,
+                               xlsx=cfg.report_xlsx, index=run_index)
+                run_index.finish()
+            finally:
+                run_index.close()
+            export_bots(out_dir, chats, cfg.include_private, xlsx=cfg.report_xlsx)
+            export_unresolved_uids(out_dir, chats, xlsx=cfg.report_xlsx)
+            export_readme(out_dir)
 
         # --- 6. запоминаем состав, чтобы потом видеть изменения ---
         snapshots = SnapshotStore(cfg.db_path)
         try:
-            diff = snapshots.apply_run(chats, cfg.include_private,
-                                       scopes=tuple(scopes))
+            with timer.stage("snapshot"):
+                diff = snapshots.apply_run(chats, cfg.include_private,
+                                           scopes=tuple(scopes))
             counts = diff.counts()
             if any(counts[key] for key in ("added", "removed", "role_changed")):
                 log.info("Изменения с прошлого запуска: добавлено участников %s, "
@@ -210,13 +290,14 @@ def cmd_analyze(cfg: Config) -> None:
         checkpoint = store.get_checkpoint()
         write_manifest(
             run, cfg=cfg, status=status, metrics=summary,
-            flags=cfg.flags_snapshot(), errors=errors,
+            flags=cfg.flags_snapshot(), errors=errors, perf=timer.report(),
             inputs={"manual": file_fingerprint(cfg.manual_path),
                     "manual_map": file_fingerprint(cfg.manual_map_path)},
             db={"path": os.path.abspath(cfg.db_path),
                 "events": store.count(),
                 "checkpoint": checkpoint.isoformat() if checkpoint else None})
         identity_store.close()
+        directory_store.close()
         directory.close()
         api360.close()
         store.close()
@@ -363,12 +444,13 @@ def cmd_runs(cfg: Config) -> None:
     command_ru = {"analyze": "отчёты", "validate": "проверка таблицы",
                   "run": "отчёты"}
 
-    print("\n" + "=" * 92)
+    print("\n" + "=" * 110)
     print(f"ЗАПУСКИ  ({os.path.abspath(cfg.results_dir)})")
-    print("=" * 92)
+    print("=" * 110)
     print(f"{'№':>3}  {'когда':17}  {'что делали':18}  {'чатов':>6}  "
-          f"{'ботов':>6}  {'без логина':>10}  режим")
-    print("-" * 92)
+          f"{'ботов':>6}  {'без логина':>10}  {'длилось':>10}  "
+          f"{'запросов':>8}  режим")
+    print("-" * 110)
 
     analyze_index = 0
     for run in runs:
@@ -393,18 +475,47 @@ def cmd_runs(cfg: Config) -> None:
         chats = metrics.get("total_chats", "—")
         unresolved = metrics.get("unresolved_uid_members", "—")
         broken = "  (не завершён)" if run.status != "ok" else ""
+        perf = run.perf
+        took = duration(perf["wall_s"]) if "wall_s" in perf else "—"
+        requests = (perf.get("http") or {}).get("requests", "—")
 
         print(f"{position:>3}  {dt_human(run.dt):17.17}  "
               f"{command_ru.get(run.command, run.command):18.18}  "
               f"{str(chats):>6}  {str(bots):>6}  {str(unresolved):>10}  "
+              f"{took:>10}  {str(requests):>8}  "
               f"{', '.join(modes) or '—'}{broken}")
 
-    print("-" * 92)
+    print("-" * 110)
+    measured = [run for run in runs if run.perf.get("stages")]
+    if measured:
+        _print_perf(measured[-1])
     print("Сравнить последний с предыдущим:  python cli.py compare")
     print("Сравнить любые два по номерам:    python cli.py compare --from 1 --to 3")
     print("Номер в первой колонке относится только к запускам с отчётами.\n")
 
 
+def _print_perf(run) -> None:
+    """Этапы последнего запуска с замерами: время, память, HTTP."""
+    perf = run.perf
+    http = perf.get("http") or {}
+    memory = perf.get("peak_rss_mb")
+    print(f"Последний замер ({run.run_id}): {duration(perf.get('wall_s', 0))}, "
+          f"процессор {duration(perf.get('cpu_s', 0))}"
+          + (f", память до {memory:.0f} МБ" if memory is not None else ""))
+    if http.get("requests"):
+        print(f"  HTTP: запросов {http['requests']}, повторов "
+              f"{http.get('retries', 0)}, из них 429 — {http.get('throttled', 0)}, "
+              f"получено {http.get('bytes', 0) / 2 ** 20:.1f} МБ")
+    for stage in perf.get("stages", []):
+        calls = (stage.get("http") or {}).get("requests")
+        print(f"  {stage['stage']:10}  {stage['wall_s']:9.2f} с  "
+              f"процессор {stage['cpu_s']:8.2f} с"
+              + (f"  запросов {calls}" if calls else ""))
+    if perf.get("profile_dir"):
+        print(f"  cProfile по этапам: {perf['profile_dir']}")
+    print("-" * 110)
+
+
 # ============================== compare ==============================
 def cmd_compare(cfg: Config, from_ref: str, to_ref: str,
                 out_dir: str | None = None) -> None:
@@ -423,7 +534,193 @@ def cmd_compare(cfg: Config, from_ref: str, to_ref: str,
     print_compare(result, target)
 
 
+# ============================== watch ==============================
+WATCH_FILE = "watch.jsonl"
+WATCH_WEBHOOK_SPOOL = "watch_webhook_pending.jsonl"
+
+
+def cmd_watch(cfg: Config, polls: int = 0) -> None:
+    """Опрашивает аудит-лог раз в cfg.watch_interval секунд и сразу
+    сообщает об изменениях состава чатов. polls — сколько опросов сделать
+    (0 — пока не остановят)."""
+    store = EventStore(cfg.db_path, layout=cfg.events_layout)
+    audit = AuditLogClient(cfg.audit_base, cfg.audit_token)
+    collector = SlicedCollector(audit, store, cfg.org_id,
+                                workers=cfg.collect_workers,
+                                slice_hours=cfg.slice_hours)
+    projection = ProjectionStore(cfg.db_path, checkpoint_every=cfg.checkpoint_every,
+                                 replay_workers=cfg.replay_workers)
+    snapshots = SnapshotStore(cfg.db_path)
+    identity_store = IdentityStore(cfg.db_path)
+    sinks: list = []
+    if cfg.watch_webhook:
+        sinks.append(WebhookSink(cfg.watch_webhook, spool=os.path.join(
+            cfg.results_dir, WATCH_WEBHOOK_SPOOL)))
+    if cfg.watch_out or not sinks:
+        sinks.append(JsonlSink(cfg.watch_out
+                               or os.path.join(cfg.results_dir, WATCH_FILE)))
+    watcher = ChangeWatcher(store, projection, snapshots, identity_store, sinks,
+                            include_private=cfg.include_private)
+    try:
+        watcher.start()
+        for sink in sinks:
+            log.info("Изменения пишем: %s", getattr(sink, "path", None)
+                     or getattr(sink, "url", ""))
+        done = 0
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                collector.collect(collect_window(cfg, store, now), now,
+                                  CHAT_EVENT_TYPES)
+            except HttpError as exc:
+                log.warning("Аудит-лог не ответил: %s. Повторим через %s с.",
+                            exc, cfg.watch_interval)
+            newest = store.max_occurred_at()
+            if newest:
+                store.set_checkpoint(newest)
+            changes = watcher.poll()
+            if changes:
+                counts = Counter(change.change for change in changes)
+                log.info("Изменений: %s (%s).", len(changes),
+                         ", ".join(f"{name} {count}"
+                                   for name, count in counts.most_common()))
+            done += 1
+            if polls and done >= polls:
+                break
+            time.sleep(cfg.watch_interval)
+    except KeyboardInterrupt:
+        log.info("Наблюдение остановлено.")
+    finally:
+        watcher.close()
+        audit.close()
+        for closable in (identity_store, snapshots, projection, store):
+            closable.close()
+
+
+# ============================== serve ==============================
+def cmd_serve(cfg: Config) -> None:
+    """Служба запросов по локальной базе: только чтение, ответы в JSON."""
+    if not os.path.exists(cfg.db_path):
+        raise SystemExit(f"Файл базы не найден: {cfg.db_path}")
+    # таблицы и индексы, на которые опираются запросы, создают сами хранилища;
+    # служба потом открывает базу только на чтение
+    for store_cls in (EventStore, SnapshotStore, IdentityStore):
+        store_cls(cfg.db_path).close()
+    api = QueryApi(cfg.db_path)
+    server = QueryServer(api, cfg.serve_host, cfg.serve_port)
+    log.info("Служба запросов слушает http://%s:%s/ (база %s). Адреса:",
+             cfg.serve_host, server.server_port, cfg.db_path)
+    for route in QueryApi.ROUTES:
+        log.info("  %s", route)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Служба остановлена.")
+    finally:
+        server.server_close()
+        api.close()
+
+
+# ============================== migrate-events ==============================
+def cmd_migrate_events(cfg: Config, monthly: bool = False) -> None:
+    """Переводит базу событий в компактный формат; с monthly — раскладывает
+    события по помесячным файлам."""
+    if not os.path.exists(cfg.db_path):
+        raise SystemExit(f"Файл базы не найден: {cfg.db_path}")
+    size_before = _events_size(cfg.db_path)
+    store = EventStore(cfg.db_path)
+    try:
+        if monthly and store.layout == LAYOUT_MONTHLY:
+            print("События уже разложены по месяцам.")
+            return
+        if not monthly and store.storage == STORAGE_COMPACT:
+            print("База событий уже в компактном формате.")
+            return
+        if monthly:
+            migrated = store.migrate_to_monthly()
+        else:
+            migrated = store.migrate_to_compact()
+    finally:
+        store.close()
+    size_after = _events_size(cfg.db_path)
+    print(f"Переведено событий: {migrated}. Размер базы: "
+          f"{size_before / 2 ** 20:.1f} МБ → {size_after / 2 ** 20:.1f} МБ.")
+    if monthly:
+        print(f"Файлы месяцев: {partitions_dir(cfg.db_path)}")
+
+
+def _events_size(db_path: str) -> int:
+    """Размер базы вместе с файлами месяцев, если они есть."""
+    folder = partitions_dir(db_path)
+    files = [db_path] + ([os.path.join(folder, name) for name in os.listdir(folder)]
+                         if os.path.isdir(folder) else [])
+    return sum(os.path.getsize(path) for path in files if os.path.isfile(path))
+
+
+# ============================== archive-events ==============================
+def cmd_archive_events(cfg: Config) -> None:
+    """Сжимает файлы событий старше cfg.events_hot_months последних месяцев."""
+    store = EventStore(cfg.db_path)
+    try:
+        if store.layout != LAYOUT_MONTHLY:
+            raise SystemExit("События лежат в одном файле; сначала разложите их "
+                             "по месяцам: python cli.py migrate-events --monthly")
+        archived = store.archive_months(cfg.events_hot_months)
+        months = store.partitions()
+    finally:
+        store.close()
+    for month, before, after in archived:
+        print(f"  {month}: {before / 2 ** 20:.1f} МБ → {after / 2 ** 20:.1f} МБ")
+    print(f"Сжато месяцев: {len(archived)}. Всего месяцев: {len(months)}, "
+          f"из них в архиве: {sum(1 for month in months if month['archived'])}.")
+
+
+# ============================== benchmark ==============================
+def cmd_benchmark(cfg: Config, users: int, chats: int, events: int) -> None:
+    """Гоняет конвейер на синтетических данных и сравнивает скорость
+    с прошлым замером из папки результатов."""
+    from bench_pipeline import print_benchmark, run_benchmark
+
+    bench_dir = os.path.join(cfg.results_dir, BENCH_DIR)
+    os.makedirs(bench_dir, exist_ok=True)
+    previous = sorted(name for name in os.listdir(bench_dir)
+                      if name.endswith(".json"))
+    report = run_benchmark(users=users, chats=chats, events=events)
+    print_benchmark(report)
+
+    if previous:
+        with open(os.path.join(bench_dir, previous[-1]), encoding="utf-8") as handle:
+            before = json.load(handle)
+        if before.get("params") != report["params"]:
+            print("Прошлый замер сделан на других объёмах — сравнивать не будем.")
+        else:
+            speed = {stage["stage"]: stage["per_second"]
+                     for stage in before.get("stages", [])}
+            print(f"По сравнению с замером {previous[-1][:-5]}:")
+            for stage in report["stages"]:
+                old = speed.get(stage["stage"])
+                if old:
+                    change = (stage["per_second"] - old) * 100 / old
+                    mark = "  ← медленнее" if change <= -BENCH_SLOWDOWN_PCT else ""
+                    print(f"  {stage['stage']:10} {change:+6.0f}%{mark}")
+            print()
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    target = os.path.join(bench_dir, f"{stamp}.json")
+    with open(target, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, ensure_ascii=False, indent=2)
+    log.info("Замер сохранён: %s", os.path.abspath(target))
+
+
 # ============================== validate ==============================
+def _load_manual(cfg: Config) -> ManualImportResult:
+    """Ручная таблица; неизменившийся файл берётся уже разобранным из базы."""
+    return load_manual_cached(cfg.manual_path,
+                              db_path=cfg.db_path if cfg.manual_cache else None,
+                              sheet=cfg.manual_sheet, tz_offset=cfg.manual_tz,
+                              date_semantics=cfg.manual_date_semantics)
+
+
 def cmd_validate(cfg: Config) -> None:
     """Проверяет ручную таблицу, не обращаясь ни к каким сервисам."""
     if not cfg.manual_path:
@@ -434,9 +731,7 @@ def cmd_validate(cfg: Config) -> None:
     run = create_run_dir(cfg.results_dir, command="validate", tag=cfg.run_tag)
     out_dir = run.path
 
-    manual = load_manual(cfg.manual_path, sheet=cfg.manual_sheet,
-                         tz_offset=cfg.manual_tz,
-                         date_semantics=cfg.manual_date_semantics)
+    manual = _load_manual(cfg)
     export_manual_issues(out_dir, manual)
     export_quality(out_dir, manual)
 
@@ -523,38 +818,171 @@ def cmd_validate(cfg: Config) -> None:
 
 
 # ============================== at ==============================
-def cmd_at(cfg: Config, chat_key: str, at_iso: str) -> None:
-    """Показывает, кто был в чате на указанный момент времени."""
-    snapshots = SnapshotStore(cfg.db_path)
+def cmd_at(cfg: Config, chat_keys: list[str], at_iso: str,
+           until_iso: str | None = None, source: str = "events") -> None:
+    """Показывает, кто был в чатах на указанный момент или за период.
+
+    Состав на момент по умолчанию восстанавливается из событий аудит-лога
+    (source="events") — точно на любой момент. Из истории запусков
+    (source="runs") видны и участники из групп и ручной таблицы, но только
+    на моменты, когда делались отчёты. Период (until_iso) — только из запусков."""
     try:
-        meta = snapshots.chat_at(chat_key, at_iso)
-        members = snapshots.members_at(chat_key, at_iso)
+        event_time(at_iso)
+    except ValueError:
+        raise SystemExit(f"Не удалось разобрать момент {at_iso!r}. Пример: "
+                         f"2026-03-01T00:00:00+00:00")
+    if source == "events" and not until_iso:
+        found = _chats_at_from_events(cfg, chat_keys, at_iso)
+        if found is None:
+            log.info("В базе нет событий аудит-лога — отвечаем по истории "
+                     "запусков.")
+            source = "runs"
+        else:
+            metas, members = found
+    if source == "runs" or until_iso:
+        snapshots = SnapshotStore(cfg.db_path)
+        try:
+            points = [(chat_key, at_iso) for chat_key in chat_keys]
+            metas = {key: meta for (key, _), meta in
+                     snapshots.chats_at_many(points).items()}
+            if until_iso:
+                versions = snapshots.members_between(chat_keys, at_iso, until_iso)
+            else:
+                members = {key: rows for (key, _), rows in
+                           snapshots.members_at_many(points).items()}
+        finally:
+            snapshots.close()
+        source = "runs"
 
+    for chat_key in chat_keys:
+        meta = metas[chat_key]
         print("\n" + "=" * 74)
-        print(f"СОСТАВ ЧАТА НА {dt_human(at_iso)}")
+        if until_iso:
+            print(f"СОСТАВ ЧАТА С {dt_human(at_iso)} ПО {dt_human(until_iso)}")
+        else:
+            print(f"СОСТАВ ЧАТА НА {dt_human(at_iso)}")
         print("=" * 74)
+        if len(chat_keys) > 1:
+            print(f"Чат:      {chat_key}")
         if meta:
             print(f"Название: {meta['name'] or '—'}")
             print(f"Тип:      {chat_type_ru(meta['type'])}")
             if meta.get("description"):
                 print(f"Описание: {meta['description']}")
+        elif source == "events":
+            print("Сведений о чате на эту дату нет: в аудит-логе до этого "
+                  "момента событий чата не было.")
         else:
             print("Сведений о чате на эту дату нет.")
-            print("Возможно, на тот момент чата ещё не существовало либо запуск "
-                  "с отчётами тогда не делался.")
-        print(f"\nУчастников: {len(members)}")
-        if members:
-            print()
-        for row in sorted(members, key=lambda item: (item["scope"],
-                                                     item["login"] or "")):
-            mark = "бот " if row["is_bot"] else "    "
-            print(f"  {mark}{(row['login'] or row['member_key']):42.42} "
-                  f"{role_ru(row['role']):12.12} "
-                  f"добавлен {dt_human(row['added_at'])}")
+            print("Возможно, на тот момент чата ещё не существовало либо "
+                  "запуск с отчётами тогда не делался.")
+        if until_iso:
+            _print_versions(versions[chat_key])
+        else:
+            _print_members_at(members[chat_key])
         print("=" * 74 + "\n")
+
+
+def _chats_at_from_events(cfg: Config, chat_keys: list[str], at_iso: str):
+    """Состав чатов на момент по событиям: ближайшая сохранённая точка
+    состояния и проигрывание событий после неё. None — событий в базе нет."""
+    store = EventStore(cfg.db_path)
+    projections = ProjectionStore(cfg.db_path)
+    identity_store = IdentityStore(cfg.db_path)
+    try:
+        if not store.count():
+            return None
+        chats = projections.chats_at(store, chat_keys, at_iso)
+        logins = identity_store.logins_for(
+            {member.uid for chat in chats.values() if chat
+             for member in chat.members.values() if member.uid})
+    finally:
+        identity_store.close()
+        projections.close()
+        store.close()
+
+    metas: dict[str, dict | None] = {}
+    members: dict[str, list[dict]] = {}
+    for key, chat in chats.items():
+        metas[key] = ({"name": chat.name, "type": chat.type,
+                       "description": chat.description} if chat else None)
+        members[key] = [
+            {"scope": "audit", "member_key": member_key(member),
+             "login": member.login or logins.get(member.uid),
+             "role": member.role, "is_bot": member.is_bot,
+             "added_at": member.added_at}
+            for member in (chat.members.values() if chat else ())]
+    return metas, members
+
+
+def _print_members_at(members: list[dict]) -> None:
+    print(f"\nУчастников: {len(members)}")
+    if members:
+        print()
+    for row in sorted(members, key=lambda item: (item["scope"],
+                                                 item["login"] or "")):
+        mark = "бот " if row["is_bot"] else "    "
+        print(f"  {mark}{(row['login'] or row['member_key']):42.42} "
+              f"{role_ru(row['role']):12.12} "
+              f"добавлен {dt_human(row['added_at'])}")
+
+
+def _print_versions(versions: list[dict]) -> None:
+    people = {row["member_key"] for row in versions}
+    print(f"\nУчастников за период: {len(people)}")
+    if versions:
+        print()
+    for row in versions:
+        mark = "бот " if row["is_bot"] else "    "
+        print(f"  {mark}{(row['login'] or row['member_key']):34.34} "
+              f"{role_ru(row['role']):12.12} "
+              f"{dt_human(row['valid_from'])} — {dt_human(row['valid_to'])}")
+
+
+def cmd_timeline(cfg: Config, member: str) -> None:
+    """Показывает, в каких чатах и когда состоял сотрудник."""
+    snapshots = SnapshotStore(cfg.db_path)
+    try:
+        keys = _member_keys(cfg, snapshots, member)
+        rows = snapshots.member_timeline(keys)
     finally:
         snapshots.close()
 
+    print("\n" + "=" * 74)
+    print(f"УЧАСТИЕ В ЧАТАХ: {member}")
+    print("=" * 74)
+    if not rows:
+        print("В накопленной истории этот сотрудник не встречается.")
+    chats = {row["chat_key"] for row in rows}
+    if rows:
+        print(f"Чатов: {len(chats)}, записей истории: {len(rows)}\n")
+    for row in rows:
+        title = row["chat_name"] or row["chat_key"]
+        print(f"  {title:32.32} {chat_type_short_ru(row['chat_type']):10.10} "
+              f"{role_ru(row['role']):12.12} "
+              f"{dt_human(row['valid_from'])} — {dt_human(row['valid_to'])}")
+    print("=" * 74 + "\n")
+
+
+def _member_keys(cfg: Config, snapshots: SnapshotStore, member: str) -> list[str]:
+    """Ключи истории, под которыми мог быть записан сотрудник: по номеру
+    и по логину. Связку логина с номером берём из самой истории и из кэша
+    идентичностей."""
+    member = member.strip()
+    if "::" in member:
+        return [member]
+    if member.isdigit():
+        return [f"uid::{member}"]
+    keys = [f"login::{member.casefold()}", *snapshots.member_keys_for(member)]
+    identity_store = IdentityStore(cfg.db_path)
+    try:
+        uid = identity_store.uid_for(member)
+    finally:
+        identity_store.close()
+    if uid:
+        keys.append(f"uid::{uid}")
+    return keys
+
 
 # ============================== selftest ==============================
 # Все данные ниже выдуманы: номера сотрудников, логины, имена и названия
@@ -669,6 +1097,35 @@ class _StubResolver:
         self.learned[str(uid)] = login
 
 
+class _StubAuditLog:
+    """Заглушка аудит-лога: отдаёт события из списка по окну времени."""
+
+    def __init__(self, events: list[dict], fail_on: str | None = None):
+        self.events = events
+        self.fail_on = fail_on
+        self.calls: list[str] = []
+
+    def iter_events(self, org_id, started_at, ended_at, types):
+        self.calls.append(started_at)
+        if self.fail_on and started_at.startswith(self.fail_on):
+            raise RuntimeError("сбой сети для проверки")
+        for item in self.events:
+            if started_at <= item["event"]["occurred_at"] < ended_at:
+                yield item
+
+
+class _StubApi360:
+    """Заглушка api360: составы групп из словаря, считает запросы."""
+
+    def __init__(self, groups: dict[str, dict]):
+        self.groups = groups
+        self.calls: list[str] = []
+
+    def group_members(self, org_id, group_id):
+        self.calls.append(str(group_id))
+        return self.groups.get(str(group_id), {})
+
+
 def _make_manual_result(chat_name: str, chat_type: str,
                         rows: list[ManualRow]) -> ManualImportResult:
     result = ManualImportResult(source_file="<для проверки>")
@@ -1009,13 +1466,822 @@ def cmd_selftest() -> None:
         print("[ок] лишние старые запуски удаляются")
 
         chat.members[victim_key] = removed_member
+
+        # 24. сохранённое состояние чатов докатывается только новыми событиями
+        replay_path = os.path.join(tmp, "replay.sqlite3")
+        replay_store = EventStore(replay_path)
+        replay_store.upsert_events(SAMPLE_EVENTS[:2])
+        projections = ProjectionStore(replay_path)
+        projections.refresh(replay_store)
+        replay_store.upsert_events(SAMPLE_EVENTS[2:3])
+        incremental = projections.refresh(replay_store)
+        assert len(incremental[DEMO_CHAT_KEY].members) == 2
+        # событие задним числом: раньше уже учтённых
+        late = copy.deepcopy(SAMPLE_EVENTS[3])
+        late["event"]["idempotency_id"] = "ev-000"
+        late["event"]["occurred_at"] = "2026-02-16T05:00:00.000000+00:00"
+        replay_store.upsert_events([late, SAMPLE_EVENTS[3]])
+        rebuilt = projections.refresh(replay_store)
+        reference = build_projection(replay_store.iter_all_events_ordered())
+        assert ([chat_to_json(item) for item in rebuilt.values()] ==
+                [chat_to_json(item) for item in reference.values()]), \
+            "сохранённое состояние должно совпадать с полным проигрыванием"
+        projections.close()
+        replay_store.close()
+        print("[ок] состояние чатов докатывается новыми событиями, "
+              "событие задним числом вызывает пересборку")
+
+        # 25. загрузка по отрезкам продолжается после сбоя с недоделанных
+        sliced_store = EventStore(os.path.join(tmp, "sliced.sqlite3"))
+        stub_audit = _StubAuditLog(SAMPLE_EVENTS, fail_on="2026-02-16T05:")
+        collector = SlicedCollector(stub_audit, sliced_store, 1,
+                                    workers=3, slice_hours=1)
+        window = (datetime(2026, 2, 16, 3, tzinfo=timezone.utc),
+                  datetime(2026, 2, 16, 8, tzinfo=timezone.utc))
+        try:
+            collector.collect(*window, CHAT_EVENT_TYPES)
+            raise AssertionError("ожидали сбой на одном из отрезков")
+        except RuntimeError:
+            pass
+        assert collector.pending_plan(), "план загрузки должен сохраниться"
+        done_before = {key.split(":", 1)[1].split("|")[0] for key in
+                       sliced_store.keys_with_prefix(SLICE_PREFIX)}
+        stub_audit.fail_on = None
+        stub_audit.calls.clear()
+        collector.resume()
+        assert sliced_store.count() == 4, sliced_store.count()
+        assert len(stub_audit.calls) == 5 - len(done_before), stub_audit.calls
+        assert not done_before & set(stub_audit.calls), \
+            f"готовые отрезки повторно не загружаются: {stub_audit.calls}"
+        assert collector.pending_plan() is None
+        sliced_store.close()
+        print("[ок] история загружается по отрезкам параллельно, после сбоя "
+              "докачиваются только недоделанные")
+
+        # 26. разворот групп: один запрос на группу, кольца не мешают,
+        # повторный запуск берёт составы из кэша
+        stub_api360 = _StubApi360({
+            "g1": {"users": [{"id": "101"}], "groups": [{"id": "g2"}]},
+            "g2": {"users": [{"id": "102"}], "groups": [{"id": "g3"}]},
+            "g3": {"users": [{"id": "103"}], "groups": [{"id": "g2"}]},
+            "g4": {"users": [{"id": "104"}], "groups": [{"id": "g3"}]},
+        })
+        expand_chats = {
+            "a": ChatState(chat_id_raw="a", chat_key="a", groups={"g1": {}}),
+            "b": ChatState(chat_id_raw="b", chat_key="b",
+                           groups={"g4": {}, "g2": {}}),
+        }
+        directory_store = DirectoryStore(os.path.join(tmp, "directory.sqlite3"))
+        planner = DirectoryResolver(None, stub_api360, 1,
+                                    directory_store=directory_store,
+                                    expand_workers=3)
+        planner.plan_expansion(expand_chats)
+        assert sorted(stub_api360.calls) == ["g1", "g2", "g3", "g4"], \
+            stub_api360.calls
+        assert planner.expand_group("g1") == ["101", "102", "103"], \
+            planner.expand_group("g1")
+        assert sorted(planner.expand_group("g3")) == ["102", "103"]
+        assert sorted(planner.expand_group("g4")) == ["102", "103", "104"]
+        stub_api360.calls.clear()
+        again = DirectoryResolver(None, stub_api360, 1,
+                                  directory_store=directory_store)
+        again.plan_expansion(expand_chats)
+        assert not stub_api360.calls, stub_api360.calls
+        assert again.expand_group("g1") == planner.expand_group("g1")
+        other_org = DirectoryResolver(None, stub_api360, 2,
+                                      directory_store=directory_store)
+        other_org.plan_expansion(expand_chats)
+        assert sorted(stub_api360.calls) == ["g1", "g2", "g3", "g4"], \
+            "кэш составов другой организации не используется"
+        directory_store.close()
+        print("[ок] группы разворачиваются по одному запросу на группу, "
+              "составы берутся из кэша своей организации")
+
+        # 27. запоминание состава пачкой даёт те же изменения, что построчное
+        def _bulk_chats(renamed: bool) -> dict:
+            result = {}
+            for index in range(3):
+                key = f"bulk{index}"
+                result[key] = ChatState(
+                    chat_id_raw=key, chat_key=key, type="group",
+                    name=f"чат {index}" + (" (новое имя)" if renamed and index == 1
+                                           else ""))
+                for uid in range(4):
+                    result[key].members[str(uid)] = MemberState(
+                        uid=str(uid), role="admin" if uid == 0 else "member",
+                        source="audit_projection")
+            return result
+
+        before, after = _bulk_chats(False), _bulk_chats(True)
+        del after["bulk0"].members["3"]
+        after["bulk1"].members["2"].role = "admin"
+        after["bulk2"].members["9"] = MemberState(uid="9", role="member")
+        after["bulk3"] = ChatState(chat_id_raw="bulk3", chat_key="bulk3",
+                                   type="channel", name="новый канал")
+        diffs, states = {}, {}
+        for bulk in (False, True):
+            scd = SnapshotStore(os.path.join(tmp, f"scd_{bulk}.sqlite3"))
+            scd.apply_run(before, include_private=False, bulk=bulk)
+            diffs[bulk] = scd.apply_run(after, include_private=False, bulk=bulk)
+            states[bulk] = [tuple(row) for row in scd.conn.execute(
+                "SELECT chat_key, member_key, role, valid_to IS NULL "
+                "FROM membership_scd ORDER BY chat_key, member_key, valid_to")]
+            states[bulk] += [tuple(row) for row in scd.conn.execute(
+                "SELECT chat_key, name, valid_to IS NULL FROM chat_scd "
+                "ORDER BY chat_key, valid_to")]
+            scd.close()
+        for attr in ("added", "removed", "role_changed"):
+            assert sorted(getattr(diffs[True], attr)) == \
+                sorted(getattr(diffs[False], attr)), attr
+        assert diffs[True].counts()["added"] == 1
+        assert diffs[True].counts()["removed"] == 1
+        assert diffs[True].counts()["role_changed"] == 1
+        assert states[True] == states[False]
+        print("[ок] состав запоминается пачкой с тем же результатом, "
+              "что и по одной записи")
+
+        # 28. составы многих чатов одним запросом, период и история сотрудника
+        scd = SnapshotStore(os.path.join(tmp, "scd_True.sqlite3"))
+        now_iso = datetime.now(timezone.utc).isoformat()
+        many = scd.members_at_many([(key, now_iso) for key in after])
+        assert [len(many[(key, now_iso)]) for key in after] == [3, 4, 5, 0]
+        assert scd.chats_at_many([("bulk3", now_iso)])[("bulk3", now_iso)]
+        assert scd.chat_at("bulk0", "2000-01-01T00:00:00+00:00") is None
+        period = scd.members_between(["bulk1"], "2000-01-01T00:00:00+00:00",
+                                     now_iso)
+        assert len(period["bulk1"]) == 5, period["bulk1"]
+        timeline = scd.member_timeline(["uid::2"])
+        assert len({row["chat_key"] for row in timeline}) == 3
+        assert [row["role"] for row in timeline
+                if row["chat_key"] == "bulk1"] == ["member", "admin"]
+        scd.close()
+        print("[ок] составы на дату и за период читаются пачкой, "
+              "история сотрудника собирается по всем чатам")
+
+        # 29. компактная база событий: то же состояние чатов без разбора JSON,
+        # перевод старой базы сохраняет события целиком
+        def _compact_event(idem: str, etype: str, meta: dict) -> dict:
+            return {"user_login": DEMO_ADMIN_LOGIN,
+                    "event": {"uid": int(DEMO_ADMIN_UID), "type": etype,
+                              "occurred_at": f"2026-02-17T05:00:{idem[-2:]}+00:00",
+                              "idempotency_id": idem,
+                              "meta": {"chat_id": DEMO_CHAT_ID, **meta}}}
+
+        mixed_events = SAMPLE_EVENTS + [
+            _compact_event("cx-01", "messenger_chat.info_changed",
+                           {"chat_info": {"name": "новое имя", "is_thread": True}}),
+            _compact_event("cx-02", "messenger_chat.member.role_changed",
+                           {"object_uid": DEMO_ADMIN_UID,
+                            "member_info": {"role": "member"}}),
+            _compact_event("cx-03", "messenger_chat.group_added",
+                           {"object_info": {"id": 55}}),
+            _compact_event("cx-04", "messenger_chat.department_added",
+                           {"department_id": 7}),
+            _compact_event("cx-05", "messenger_chat.department_removed",
+                           {"department_id": "7"}),
+        ]
+        states = {}
+        for storage in (STORAGE_JSON, STORAGE_COMPACT):
+            fmt_store = EventStore(os.path.join(tmp, f"events_{storage}.sqlite3"),
+                                   storage=storage)
+            assert fmt_store.storage == storage
+            fmt_store.upsert_events(mixed_events)
+            states[storage] = {key: chat_to_json(value) for key, value in
+                               build_projection(
+                                   fmt_store.iter_all_events_ordered()).items()}
+            fmt_store.close()
+        assert states[STORAGE_JSON] == states[STORAGE_COMPACT]
+        legacy = EventStore(os.path.join(tmp, f"events_{STORAGE_JSON}.sqlite3"))
+        assert legacy.storage == STORAGE_JSON, "старая база сама не меняет формат"
+        legacy_count = legacy.count()
+        assert legacy.migrate_to_compact() == legacy_count
+        assert legacy.storage == STORAGE_COMPACT and legacy.count() == legacy_count
+        migrated = {key: chat_to_json(value) for key, value in
+                    build_projection(legacy.iter_all_events_ordered()).items()}
+        assert migrated == states[STORAGE_JSON]
+        assert legacy.get_payload("cx-03") == mixed_events[-3]
+        legacy.close()
+        print("[ок] компактная база событий восстанавливает то же состояние, "
+              "перевод старой базы сохраняет события целиком")
+
+        # 30. потоковые отчёты: Excel пишется построчно
+        stream_dir = os.path.join(tmp, "stream")
+        export_members(stream_dir, chats, False, xlsx=True)
+        from openpyxl import load_workbook
+        book = load_workbook(os.path.join(stream_dir, "members.xlsx"),
+                             read_only=True)
+        xlsx_rows = sum(1 for sheet in book.worksheets for _ in sheet.iter_rows())
+        book.close()
+        members_csv = os.path.join(stream_dir, "members.csv")
+        with open(members_csv, "r", encoding="utf-8-sig", newline="") as handle:
+            csv_rows = sum(1 for _ in handle)
+        assert xlsx_rows == csv_rows, (xlsx_rows, csv_rows)
+        print("[ок] отчёты пишутся построчно, в том числе в Excel")
+
+        # 31. замеры этапов: время, HTTP-счётчики и cProfile в папку запуска
+        import httpx
+        from http_base import BaseClient
+        replies = iter([httpx.Response(429, headers={"Retry-After": "0"}),
+                        httpx.Response(200, json={"ok": True})])
+        probe = BaseClient("https://example.invalid", "token")
+        probe._client = httpx.Client(
+            transport=httpx.MockTransport(lambda request: next(replies)))
+        timer = StageTimer(os.path.join(tmp, PROFILE_DIR), http_stats=HTTP_STATS)
+        with timer.stage("probe"):
+            assert probe.get("/ping") == {"ok": True}
+        probe.close()
+        perf = timer.report()
+        assert perf["stages"][0]["http"]["requests"] == 2
+        assert perf["http"]["retries"] == perf["http"]["throttled"] == 1
+        assert perf["http"]["bytes"] > 0
+        assert os.path.exists(os.path.join(tmp, PROFILE_DIR, "01_probe.prof"))
+        print("[ок] этапы прогона замеряются: время, память, запросы и "
+              "повторы, cProfile по желанию")
+
+        # 32. замер скорости на синтетике проходит все шаги конвейера
+        from bench_pipeline import run_benchmark
+        bench = run_benchmark(users=200, chats=30, events=1_500, groups=10,
+                              departments=5, manual_share=0.5, workdir=tmp)
+        assert [stage["stage"] for stage in bench["stages"]] == [
+            "generate", "store", "replay", "expand", "manual", "snapshot", "export"]
+        assert all(stage["items"] > 0 for stage in bench["stages"]), bench["stages"]
+        print("[ок] замер скорости на синтетических данных проходит весь конвейер")
+
+        # 33. состав на любой момент: точка состояния + короткий хвост событий
+        from bench_pipeline import SyntheticOrg, synthetic_events
+        org = SyntheticOrg(50, 3, 2)
+        history, _ = synthetic_events(org, 12, 900)
+        points_path = os.path.join(tmp, "points.sqlite3")
+        points_store = EventStore(points_path)
+        points_store.upsert_events(history[:500])
+        points = ProjectionStore(points_path, checkpoint_every=64)
+        points.refresh(points_store)
+        points_store.upsert_events(history[500:])
+        points.refresh(points_store)
+        assert points.checkpoint_count() == 900 // 64
+        for index in (0, 63, 64, 65, 300, 517, 899):
+            moment = history[index]["event"]["occurred_at"]
+            expected = build_projection(history[:index + 1])
+            keys = sorted(expected) + ["нет-такого-чата"]
+            exact = points.chats_at(points_store, keys, moment)
+            assert exact.pop("нет-такого-чата") is None
+            assert ({key: chat_to_json(chat) for key, chat in exact.items()} ==
+                    {key: chat_to_json(expected[key]) for key in exact}), index
+        assert not any(points.chats_at(points_store, keys,
+                                       "2025-12-31T23:00:00Z").values())
+        points.close()
+        points_store.close()
+        print("[ок] состав на любой момент восстанавливается по точкам "
+              "состояния и совпадает с полным проигрыванием")
+
+        # 34. справочник пишется в кэш пачкой, неизменившиеся записи не трогаются
+        sync_path = os.path.join(tmp, "sync.sqlite3")
+        for attempt in range(2):
+            sync_store = IdentityStore(sync_path)
+            for index in range(300):
+                sync_store.stage_user(str(index), login=f"user{index}@example.org",
+                                      source="directory")
+                sync_store.stage_alias(f"user{index}@example.org", str(index),
+                                       "directory")
+            sync_store.stage_user("7", full_name="Седьмой", source="audit_log")
+            written = sync_store.flush()
+            sync_store.commit()
+            assert written == ((301, 300) if attempt == 0 else (2, 0)), written
+            assert sync_store.logins_for(["7"]) == {"7": "user7@example.org"}
+            sync_store.close()
+        sync_resolver = DirectoryResolver(None, None, 1)
+        for uid in ("1", "2", "1"):
+            sync_resolver._register(UserInfo(uid=uid, department_id="d"), [])
+        assert sync_resolver.expand_department("d") == ["1", "2"]
+        print("[ок] сотрудники из справочника пишутся в кэш пачкой, "
+              "повторная запись без изменений пропускается")
+
+        # 35. копия справочника: в пределах срока сервис не спрашивается,
+        # после срока загружается заново с записью отличий
+        class _CountingDirectory:
+            def __init__(self):
+                self.users = [{"id": 1, "nickname": "a"}, {"id": 2, "nickname": "b"}]
+                self.calls = 0
+                self.fail = False
+
+            def iter_users(self, org_id, limit=100):
+                self.calls += 1
+                if self.fail:
+                    raise HttpError("GET users -> 503")
+                yield from self.users
+
+            def close(self):
+                pass
+
+        counting = _CountingDirectory()
+        snap_store = DirectoryStore(os.path.join(tmp, "snap.sqlite3"))
+        cached_dir = SnapshotDirectory(counting, snap_store, ttl_hours=1)
+        assert len(list(cached_dir.iter_users(1))) == 2
+        assert len(list(cached_dir.iter_users(1))) == 2 and counting.calls == 1
+        counting.users = [{"id": 1, "nickname": "a2"}, {"id": 3, "nickname": "c"}]
+        refreshed = SnapshotDirectory(counting, snap_store, ttl_hours=1, refresh=True)
+        assert [user["id"] for user in refreshed.iter_users(1)] == [1, 3]
+        changes = {(item["item_id"], item["change"])
+                   for item in snap_store.recent_changes(1, "users")}
+        assert changes == {("1", "changed"), ("3", "added"), ("2", "removed")}, changes
+        counting.fail = True
+        expired = SnapshotDirectory(counting, snap_store, ttl_hours=0)
+        assert [user["nickname"] for user in expired.iter_users(1)] == ["a2", "c"]
+        # пустой ответ не затирает копию; другая организация — своя копия
+        counting.fail, counting.users = False, []
+        assert [user["id"] for user in expired.iter_users(1)] == [1, 3]
+        assert snap_store.snapshot_info(1, "users")["items"] == 2
+        assert len(snap_store.recent_changes(1, "users")) == 3
+        assert list(expired.iter_users(2)) == []
+        assert snap_store.snapshot_info(2, "users")["items"] == 0
+        forced = SnapshotDirectory(counting, snap_store, ttl_hours=0,
+                                   allow_empty=True)
+        assert list(forced.iter_users(1)) == []
+        assert snap_store.snapshot_info(1, "users")["items"] == 0
+        snap_store.close()
+        print("[ок] справочник берётся из локальной копии, пока она свежая; "
+              "при обновлении записываются изменения")
+
+        # 36. пары uid -> логин копятся при записи событий; повторы не
+        # считаются, старая база заполняет таблицу один раз при открытии
+        obs_path = os.path.join(tmp, "observations.sqlite3")
+        obs_store = EventStore(obs_path)
+        private = copy.deepcopy(SAMPLE_EVENTS[0])
+        private["event"]["idempotency_id"] = "ev-private"
+        private["event"]["meta"]["chat_info"].update(type="private",
+                                                     partner_uid=DEMO_MEMBER_UID)
+        obs_store.upsert_events(SAMPLE_EVENTS + [private])
+        obs_store.upsert_events(SAMPLE_EVENTS)
+        counted = list(obs_store.identity_observations())
+        assert counted == [(DEMO_ADMIN_UID, DEMO_ADMIN_LOGIN, 5)], counted
+        assert harvest_partner_uids(obs_store) == {DEMO_ADMIN_UID: DEMO_ADMIN_LOGIN}
+        obs_store.conn.execute("DELETE FROM uid_login_observations")
+        obs_store.conn.execute("DELETE FROM checkpoint")
+        obs_store.conn.commit()
+        obs_store.close()
+        obs_store = EventStore(obs_path)
+        assert list(obs_store.identity_observations()) == counted
+        assert harvest_partner_uids(obs_store) == {DEMO_ADMIN_UID: DEMO_ADMIN_LOGIN}
+        obs_store.close()
+        print("[ок] логины из аудит-лога читаются из накопленной таблицы пар, "
+              "без прохода по всем событиям")
+
+        # 37. неизменившаяся таблица второй раз не разбирается
+        import manual_cache
+        cache_db = os.path.join(tmp, "manual_cache.sqlite3")
+        parsed = load_manual_cached(manual_path, db_path=cache_db, tz_offset="+03:00")
+        original_loader = manual_cache.load_manual
+
+        def _must_not_parse(*args, **kwargs):
+            raise AssertionError("таблица разобрана повторно")
+
+        manual_cache.load_manual = _must_not_parse
+        try:
+            cached = load_manual_cached(manual_path, db_path=cache_db,
+                                        tz_offset="+03:00")
+        finally:
+            manual_cache.load_manual = original_loader
+        assert cached.chats == parsed.chats
+        assert cached.quality_issues == parsed.quality_issues
+        assert cached.conflicts == parsed.conflicts
+        assert cached.errors == parsed.errors and cached.rows_ok == parsed.rows_ok
+        other_tz = load_manual_cached(manual_path, db_path=cache_db,
+                                      tz_offset="+00:00")
+        first_chat = next(iter(parsed.chats))
+        assert (other_tz.chats[first_chat].created_at
+                != parsed.chats[first_chat].created_at)
+        print("[ок] разобранная ручная таблица берётся из базы, пока файл "
+              "и настройки разбора те же")
+
+        # 38. watch: новые события докатываются в память, изменения уходят
+        # в JSONL и на локальный адрес, версии состава пишутся сразу
+        import http.server
+        import threading
+
+        received: list[dict] = []
+
+        class _Hook(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                received.extend(json.loads(body)["changes"])
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        hook = http.server.HTTPServer(("127.0.0.1", 0), _Hook)
+        threading.Thread(target=hook.serve_forever, daemon=True).start()
+
+        def _event(base: int, idem: str, at: str, **changes) -> dict:
+            event = copy.deepcopy(SAMPLE_EVENTS[base])
+            event["event"].update(idempotency_id=idem, occurred_at=at,
+                                  type=changes.pop("type", event["event"]["type"]))
+            event["event"]["meta"].update(changes)
+            return event
+
+        watch_db = os.path.join(tmp, "watch.sqlite3")
+        watch_store = EventStore(watch_db)
+        watch_store.upsert_events(SAMPLE_EVENTS)
+        watch_projection = ProjectionStore(watch_db)
+        watch_snapshots = SnapshotStore(watch_db)
+        watch_ids = IdentityStore(watch_db)
+        watch_ids.upsert_user(DEMO_MEMBER_UID, login="sidorova@example.org",
+                              source="audit_log")
+        watch_ids.commit()
+        watch_snapshots.apply_run(watch_projection.refresh(watch_store), False)
+        jsonl_path = os.path.join(tmp, "watch", "changes.jsonl")
+        watcher = ChangeWatcher(
+            watch_store, watch_projection, watch_snapshots, watch_ids,
+            [JsonlSink(jsonl_path),
+             WebhookSink(f"http://127.0.0.1:{hook.server_port}/hook")])
+        watcher.start()
+        assert watcher.poll() == []
+        watch_store.upsert_events([
+            _event(3, "ev-w1", "2026-02-17T10:00:00.000000+00:00",
+                   object_uid="1130000000000999",
+                   member_info={"role": "member", "is_robot": True}),
+            _event(2, "ev-w2", "2026-02-17T10:01:00.000000+00:00",
+                   type="messenger_chat.member.role_changed",
+                   member_info={"role": "admin"}),
+            _event(2, "ev-w3", "2026-02-17T10:02:00.000000+00:00",
+                   type="messenger_chat.member.removed"),
+        ])
+        kinds = [(change.change, change.uid) for change in watcher.poll()]
+        assert kinds == [("bot_added", "1130000000000999"),
+                         ("role_changed", DEMO_MEMBER_UID),
+                         ("member_removed", DEMO_MEMBER_UID)], kinds
+        with open(jsonl_path, encoding="utf-8") as handle:
+            lines = [json.loads(line) for line in handle]
+        assert [line["change"] for line in lines] == [kind for kind, _ in kinds]
+        assert lines[1]["login"] == "sidorova@example.org"
+        assert lines[1]["previous_role"] == "member" and lines[1]["role"] == "admin"
+        assert [item["change"] for item in received] == [kind for kind, _ in kinds]
+        open_member = watch_snapshots.conn.execute(
+            "SELECT COUNT(*) FROM membership_scd WHERE member_key=? "
+            "AND valid_to IS NULL", (f"uid::{DEMO_MEMBER_UID}",)).fetchone()[0]
+        assert open_member == 0
+        members = {row["member_key"] for row in watch_snapshots.members_at(
+            normalize_chat_id(DEMO_CHAT_ID), "2026-02-17T10:00:30.000000+00:00")}
+        assert "uid::1130000000000999" in members, members
+
+        # состояние сдвинул другой запуск — изменения находятся сверкой
+        watch_store.upsert_events([
+            _event(2, "ev-w4", "2026-02-17T11:00:00.000000+00:00")])
+        other = ProjectionStore(watch_db)
+        other.refresh(watch_store)
+        other.close()
+        kinds = [(change.change, change.occurred_at) for change in watcher.poll()]
+        assert kinds == [("member_added", None)], kinds
+        watcher.close()
+
+        # адрес не отвечает при остановке — изменения ждут следующего запуска
+        spool = os.path.join(tmp, "watch", "webhook_pending.jsonl")
+        offline = WebhookSink("http://127.0.0.1:1/hook", timeout=1, spool=spool)
+        offline.emit([MembershipChange("member_added", "k", "2026-02-17", uid="1")])
+        offline.close()
+        assert os.path.exists(spool)
+        received.clear()
+        online = WebhookSink(f"http://127.0.0.1:{hook.server_port}/hook",
+                             spool=spool)
+        online.emit([])
+        online.close()
+        assert [item["uid"] for item in received] == ["1"], received
+        assert not os.path.exists(spool)
+        hook.shutdown()
+        for closable in (watch_ids, watch_snapshots, watch_projection, watch_store):
+            closable.close()
+        print("[ок] watch докатывает новые события и сразу сообщает об "
+              "изменениях состава в файл и на адрес")
+
+        # 39. compare соединяет файлы сравнения запусков по ключу; файл,
+        # записанный при выгрузке, и файл, собранный из CSV, дают одно и то же
+        index_dir = os.path.join(tmp, "index_runs")
+        state = build_projection(SAMPLE_EVENTS)
+        index_runs = []
+        for tag in ("i1", "i2"):
+            index_run = create_run_dir(index_dir, command="analyze", tag=tag)
+            run_index = RunIndex.create(index_run.path)
+            export_chats(index_run.path, state, False, index=run_index)
+            export_members(index_run.path, state, False, index=run_index)
+            run_index.finish()
+            run_index.close()
+            write_manifest(index_run, status="ok", flags=TEST_FLAGS)
+            index_runs.append(index_run)
+            if tag == "i2":
+                break
+            state = copy.deepcopy(state)
+            only_chat = next(iter(state.values()))
+            only_chat.name = "переименованный чат"
+            only_chat.members.pop(DEMO_BOT_UID)
+            only_chat.members[DEMO_MEMBER_UID].role = "admin"
+            only_chat.members["1130000000000777"] = MemberState(
+                uid="1130000000000777", role="member")
+        indexed = compare_runs(*index_runs)
+        for index_run in index_runs:
+            os.remove(os.path.join(index_run.path, RUN_INDEX))
+        rebuilt = compare_runs(*index_runs)
+        assert indexed.counts() == rebuilt.counts() == {
+            "chats_added": 0, "chats_removed": 0, "chats_changed": 2,
+            "members_added": 1, "members_removed": 1,
+            "members_changed": 1}, indexed.counts()
+        assert indexed.members_changed == rebuilt.members_changed
+        assert indexed.chats_changed == rebuilt.chats_changed
+        assert indexed.members_added == rebuilt.members_added
+        assert indexed.members_removed[0]["member_key"] == f"uid::{DEMO_BOT_UID}"
+        # пробелы по краям значений — не изменение
+        padded_csv = os.path.join(index_runs[1].path, "members.csv")
+        with open(padded_csv, "r", encoding="utf-8-sig", newline="") as handle:
+            padded = list(csv.reader(handle, delimiter=";"))
+        uid_column, role_column = padded[0].index("uid"), padded[0].index("role")
+        for row in padded[1:]:
+            row[uid_column] = f" {row[uid_column]} "
+            row[role_column] = f"{row[role_column]}  "
+        with open(padded_csv, "w", encoding="utf-8-sig", newline="") as handle:
+            csv.writer(handle, delimiter=";").writerows(padded)
+        os.remove(os.path.join(index_runs[1].path, RUN_INDEX))
+        padded_result = compare_runs(*index_runs)
+        assert padded_result.counts() == indexed.counts(), padded_result.counts()
+        assert padded_result.members_changed == indexed.members_changed
+        print("[ок] запуски сравниваются соединением по ключу в SQLite; "
+              "старые запуски готовятся к этому из CSV")
+
+        # 40. служба запросов: постраничные ответы по индексам, кэш ответов
+        # сбрасывается новым запуском, в базу через неё не записать
+        import sqlite3
+        from urllib.parse import quote
+
+        import httpx
+
+        serve_db = os.path.join(tmp, "serve.sqlite3")
+        serve_store = EventStore(serve_db)
+        serve_store.upsert_events(SAMPLE_EVENTS)
+        serve_ids = IdentityStore(serve_db)
+        serve_ids.upsert_user(DEMO_MEMBER_UID, login="sidorova@example.org",
+                              full_name="Сидорова Анна", source="audit_log")
+        serve_ids.upsert_alias(DEMO_ADMIN_LOGIN, DEMO_ADMIN_UID, "audit_log")
+        serve_ids.commit()
+        serve_snapshots = SnapshotStore(serve_db)
+        serve_chats = build_projection(serve_store.iter_all_events_ordered())
+        serve_snapshots.apply_run(serve_chats, False)
+        api = QueryApi(serve_db, pool_size=2)
+
+        def _get(target: str) -> dict:
+            status, body = api.get(target)
+            assert status == 200, (target, status, body)
+            return json.loads(body)
+
+        members_url = f"/chats/{quote(DEMO_CHAT_ID, safe='')}/members"
+        page = _get(members_url + "?limit=2")
+        assert page["chat_key"] == DEMO_CHAT_KEY
+        assert page["chat"]["name"] == "рабочий чат"
+        items = page["items"]
+        assert len(items) == 2 and page["next"]
+        rest = _get(f"{members_url}?limit=2&cursor={page['next']}")
+        items += rest["items"]
+        assert rest["next"] is None
+        by_key = {item["member_key"]: item for item in items}
+        assert len(by_key) == 3, by_key
+        assert by_key[f"uid::{DEMO_MEMBER_UID}"]["login"] == "sidorova@example.org"
+        assert by_key[f"uid::{DEMO_MEMBER_UID}"]["full_name"] == "Сидорова Анна"
+        bots = _get("/bots")["items"]
+        assert [(row["member_key"], row["chat_name"]) for row in bots] == [
+            (f"uid::{DEMO_BOT_UID}", "рабочий чат")], bots
+        mine = _get(f"/members/{DEMO_ADMIN_LOGIN}/chats")
+        assert f"uid::{DEMO_ADMIN_UID}" in mine["member_keys"]
+        assert [row["chat_key"] for row in mine["items"]] == [DEMO_CHAT_KEY]
+
+        _get(members_url)
+        hits = api.cache.stats()["hits"]
+        _get(members_url)
+        assert api.cache.stats()["hits"] == hits + 1
+        serve_chats[DEMO_CHAT_KEY].members.pop(DEMO_MEMBER_UID)
+        serve_snapshots.apply_run(serve_chats, False)
+        assert len(_get(members_url)["items"]) == 2, "кэш не сбросился"
+        assert api.cache.stats()["resets"] == 1
+        history = _get(f"/members/{DEMO_MEMBER_UID}/history")["items"]
+        assert len(history) == 1 and history[0]["valid_to"], history
+
+        for target, status in (("/bots?limit=0", 400), ("/bots?limit=x", 400),
+                               ("/bots?cursor=!!", 400), ("/nowhere", 404),
+                               (f"{members_url}?at=вчера", 400)):
+            assert api.get(target)[0] == status, target
+        conn = api.pool.acquire()
+        try:
+            conn.execute("DELETE FROM membership_scd")
+            raise AssertionError("через службу запросов удалось записать в базу")
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            api.pool.release(conn)
+        import query_api
+        for name in dir(query_api):
+            if not name.startswith("SQL_") or name == "SQL_LAST_RUN":
+                continue
+            sql = getattr(query_api, name).format(keys="?")
+            plan = serve_snapshots.conn.execute(
+                "EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?")).fetchall()
+            assert not any(row[3].startswith("SCAN") for row in plan), (name, plan)
+
+        server = QueryServer(api, "127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        resp = httpx.get(f"http://127.0.0.1:{server.server_port}/status")
+        assert resp.status_code == 200
+        assert resp.json()["last_run"]["members_total"] == 2, resp.json()
+        server.shutdown()
+        server.server_close()
+        api.close()
+        # база без таблиц (до первого запуска): ответ 500, а не обрыв
+        empty_db = os.path.join(tmp, "serve_empty.sqlite3")
+        sqlite3.connect(empty_db).close()
+        empty_api = QueryApi(empty_db, pool_size=1)
+        status, body = empty_api.get("/bots")
+        assert status == 500 and "error" in json.loads(body), (status, body)
+        assert empty_api.get("/status")[0] == 500
+        empty_api.close()
+        for closable in (serve_snapshots, serve_ids, serve_store):
+            closable.close()
+        print("[ок] служба запросов отвечает постранично по индексам; кэш "
+              "ответов сбрасывается новым запуском, запись в базу невозможна")
+
+        # 41. события по месяцам: тот же порядок проигрывания, что и в одном
+        # файле; старые месяцы сжимаются и продолжают читаться
+        spread = [*SAMPLE_EVENTS,
+                  _event(2, "ev-m1", "2026-03-02T09:00:00.000000+00:00",
+                         type="messenger_chat.member.role_changed",
+                         member_info={"role": "admin"}),
+                  _event(3, "ev-m2", "2026-04-05T09:00:00.000000+00:00",
+                         type="messenger_chat.member.removed"),
+                  _event(3, "ev-m3", "2026-04-05T09:00:00.000000+00:00",
+                         object_uid="1130000000000999",
+                         member_info={"role": "member", "is_robot": True})]
+        single = EventStore(os.path.join(tmp, "single.sqlite3"))
+        single.upsert_events(spread)
+        monthly_db = os.path.join(tmp, "monthly.sqlite3")
+        monthly = EventStore(monthly_db, layout=LAYOUT_MONTHLY)
+        assert monthly.layout == LAYOUT_MONTHLY
+        monthly.upsert_events(spread[:6])
+        monthly.upsert_events(spread[4:])
+        assert monthly.count() == single.count() == 7
+
+        def _order(events_store: EventStore, after=None) -> list[str]:
+            events = (events_store.iter_events_after(*after) if after
+                      else events_store.iter_all_events_ordered())
+            return [event["event"]["idempotency_id"] for event in events]
+
+        assert _order(monthly) == _order(single), _order(monthly)
+        cursor = ("2026-02-16T05:50:20.000000+00:00", "ev-004")
+        assert _order(monthly, cursor) == _order(single, cursor) == [
+            "ev-m1", "ev-m2", "ev-m3"]
+        assert monthly.count_through(*cursor) == single.count_through(*cursor) == 4
+        assert [row["month"] for row in monthly.partitions()] == [
+            "2026-02", "2026-03", "2026-04"]
+        expected = {key: chat.members.keys() for key, chat in
+                    build_projection(single.iter_all_events_ordered()).items()}
+        monthly_projection = ProjectionStore(monthly_db)
+        assert {key: chat.members.keys() for key, chat in
+                monthly_projection.refresh(monthly).items()} == expected
+
+        migrated_db = os.path.join(tmp, "single.sqlite3")
+        single.close()
+        migrated = EventStore(migrated_db)
+        assert migrated.migrate_to_monthly() == 7
+        assert migrated.layout == LAYOUT_MONTHLY
+        assert _order(migrated) == _order(monthly)
+        migrated.close()
+
+        archived = monthly.archive_months(
+            1, now=datetime(2026, 4, 20, tzinfo=timezone.utc))
+        assert [month for month, _, _ in archived] == ["2026-02", "2026-03"]
+        folder = partitions_dir(monthly_db)
+        files = sorted(name for name in os.listdir(folder)
+                       if not name.endswith(("-wal", "-shm")))
+        assert files == ["2026-02.sqlite3.gz", "2026-03.sqlite3.gz",
+                         "2026-04.sqlite3"], files
+        monthly.close()
+        monthly = EventStore(monthly_db)
+        migrated = EventStore(migrated_db)
+        assert _order(monthly) == _order(migrated)
+        assert monthly.get_payload("ev-002")["event"]["type"] == \
+            "messenger_chat.member.added"
+        monthly.upsert_events([_event(2, "ev-m0", "2026-03-01T00:00:00.000000+00:00")])
+        assert "2026-03.sqlite3" in os.listdir(folder)
+        assert _order(monthly)[4:6] == ["ev-m0", "ev-m1"]
+        assert monthly_projection.stale_reason(monthly)
+        monthly_projection.refresh(monthly)
+        for closable in (monthly_projection, monthly, migrated):
+            closable.close()
+        print("[ок] события по месяцам проигрываются в том же порядке, что и "
+              "из одного файла; старые месяцы сжимаются и остаются читаемыми")
+
+        # 42. проигрывание с нуля в нескольких процессах даёт то же
+        # состояние, тот же порядок чатов и те же точки состояния
+        from projection_store import replay_parallel
+        history, _ = synthetic_events(SyntheticOrg(80, 4, 3), 40, 1_200, seed=5)
+        for index, event in enumerate(history):
+            # по три события в одну секунду: точки попадают внутрь секунды
+            event["event"]["occurred_at"] = \
+                history[index - index % 3]["event"]["occurred_at"]
+        history += [
+            _event(1, "ev-p1", "2026-07-05T00:00:00.000000+00:00",
+                   chat_id="guidA_guidB"),
+            _event(2, "ev-p2", "2026-07-05T00:00:00.000000+00:00",
+                   chat_id="guidB_guidA")]
+        dumps = {}
+        for workers in (1, 3):
+            replay_db = os.path.join(tmp, f"replay{workers}.sqlite3")
+            replay_store = EventStore(replay_db)
+            replay_store.upsert_events(history)
+            replay_projection = ProjectionStore(replay_db, checkpoint_every=100,
+                                                replay_workers=workers)
+            chats = replay_projection.refresh(replay_store)
+            conn = replay_projection.conn
+            dumps[workers] = (
+                [(key, chat_to_json(chat)) for key, chat in chats.items()],
+                conn.execute("SELECT * FROM projection_chat ORDER BY chat_key"
+                             ).fetchall(),
+                conn.execute("SELECT * FROM projection_meta ORDER BY key").fetchall(),
+                conn.execute("SELECT * FROM projection_checkpoint "
+                             "ORDER BY applied").fetchall(),
+                conn.execute("SELECT * FROM projection_checkpoint_chat "
+                             "ORDER BY checkpoint, chat_key").fetchall())
+            if workers > 1:
+                direct, _, _, _ = replay_parallel(replay_store, 2)
+                assert [(key, chat_to_json(chat)) for key, chat in direct.items()] \
+                    == dumps[1][0]
+            replay_projection.close()
+            replay_store.close()
+        assert [tuple(map(tuple, part)) for part in dumps[3][1:]] == \
+            [tuple(map(tuple, part)) for part in dumps[1][1:]]
+        assert dumps[3][0] == dumps[1][0]
+        assert "priv::guidA_guidB" in dict(dumps[3][0])
+        assert len(dumps[3][3]) == 1_202 // 100
+        print("[ок] проигрывание с нуля в нескольких процессах совпадает с "
+              "последовательным до байта, включая точки состояния")
         store.close()
 
+        # 43. --async-http: короткое окно листается целиком, длинное — по
+        # отрезкам; составы групп идут через тот же бюджет, свежие в кэше
+        # и недоступные пропускаются
+        from http_async import AsyncSession
+
+        audit_calls: list[str] = []
+        member_calls: list[str] = []
+
+        def _async_reply(request: httpx.Request) -> httpx.Response:
+            path = request.url.path
+            if path.endswith("/events"):
+                started = request.url.params["started_at"]
+                ended = request.url.params["ended_at"]
+                audit_calls.append(started)
+                return httpx.Response(200, json={"items": [
+                    item for item in SAMPLE_EVENTS
+                    if started <= item["event"]["occurred_at"] < ended]})
+            if path.endswith("/groups"):
+                return httpx.Response(200, json={"items": [
+                    {"id": "g1"}, {"id": "g2"}, {"id": "g3"}], "total": 3})
+            if path.endswith("/members"):
+                gid = path.split("/")[-2]
+                member_calls.append(gid)
+                if gid == "g2":
+                    return httpx.Response(404, json={})
+                return httpx.Response(200, json={"users": [{"id": "101"}]})
+            return httpx.Response(200, json={"items": [], "total": 0})
+
+        def _prefetch(workers: int, name: str):
+            async_store = EventStore(os.path.join(tmp, name))
+            async_cfg = Config(org_id=1, backfill_days=365, collect_workers=workers,
+                               slice_hours=24 * 200, http_rps=1000)
+            session = AsyncSession(rps=async_cfg.http_rps)
+            session.client = httpx.AsyncClient(
+                transport=httpx.MockTransport(_async_reply))
+            try:
+                return asyncio.run(collect_and_prefetch(
+                    async_cfg, async_store, users=False, groups=True,
+                    fresh_groups={"g3"}, session=session)), async_store.count()
+            finally:
+                async_store.close()
+
+        (inserted, prefetched), stored = _prefetch(1, "async_one.sqlite3")
+        assert len(audit_calls) == 1, audit_calls
+        assert inserted == stored > 0, (inserted, stored)
+        whole = stored
+        assert sorted(member_calls) == ["g1", "g2"], member_calls
+        assert prefetched.group_members == {"g1": {"users": [{"id": "101"}]}}
+        audit_calls.clear()
+        (inserted, _), stored = _prefetch(3, "async_sliced.sqlite3")
+        assert len(audit_calls) == 2, audit_calls
+        assert inserted == stored == whole, (inserted, stored)
+        print("[ок] --async-http делит длинное окно на отрезки, как обычный "
+              "сбор, и загружает составы групп через общий бюджет")
+
     print("\n=== ВСЕ ПРОВЕРКИ ПРОЙДЕНЫ ===\n")
 
 
 # ============================== main ==============================
-OFFLINE_COMMANDS = {"validate", "selftest", "runs", "compare"}
+OFFLINE_COMMANDS = {"validate", "selftest", "runs", "compare", "at", "timeline",
+                    "migrate-events", "archive-events", "benchmark", "serve"}
+BENCH_SLOWDOWN_PCT = 20              # с какого замедления шага обращать внимание
 
 
 def main() -> int:
@@ -1026,13 +2292,20 @@ def main() -> int:
                     "изменения между запусками.")
     parser.add_argument(
         "command",
-        choices=["collect", "analyze", "run", "at", "validate", "selftest",
-                 "doctor", "runs", "compare"],
+        choices=["collect", "analyze", "run", "at", "timeline", "validate",
+                 "selftest", "doctor", "runs", "compare", "migrate-events",
+                 "archive-events", "benchmark", "watch", "serve"],
         help="collect — забрать новые события; analyze — собрать отчёты; "
              "run — сделать и то, и другое; runs — список запусков; "
              "compare — сравнить два запуска; at — состав чата на дату; "
+             "timeline — в каких чатах состоял сотрудник; "
+             "migrate-events — перевести базу событий в компактный формат "
+             "или по месяцам; archive-events — сжать старые месяцы; "
              "validate — проверить таблицу без обращения к сервисам; "
-             "selftest — самопроверка; doctor — проверка доступов")
+             "selftest — самопроверка; doctor — проверка доступов; "
+             "benchmark — замер скорости на синтетических данных; "
+             "watch — следить за изменениями состава чатов; "
+             "serve — служба запросов по локальной базе")
 
     # --- ручная таблица ---
     parser.add_argument("--manual", dest="manual_path",
@@ -1048,12 +2321,18 @@ def main() -> int:
     parser.add_argument("--manual-map", dest="manual_map_path",
                         help="файл chat_name;type;chat_key для чатов "
                              "с одинаковыми названиями")
+    parser.add_argument("--no-manual-cache", action="store_true",
+                        help="разобрать таблицу заново, даже если файл "
+                             "не менялся с прошлого запуска")
 
     # --- справочник сотрудников ---
     parser.add_argument("--directory-source", default=None,
                         choices=["auto", "cloud", "api360", "none"],
                         help="какой адрес справочника использовать "
                              "(по умолчанию auto — пробуем оба)")
+    parser.add_argument("--refresh-directory", action="store_true",
+                        help="загрузить справочник заново, даже если "
+                             "локальная копия ещё свежая")
     parser.add_argument("--allow-empty-directory", action="store_true",
                         help="продолжать, даже если справочник недоступен; "
                              "логины и ФИО тогда будут пустыми")
@@ -1068,6 +2347,18 @@ def main() -> int:
     parser.add_argument("--backfill-days", type=int, default=None,
                         help="за сколько дней забрать историю при первом "
                              "запуске collect (по умолчанию 180)")
+    parser.add_argument("--collect-workers", type=int, default=None,
+                        help="сколько потоков использовать при загрузке "
+                             "длинной истории (по умолчанию 4)")
+    parser.add_argument("--async-http", action="store_true",
+                        help="для run: загружать справочник одновременно "
+                             "со сбором событий, с общим лимитом запросов")
+    parser.add_argument("--full-replay", action="store_true",
+                        help="восстановить состояние чатов заново по всем "
+                             "событиям, не опираясь на сохранённое")
+    parser.add_argument("--replay-workers", type=int, default=None,
+                        help="сколько процессов использовать, когда состояние "
+                             "чатов восстанавливается с нуля (по умолчанию 1)")
 
     # --- результаты ---
     parser.add_argument("--results-dir", default=None,
@@ -1078,6 +2369,11 @@ def main() -> int:
                         help="хранить только указанное число последних запусков")
     parser.add_argument("--no-compare", action="store_true",
                         help="не сравнивать автоматически с прошлым запуском")
+    parser.add_argument("--xlsx", action="store_true",
+                        help="рядом с основными CSV класть такие же файлы Excel")
+    parser.add_argument("--profile", action="store_true",
+                        help="снять cProfile по каждому этапу в папку "
+                             "запуска (profile/)")
     parser.add_argument("--from", dest="from_ref", default="prev",
                         help="для compare: prev, latest, номер из списка runs "
                              "или название папки")
@@ -1088,12 +2384,52 @@ def main() -> int:
 
     parser.add_argument("--db", dest="db_path", default=None,
                         help="файл локальной базы")
-    parser.add_argument("--chat-key",
+    parser.add_argument("--chat-key", action="append",
                         help="для команды at: идентификатор чата из колонки "
-                             "chat_key файла chats.csv")
+                             "chat_key файла chats.csv; можно указать "
+                             "несколько раз")
     parser.add_argument("--at",
                         help="для команды at: момент времени в формате ISO 8601, "
                              "например 2026-03-01T00:00:00+00:00")
+    parser.add_argument("--source", choices=["events", "runs"], default="events",
+                        help="для команды at: events — точно по событиям "
+                             "аудит-лога (по умолчанию), runs — по истории "
+                             "запусков, вместе с группами и ручной таблицей")
+    parser.add_argument("--until",
+                        help="для команды at: конец периода; тогда показываются "
+                             "все, кто был в чате с --at по --until")
+    parser.add_argument("--member",
+                        help="для команды timeline: логин, адрес или номер "
+                             "сотрудника")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="для команды watch: секунд между опросами "
+                             "(по умолчанию 60)")
+    parser.add_argument("--watch-out", default=None,
+                        help="для команды watch: файл JSONL для изменений "
+                             "(по умолчанию result/watch.jsonl)")
+    parser.add_argument("--webhook", default=None,
+                        help="для команды watch: адрес, куда отправлять "
+                             "изменения POST-запросом")
+    parser.add_argument("--polls", type=int, default=0,
+                        help="для команды watch: сколько опросов сделать; "
+                             "0 — пока не остановят")
+    parser.add_argument("--monthly", action="store_true",
+                        help="для команды migrate-events: разложить события "
+                             "по помесячным файлам")
+    parser.add_argument("--hot-months", type=int, default=None,
+                        help="для команды archive-events: сколько последних "
+                             "месяцев не сжимать (по умолчанию 3)")
+    parser.add_argument("--host", default=None,
+                        help="для команды serve: адрес, на котором слушать "
+                             "(по умолчанию 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=None,
+                        help="для команды serve: порт (по умолчанию 8360)")
+    parser.add_argument("--bench-users", type=int, default=20_000,
+                        help="для команды benchmark: сколько сотрудников")
+    parser.add_argument("--bench-chats", type=int, default=5_000,
+                        help="для команды benchmark: сколько чатов")
+    parser.add_argument("--bench-events", type=int, default=300_000,
+                        help="для команды benchmark: сколько событий")
     args = parser.parse_args()
 
     if args.command == "selftest":
@@ -1116,6 +2452,10 @@ def main() -> int:
         cfg.directory_source = args.directory_source
     if args.backfill_days:
         cfg.backfill_days = args.backfill_days
+    if args.collect_workers:
+        cfg.collect_workers = args.collect_workers
+    if args.replay_workers:
+        cfg.replay_workers = args.replay_workers
     if args.results_dir:
         cfg.results_dir = args.results_dir
     if args.run_tag:
@@ -1126,17 +2466,38 @@ def main() -> int:
         cfg.db_path = args.db_path
     cfg.expand_groups = args.expand_groups or cfg.expand_groups
     cfg.include_private = args.include_private or cfg.include_private
+    cfg.full_replay = args.full_replay or cfg.full_replay
+    cfg.async_http = args.async_http or cfg.async_http
     cfg.allow_empty_directory = (args.allow_empty_directory
                                  or cfg.allow_empty_directory)
+    cfg.refresh_directory = args.refresh_directory or cfg.refresh_directory
     if args.no_resolve_uids:
         cfg.resolve_uids = False
     if args.no_compare:
         cfg.compare_previous = False
+    if args.no_manual_cache:
+        cfg.manual_cache = False
+    cfg.report_xlsx = args.xlsx or cfg.report_xlsx
+    cfg.profile = args.profile or cfg.profile
+    if args.interval is not None:
+        cfg.watch_interval = args.interval
+    if args.watch_out:
+        cfg.watch_out = args.watch_out
+    if args.webhook:
+        cfg.watch_webhook = args.webhook
+    if args.hot_months is not None:
+        cfg.events_hot_months = args.hot_months
+    if args.host:
+        cfg.serve_host = args.host
+    if args.port is not None:
+        cfg.serve_port = args.port
 
     if args.command == "collect":
         cmd_collect(cfg)
     elif args.command == "analyze":
         cmd_analyze(cfg)
+    elif args.command == "run" and cfg.async_http:
+        cmd_analyze(cfg, directory=cmd_collect_async(cfg))
     elif args.command == "run":
         cmd_collect(cfg)
         cmd_analyze(cfg)
@@ -1152,7 +2513,21 @@ def main() -> int:
     elif args.command == "at":
         if not (args.chat_key and args.at):
             parser.error("для команды at нужны --chat-key и --at")
-        cmd_at(cfg, args.chat_key, args.at)
+        cmd_at(cfg, args.chat_key, args.at, args.until, args.source)
+    elif args.command == "migrate-events":
+        cmd_migrate_events(cfg, args.monthly)
+    elif args.command == "archive-events":
+        cmd_archive_events(cfg)
+    elif args.command == "timeline":
+        if not args.member:
+            parser.error("для команды timeline нужен --member")
+        cmd_timeline(cfg, args.member)
+    elif args.command == "benchmark":
+        cmd_benchmark(cfg, args.bench_users, args.bench_chats, args.bench_events)
+    elif args.command == "watch":
+        cmd_watch(cfg, args.polls)
+    elif args.command == "serve":
+        cmd_serve(cfg)
 
     return 0
 
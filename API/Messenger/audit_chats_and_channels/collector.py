@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from clients import AuditLogClient
+from human import date_human, dt_human
+from store import BATCH, EventStore
+
+log = logging.getLogger("collect")
+
+PLAN_KEY = "backfill_plan"
+SLICE_PREFIX = "slice:"
+
+
+def collect_window(cfg, store: EventStore,
+                   now: datetime) -> datetime:
+    """Откуда начинать сбор: весь срок при первом запуске, иначе от
+    последнего события с запасом на опоздавшие."""
+    checkpoint = store.get_checkpoint()
+    if checkpoint is None:
+        started = now - timedelta(days=cfg.backfill_days)
+        log.info("Первый запуск: забираем всю доступную историю, "
+                 "начиная с %s (%s дней назад). "
+                 "Дальше будем брать только новое.",
+                 date_human(started), cfg.backfill_days)
+    else:
+        started = checkpoint - timedelta(minutes=cfg.overlap_minutes)
+        log.info("Забираем события с %s. Взяли запас в %s минут назад, "
+                 "чтобы не пропустить те, что пришли с задержкой.",
+                 dt_human(started), cfg.overlap_minutes)
+    return started
+
+
+def make_slices(started: datetime, ended: datetime,
+                slice_hours: int) -> list[tuple[str, str]]:
+    """Делит [started, ended] на отрезки по slice_hours часов."""
+    step = timedelta(hours=max(1, slice_hours))
+    slices: list[tuple[str, str]] = []
+    cursor = started
+    while cursor < ended:
+        upper = min(cursor + step, ended)
+        slices.append((cursor.isoformat(), upper.isoformat()))
+        cursor = upper
+    return slices
+
+
+class SlicedCollector:
+    """Сбор аудит-лога параллельно по отрезкам времени.
+
+    Длинное окно (первый запуск — полгода истории) делится на отрезки, и
+    каждый отрезок листается своим потоком. Страницы одного отрезка
+    по-прежнему идут друг за другом: iteration_key от них зависит.
+
+    Записью в базу занимается только основной поток: соединение SQLite
+    между потоками не делится. Готовый отрезок отмечается в таблице
+    checkpoint после того, как все его события записаны, поэтому
+    прерванная загрузка продолжается с недоделанных отрезков.
+
+    Пауза после ответа 429 общая для всех потоков — это делает BaseClient.
+    """
+
+    def __init__(self, audit: AuditLogClient, store: EventStore, org_id: int,
+                 *, workers: int = 4, slice_hours: int = 24):
+        self.audit = audit
+        self.store = store
+        self.org_id = org_id
+        self.workers = max(1, workers)
+        self.slice_hours = max(1, slice_hours)
+
+    # ------------------------------------------------------------------
+    def pending_plan(self) -> dict | None:
+        raw = self.store.get_value(PLAN_KEY)
+        return json.loads(raw) if raw else None
+
+    def needs_slicing(self, started: datetime, ended: datetime) -> bool:
+        return (self.workers > 1
+                and ended - started > timedelta(hours=self.slice_hours))
+
+    def start_plan(self, started: datetime, ended: datetime,
+                   types: list[str]) -> dict:
+        slices = make_slices(started, ended, self.slice_hours)
+        plan = {"slices": slices, "types": types}
+        self.store.delete_prefix(SLICE_PREFIX)
+        self.store.set_value(PLAN_KEY, json.dumps(plan, ensure_ascii=False))
+        log.info("Окно разбито на %s отрезков по %s ч, загружаем в %s потоков.",
+                 len(slices), self.slice_hours, self.workers)
+        return plan
+
+    def todo_slices(self, plan: dict) -> list[tuple[str, str]]:
+        done = self.store.keys_with_prefix(SLICE_PREFIX)
+        return [tuple(item) for item in plan["slices"]
+                if _slice_key(item) not in done]
+
+    def mark_done(self, item) -> None:
+        self.store.set_value(_slice_key(item), "done")
+
+    def finish_plan(self) -> None:
+        self.store.delete_prefix(SLICE_PREFIX)
+        self.store.delete_prefix(PLAN_KEY)
+
+    def resume(self) -> int:
+        """Дозагружает отрезки прерванного плана. -> число новых событий."""
+        plan = self.pending_plan()
+        if plan is None:
+            return 0
+        todo = self.todo_slices(plan)
+        log.info("Продолжаем прерванную загрузку истории: осталось отрезков "
+                 "%s из %s.", len(todo), len(plan["slices"]))
+        inserted = self._run(todo, plan["types"])
+        self.finish_plan()
+        return inserted
+
+    def collect(self, started: datetime, ended: datetime,
+                types: list[str]) -> int:
+        """Забирает события за [started, ended]. Короткое окно — одним
+        потоком, как раньше; длинное — по отрезкам."""
+        if not self.needs_slicing(started, ended):
+            return self.store.upsert_events(self.audit.iter_events(
+                self.org_id, started.isoformat(), ended.isoformat(), types))
+        self.start_plan(started, ended, types)
+        return self.resume()
+
+    # ------------------------------------------------------------------
+    def _run(self, slices: list[tuple[str, str]], types: list[str]) -> int:
+        if not slices:
+            return 0
+        results: queue.Queue = queue.Queue(maxsize=self.workers * 4)
+        stop = threading.Event()
+
+        def put(item) -> None:
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def work(item: tuple[str, str]) -> None:
+            try:
+                batch: list[dict] = []
+                for event in self.audit.iter_events(self.org_id, item[0],
+                                                    item[1], types):
+                    if stop.is_set():
+                        return
+                    batch.append(event)
+                    if len(batch) >= BATCH:
+                        put(("events", item, batch))
+                        batch = []
+                put(("events", item, batch))
+                put(("done", item, None))
+            except Exception as exc:               # noqa: BLE001
+                put(("error", item, exc))
+
+        inserted = 0
+        remaining = len(slices)
+        pool = ThreadPoolExecutor(max_workers=self.workers,
+                                  thread_name_prefix="collect")
+        try:
+            for item in slices:
+                pool.submit(work, item)
+            while remaining:
+                kind, item, payload = results.get()
+                if kind == "events":
+                    inserted += self.store.upsert_events(payload)
+                elif kind == "done":
+                    self.mark_done(item)
+                    remaining -= 1
+                    if remaining and remaining % 10 == 0:
+                        log.info("Осталось отрезков: %s, новых событий пока %s.",
+                                 remaining, inserted)
+                else:
+                    raise payload
+        finally:
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+        return inserted
+
+
+def _slice_key(item) -> str:
+    return f"{SLICE_PREFIX}{item[0]}|{item[1]}"
+
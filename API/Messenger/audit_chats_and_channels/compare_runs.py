@@ -4,9 +4,11 @@ import csv
 import json
 import logging
 import os
+import sqlite3
 from dataclasses import dataclass, field
 from datetime import datetime
 
+from run_index import ensure_run_index
 from run_layout import RUN_DIR_RE, RunInfo
 
 log = logging.getLogger("compare")
@@ -55,40 +57,37 @@ class CompareResult:
         return all(value == 0 for value in self.counts().values())
 
 
-def _read_csv(path: str) -> list[dict]:
-    if not os.path.isfile(path):
-        return []
-    with open(path, "r", encoding=ENCODING, newline="") as handle:
-        return list(csv.DictReader(handle, delimiter=DELIMITER))
-
-
-def member_key(row: dict) -> str:
-    """Стабильный ключ участника — совпадает с логикой SCD2."""
-    uid = (row.get("uid") or "").strip()
-    if uid:
-        return f"uid::{uid}"
-    login = (row.get("login") or "").strip().casefold()
-    if login:
-        return f"login::{login}"
-    return "anon::unknown"
-
-
-def _load_artifacts(run: RunInfo) -> tuple[dict, dict, dict]:
-    chats = {row["chat_key"]: row
-             for row in _read_csv(os.path.join(run.path, "chats.csv"))
-             if row.get("chat_key")}
-    members: dict[tuple[str, str], dict] = {}
-    for row in _read_csv(os.path.join(run.path, "members.csv")):
-        chat_key = row.get("chat_key")
-        if not chat_key:
-            continue
-        members[(chat_key, member_key(row))] = row
+def _load_summary(run: RunInfo) -> dict:
     summary_path = os.path.join(run.path, "summary.json")
     summary = {}
     if os.path.isfile(summary_path):
         with open(summary_path, "r", encoding="utf-8") as handle:
             summary = json.load(handle)
-    return chats, members, summary
+    return summary
+
+
+# Пробелы по краям значений при сравнении не учитываются — как в CSV-сравнении
+_TRIMMED = "' '||char(9)||char(10)||char(13)"
+
+
+def _differs(fields: list[str]) -> str:
+    return " OR ".join(
+        f'COALESCE(TRIM(a."{name}", {_TRIMMED}), \'\') <> '
+        f'COALESCE(TRIM(b."{name}", {_TRIMMED}), \'\')' for name in fields)
+
+
+def _text(value) -> str:
+    return (value or "").strip()
+
+
+def _open_pair(from_run: RunInfo, to_run: RunInfo) -> sqlite3.Connection:
+    """Соединение, к которому подключены файлы сравнения обоих запусков:
+    a — from_run, b — to_run."""
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("ATTACH DATABASE ? AS a", (ensure_run_index(from_run.path),))
+    conn.execute("ATTACH DATABASE ? AS b", (ensure_run_index(to_run.path),))
+    return conn
 
 
 def _check_flags(from_run: RunInfo, to_run: RunInfo) -> list[str]:
@@ -153,60 +152,76 @@ def compare_runs(from_run: RunInfo, to_run: RunInfo) -> CompareResult:
     result = CompareResult(from_run=from_run.run_id, to_run=to_run.run_id)
     result.warnings = _check_flags(from_run, to_run)
 
-    chats_a, members_a, summary_a = _load_artifacts(from_run)
-    chats_b, members_b, summary_b = _load_artifacts(to_run)
+    summary_a, summary_b = _load_summary(from_run), _load_summary(to_run)
 
-    if not chats_a and not chats_b:
+    if not any(os.path.isfile(os.path.join(run.path, "chats.csv"))
+               for run in (from_run, to_run)):
         result.warnings.append("В обоих прогонах нет chats.csv — нечего сравнивать")
 
-    # ---- чаты ----
-    for key in sorted(set(chats_b) - set(chats_a)):
-        row = chats_b[key]
-        result.chats_added.append({
-            "chat_key": key, "chat_name": row.get("name"),
-            "chat_type": row.get("type"), "created_at": row.get("created_at"),
-            "created_by_login": row.get("created_by_login"),
-            "members_count": row.get("members_count"),
-            "bots_count": row.get("bots_count")})
-    for key in sorted(set(chats_a) - set(chats_b)):
-        row = chats_a[key]
-        result.chats_removed.append({
-            "chat_key": key, "chat_name": row.get("name"),
-            "chat_type": row.get("type"), "created_at": row.get("created_at"),
-            "created_by_login": row.get("created_by_login"),
-            "members_count": row.get("members_count"),
-            "bots_count": row.get("bots_count")})
-    for key in sorted(set(chats_a) & set(chats_b)):
-        row_a, row_b = chats_a[key], chats_b[key]
-        for field_name in CHAT_FIELDS:
-            value_a = (row_a.get(field_name) or "").strip()
-            value_b = (row_b.get(field_name) or "").strip()
-            if value_a != value_b:
-                result.chats_changed.append({
-                    "chat_key": key,
-                    "chat_name": row_b.get("name") or row_a.get("name"),
-                    "field": field_name, "from_value": value_a,
-                    "to_value": value_b})
-
-    # ---- участники ----
-    for key in sorted(set(members_b) - set(members_a)):
-        row = members_b[key]
-        result.members_added.append(_member_row(key, row))
-    for key in sorted(set(members_a) - set(members_b)):
-        row = members_a[key]
-        result.members_removed.append(_member_row(key, row))
-    for key in sorted(set(members_a) & set(members_b)):
-        row_a, row_b = members_a[key], members_b[key]
-        for field_name in MEMBER_FIELDS:
-            value_a = (row_a.get(field_name) or "").strip()
-            value_b = (row_b.get(field_name) or "").strip()
-            if value_a != value_b:
-                result.members_changed.append({
-                    "chat_key": key[0], "member_key": key[1],
-                    "chat_name": row_b.get("chat_name") or row_a.get("chat_name"),
-                    "login": row_b.get("login") or row_a.get("login"),
-                    "field": field_name, "from_value": value_a,
-                    "to_value": value_b})
+    # Оба запуска — файлы SQLite с первичными ключами (run_index.py):
+    # добавленное, удалённое и изменённое находится соединением по ключу.
+    conn = _open_pair(from_run, to_run)
+    try:
+        # ---- чаты ----
+        for target, outer, inner in ((result.chats_added, "b", "a"),
+                                     (result.chats_removed, "a", "b")):
+            for row in conn.execute(
+                    f"SELECT * FROM {outer}.chats x WHERE NOT EXISTS ("
+                    f"SELECT 1 FROM {inner}.chats y WHERE y.chat_key=x.chat_key) "
+                    f"ORDER BY x.chat_key"):
+                target.append({
+                    "chat_key": row["chat_key"], "chat_name": row["name"],
+                    "chat_type": row["type"], "created_at": row["created_at"],
+                    "created_by_login": row["created_by_login"],
+                    "members_count": row["members_count"],
+                    "bots_count": row["bots_count"]})
+        columns = ", ".join(f'a."{name}" AS "a_{name}", b."{name}" AS "b_{name}"'
+                            for name in CHAT_FIELDS)
+        for row in conn.execute(
+                f"SELECT a.chat_key, {columns} FROM a.chats a "
+                f"JOIN b.chats b ON b.chat_key=a.chat_key "
+                f"WHERE {_differs(CHAT_FIELDS)} ORDER BY a.chat_key"):
+            for field_name in CHAT_FIELDS:
+                value_a = _text(row[f"a_{field_name}"])
+                value_b = _text(row[f"b_{field_name}"])
+                if value_a != value_b:
+                    result.chats_changed.append({
+                        "chat_key": row["chat_key"],
+                        "chat_name": row["b_name"] or row["a_name"],
+                        "field": field_name, "from_value": value_a,
+                        "to_value": value_b})
+
+        # ---- участники ----
+        for target, outer, inner in ((result.members_added, "b", "a"),
+                                     (result.members_removed, "a", "b")):
+            for row in conn.execute(
+                    f"SELECT * FROM {outer}.members x WHERE NOT EXISTS ("
+                    f"SELECT 1 FROM {inner}.members y WHERE y.chat_key=x.chat_key "
+                    f"AND y.member_key=x.member_key) "
+                    f"ORDER BY x.chat_key, x.member_key"):
+                target.append(_member_row((row["chat_key"], row["member_key"]),
+                                          dict(row)))
+        names = MEMBER_FIELDS + ["chat_name", "login"]
+        columns = ", ".join(f'a."{name}" AS "a_{name}", b."{name}" AS "b_{name}"'
+                            for name in names)
+        for row in conn.execute(
+                f"SELECT a.chat_key, a.member_key, {columns} FROM a.members a "
+                f"JOIN b.members b ON b.chat_key=a.chat_key "
+                f"AND b.member_key=a.member_key "
+                f"WHERE {_differs(MEMBER_FIELDS)} "
+                f"ORDER BY a.chat_key, a.member_key"):
+            for field_name in MEMBER_FIELDS:
+                value_a = _text(row[f"a_{field_name}"])
+                value_b = _text(row[f"b_{field_name}"])
+                if value_a != value_b:
+                    result.members_changed.append({
+                        "chat_key": row["chat_key"], "member_key": row["member_key"],
+                        "chat_name": row["b_chat_name"] or row["a_chat_name"],
+                        "login": row["b_login"] or row["a_login"],
+                        "field": field_name, "from_value": value_a,
+                        "to_value": value_b})
+    finally:
+        conn.close()
 
     # ---- метрики ----
     flat_a, flat_b = _flatten_metrics(summary_a), _flatten_metrics(summary_b)
@@ -22,10 +22,34 @@ class Config:
     # --- сбор аудит-лога ---
     backfill_days: int = 180
     overlap_minutes: int = 10
+    collect_workers: int = 4           # потоков при загрузке длинного окна
+    slice_hours: int = 24              # длина отрезка при параллельной загрузке
+    full_replay: bool = False          # пересобрать состояние чатов с нуля
+    replay_workers: int = 1            # процессов при проигрывании с нуля
+    checkpoint_every: int = 20_000     # событий между точками состояния для at
+    events_layout: str = "single"      # новая база событий: single | monthly
+    events_hot_months: int = 3         # archive-events: сколько месяцев не сжимать
+
+    # --- watch ---
+    watch_interval: float = 60         # секунд между опросами аудит-лога
+    watch_out: str | None = None       # файл JSONL для изменений
+    watch_webhook: str | None = None   # адрес, куда POST-ом отправлять изменения
+
+    # --- serve ---
+    serve_host: str = "127.0.0.1"      # служба запросов слушает только этот адрес
+    serve_port: int = 8360
+
+    # --- HTTP ---
+    async_http: bool = False           # run: сбор и справочник одновременно
+    http_rps: float = 10.0             # общий бюджет запросов в секунду
 
     # --- скоуп ---
     include_private: bool = False
     expand_groups: bool = False
+    expand_workers: int = 8            # потоков при загрузке составов групп
+    group_cache_ttl_hours: float = 24  # сколько часов верим кэшу составов
+    directory_ttl_hours: float = 12    # сколько часов верим копии справочника
+    refresh_directory: bool = False    # загрузить справочник заново, не глядя на срок
     resolve_uids: bool = True
 
     # --- источники идентичностей ---
@@ -39,6 +63,7 @@ class Config:
     manual_date_semantics: str = "member_added"
     manual_map_path: str | None = None
     date_tolerance_days: int = 1
+    manual_cache: bool = True          # хранить разобранную таблицу в базе
 
     # --- хранение результатов ---
     db_path: str = "./msgaudit.sqlite3"
@@ -46,6 +71,8 @@ class Config:
     run_tag: str | None = None
     keep_runs: int = 0                 # 0 = не удалять старые прогоны
     compare_previous: bool = True      # авто-сравнение с предыдущим прогоном
+    report_xlsx: bool = False          # рядом с CSV класть такие же файлы Excel
+    profile: bool = False              # cProfile по этапам в папку запуска
 
     @classmethod
     def from_env(cls, *, require_network: bool = True) -> "Config":
@@ -71,18 +98,41 @@ class Config:
             directory_token=os.environ.get("DIRECTORY_TOKEN") or audit_token,
             include_private=os.environ.get("INCLUDE_PRIVATE", "0") == "1",
             expand_groups=os.environ.get("EXPAND_GROUPS", "0") == "1",
+            expand_workers=int(os.environ.get("EXPAND_WORKERS", "8")),
+            group_cache_ttl_hours=float(
+                os.environ.get("GROUP_CACHE_TTL_HOURS", "24")),
+            directory_ttl_hours=float(
+                os.environ.get("DIRECTORY_TTL_HOURS", "12")),
+            refresh_directory=os.environ.get("REFRESH_DIRECTORY", "0") == "1",
             resolve_uids=os.environ.get("RESOLVE_UIDS", "1") == "1",
+            full_replay=os.environ.get("FULL_REPLAY", "0") == "1",
+            replay_workers=int(os.environ.get("REPLAY_WORKERS", "1")),
+            checkpoint_every=int(os.environ.get("CHECKPOINT_EVERY", "20000")),
+            events_layout=os.environ.get("EVENTS_LAYOUT", "single"),
+            events_hot_months=int(os.environ.get("EVENTS_HOT_MONTHS", "3")),
+            watch_interval=float(os.environ.get("WATCH_INTERVAL", "60")),
+            watch_out=os.environ.get("WATCH_OUT") or None,
+            watch_webhook=os.environ.get("WATCH_WEBHOOK") or None,
+            serve_host=os.environ.get("SERVE_HOST", "127.0.0.1"),
+            serve_port=int(os.environ.get("SERVE_PORT", "8360")),
+            collect_workers=int(os.environ.get("COLLECT_WORKERS", "4")),
+            slice_hours=int(os.environ.get("SLICE_HOURS", "24")),
+            async_http=os.environ.get("ASYNC_HTTP", "0") == "1",
+            http_rps=float(os.environ.get("HTTP_RPS", "10")),
             directory_source=os.environ.get("DIRECTORY_SOURCE", "auto"),
             allow_empty_directory=os.environ.get("ALLOW_EMPTY_DIRECTORY", "0") == "1",
             manual_path=os.environ.get("MANUAL_PATH") or None,
             manual_sheet=os.environ.get("MANUAL_SHEET") or None,
             manual_tz=os.environ.get("MANUAL_TZ", "+00:00"),
             manual_map_path=os.environ.get("MANUAL_MAP_PATH") or None,
+            manual_cache=os.environ.get("MANUAL_CACHE", "1") == "1",
             db_path=os.environ.get("DB_PATH", "./msgaudit.sqlite3"),
             results_dir=results_dir or "./result",
             run_tag=os.environ.get("RUN_TAG") or None,
             keep_runs=int(os.environ.get("KEEP_RUNS", "0")),
             compare_previous=os.environ.get("COMPARE_PREVIOUS", "1") == "1",
+            report_xlsx=os.environ.get("REPORT_XLSX", "0") == "1",
+            profile=os.environ.get("PROFILE", "0") == "1",
         )
 
     def flags_snapshot(self) -> dict:
@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator, Optional
+
+from http_base import HttpError
+
+log = logging.getLogger("directory")
+
+# что хранится в копии справочника; api360_users — те же сотрудники,
+# полученные по резервному адресу, в его формате
+SNAPSHOT_KINDS = ("users", "api360_users", "departments", "groups")
+KIND_RU = {"users": "сотрудники", "api360_users": "сотрудники (резервный адрес)",
+           "departments": "подразделения", "groups": "группы"}
+
+
+def _body_hash(body: str) -> str:
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class DirectoryStore:
+    """Кэш ответов справочника между запусками.
+
+    Состав группы меняется редко, а при развороте групп на большой
+    организации запросов получается столько же, сколько групп. Ответ
+    хранится вместе со временем получения, отдельно для каждой организации,
+    и считается свежим ttl часов.
+
+    Здесь же лежит копия самого справочника — сотрудники, подразделения,
+    группы — со временем получения, отдельно для каждой организации. При
+    обновлении копии записывается, кто появился, изменился или исчез
+    (directory_changes)."""
+
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        columns = {row["name"] for row in
+                   self.conn.execute("PRAGMA table_info(directory_snapshot)")}
+        if columns and "org_id" not in columns:
+            # копия от прежних версий без номера организации: это кэш,
+            # при следующем analyze он загрузится заново
+            self.conn.executescript("DROP TABLE directory_snapshot;"
+                                    "DROP TABLE IF EXISTS directory_snapshot_meta;")
+        columns = {row["name"] for row in
+                   self.conn.execute("PRAGMA table_info(group_members_cache)")}
+        if columns and "org_id" not in columns:
+            # составы от прежних версий без номера организации тоже кэш
+            self.conn.execute("DROP TABLE group_members_cache")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS group_members_cache (
+                org_id     INTEGER NOT NULL,
+                group_id   TEXT NOT NULL,
+                body       TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                PRIMARY KEY (org_id, group_id)
+            );
+            CREATE TABLE IF NOT EXISTS directory_snapshot (
+                org_id    INTEGER NOT NULL,
+                kind      TEXT NOT NULL,
+                item_id   TEXT NOT NULL,
+                seq       INTEGER NOT NULL,
+                body      TEXT NOT NULL,
+                body_hash TEXT NOT NULL,
+                PRIMARY KEY (org_id, kind, item_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS directory_snapshot_meta (
+                org_id     INTEGER NOT NULL,
+                kind       TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                items      INTEGER NOT NULL,
+                PRIMARY KEY (org_id, kind)
+            );
+            CREATE TABLE IF NOT EXISTS directory_changes (
+                id          INTEGER PRIMARY KEY,
+                org_id      INTEGER,
+                kind        TEXT NOT NULL,
+                item_id     TEXT NOT NULL,
+                change      TEXT NOT NULL,      -- added | changed | removed
+                detected_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_directory_changes_time
+                ON directory_changes(detected_at);
+            """
+        )
+        columns = {row["name"] for row in
+                   self.conn.execute("PRAGMA table_info(directory_changes)")}
+        if "org_id" not in columns:             # база от прежних версий
+            self.conn.execute("ALTER TABLE directory_changes ADD COLUMN org_id INTEGER")
+        self.conn.commit()
+
+    def get_group_members(self, org_id: int, group_id: str,
+                          ttl_hours: float) -> dict | None:
+        row = self.conn.execute(
+            "SELECT body, fetched_at FROM group_members_cache "
+            "WHERE org_id=? AND group_id=?", (org_id, str(group_id))).fetchone()
+        if row is None:
+            return None
+        fetched = datetime.fromisoformat(row["fetched_at"])
+        if datetime.now(timezone.utc) - fetched > timedelta(hours=ttl_hours):
+            return None
+        return json.loads(row["body"])
+
+    def fresh_group_ids(self, org_id: int, ttl_hours: float) -> set[str]:
+        """Группы, чей состав в кэше ещё свежий: заново их не запрашиваем."""
+        since = (datetime.now(timezone.utc) - timedelta(hours=ttl_hours)).isoformat()
+        return {row["group_id"] for row in self.conn.execute(
+            "SELECT group_id FROM group_members_cache "
+            "WHERE org_id=? AND fetched_at >= ?", (org_id, since))}
+
+    def put_group_members(self, org_id: int, group_id: str, body: dict) -> None:
+        self.conn.execute(
+            "INSERT INTO group_members_cache(org_id, group_id, body, fetched_at) "
+            "VALUES(?,?,?,?) ON CONFLICT(org_id, group_id) DO UPDATE SET "
+            "body=excluded.body, fetched_at=excluded.fetched_at",
+            (org_id, str(group_id), json.dumps(body, ensure_ascii=False),
+             datetime.now(timezone.utc).isoformat()))
+
+    # ------------------------------------------------------------------
+    def snapshot_info(self, org_id: int, kind: str) -> Optional[dict]:
+        """{'fetched_at', 'items', 'age_hours'} или None, если копии нет."""
+        row = self.conn.execute(
+            "SELECT fetched_at, items FROM directory_snapshot_meta "
+            "WHERE org_id=? AND kind=?", (org_id, kind)).fetchone()
+        if row is None:
+            return None
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(row["fetched_at"])
+        return {"fetched_at": row["fetched_at"], "items": row["items"],
+                "age_hours": age.total_seconds() / 3600}
+
+    def snapshot_fresh(self, org_id: int, kind: str, ttl_hours: float) -> bool:
+        info = self.snapshot_info(org_id, kind)
+        return info is not None and info["age_hours"] < ttl_hours
+
+    def load_snapshot(self, org_id: int, kind: str,
+                      limit: Optional[int] = None) -> list[dict]:
+        return [json.loads(row["body"]) for row in self.conn.execute(
+            "SELECT body FROM directory_snapshot WHERE org_id=? AND kind=? "
+            "ORDER BY seq LIMIT ?", (org_id, kind, -1 if limit is None else limit))]
+
+    def save_snapshot(self, org_id: int, kind: str, items: Iterable[dict], *,
+                      allow_empty: bool = False) -> Optional[dict[str, int]]:
+        """Заменяет копию и записывает отличия от прежней.
+        -> {'added', 'changed', 'removed'}; у первой копии отличий нет.
+
+        Пустой ответ не заменяет непустую копию (-> None): скорее всего,
+        сервис ответил неполно, а не все разом исчезли. allow_empty=True
+        заменяет всё равно."""
+        previous = dict(self.conn.execute(
+            "SELECT item_id, body_hash FROM directory_snapshot "
+            "WHERE org_id=? AND kind=?", (org_id, kind)).fetchall())
+        first = self.snapshot_info(org_id, kind) is None
+        now = datetime.now(timezone.utc).isoformat()
+        rows, changes, seen = [], [], set()
+        for seq, item in enumerate(items):
+            item_id = str(item.get("id") or "")
+            if not item_id or item_id in seen:
+                continue
+            seen.add(item_id)
+            body = json.dumps(item, ensure_ascii=False, sort_keys=True)
+            digest = _body_hash(body)
+            rows.append((org_id, kind, item_id, seq, body, digest))
+            if item_id not in previous:
+                changes.append((org_id, kind, item_id, "added", now))
+            elif previous[item_id] != digest:
+                changes.append((org_id, kind, item_id, "changed", now))
+        if not rows and previous and not allow_empty:
+            return None
+        changes += [(org_id, kind, item_id, "removed", now)
+                    for item_id in previous if item_id not in seen]
+
+        self.conn.execute("DELETE FROM directory_snapshot WHERE org_id=? AND kind=?",
+                          (org_id, kind))
+        self.conn.executemany(
+            "INSERT INTO directory_snapshot(org_id, kind, item_id, seq, body, body_hash) "
+            "VALUES(?,?,?,?,?,?)", rows)
+        self.conn.execute(
+            "INSERT INTO directory_snapshot_meta(org_id, kind, fetched_at, items) "
+            "VALUES(?,?,?,?) ON CONFLICT(org_id, kind) DO UPDATE SET "
+            "fetched_at=excluded.fetched_at, items=excluded.items",
+            (org_id, kind, now, len(rows)))
+        counts = {"added": 0, "changed": 0, "removed": 0}
+        if not first:
+            self.conn.executemany(
+                "INSERT INTO directory_changes(org_id, kind, item_id, change, detected_at) "
+                "VALUES(?,?,?,?,?)", changes)
+            for change in changes:
+                counts[change[3]] += 1
+        return counts
+
+    def recent_changes(self, org_id: int, kind: str, limit: int = 20) -> list[dict]:
+        return [dict(row) for row in self.conn.execute(
+            "SELECT item_id, change, detected_at FROM directory_changes "
+            "WHERE org_id=? AND kind=? ORDER BY id DESC LIMIT ?", (org_id, kind, limit))]
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class SnapshotDirectory:
+    """Справочник через локальную копию в DirectoryStore.
+
+    Отдаёт те же iter_*, что DirectoryClient и Api360Client, поэтому
+    DirectoryResolver работает с ним без изменений. Пока копия моложе
+    ttl_hours, сервис не спрашивается. Устаревшая копия (или refresh=True)
+    загружается заново целиком, отличия записываются в directory_changes.
+    Если сервис при этом не ответил или вернул пустой список, а копия есть,
+    работаем по ней; пустой список заменяет копию только при allow_empty."""
+
+    def __init__(self, client, store: DirectoryStore, *, ttl_hours: float,
+                 refresh: bool = False, prefix: str = "",
+                 allow_empty: bool = False):
+        self.client = client
+        self.store = store
+        self.ttl_hours = ttl_hours
+        self.refresh = refresh
+        self.prefix = prefix
+        self.allow_empty = allow_empty
+
+    def iter_users(self, org_id: int, limit: int = 100) -> Iterator[dict]:
+        return self._through(org_id, f"{self.prefix}users",
+                             lambda: self.client.iter_users(org_id, limit))
+
+    def iter_groups(self, org_id: int, limit: int = 100) -> Iterator[dict]:
+        return self._through(org_id, "groups",
+                             lambda: self.client.iter_groups(org_id, limit))
+
+    def iter_departments(self, org_id: int, limit: int = 100) -> Iterator[dict]:
+        return self._through(org_id, "departments",
+                             lambda: self.client.iter_departments(org_id, limit))
+
+    def group_members(self, org_id: int, group_id) -> dict:
+        return self.client.group_members(org_id, group_id)
+
+    def close(self) -> None:
+        self.client.close()
+
+    def _through(self, org_id: int, kind: str,
+                 fetch: Callable[[], Iterable[dict]]) -> Iterator[dict]:
+        info = self.store.snapshot_info(org_id, kind)
+        if info is not None and not self.refresh and info["age_hours"] < self.ttl_hours:
+            log.info("Справочник (%s): берём локальную копию, полученную "
+                     "%.1f ч назад (%s записей).", KIND_RU.get(kind, kind),
+                     info["age_hours"], info["items"])
+            yield from self.store.load_snapshot(org_id, kind)
+            return
+        try:
+            items = list(fetch())
+        except HttpError as exc:
+            if info is None:
+                raise
+            log.warning("Справочник (%s) не ответил: %s. Работаем по локальной "
+                        "копии, полученной %.1f ч назад.", KIND_RU.get(kind, kind),
+                        exc, info["age_hours"])
+            yield from self.store.load_snapshot(org_id, kind)
+            return
+        counts = self.store.save_snapshot(org_id, kind, items,
+                                          allow_empty=self.allow_empty)
+        if counts is None:
+            log.warning("Справочник (%s) вернул пустой список, а в локальной "
+                        "копии %s записей. Копию не заменяем и работаем по ней; "
+                        "если организация действительно пуста, запустите с "
+                        "--allow-empty-directory.", KIND_RU.get(kind, kind),
+                        info["items"])
+            yield from self.store.load_snapshot(org_id, kind)
+            return
+        self.store.commit()
+        if info is not None:
+            log.info("Справочник (%s) обновлён: появилось %s, изменилось %s, "
+                     "исчезло %s.", KIND_RU.get(kind, kind), counts["added"],
+                     counts["changed"], counts["removed"])
+        yield from items
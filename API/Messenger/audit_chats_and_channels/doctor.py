@@ -4,6 +4,7 @@ import logging
 from datetime import datetime, timedelta, timezone
 
 from clients import Api360Client, AuditLogClient, DirectoryClient
+from directory_store import KIND_RU, SNAPSHOT_KINDS, DirectoryStore
 from http_base import HttpError
 from store import EventStore
 
@@ -105,11 +106,14 @@ def run_doctor(cfg) -> None:
         _probe("группы", lambda: f"{len(list(_take(directory.iter_groups(cfg.org_id), 3)))} шт. (проба)")
         _probe("подразделения", lambda: f"{len(list(_take(directory.iter_departments(cfg.org_id), 3)))} шт. (проба)")
 
+        print("\nЛокальная копия справочника")
+        snapshot_users = _print_snapshots(cfg)
+
         # Номера сотрудников — персональные данные, поэтому в вывод они не
         # попадают: сравниваем только форму записи. Вывод doctor часто
         # копируют в переписку и тикеты.
         print("\nСверка номеров сотрудников")
-        sample = directory_users or api360_users
+        sample = directory_users or api360_users or snapshot_users
         if not sample:
             print("  Пропущена: сведений о сотрудниках получить не удалось.")
         else:
@@ -156,6 +160,34 @@ def run_doctor(cfg) -> None:
         api360.close()
 
 
+def _print_snapshots(cfg) -> list[dict]:
+    """Сколько записей в копии и насколько она свежая; -> несколько
+    сотрудников из копии для сверки номеров, если сервис не ответил."""
+    directory_store = DirectoryStore(cfg.db_path)
+    try:
+        sample: list[dict] = []
+        for kind in SNAPSHOT_KINDS:
+            info = directory_store.snapshot_info(cfg.org_id, kind)
+            if info is None:
+                continue
+            state = ("свежая" if info["age_hours"] < cfg.directory_ttl_hours
+                     else "устарела, обновится при следующем analyze")
+            changes = directory_store.recent_changes(cfg.org_id, kind, limit=1000)
+            last = [item for item in changes
+                    if item["detected_at"] == info["fetched_at"]]
+            print(f"  {KIND_RU[kind]}: {info['items']}, получена "
+                  f"{info['age_hours']:.1f} ч назад — {state}"
+                  + (f"; при обновлении изменилось {len(last)}" if last else ""))
+            if kind.endswith("users") and not sample:
+                sample = directory_store.load_snapshot(cfg.org_id, kind, limit=5)
+        if not any(directory_store.snapshot_info(cfg.org_id, kind)
+                   for kind in SNAPSHOT_KINDS):
+            print("  Пока нет: появится после первого analyze.")
+        return sample
+    finally:
+        directory_store.close()
+
+
 def _take(iterator, count: int):
     for index, item in enumerate(iterator):
         if index >= count:
@@ -164,13 +196,9 @@ def _take(iterator, count: int):
 
 
 def _audit_object_uids(store: EventStore, limit: int = 5) -> set[str]:
-    import json
     found: set[str] = set()
-    cursor = store.conn.execute(
-        "SELECT payload FROM raw_events "
-        "WHERE type='messenger_chat.member.added' LIMIT 200")
-    for row in cursor:
-        meta = (json.loads(row["payload"]).get("event") or {}).get("meta") or {}
+    for enriched in store.iter_payloads("messenger_chat.member.added", limit=200):
+        meta = (enriched.get("event") or {}).get("meta") or {}
         uid = meta.get("object_uid")
         if uid:
             found.add(str(uid))
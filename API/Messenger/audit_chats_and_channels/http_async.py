@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+import httpx
+
+from http_base import HTTP_STATS, HttpError, record_response, retry_after
+
+log = logging.getLogger("http")
+
+
+class RateLimiter:
+    """Token bucket: не больше rate запросов в секунду с запасом burst.
+
+    Один экземпляр делят все клиенты сессии, поэтому аудит-лог,
+    справочник и составы групп из api360, загружаемые вместе со сбором,
+    укладываются в общий бюджет. После ответа 429 бюджет ставится на паузу
+    для всех."""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = max(rate, 0.1)
+        self.capacity = float(burst or max(1, int(self.rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AsyncSession:
+    """Общий пул соединений и общий бюджет запросов для async-клиентов."""
+
+    def __init__(self, *, rps: float = 10.0, max_connections: int = 20):
+        self.limiter = RateLimiter(rps)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+        )
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class AsyncBaseClient:
+    """Асинхронный вариант BaseClient: те же ретраи на 429/5xx, но пул
+    соединений и лимит запросов берутся из общей AsyncSession. Токен
+    передаётся в заголовке каждого запроса — так одна сессия обслуживает
+    клиентов с разными токенами."""
+
+    def __init__(self, session: AsyncSession, base_url: str, token: str,
+                 *, max_retries: int = 5):
+        self.session = session
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self._headers = {"Authorization": f"OAuth {token}"}
+
+    async def get(self, path: str, params: dict | None = None) -> dict:
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        backoff = 1.0
+        for attempt in range(1, self.max_retries + 1):
+            await self.session.limiter.acquire()
+            try:
+                resp = await self.session.client.get(url, params=params,
+                                                     headers=self._headers)
+            except httpx.TransportError as exc:
+                HTTP_STATS.add(requests=1, retries=1, errors=1)
+                log.warning("GET %s transport error (%s/%s): %s",
+                            url, attempt, self.max_retries, exc)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+
+            record_response(resp)
+            if resp.status_code == 200:
+                return resp.json()
+            if resp.status_code in (429, 500, 502, 503, 504):
+                delay = retry_after(resp, backoff)
+                log.warning("GET %s -> %s (%s/%s), retry in %.1fs",
+                            url, resp.status_code, attempt, self.max_retries, delay)
+                if resp.status_code == 429:
+                    self.session.limiter.pause(delay)
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, 30)
+                continue
+            raise HttpError(f"GET {url} -> {resp.status_code}: {resp.text[:500]}")
+
+        raise HttpError(f"GET {url} failed after {self.max_retries} retries")
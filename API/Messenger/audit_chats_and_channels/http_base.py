@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import logging
+import threading
 import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 import httpx
 
@@ -12,12 +15,71 @@ class HttpError(Exception):
     """Неретраибельная ошибка HTTP (4xx кроме 429) или исчерпание ретраев."""
 
 
+def retry_after(resp: httpx.Response, default: float) -> float:
+    """Пауза из заголовка Retry-After (секунды или дата), иначе default."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+class HttpStats:
+    """Счётчики HTTP за процесс: запросы, повторы, ответы 429, байты.
+
+    Общий экземпляр HTTP_STATS пополняют и синхронные, и async-клиенты;
+    замер этапа — разница двух snapshot()."""
+
+    FIELDS = ("requests", "retries", "throttled", "errors", "bytes")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                self._counts[name] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+    @staticmethod
+    def delta(before: dict, after: dict) -> dict:
+        return {name: after[name] - before.get(name, 0) for name in after}
+
+
+HTTP_STATS = HttpStats()
+
+
+def record_response(resp: httpx.Response) -> None:
+    """Учитывает ответ в HTTP_STATS: 429 и 5xx идут в повторы,
+    остальные коды от 400 — в ошибки."""
+    retry = resp.status_code in (429, 500, 502, 503, 504)
+    HTTP_STATS.add(requests=1, bytes=len(resp.content),
+                   retries=int(retry), throttled=int(resp.status_code == 429),
+                   errors=int(resp.status_code >= 400 and not retry))
+
+
 class BaseClient:
-    """Синхронный HTTP-клиент с ретраями на 429/5xx и явными таймаутами."""
+    """Синхронный HTTP-клиент с ретраями на 429/5xx и явными таймаутами.
+
+    Клиент можно делить между потоками. После ответа 429 пауза общая:
+    остальные потоки тоже ждут, а не добивают лимит своими запросами."""
 
     def __init__(self, base_url: str, token: str, *, max_retries: int = 5):
         self.base_url = base_url.rstrip("/")
         self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._not_before = 0.0
         self._client = httpx.Client(
             timeout=httpx.Timeout(30.0, connect=10.0),
             headers={"Authorization": f"OAuth {token}"},
@@ -27,26 +89,41 @@ class BaseClient:
         url = path if path.startswith("http") else f"{self.base_url}{path}"
         backoff = 1.0
         for attempt in range(1, self.max_retries + 1):
+            self._wait_cooldown()
             try:
                 resp = self._client.get(url, params=params)
             except httpx.TransportError as exc:
+                HTTP_STATS.add(requests=1, retries=1, errors=1)
                 log.warning("GET %s transport error (%s/%s): %s",
                             url, attempt, self.max_retries, exc)
                 time.sleep(backoff)
                 backoff = min(backoff * 2, 30)
                 continue
 
+            record_response(resp)
             if resp.status_code == 200:
                 return resp.json()
             if resp.status_code in (429, 500, 502, 503, 504):
+                delay = retry_after(resp, backoff)
                 log.warning("GET %s -> %s (%s/%s), retry in %.1fs",
-                            url, resp.status_code, attempt, self.max_retries, backoff)
-                time.sleep(backoff)
+                            url, resp.status_code, attempt, self.max_retries, delay)
+                if resp.status_code == 429:
+                    self._cooldown(delay)
+                time.sleep(delay)
                 backoff = min(backoff * 2, 30)
                 continue
             raise HttpError(f"GET {url} -> {resp.status_code}: {resp.text[:500]}")
 
         raise HttpError(f"GET {url} failed after {self.max_retries} retries")
 
+    def _cooldown(self, seconds: float) -> None:
+        with self._lock:
+            self._not_before = max(self._not_before, time.monotonic() + seconds)
+
+    def _wait_cooldown(self) -> None:
+        delay = self._not_before - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
     def close(self) -> None:
         self._client.close()
@@ -1,20 +1,59 @@
 from __future__ import annotations
 
+import hashlib
 import logging
 import sqlite3
 from datetime import datetime, timezone
 
 log = logging.getLogger("identity")
 
+_UPSERT_USER = """
+    INSERT INTO identity_cache(uid, login, full_name, position, is_robot,
+                               is_dismissed, source, updated_at, sync_hash)
+    VALUES(?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(uid) DO UPDATE SET
+        login=COALESCE(excluded.login, identity_cache.login),
+        full_name=COALESCE(excluded.full_name, identity_cache.full_name),
+        position=COALESCE(excluded.position, identity_cache.position),
+        is_robot=MAX(excluded.is_robot, identity_cache.is_robot),
+        is_dismissed=excluded.is_dismissed,
+        source=excluded.source,
+        updated_at=excluded.updated_at,
+        sync_hash=excluded.sync_hash
+"""
+_UPSERT_ALIAS = (
+    "INSERT INTO identity_alias(alias, uid, source, updated_at) "
+    "VALUES(?,?,?,?) ON CONFLICT(alias) DO UPDATE SET "
+    "uid=excluded.uid, source=excluded.source, updated_at=excluded.updated_at")
+
+
+def _user_row(uid, login, full_name, position, is_robot, is_dismissed,
+              source) -> tuple:
+    return (str(uid), login, full_name, position,
+            1 if is_robot else 0, 1 if is_dismissed else 0, source)
+
+
+def _row_hash(row: tuple) -> str:
+    return hashlib.blake2b(repr(row).encode("utf-8"), digest_size=12).hexdigest()
+
 
 class IdentityStore:
     """Персистентный кэш uid <-> login/email. Пополняется из всех источников,
-    никогда не забывает (важно для уволенных и внешних участников)."""
+    никогда не забывает (важно для уволенных и внешних участников).
+
+    stage_user/stage_alias копят записи в памяти, commit пишет их пачкой
+    в одной транзакции. Запись, пришедшая с тем же содержимым, что и в
+    прошлый раз (sync_hash), не переписывается — при ежедневном запуске
+    справочник почти не меняется, и база почти не трогается."""
 
     def __init__(self, db_path: str):
         self.conn = sqlite3.connect(db_path)
         self.conn.row_factory = sqlite3.Row
         self._init_schema()
+        self._pending_users: list[tuple] = []
+        self._pending_aliases: list[tuple] = []
+        self._known_hashes: dict[str, str] | None = None
+        self._known_aliases: dict[str, tuple] | None = None
 
     def _init_schema(self) -> None:
         self.conn.executescript(
@@ -36,43 +75,89 @@ class IdentityStore:
                 updated_at TEXT NOT NULL
             );
             CREATE INDEX IF NOT EXISTS idx_alias_uid ON identity_alias(uid);
+            CREATE INDEX IF NOT EXISTS idx_identity_login
+                ON identity_cache(login COLLATE NOCASE);
             """
         )
+        columns = {row["name"] for row in
+                   self.conn.execute("PRAGMA table_info(identity_cache)")}
+        if "sync_hash" not in columns:          # база от прежних версий
+            self.conn.execute("ALTER TABLE identity_cache ADD COLUMN sync_hash TEXT")
         self.conn.commit()
 
     def upsert_user(self, uid: str, *, login: str | None = None,
                     full_name: str | None = None, position: str | None = None,
                     is_robot: bool = False, is_dismissed: bool = False,
                     source: str = "unknown") -> None:
-        now = datetime.now(timezone.utc).isoformat()
-        self.conn.execute(
-            """
-            INSERT INTO identity_cache(uid, login, full_name, position, is_robot,
-                                       is_dismissed, source, updated_at)
-            VALUES(?,?,?,?,?,?,?,?)
-            ON CONFLICT(uid) DO UPDATE SET
-                login=COALESCE(excluded.login, identity_cache.login),
-                full_name=COALESCE(excluded.full_name, identity_cache.full_name),
-                position=COALESCE(excluded.position, identity_cache.position),
-                is_robot=MAX(excluded.is_robot, identity_cache.is_robot),
-                is_dismissed=excluded.is_dismissed,
-                source=excluded.source,
-                updated_at=excluded.updated_at
-            """,
-            (str(uid), login, full_name, position,
-             1 if is_robot else 0, 1 if is_dismissed else 0, source, now))
+        row = _user_row(uid, login, full_name, position, is_robot, is_dismissed,
+                        source)
+        digest = _row_hash(row)
+        self.conn.execute(_UPSERT_USER, (*row, datetime.now(timezone.utc).isoformat(),
+                                         digest))
+        if self._known_hashes is not None:
+            self._known_hashes[row[0]] = digest
 
     def upsert_alias(self, alias: str, uid: str, source: str = "unknown") -> None:
         if not alias or not uid:
             return
-        self.conn.execute(
-            "INSERT INTO identity_alias(alias, uid, source, updated_at) "
-            "VALUES(?,?,?,?) ON CONFLICT(alias) DO UPDATE SET "
-            "uid=excluded.uid, source=excluded.source, updated_at=excluded.updated_at",
-            (alias.strip().casefold(), str(uid), source,
-             datetime.now(timezone.utc).isoformat()))
+        alias = alias.strip().casefold()
+        self.conn.execute(_UPSERT_ALIAS, (alias, str(uid), source,
+                                          datetime.now(timezone.utc).isoformat()))
+        if self._known_aliases is not None:
+            self._known_aliases[alias] = (str(uid), source)
+
+    # ------------------------------------------------------------------
+    def stage_user(self, uid: str, *, login: str | None = None,
+                   full_name: str | None = None, position: str | None = None,
+                   is_robot: bool = False, is_dismissed: bool = False,
+                   source: str = "unknown") -> None:
+        """То же, что upsert_user, но запись уходит в базу при commit."""
+        self._pending_users.append(_user_row(
+            uid, login, full_name, position, is_robot, is_dismissed, source))
+
+    def stage_alias(self, alias: str, uid: str, source: str = "unknown") -> None:
+        if not alias or not uid:
+            return
+        self._pending_aliases.append((alias.strip().casefold(), str(uid), source))
+
+    def flush(self) -> tuple[int, int]:
+        """Пишет накопленное; -> (записано сотрудников, записано адресов)."""
+        if not self._pending_users and not self._pending_aliases:
+            return 0, 0
+        if self._known_hashes is None:
+            self._known_hashes = dict(self._plain(
+                "SELECT uid, sync_hash FROM identity_cache"))
+            self._known_aliases = {alias: (uid, source) for alias, uid, source in
+                                   self._plain("SELECT alias, uid, source "
+                                               "FROM identity_alias")}
+        now = datetime.now(timezone.utc).isoformat()
+        users = []
+        for row in self._pending_users:
+            digest = _row_hash(row)
+            if self._known_hashes.get(row[0]) != digest:
+                self._known_hashes[row[0]] = digest
+                users.append((*row, now, digest))
+        aliases = []
+        for alias, uid, source in self._pending_aliases:
+            if self._known_aliases.get(alias) != (uid, source):
+                self._known_aliases[alias] = (uid, source)
+                aliases.append((alias, uid, source, now))
+        self._pending_users.clear()
+        self._pending_aliases.clear()
+        self.conn.executemany(_UPSERT_USER, users)
+        self.conn.executemany(_UPSERT_ALIAS, aliases)
+        return len(users), len(aliases)
+
+    def _plain(self, sql: str) -> sqlite3.Cursor:
+        cur = self.conn.execute(sql)
+        cur.row_factory = None          # кортежи вместо Row: заметно быстрее
+        return cur
 
     def commit(self) -> None:
+        users, aliases = self.flush()
+        if users or aliases:
+            log.debug("Кэш сотрудников: обновлено записей %s, адресов %s.",
+                      users, aliases)
         self.conn.commit()
 
     def load_all(self) -> tuple[dict, dict]:
@@ -83,6 +168,29 @@ class IdentityStore:
                    self.conn.execute("SELECT alias, uid FROM identity_alias")}
         return users, aliases
 
+    def uid_for(self, alias: str) -> str | None:
+        """uid по логину или адресу, если связка уже встречалась."""
+        row = self.conn.execute(
+            "SELECT uid FROM identity_alias WHERE alias=?",
+            (alias.strip().casefold(),)).fetchone()
+        if row is None:
+            row = self.conn.execute(
+                "SELECT uid FROM identity_cache WHERE login=? COLLATE NOCASE",
+                (alias.strip(),)).fetchone()
+        return row["uid"] if row else None
+
+    def logins_for(self, uids) -> dict[str, str]:
+        """Известные логины для набора uid."""
+        uids = [str(uid) for uid in uids]
+        found: dict[str, str] = {}
+        for start in range(0, len(uids), 500):
+            chunk = uids[start:start + 500]
+            for row in self.conn.execute(
+                    f"SELECT uid, login FROM identity_cache WHERE login IS NOT NULL "
+                    f"AND uid IN ({','.join('?' * len(chunk))})", chunk):
+                found[row["uid"]] = row["login"]
+        return found
+
     def stats(self) -> dict:
         users = self.conn.execute(
             "SELECT COUNT(*) c FROM identity_cache").fetchone()["c"]
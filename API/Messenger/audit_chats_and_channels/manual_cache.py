@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import logging
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+import manual_import
+from manual_import import (ManualChat, ManualImportResult, ManualRow, load_manual,
+                           resolve_manual_path)
+from run_layout import file_fingerprint
+
+log = logging.getLogger("manual")
+
+# сколько разных разборов держать; старые вытесняются по времени использования
+MANUAL_CACHE_KEEP = 4
+
+
+class ManualCache:
+    """Разобранные ручные таблицы между запусками.
+
+    Разбор выгрузки на сотни тысяч строк занимает минуты, а таблица между
+    запусками обычно та же. Результат хранится сжатым JSON и ищется по
+    отпечатку файла, настройкам разбора (лист, часовой пояс, смысл дат) и
+    отпечатку кода разбора: после правки manual_import.py старые разборы
+    больше не находятся и удаляются при открытии."""
+
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS manual_import_cache (
+                cache_key TEXT PRIMARY KEY,
+                sha1      TEXT NOT NULL,
+                rows      INTEGER NOT NULL,
+                body      BLOB NOT NULL,
+                parsed_at TEXT NOT NULL,
+                used_at   TEXT NOT NULL
+            );
+            """
+        )
+        # разборы прежних версий кода (и прежнего формата) больше не нужны
+        self.conn.execute(
+            "DELETE FROM manual_import_cache WHERE substr(cache_key, 1, ?) <> ?",
+            (len(_version_prefix()), _version_prefix()))
+        self.conn.commit()
+
+    @staticmethod
+    def cache_key(fingerprint: dict, *, sheet: Optional[str], tz_offset: str,
+                  date_semantics: str) -> str:
+        return json.dumps([parser_version(), fingerprint["sha1"],
+                           fingerprint["size"], sheet, tz_offset, date_semantics])
+
+    def get(self, key: str) -> Optional[ManualImportResult]:
+        row = self.conn.execute(
+            "SELECT body FROM manual_import_cache WHERE cache_key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            result = _decode(json.loads(zlib.decompress(row["body"])))
+        except Exception as exc:        # испорченная запись — просто разберём заново
+            log.warning("Сохранённый разбор таблицы не читается (%s), "
+                        "читаем файл заново.", exc)
+            return None
+        self.conn.execute("UPDATE manual_import_cache SET used_at=? WHERE cache_key=?",
+                          (_now(), key))
+        self.conn.commit()
+        return result
+
+    def put(self, key: str, sha1: str, result: ManualImportResult) -> None:
+        body = zlib.compress(json.dumps(_encode(result), ensure_ascii=False,
+                                        separators=(",", ":")).encode("utf-8"), 6)
+        now = _now()
+        self.conn.execute(
+            "INSERT INTO manual_import_cache "
+            "(cache_key, sha1, rows, body, parsed_at, used_at) VALUES (?,?,?,?,?,?) "
+            "ON CONFLICT(cache_key) DO UPDATE SET body=excluded.body, "
+            "rows=excluded.rows, parsed_at=excluded.parsed_at, used_at=excluded.used_at",
+            (key, sha1, result.rows_total, body, now, now))
+        self.conn.execute(
+            "DELETE FROM manual_import_cache WHERE cache_key NOT IN ("
+            "SELECT cache_key FROM manual_import_cache ORDER BY used_at DESC LIMIT ?)",
+            (MANUAL_CACHE_KEEP,))
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@functools.lru_cache(maxsize=None)
+def parser_version() -> str:
+    """Отпечаток кода разбора и формата хранения: manual_import.py и этого
+    файла. Любая их правка сама делает прежние разборы недействительными."""
+    digest = hashlib.blake2b(digest_size=8)
+    for module_file in (manual_import.__file__, __file__):
+        with open(module_file, "rb") as handle:
+            digest.update(handle.read())
+    return digest.hexdigest()
+
+
+def _version_prefix() -> str:
+    return json.dumps([parser_version()])[:-1]
+
+
+def _date_text(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _date_value(text: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(text) if text else None
+
+
+def _encode(result: ManualImportResult) -> dict:
+    """ManualImportResult -> словари и списки для JSON (без source_file)."""
+    chats = {}
+    for key, chat in result.chats.items():
+        chats[key] = {
+            "chat_name": chat.chat_name, "chat_type": chat.chat_type,
+            "description": chat.description, "manual_key": chat.manual_key,
+            "created_at": _date_text(chat.created_at),
+            "members": {identity: {**vars(row), "date": _date_text(row.date)}
+                        for identity, row in chat.members.items()}}
+    return {"chats": chats, "rows_total": result.rows_total,
+            "rows_ok": result.rows_ok, "errors": result.errors,
+            "conflicts": result.conflicts, "quality_issues": result.quality_issues}
+
+
+def _decode(data: dict) -> ManualImportResult:
+    chats = {}
+    for key, chat in data["chats"].items():
+        members = {identity: ManualRow(**{**row, "date": _date_value(row["date"])})
+                   for identity, row in chat["members"].items()}
+        chats[key] = ManualChat(**{**chat, "created_at": _date_value(chat["created_at"]),
+                                   "members": members})
+    return ManualImportResult(
+        chats=chats, rows_total=data["rows_total"], rows_ok=data["rows_ok"],
+        errors=[tuple(error) for error in data["errors"]],
+        conflicts=data["conflicts"], quality_issues=data["quality_issues"])
+
+
+def load_manual_cached(path: str, *, db_path: Optional[str], sheet: Optional[str] = None,
+                       tz_offset: str = "+00:00",
+                       date_semantics: str = "member_added") -> ManualImportResult:
+    """load_manual с кэшем в db_path. Без db_path — обычный разбор."""
+    if not db_path:
+        return load_manual(path, sheet=sheet, tz_offset=tz_offset,
+                           date_semantics=date_semantics)
+    resolved = resolve_manual_path(path)
+    fingerprint = file_fingerprint(resolved)
+    key = ManualCache.cache_key(fingerprint, sheet=sheet, tz_offset=tz_offset,
+                                date_semantics=date_semantics)
+    cache = ManualCache(db_path)
+    try:
+        result = cache.get(key)
+        if result is not None:
+            result.source_file = resolved
+            log.info("Таблица не менялась с прошлого разбора — взяли готовый: "
+                     "строк %s, чатов %s.", result.rows_total, len(result.chats))
+            return result
+        result = load_manual(resolved, sheet=sheet, tz_offset=tz_offset,
+                             date_semantics=date_semantics)
+        cache.put(key, fingerprint["sha1"], result)
+        return result
+    finally:
+        cache.close()
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from clients_async import AsyncApi360Client, AsyncAuditLogClient, AsyncDirectoryClient
+from collector import SlicedCollector, collect_window
+from http_async import AsyncSession
+from http_base import HttpError
+from projection import CHAT_EVENT_TYPES
+from store import BATCH, EventStore
+
+log = logging.getLogger("prefetch")
+
+
+class PrefetchedDirectory:
+    """Справочник, загруженный заранее. Отдаёт те же iter_*, что и
+    DirectoryClient, поэтому DirectoryResolver работает с ним без изменений.
+    Ошибка загрузки откладывается до обращения — резолвер обработает её
+    так же, как ошибку живого запроса.
+
+    group_members — составы групп из api360 по id группы; cmd_collect_async
+    кладёт их в кэш составов, и разворот групп берёт их оттуда."""
+
+    def __init__(self) -> None:
+        self.users: list[dict] = []
+        self.groups: list[dict] = []
+        self.departments: list[dict] = []
+        self.group_members: dict[str, dict] = {}
+        self.errors: dict[str, HttpError] = {}
+
+    def _replay(self, name: str, items: list[dict]):
+        if name in self.errors:
+            raise self.errors[name]
+        yield from items
+
+    def iter_users(self, org_id: int, limit: int = 100):
+        return self._replay("users", self.users)
+
+    def iter_groups(self, org_id: int, limit: int = 100):
+        return self._replay("groups", self.groups)
+
+    def iter_departments(self, org_id: int, limit: int = 100):
+        return self._replay("departments", self.departments)
+
+    def close(self) -> None:
+        pass
+
+
+async def _fill(target: list[dict], iterator, name: str,
+                directory: PrefetchedDirectory) -> None:
+    try:
+        async for item in iterator:
+            target.append(item)
+    except HttpError as exc:
+        directory.errors[name] = exc
+
+
+async def _fill_group_members(target: PrefetchedDirectory,
+                              api360: AsyncApi360Client, org_id: int,
+                              fresh: set[str], workers: int) -> None:
+    """Составы всех групп организации, кроме свежих в кэше. Ошибку по
+    отдельной группе не поднимаем: её состав запросит сам резолвер."""
+    limit = asyncio.Semaphore(max(1, workers))
+
+    async def one(gid: str) -> None:
+        async with limit:
+            try:
+                target.group_members[gid] = await api360.group_members(org_id, gid)
+            except HttpError as exc:
+                log.warning("Состав группы %s заранее получить не удалось: %s",
+                            gid, exc)
+
+    async with asyncio.TaskGroup() as group:
+        for gid in sorted({str(item["id"]) for item in target.groups} - fresh):
+            group.create_task(one(gid))
+
+
+async def _fetch(cfg, store: EventStore, audit: AsyncAuditLogClient,
+                 item: tuple[str, str], types: list[str],
+                 writing: asyncio.Lock) -> int:
+    """Листает одно окно. Запись в SQLite блокирующая, поэтому уходит в
+    рабочий поток и не держит остальные корутины; writing не даёт двум
+    потокам писать в одно соединение сразу."""
+    inserted = 0
+    batch: list[dict] = []
+    async for event in audit.iter_events(cfg.org_id, item[0], item[1], types):
+        batch.append(event)
+        if len(batch) >= BATCH:
+            async with writing:
+                inserted += await asyncio.to_thread(store.upsert_events, batch)
+            batch = []
+    async with writing:
+        inserted += await asyncio.to_thread(store.upsert_events, batch)
+    return inserted
+
+
+async def _run_plan(cfg, collector: SlicedCollector, audit: AsyncAuditLogClient,
+                    writing: asyncio.Lock) -> int:
+    plan = collector.pending_plan()
+    todo = collector.todo_slices(plan)
+    limit = asyncio.Semaphore(collector.workers)
+    inserted = 0
+
+    async def one(item: tuple[str, str]) -> None:
+        nonlocal inserted
+        async with limit:
+            count = await _fetch(cfg, collector.store, audit, item,
+                                 plan["types"], writing)
+            inserted += count
+            async with writing:
+                await asyncio.to_thread(collector.mark_done, item)
+
+    async with asyncio.TaskGroup() as group:
+        for item in todo:
+            group.create_task(one(item))
+    collector.finish_plan()
+    return inserted
+
+
+async def _collect(cfg, store: EventStore, audit: AsyncAuditLogClient) -> int:
+    """То же, что cmd_collect, но отрезки окна листаются корутинами.
+    Короткое окно листается целиком, длинное делится на отрезки — по тому
+    же правилу needs_slicing. План и отметки о готовых отрезках общие с
+    SlicedCollector, так что прерванную загрузку можно продолжить любым из
+    двух способов."""
+    collector = SlicedCollector(None, store, cfg.org_id,
+                                workers=cfg.collect_workers,
+                                slice_hours=cfg.slice_hours)
+    writing = asyncio.Lock()
+    inserted = 0
+    if collector.pending_plan():
+        inserted += await _run_plan(cfg, collector, audit, writing)
+        newest = store.max_occurred_at()
+        if newest:
+            store.set_checkpoint(newest)
+    now = datetime.now(timezone.utc)
+    started = collect_window(cfg, store, now)
+    if not collector.needs_slicing(started, now):
+        return inserted + await _fetch(cfg, store, audit,
+                                       (started.isoformat(), now.isoformat()),
+                                       CHAT_EVENT_TYPES, writing)
+    collector.start_plan(started, now, CHAT_EVENT_TYPES)
+    inserted += await _run_plan(cfg, collector, audit, writing)
+    return inserted
+
+
+async def collect_and_prefetch(cfg, store: EventStore, *,
+                               users: bool = True, groups: bool = False,
+                               fresh_groups: set[str] | None = None,
+                               session: AsyncSession | None = None,
+                               ) -> tuple[int, PrefetchedDirectory]:
+    """Сбор событий и загрузка справочника идут одновременно через одну
+    сессию: общий пул соединений и общий бюджет запросов (HTTP_RPS).
+
+    fresh_groups — группы со свежим составом в кэше; если задано, составы
+    остальных групп организации загружаются здесь же, через api360 и тот
+    же бюджет. None — составы не нужны."""
+    session = session or AsyncSession(rps=cfg.http_rps)
+    audit = AsyncAuditLogClient(session, cfg.audit_base, cfg.audit_token)
+    directory = AsyncDirectoryClient(session, cfg.directory_base,
+                                     cfg.directory_token)
+    api360 = AsyncApi360Client(session, cfg.api360_base, cfg.directory_token)
+    prefetched = PrefetchedDirectory()
+
+    async def groups_and_members() -> None:
+        await _fill(prefetched.groups, directory.iter_groups(cfg.org_id),
+                    "groups", prefetched)
+        if fresh_groups is not None and "groups" not in prefetched.errors:
+            await _fill_group_members(prefetched, api360, cfg.org_id,
+                                      fresh_groups, cfg.expand_workers)
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            collecting = group.create_task(_collect(cfg, store, audit))
+            if users:
+                group.create_task(_fill(prefetched.users,
+                                        directory.iter_users(cfg.org_id),
+                                        "users", prefetched))
+            if groups or fresh_groups is not None:
+                group.create_task(groups_and_members())
+            if groups:
+                group.create_task(_fill(prefetched.departments,
+                                        directory.iter_departments(cfg.org_id),
+                                        "departments", prefetched))
+    finally:
+        await session.aclose()
+    log.info("Справочник загружен заранее: сотрудников %s, групп %s, "
+             "подразделений %s, составов групп %s.", len(prefetched.users),
+             len(prefetched.groups), len(prefetched.departments),
+             len(prefetched.group_members))
+    return collecting.result(), prefetched
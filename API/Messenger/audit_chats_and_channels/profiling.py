@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import resource
+except ImportError:                   # Windows
+    resource = None
+
+log = logging.getLogger("profile")
+
+PROFILE_DIR = "profile"            # папка cProfile внутри папки запуска
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковая память процесса в МБ; None, если система её не сообщает."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+class StageTimer:
+    """Замеры по этапам прогона: настенное и процессорное время.
+
+    С profile_dir каждый этап дополнительно снимается cProfile; в папку
+    кладутся <этап>.prof (для pstats/snakeviz) и <этап>.txt с первыми
+    строками отчёта по суммарному времени. С http_stats (см.
+    http_base.HttpStats) к этапу прикладываются его HTTP-счётчики."""
+
+    def __init__(self, profile_dir: Optional[str] = None, http_stats=None):
+        self.profile_dir = profile_dir
+        self.http_stats = http_stats
+        self.stages: list[dict] = []
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self._http_started = http_stats.snapshot() if http_stats else None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        profiler = cProfile.Profile() if self.profile_dir else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        http = self.http_stats.snapshot() if self.http_stats else None
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            entry = {"stage": name,
+                     "wall_s": round(time.perf_counter() - wall, 3),
+                     "cpu_s": round(time.process_time() - cpu, 3),
+                     "peak_rss_mb": peak_rss_mb()}
+            if http is not None:
+                entry["http"] = self.http_stats.delta(http, self.http_stats.snapshot())
+            self.stages.append(entry)
+            log.debug("Этап %s: %.1f с (процессор %.1f с).",
+                      name, entry["wall_s"], entry["cpu_s"])
+            if profiler:
+                self._dump(name, profiler)
+
+    def _dump(self, name: str, profiler: cProfile.Profile) -> None:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, f"{len(self.stages):02d}_{name}")
+        profiler.dump_stats(base + ".prof")
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(40)
+        with open(base + ".txt", "w", encoding="utf-8") as handle:
+            handle.write(text.getvalue())
+
+    def report(self) -> dict:
+        http = None
+        if self.http_stats:
+            http = self.http_stats.delta(self._http_started,
+                                         self.http_stats.snapshot())
+        return {
+            "wall_s": round(time.perf_counter() - self._started, 3),
+            "cpu_s": round(time.process_time() - self._cpu_started, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": self.stages,
+            "http": http or {},
+            "profile_dir": self.profile_dir,
+        }
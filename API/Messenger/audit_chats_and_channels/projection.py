@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+import zlib
 from dataclasses import dataclass, field
 from typing import Iterable, Optional
 
@@ -32,6 +33,16 @@ def normalize_chat_id(raw: Optional[str]) -> Optional[str]:
     return raw.rsplit("/", 1)[-1]
 
 
+def chat_partition(raw: Optional[str], parts: int) -> int:
+    """Номер части 0..parts-1, к которой относятся события чата raw.
+    Считается по ключу normalize_chat_id, поэтому оба написания личного
+    чата попадают в одну часть; -1 — событие без чата."""
+    key = normalize_chat_id(raw)
+    if not key:
+        return -1
+    return zlib.crc32(key.encode("utf-8")) % parts
+
+
 @dataclass
 class MemberState:
     uid: Optional[str] = None
@@ -96,9 +107,68 @@ def _extract_id(meta: dict, *candidates: str) -> Optional[str]:
     return None
 
 
-def build_projection(events_ordered: Iterable[dict]) -> dict[str, ChatState]:
-    """Проигрывает события в хронологическом порядке -> состояние чатов."""
-    chats: dict[str, ChatState] = {}
+# Поля события, которые читает build_projection. Компактная база событий
+# хранит их отдельными колонками в этом порядке.
+EVENT_FIELDS = ("object_uid", "member_role", "member_is_robot", "chat_name",
+                "chat_description", "chat_type", "chat_is_thread",
+                "group_id", "department_id")
+
+_GROUP_KEYS = ("group_id", "object_id", "object_group_id")
+_DEPARTMENT_KEYS = ("department_id", "object_id", "object_department_id")
+
+
+def event_fields(enriched: dict) -> tuple:
+    """Достаёт из события поля для проигрывания (порядок EVENT_FIELDS)."""
+    ev = enriched.get("event", {}) or {}
+    meta = ev.get("meta") or {}
+    etype = ev.get("type") or ""
+    info = meta.get("chat_info") or {}
+    member_info = meta.get("member_info") or {}
+    is_robot = member_info.get("is_robot")
+    return (
+        _extract_id(meta, "object_uid"),
+        member_info.get("role"),
+        None if is_robot is None else int(bool(is_robot)),
+        info.get("name"),
+        info.get("description"),
+        info.get("type"),
+        1 if info.get("is_thread") else 0,
+        _extract_id(meta, *_GROUP_KEYS) if "group" in etype else None,
+        _extract_id(meta, *_DEPARTMENT_KEYS) if "department" in etype else None,
+    )
+
+
+def event_from_fields(idempotency_id: str, occurred_at: str, etype: str,
+                      chat_id: Optional[str], uid: Optional[str],
+                      user_login: Optional[str], *fields) -> dict:
+    """Собирает событие из колонок компактной базы. build_projection
+    получает его в том же виде, что и исходное, без разбора JSON."""
+    (object_uid, role, is_robot, name, description, chat_type, is_thread,
+     group_id, department_id) = fields
+    meta: dict = {
+        "chat_id": chat_id,
+        "chat_info": {"name": name, "description": description,
+                      "type": chat_type, "is_thread": bool(is_thread)},
+        "member_info": {"role": role, "is_robot": bool(is_robot)},
+    }
+    if object_uid is not None:
+        meta["object_uid"] = object_uid
+    if group_id is not None:
+        meta["group_id"] = group_id
+    if department_id is not None:
+        meta["department_id"] = department_id
+    return {"user_login": user_login,
+            "event": {"idempotency_id": idempotency_id, "occurred_at": occurred_at,
+                      "type": etype, "uid": uid, "meta": meta}}
+
+
+def build_projection(events_ordered: Iterable[dict],
+                     chats: Optional[dict[str, ChatState]] = None
+                     ) -> dict[str, ChatState]:
+    """Проигрывает события в хронологическом порядке -> состояние чатов.
+    Если передано готовое состояние chats, события докатываются поверх него."""
+    if chats is None:
+        chats = {}
 
     for enriched in events_ordered:
         ev = enriched.get("event", {}) or {}
@@ -164,7 +234,7 @@ def build_projection(events_ordered: Iterable[dict]) -> dict[str, ChatState]:
                 chat.members.pop(uid, None)
 
         elif etype == "messenger_chat.group_added":
-            gid = _extract_id(meta, "group_id", "object_id", "object_group_id")
+            gid = _extract_id(meta, *_GROUP_KEYS)
             if gid:
                 chat.groups[gid] = {"added_at": ev.get("occurred_at"),
                                     "added_by_login": initiator}
@@ -175,12 +245,12 @@ def build_projection(events_ordered: Iterable[dict]) -> dict[str, ChatState]:
                             etype, sorted(meta.keys()))
 
         elif etype == "messenger_chat.group_removed":
-            gid = _extract_id(meta, "group_id", "object_id", "object_group_id")
+            gid = _extract_id(meta, *_GROUP_KEYS)
             if gid:
                 chat.groups.pop(gid, None)
 
         elif etype == "messenger_chat.department_added":
-            did = _extract_id(meta, "department_id", "object_id", "object_department_id")
+            did = _extract_id(meta, *_DEPARTMENT_KEYS)
             if did:
                 chat.departments[did] = {"added_at": ev.get("occurred_at"),
                                          "added_by_login": initiator}
@@ -191,7 +261,7 @@ def build_projection(events_ordered: Iterable[dict]) -> dict[str, ChatState]:
                             etype, sorted(meta.keys()))
 
         elif etype == "messenger_chat.department_removed":
-            did = _extract_id(meta, "department_id", "object_id", "object_department_id")
+            did = _extract_id(meta, *_DEPARTMENT_KEYS)
             if did:
                 chat.departments.pop(did, None)
 
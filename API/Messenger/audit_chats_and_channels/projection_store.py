@@ -0,0 +1,416 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
+
+from projection import ChatState, MemberState, build_projection, normalize_chat_id
+from store import EventStore
+
+log = logging.getLogger("projection")
+
+# Меняется вместе с логикой build_projection: сохранённое состояние,
+# посчитанное старой версией, тогда пересобирается с нуля.
+PROJECTION_VERSION = "1"
+
+# Через сколько событий сохранять промежуточное состояние для вопросов
+# «кто был в чате в момент T»: ответ — ближайшая точка до T плюс
+# проигрывание не больше CHECKPOINT_EVERY событий одного чата.
+CHECKPOINT_EVERY = 20_000
+
+
+def chat_to_json(chat: ChatState) -> str:
+    return json.dumps(asdict(chat), ensure_ascii=False)
+
+
+def chat_from_json(text: str) -> ChatState:
+    data = json.loads(text)
+    members = {uid: MemberState(**member)
+               for uid, member in (data.pop("members") or {}).items()}
+    return ChatState(**data, members=members)
+
+
+def event_time(value: str) -> str:
+    """ISO-время в той же записи, что occurred_at событий: UTC и микросекунды.
+    Без этого строки сравнивались бы неверно ('…00+00:00' < '…00.000000+00:00')."""
+    moment = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _pack_chat(chat: ChatState) -> bytes:
+    return zlib.compress(chat_to_json(chat).encode("utf-8"), 6)
+
+
+def _unpack_chat(blob: bytes) -> ChatState:
+    return chat_from_json(zlib.decompress(blob).decode("utf-8"))
+
+
+class _Cursor:
+    """Запоминает последнее проигранное событие и затронутые чаты.
+    С on_checkpoint вызывает его после каждых every применённых событий."""
+
+    def __init__(self, occurred_at: Optional[str] = None,
+                 idempotency_id: Optional[str] = None, applied: int = 0,
+                 *, every: int = 0, on_checkpoint=None):
+        self.occurred_at = occurred_at
+        self.idempotency_id = idempotency_id
+        self.applied = applied
+        self.touched: set[str] = set()
+        self.every = every
+        self.on_checkpoint = on_checkpoint
+
+    def track(self, events: Iterable[dict]) -> Iterator[dict]:
+        for enriched in events:
+            ev = enriched.get("event", {}) or {}
+            self.occurred_at = ev.get("occurred_at")
+            self.idempotency_id = ev.get("idempotency_id")
+            self.applied += 1
+            key = normalize_chat_id((ev.get("meta") or {}).get("chat_id"))
+            if key:
+                self.touched.add(key)
+            yield enriched
+            # сюда возвращаемся, когда build_projection уже применил событие
+            if self.on_checkpoint and self.applied % self.every == 0:
+                self.on_checkpoint(self)
+
+
+def _replay_part(db_path: str, part: int, parts: int,
+                 points: list[tuple[int, str, str]]) -> tuple[dict, dict, list]:
+    """Проигрывает в отдельном процессе события чатов одной части.
+
+    points — точки состояния полного проигрывания: (номер, occurred_at,
+    idempotency_id). Для каждой точки сохраняются те же чаты, что и при
+    последовательном проигрывании: с событиями после прошлой точки по
+    секунду точки включительно. -> (чаты, позиция первого события каждого
+    чата, строки projection_checkpoint_chat)."""
+    store = EventStore(db_path)
+    chats: dict[str, ChatState] = {}
+    first_seen: dict[str, tuple[str, str]] = {}
+    rows: list[tuple[str, int, bytes]] = []
+    touched: set[str] = set()
+    # пройденные точки с тем же occurred_at, что у текущего события,
+    # и чаты, уже решённые для них
+    open_points: list[tuple[int, str, set[str]]] = []
+    upcoming = iter(points)
+    point = next(upcoming, None)
+
+    def close_point() -> None:
+        nonlocal touched, point
+        applied, occurred_at, _ = point
+        rows.extend((key, applied, _pack_chat(chats[key])) for key in touched)
+        open_points.append((applied, occurred_at, touched))
+        touched = set()
+        point = next(upcoming, None)
+
+    def track(events: Iterable[dict]) -> Iterator[dict]:
+        nonlocal open_points
+        for enriched in events:
+            ev = enriched.get("event", {}) or {}
+            position = (ev.get("occurred_at"), ev.get("idempotency_id"))
+            key = normalize_chat_id((ev.get("meta") or {}).get("chat_id"))
+            while point is not None and position > (point[1], point[2]):
+                close_point()
+            open_points = [entry for entry in open_points if entry[1] == position[0]]
+            for applied, _, saved in open_points:
+                if key not in saved:
+                    # событие в ту же секунду, что и точка, но после неё:
+                    # чат сохраняется в точке без этого события
+                    saved.add(key)
+                    if key in chats:
+                        rows.append((key, applied, _pack_chat(chats[key])))
+            first_seen.setdefault(key, position)
+            touched.add(key)
+            yield enriched
+
+    try:
+        build_projection(track(store.iter_events_partition(part, parts)), chats)
+    finally:
+        store.close()
+    while point is not None:
+        close_point()
+    return chats, first_seen, rows
+
+
+def replay_parallel(store, workers: int, checkpoint_every: int = 0
+                    ) -> tuple[dict[str, ChatState], _Cursor, list, list]:
+    """Полное проигрывание событий store в workers процессах.
+
+    События делятся по чатам (chat_partition): события одного чата идут
+    в один процесс в исходном порядке, а чаты друг от друга не зависят.
+    Результат тот же, что у build_projection(store.iter_all_events_ordered()),
+    вплоть до порядка чатов. -> (чаты, курсор, точки, строки точек)."""
+    cursor = _Cursor()
+    points: list[tuple[int, str, str]] = []
+    for occurred_at, idempotency_id in store.iter_positions():
+        cursor.occurred_at, cursor.idempotency_id = occurred_at, idempotency_id
+        cursor.applied += 1
+        if checkpoint_every > 0 and cursor.applied % checkpoint_every == 0:
+            points.append((cursor.applied, occurred_at, idempotency_id))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(_replay_part, [store.path] * workers, range(workers),
+                              [workers] * workers, [points] * workers))
+    merged: dict[str, ChatState] = {}
+    first_seen: dict[str, tuple[str, str]] = {}
+    rows: list[tuple[str, int, bytes]] = []
+    for part_chats, part_first_seen, part_rows in parts:
+        merged.update(part_chats)
+        first_seen.update(part_first_seen)
+        rows.extend(part_rows)
+    # чаты — в порядке первого события, как при последовательном проигрывании
+    chats = {key: merged[key] for key in sorted(merged, key=first_seen.__getitem__)}
+    cursor.touched = set(chats)
+    return chats, cursor, points, rows
+
+
+class ProjectionStore:
+    """Сохранённое состояние чатов после проигрывания событий.
+
+    Рядом с состоянием хранится курсор — последнее применённое событие
+    (occurred_at, idempotency_id) и число событий до него. Следующий
+    analyze докатывает только события после курсора. Если в базе появилось
+    событие раньше курсора (пришло с задержкой и попало в окно перекрытия
+    collect), число событий до курсора перестаёт сходиться — тогда
+    состояние пересобирается с нуля.
+
+    По ходу проигрывания каждые checkpoint_every событий сохраняется точка:
+    состояние чатов, изменившихся с прошлой точки. По ним chats_at отвечает
+    на вопрос о любом моменте истории, проигрывая только короткий хвост.
+    """
+
+    def __init__(self, db_path: str, *, checkpoint_every: int = CHECKPOINT_EVERY,
+                 replay_workers: int = 1):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.checkpoint_every = checkpoint_every
+        self.replay_workers = replay_workers
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS projection_chat (
+                chat_key TEXT PRIMARY KEY,
+                seq      INTEGER NOT NULL,
+                state    TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS projection_meta (
+                key   TEXT PRIMARY KEY,
+                value TEXT
+            );
+            -- applied: сколько событий проиграно к точке, он же её номер
+            CREATE TABLE IF NOT EXISTS projection_checkpoint (
+                applied        INTEGER PRIMARY KEY,
+                occurred_at    TEXT NOT NULL,
+                idempotency_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_checkpoint_time
+                ON projection_checkpoint(occurred_at);
+            CREATE TABLE IF NOT EXISTS projection_checkpoint_chat (
+                chat_key   TEXT NOT NULL,
+                checkpoint INTEGER NOT NULL,
+                state      BLOB NOT NULL,
+                PRIMARY KEY (chat_key, checkpoint)
+            ) WITHOUT ROWID;
+            """
+        )
+        self.conn.commit()
+
+    # ------------------------------------------------------------------
+    def refresh(self, store, *, full_replay: bool = False) -> dict[str, ChatState]:
+        """Возвращает актуальное состояние чатов по базе событий store."""
+        reason = ("запрошено ключом --full-replay" if full_replay
+                  else self.stale_reason(store))
+        if reason:
+            log.info("Восстанавливаем состояние чатов с нуля: %s.", reason)
+            self._drop_checkpoints()
+            if self.replay_workers > 1:
+                return self._rebuild_parallel(store)
+            chats: dict[str, ChatState] = {}
+            cursor = self._cursor(store, chats)
+            build_projection(cursor.track(store.iter_all_events_ordered()), chats)
+            self._save(chats, cursor, full=True)
+            return chats
+
+        chats = self.load()
+        new_events, touched = self.advance(store, chats)
+        log.info("Взяли сохранённое состояние чатов и докатили %s новых "
+                 "событий (затронуто чатов: %s).", new_events, touched)
+        return chats
+
+    def _rebuild_parallel(self, store) -> dict[str, ChatState]:
+        log.info("Проигрываем события в %s процессах.", self.replay_workers)
+        chats, cursor, points, rows = replay_parallel(
+            store, self.replay_workers, self.checkpoint_every)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO projection_checkpoint"
+            "(applied, occurred_at, idempotency_id) VALUES(?,?,?)", points)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO projection_checkpoint_chat"
+            "(chat_key, checkpoint, state) VALUES(?,?,?)", rows)
+        self._save(chats, cursor, full=True)
+        return chats
+
+    def stale_reason(self, store) -> Optional[str]:
+        """Почему сохранённое состояние нельзя докатывать; None — можно."""
+        meta = self._meta()
+        if meta.get("version") != PROJECTION_VERSION:
+            return ("сохранённого состояния ещё нет" if not meta
+                    else "изменилась логика восстановления")
+        if meta.get("occurred_at"):
+            applied = int(meta.get("applied") or 0)
+            actual = store.count_through(meta["occurred_at"],
+                                         meta["idempotency_id"])
+            if actual != applied:
+                return (f"в базе появились события раньше уже учтённых "
+                        f"({actual - applied:+d})")
+        return None
+
+    def applied(self) -> int:
+        """Сколько событий учтено в сохранённом состоянии."""
+        return int(self._meta().get("applied") or 0)
+
+    def advance(self, store, chats: dict[str, ChatState],
+                observe=None) -> tuple[int, int]:
+        """Докатывает в chats события после сохранённого курсора и сохраняет
+        затронутые чаты. chats должно соответствовать этому курсору.
+
+        observe — обёртка над потоком событий (генератор): код после её
+        yield выполняется, когда событие уже применено. Возвращает число
+        новых событий и затронутых чатов."""
+        meta = self._meta()
+        if not meta.get("occurred_at"):
+            events = store.iter_all_events_ordered()
+        else:
+            events = store.iter_events_after(meta["occurred_at"],
+                                             meta["idempotency_id"])
+        if observe is not None:
+            events = observe(events)
+        cursor = self._cursor(store, chats, meta.get("occurred_at"),
+                              meta.get("idempotency_id"),
+                              int(meta.get("applied") or 0))
+        build_projection(cursor.track(events), chats)
+        new_events = cursor.applied - int(meta.get("applied") or 0)
+        if new_events:
+            self._save(chats, cursor, full=False)
+        return new_events, len(cursor.touched)
+
+    def load(self) -> dict[str, ChatState]:
+        chats: dict[str, ChatState] = {}
+        for row in self.conn.execute(
+                "SELECT chat_key, state FROM projection_chat ORDER BY seq"):
+            chats[row["chat_key"]] = chat_from_json(row["state"])
+        return chats
+
+    def reset(self) -> None:
+        self.conn.execute("DELETE FROM projection_chat")
+        self.conn.execute("DELETE FROM projection_meta")
+        self._drop_checkpoints()
+        self.conn.commit()
+
+    # ------------------------------------------------------------------
+    def chats_at(self, store, chat_keys: Iterable[str],
+                 at_iso: str) -> dict[str, Optional[ChatState]]:
+        """Состояние чатов на момент at_iso (события в этот момент учтены).
+        None — чата к тому моменту ещё не было."""
+        at_iso = event_time(at_iso)
+        keys = list(dict.fromkeys(chat_keys))
+        point = self.conn.execute(
+            "SELECT applied, occurred_at, idempotency_id FROM projection_checkpoint "
+            "WHERE occurred_at <= ? ORDER BY applied DESC LIMIT 1",
+            (at_iso,)).fetchone()
+        chats: dict[str, ChatState] = {}
+        after = None
+        if point is not None:
+            after = (point["occurred_at"], point["idempotency_id"])
+            for key in keys:
+                row = self.conn.execute(
+                    "SELECT state FROM projection_checkpoint_chat "
+                    "WHERE chat_key=? AND checkpoint<=? "
+                    "ORDER BY checkpoint DESC LIMIT 1",
+                    (key, point["applied"])).fetchone()
+                if row is not None:
+                    chats[key] = _unpack_chat(row["state"])
+
+        wanted = set(keys)
+        chat_ids = [raw for raw in store.chat_ids_window(after, at_iso)
+                    if normalize_chat_id(raw) in wanted]
+        build_projection(store.iter_events_window(after, at_iso, chat_ids), chats)
+        return {key: chats.get(key) for key in keys}
+
+    def checkpoint_count(self) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) AS c FROM projection_checkpoint").fetchone()["c"]
+
+    def _cursor(self, store, chats: dict[str, ChatState], *args) -> _Cursor:
+        if self.checkpoint_every <= 0:
+            return _Cursor(*args)
+        return _Cursor(*args, every=self.checkpoint_every,
+                       on_checkpoint=lambda cursor: self._checkpoint(store, chats,
+                                                                     cursor))
+
+    def _checkpoint(self, store, chats: dict[str, ChatState], cursor: _Cursor) -> None:
+        """Сохраняет точку: чаты, у которых были события с прошлой точки.
+        Их берём из базы событий, а не из памяти — прошлая точка могла быть
+        поставлена в другом запуске."""
+        previous = self.conn.execute(
+            "SELECT occurred_at, idempotency_id FROM projection_checkpoint "
+            "WHERE applied < ? ORDER BY applied DESC LIMIT 1",
+            (cursor.applied,)).fetchone()
+        after = tuple(previous) if previous is not None else None
+        changed = {normalize_chat_id(raw)
+                   for raw in store.chat_ids_window(after, cursor.occurred_at)}
+        self.conn.execute(
+            "INSERT OR REPLACE INTO projection_checkpoint"
+            "(applied, occurred_at, idempotency_id) VALUES(?,?,?)",
+            (cursor.applied, cursor.occurred_at, cursor.idempotency_id))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO projection_checkpoint_chat"
+            "(chat_key, checkpoint, state) VALUES(?,?,?)",
+            ((key, cursor.applied, _pack_chat(chats[key]))
+             for key in changed if key in chats))
+        self.conn.commit()
+        log.debug("Точка состояния после %s событий: чатов %s.",
+                  cursor.applied, len(changed))
+
+    def _drop_checkpoints(self) -> None:
+        self.conn.execute("DELETE FROM projection_checkpoint")
+        self.conn.execute("DELETE FROM projection_checkpoint_chat")
+
+    # ------------------------------------------------------------------
+    def _meta(self) -> dict:
+        return {row["key"]: row["value"] for row in
+                self.conn.execute("SELECT key, value FROM projection_meta")}
+
+    def _save(self, chats: dict[str, ChatState], cursor: _Cursor,
+              *, full: bool) -> None:
+        if full:
+            self.conn.execute("DELETE FROM projection_chat")
+            keys = list(chats)
+        else:
+            keys = [key for key in chats if key in cursor.touched]
+        # seq — порядок появления чата; без него после загрузки строки
+        # отчётов шли бы в другом порядке, чем при полном проигрывании
+        order = {key: index for index, key in enumerate(chats)}
+        self.conn.executemany(
+            "INSERT INTO projection_chat(chat_key, seq, state) VALUES(?,?,?) "
+            "ON CONFLICT(chat_key) DO UPDATE SET seq=excluded.seq, "
+            "state=excluded.state",
+            ((key, order[key], chat_to_json(chats[key])) for key in keys))
+        self.conn.executemany(
+            "INSERT INTO projection_meta(key, value) VALUES(?,?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            [("version", PROJECTION_VERSION),
+             ("occurred_at", cursor.occurred_at),
+             ("idempotency_id", cursor.idempotency_id),
+             ("applied", str(cursor.applied))])
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
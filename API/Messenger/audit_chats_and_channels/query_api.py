@@ -0,0 +1,420 @@
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from projection import normalize_chat_id
+from projection_store import event_time
+
+log = logging.getLogger("serve")
+
+# сколько соединений с базой держать открытыми; запрос сверх них ждёт
+POOL_SIZE = 4
+POOL_WAIT_SECONDS = 10
+
+# сколько готовых ответов помнить; сбрасываются, когда базу кто-то изменил
+CACHE_SIZE = 512
+
+PAGE_DEFAULT = 100
+PAGE_MAX = 1000
+
+# Логин и ФИО берутся из версии участия, а если их там нет (участник
+# записан по номеру) — из кэша сотрудников IdentityStore.
+_MEMBER_COLUMNS = """
+    m.id, m.chat_key, m.member_key, m.scope,
+    COALESCE(m.login, i.login) AS login, m.role, m.source, m.confidence,
+    m.is_bot, COALESCE(m.full_name, i.full_name) AS full_name,
+    COALESCE(m.position, i.position) AS position, m.added_at,
+    m.added_by_login, m.valid_from, m.valid_to"""
+_CHAT_COLUMNS = """,
+    (SELECT c.name FROM chat_scd c WHERE c.chat_key=m.chat_key
+      ORDER BY c.valid_from DESC LIMIT 1) AS chat_name,
+    (SELECT c.type FROM chat_scd c WHERE c.chat_key=m.chat_key
+      ORDER BY c.valid_from DESC LIMIT 1) AS chat_type"""
+_MEMBER_FROM = """
+  FROM membership_scd m
+  LEFT JOIN identity_cache i ON i.uid = CASE
+       WHEN m.member_key LIKE 'uid::%' THEN substr(m.member_key, 6) END"""
+_MEMBER_SELECT = "SELECT" + _MEMBER_COLUMNS + _MEMBER_FROM
+_MEMBER_SELECT_WITH_CHAT = "SELECT" + _MEMBER_COLUMNS + _CHAT_COLUMNS + _MEMBER_FROM
+
+# Каждый запрос — постоянный текст SQL: sqlite3 держит его подготовленным
+# в кэше соединения, а план опирается на индексы SnapshotStore.
+SQL_CHAT_MEMBERS = _MEMBER_SELECT + """
+     WHERE m.chat_key=? AND m.valid_to IS NULL
+       AND (m.member_key, m.scope) > (?, ?)
+     ORDER BY m.member_key, m.scope LIMIT ?"""
+SQL_CHAT_MEMBERS_AT = _MEMBER_SELECT + """
+     WHERE m.chat_key=? AND m.valid_from<=? AND (m.valid_to IS NULL OR m.valid_to>?)
+       AND (m.member_key, m.scope) > (?, ?)
+     ORDER BY m.member_key, m.scope LIMIT ?"""
+SQL_CHAT_HISTORY = _MEMBER_SELECT + """
+     WHERE m.chat_key=? AND (m.valid_from, m.id) > (?, ?)
+     ORDER BY m.valid_from, m.id LIMIT ?"""
+SQL_CHAT_OPEN = ("SELECT chat_key, name, description, type, valid_from FROM chat_scd "
+                 "WHERE chat_key=? AND valid_to IS NULL")
+SQL_CHAT_AT = ("SELECT chat_key, name, description, type, valid_from FROM chat_scd "
+               "WHERE chat_key=? AND valid_from<=? "
+               "AND (valid_to IS NULL OR valid_to>?)")
+SQL_BOTS = _MEMBER_SELECT_WITH_CHAT + """
+     WHERE m.is_bot=1 AND m.valid_to IS NULL
+       AND (m.chat_key, m.member_key, m.scope) > (?, ?, ?)
+     ORDER BY m.chat_key, m.member_key, m.scope LIMIT ?"""
+# у сотрудника несколько ключей истории, поэтому IN — текст запроса
+# зависит только от их числа
+SQL_MEMBER_CHATS = _MEMBER_SELECT_WITH_CHAT + """
+     WHERE m.member_key IN ({keys}) AND m.valid_to IS NULL
+       AND (m.chat_key, m.member_key, m.scope) > (?, ?, ?)
+     ORDER BY m.chat_key, m.member_key, m.scope LIMIT ?"""
+SQL_MEMBER_HISTORY = _MEMBER_SELECT_WITH_CHAT + """
+     WHERE m.member_key IN ({keys}) AND (m.valid_from, m.id) > (?, ?)
+     ORDER BY m.valid_from, m.id LIMIT ?"""
+SQL_KEYS_BY_LOGIN = ("SELECT DISTINCT member_key FROM membership_scd "
+                     "WHERE login=? COLLATE NOCASE")
+SQL_UID_BY_ALIAS = "SELECT uid FROM identity_alias WHERE alias=?"
+SQL_UID_BY_LOGIN = "SELECT uid FROM identity_cache WHERE login=? COLLATE NOCASE"
+SQL_LAST_RUN = ("SELECT run_id, run_at, scopes, chats_total, members_total, added, "
+                "removed, role_changed FROM runs ORDER BY run_at DESC LIMIT 1")
+SQL_LAST_EVENT = "SELECT value AS m FROM checkpoint WHERE key='last_occurred_at'"
+
+# начало страницы для каждого вида сортировки
+_FIRST_MEMBER = ("", "")
+_FIRST_CHAT_MEMBER = ("", "", "")
+_FIRST_VERSION = ("", 0)
+
+
+class QueryError(Exception):
+    """Ошибка в запросе клиента: ответ 400 с текстом ошибки."""
+
+
+class PoolTimeout(Exception):
+    """Все соединения заняты дольше POOL_WAIT_SECONDS: ответ 503."""
+
+
+class ReadOnlyPool:
+    """Соединения с базой только на чтение (mode=ro и query_only).
+
+    Запросы из разных потоков берут свободное соединение и возвращают его;
+    писать через них нельзя, так что служба не может испортить базу,
+    с которой одновременно работают analyze, collect и watch."""
+
+    def __init__(self, db_path: str, size: int = POOL_SIZE):
+        self.db_path = db_path
+        self._free: queue.Queue = queue.Queue()
+        self._all = [self._connect() for _ in range(size)]
+        for conn in self._all:
+            self._free.put(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._free.get(timeout=POOL_WAIT_SECONDS)
+        except queue.Empty:
+            raise PoolTimeout("все соединения с базой заняты") from None
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        self._free.put(conn)
+
+    def close(self) -> None:
+        for conn in self._all:
+            conn.close()
+
+
+class ResponseCache:
+    """Готовые ответы по тексту запроса, вытесняются самые давние.
+
+    Отдельное соединение спрашивает у SQLite PRAGMA data_version: число
+    меняется, когда в базу записало любое другое соединение — новый
+    запуск analyze, watch, collect. Тогда весь кэш сбрасывается."""
+
+    def __init__(self, db_path: str, size: int = CACHE_SIZE):
+        self.size = size
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True,
+                                     check_same_thread=False)
+        self._version = self._data_version()
+        self.hits = self.misses = self.resets = 0
+
+    def _data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            version = self._data_version()
+            if version != self._version:
+                self._version = version
+                if self._items:
+                    self._items.clear()
+                    self.resets += 1
+            body = self._items.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: str, body: bytes) -> None:
+        with self._lock:
+            self._items[key] = body
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._items), "hits": self.hits,
+                    "misses": self.misses, "resets": self.resets}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def encode_cursor(values) -> str:
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(text: Optional[str], first: tuple) -> tuple:
+    """Продолжение страницы; first — начало для пустого курсора."""
+    if not text:
+        return first
+    try:
+        padded = text + "=" * (-len(text) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise QueryError("курсор не читается; возьмите его из поля next") from None
+    if not isinstance(values, list) or len(values) != len(first) or any(
+            type(value) is not type(start) for value, start in zip(values, first)):
+        raise QueryError("курсор от другого запроса")
+    return tuple(values)
+
+
+def chat_key_from(text: str) -> str:
+    """Ключ чата из адреса: как в chats.csv или исходный chat_id."""
+    text = text.strip()
+    return text if "::" in text else normalize_chat_id(text) or text
+
+
+def _row(row: sqlite3.Row) -> dict:
+    item = dict(row)
+    item.pop("id", None)
+    item["is_bot"] = bool(item["is_bot"])
+    return item
+
+
+class QueryApi:
+    """Ответы на частые вопросы по базе: кто в чате, в каких чатах
+    сотрудник, где есть боты, как менялось участие.
+
+    Читает таблицы SnapshotStore (история составов), IdentityStore (логины
+    по номерам) и EventStore (докуда собраны события) через пул
+    соединений только на чтение. get() не зависит от HTTP: его же вызывает
+    самопроверка."""
+
+    ROUTES = (
+        "GET /status",
+        "GET /chats/{chat_key}/members?at=&limit=&cursor=",
+        "GET /chats/{chat_key}/history?limit=&cursor=",
+        "GET /members/{login|uid}/chats?limit=&cursor=",
+        "GET /members/{login|uid}/history?limit=&cursor=",
+        "GET /bots?limit=&cursor=",
+    )
+
+    _VIEWS = {("chats", "members"): "_chat_members",
+              ("chats", "history"): "_chat_history",
+              ("members", "chats"): "_member_chats",
+              ("members", "history"): "_member_history"}
+
+    def __init__(self, db_path: str, *, pool_size: int = POOL_SIZE,
+                 cache_size: int = CACHE_SIZE):
+        self.pool = ReadOnlyPool(db_path, pool_size)
+        self.cache = ResponseCache(db_path, cache_size)
+
+    def get(self, target: str) -> tuple[int, bytes]:
+        """Ответ на GET-запрос target (путь с параметрами). -> (код, JSON)."""
+        parts = urlsplit(target)
+        segments = [unquote(part) for part in parts.path.split("/") if part]
+        params = dict(parse_qsl(parts.query))
+        if segments == ["status"]:
+            return self._respond(self._status)
+        key = "/".join(segments) + "?" + "&".join(
+            f"{name}={value}" for name, value in sorted(params.items()))
+        body = self.cache.get(key)
+        if body is not None:
+            return 200, body
+        route = self._route(segments)
+        if route is None:
+            return 404, _json({"error": "нет такого адреса", "routes": self.ROUTES})
+        status, body = self._respond(lambda conn: route(conn, params))
+        if status == 200:
+            self.cache.put(key, body)
+        return status, body
+
+    def _respond(self, handler) -> tuple[int, bytes]:
+        try:
+            conn = self.pool.acquire()
+        except PoolTimeout as exc:
+            return 503, _json({"error": str(exc)})
+        try:
+            return 200, _json(handler(conn))
+        except QueryError as exc:
+            return 400, _json({"error": str(exc)})
+        except sqlite3.Error as exc:
+            # база занята или ещё не собрана (нет таблиц до первого запуска)
+            log.warning("Ошибка базы при ответе на запрос: %s", exc)
+            return 500, _json({"error": f"ошибка базы: {exc}"})
+        finally:
+            self.pool.release(conn)
+
+    def _route(self, segments: list[str]):
+        """Обработчик (conn, params) -> dict для пути; None — адреса нет."""
+        if segments == ["bots"]:
+            return self._bots
+        if len(segments) != 3 or (segments[0], segments[2]) not in self._VIEWS:
+            return None
+        kind, subject, view = segments
+        handler = getattr(self, self._VIEWS[(kind, view)])
+        return lambda conn, params: handler(conn, subject, params)
+
+    # ------------------------------------------------------------------
+    def _status(self, conn: sqlite3.Connection) -> dict:
+        last_run = conn.execute(SQL_LAST_RUN).fetchone()
+        last_event = conn.execute(SQL_LAST_EVENT).fetchone()
+        return {"last_run": dict(last_run) if last_run else None,
+                "last_event_at": last_event["m"] if last_event else None,
+                "cache": self.cache.stats(), "routes": self.ROUTES}
+
+    def _chat_members(self, conn, subject: str, params: dict) -> dict:
+        chat_key, at = chat_key_from(subject), params.get("at")
+        limit, after = _paging(params, _FIRST_MEMBER)
+        if at:
+            try:
+                at = event_time(at)
+            except ValueError:
+                raise QueryError(f"не удалось разобрать момент {at!r}; пример: "
+                                 f"2026-03-01T00:00:00+00:00") from None
+            chat = conn.execute(SQL_CHAT_AT, (chat_key, at, at)).fetchone()
+            rows = conn.execute(SQL_CHAT_MEMBERS_AT,
+                                (chat_key, at, at, *after, limit + 1)).fetchall()
+        else:
+            chat = conn.execute(SQL_CHAT_OPEN, (chat_key,)).fetchone()
+            rows = conn.execute(SQL_CHAT_MEMBERS,
+                                (chat_key, *after, limit + 1)).fetchall()
+        return {"chat_key": chat_key, "at": at, "chat": dict(chat) if chat else None,
+                **_page(rows, limit, ("member_key", "scope"))}
+
+    def _chat_history(self, conn, subject: str, params: dict) -> dict:
+        chat_key = chat_key_from(subject)
+        limit, after = _paging(params, _FIRST_VERSION)
+        rows = conn.execute(SQL_CHAT_HISTORY, (chat_key, *after, limit + 1)).fetchall()
+        return {"chat_key": chat_key, **_page(rows, limit, ("valid_from", "id"))}
+
+    def _member_chats(self, conn, member: str, params: dict) -> dict:
+        limit, after = _paging(params, _FIRST_CHAT_MEMBER)
+        keys = member_keys(conn, member)
+        rows = conn.execute(
+            SQL_MEMBER_CHATS.format(keys=",".join("?" * len(keys))),
+            (*keys, *after, limit + 1)).fetchall()
+        return {"member": member, "member_keys": keys,
+                **_page(rows, limit, ("chat_key", "member_key", "scope"))}
+
+    def _member_history(self, conn, member: str, params: dict) -> dict:
+        limit, after = _paging(params, _FIRST_VERSION)
+        keys = member_keys(conn, member)
+        rows = conn.execute(
+            SQL_MEMBER_HISTORY.format(keys=",".join("?" * len(keys))),
+            (*keys, *after, limit + 1)).fetchall()
+        return {"member": member, "member_keys": keys,
+                **_page(rows, limit, ("valid_from", "id"))}
+
+    def _bots(self, conn, params: dict) -> dict:
+        limit, after = _paging(params, _FIRST_CHAT_MEMBER)
+        rows = conn.execute(SQL_BOTS, (*after, limit + 1)).fetchall()
+        return _page(rows, limit, ("chat_key", "member_key", "scope"))
+
+    def close(self) -> None:
+        self.cache.close()
+        self.pool.close()
+
+
+def member_keys(conn: sqlite3.Connection, member: str) -> list[str]:
+    """Ключи истории сотрудника: по номеру, по логину и по связке логина
+    с номером из истории и кэша сотрудников — как у команды timeline."""
+    member = member.strip()
+    if "::" in member:
+        return [member]
+    if member.isdigit():
+        return [f"uid::{member}"]
+    keys = [f"login::{member.casefold()}",
+            *(row["member_key"] for row in conn.execute(SQL_KEYS_BY_LOGIN, (member,)))]
+    row = (conn.execute(SQL_UID_BY_ALIAS, (member.casefold(),)).fetchone()
+           or conn.execute(SQL_UID_BY_LOGIN, (member,)).fetchone())
+    if row:
+        keys.append(f"uid::{row['uid']}")
+    return list(dict.fromkeys(keys))
+
+
+def _paging(params: dict, first: tuple) -> tuple[int, tuple]:
+    """-> (размер страницы, ключ, после которого она начинается)."""
+    value = params.get("limit")
+    try:
+        limit = PAGE_DEFAULT if value is None else int(value)
+    except ValueError:
+        raise QueryError(f"limit должен быть числом, получили {value!r}") from None
+    if not 1 <= limit <= PAGE_MAX:
+        raise QueryError(f"limit — от 1 до {PAGE_MAX}")
+    return limit, decode_cursor(params.get("cursor"), first)
+
+
+def _page(rows: list, limit: int, order: tuple[str, ...]) -> dict:
+    """Страница и курсор следующей: запрошено на строку больше limit."""
+    more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = (encode_cursor(rows[-1][name] for name in order)
+                   if more else None)
+    return {"items": [_row(row) for row in rows], "next": next_cursor}
+
+
+def _json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "QueryServer"
+
+    def do_GET(self) -> None:
+        status, body = self.server.api.get(self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt: str, *args) -> None:
+        log.debug("%s %s", self.address_string(), fmt % args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    """HTTP-служба над QueryApi: только GET, ответы в JSON."""
+
+    daemon_threads = True
+
+    def __init__(self, api: QueryApi, host: str, port: int):
+        self.api = api
+        super().__init__((host, port), _Handler)
@@ -3,6 +3,7 @@ from __future__ import annotations
 import csv
 import json
 import os
+from typing import Iterable, Iterator
 
 ENCODING = "utf-8-sig"     # с меткой BOM — Excel правильно открывает кириллицу
 DELIMITER = ";"            # точка с запятой удобна для русской локали Excel
@@ -21,86 +22,144 @@ def _writer(out_dir: str, filename: str, header: list[str]):
     return handle, writer
 
 
-def export_chats(out_dir: str, chats: dict, include_private: bool) -> None:
-    handle, writer = _writer(out_dir, "chats.csv", [
-        "chat_key", "chat_id_raw", "origin", "coverage_status", "type", "name",
-        "description", "created_at", "created_by_login", "manual_confirmed",
-        "ambiguous", "incomplete", "is_thread", "members_count", "bots_count",
-        "groups_count", "departments_count"])
-    with handle:
-        for chat in chats.values():
-            if not include_private and chat.type == "private":
-                continue
-            writer.writerow([
-                chat.chat_key, chat.chat_id_raw, chat.origin, chat.coverage_status,
-                chat.type, chat.name, chat.description, chat.created_at,
-                chat.created_by_login, chat.manual_confirmed, chat.ambiguous,
-                chat.incomplete, chat.is_thread, len(chat.members), chat.bots_count,
-                len(chat.groups), len(chat.departments)])
-
-
-def export_members(out_dir: str, chats: dict, include_private: bool) -> None:
-    handle, writer = _writer(out_dir, "members.csv", [
-        "chat_key", "chat_name", "chat_type", "login", "uid", "full_name",
-        "position", "role", "added_at", "added_by_login", "is_bot",
-        "bot_evidence", "identity_kind", "source", "confidence", "fio_source",
-        "resolve_status", "manual_confirmed", "via"])
-    with handle:
-        for chat in chats.values():
-            if not include_private and chat.type == "private":
-                continue
-            for member in chat.members.values():
-                writer.writerow([
-                    chat.chat_key, chat.name, chat.type, member.login, member.uid,
-                    member.full_name, member.position, member.role, member.added_at,
-                    member.added_by_login, member.is_bot, member.bot_evidence,
-                    member.identity_kind, member.source, member.confidence,
-                    member.fio_source, member.resolve_status,
-                    member.manual_confirmed, member.via])
+# Excel держит в листе не больше 1 048 576 строк; остальное — в следующий лист
+XLSX_MAX_ROWS = 1_048_575
 
 
-def export_bots(out_dir: str, chats: dict, include_private: bool) -> None:
-    """Боты в чатах — главный отчёт для информационной безопасности."""
-    handle, writer = _writer(out_dir, "bots_in_chats.csv", [
-        "chat_key", "chat_name", "chat_type", "bot_login", "display_name",
-        "bot_evidence", "role", "added_at", "added_by_login", "source",
-        "resolve_status", "chat_members_total", "chat_bots_total"])
+def _write_rows(out_dir: str, filename: str, header: list[str], rows: Iterable,
+                xlsx: bool = False) -> None:
+    """Пишет строки по одной по мере получения — весь отчёт в памяти не
+    собирается. С xlsx=True рядом с CSV кладётся такой же файл Excel,
+    записанный в потоковом режиме openpyxl (write_only)."""
+    handle, writer = _writer(out_dir, filename, header)
+    book = sheet = None
+    written = 0
+    if xlsx:
+        from openpyxl import Workbook
+        book = Workbook(write_only=True)
     with handle:
-        for chat in chats.values():
-            if not include_private and chat.type == "private":
+        for row in rows:
+            writer.writerow(row)
+            if book is None:
                 continue
-            if not chat.bots_count:
+            if written % XLSX_MAX_ROWS == 0:
+                sheet = book.create_sheet(f"Лист{written // XLSX_MAX_ROWS + 1}")
+                sheet.append(header)
+            sheet.append(["" if value is None else value for value in row])
+            written += 1
+    if book is not None:
+        if sheet is None:
+            book.create_sheet("Лист1").append(header)
+        book.save(os.path.join(out_dir, os.path.splitext(filename)[0] + ".xlsx"))
+
+
+def _tracked_chats(chats: dict, include_private: bool) -> Iterator:
+    for chat in chats.values():
+        if include_private or chat.type != "private":
+            yield chat
+
+
+CHAT_HEADER = [
+    "chat_key", "chat_id_raw", "origin", "coverage_status", "type", "name",
+    "description", "created_at", "created_by_login", "manual_confirmed",
+    "ambiguous", "incomplete", "is_thread", "members_count", "bots_count",
+    "groups_count", "departments_count"]
+
+MEMBER_HEADER = [
+    "chat_key", "chat_name", "chat_type", "login", "uid", "full_name",
+    "position", "role", "added_at", "added_by_login", "is_bot",
+    "bot_evidence", "identity_kind", "source", "confidence", "fio_source",
+    "resolve_status", "manual_confirmed", "via"]
+
+BOT_HEADER = [
+    "chat_key", "chat_name", "chat_type", "bot_login", "display_name",
+    "bot_evidence", "role", "added_at", "added_by_login", "source",
+    "resolve_status", "chat_members_total", "chat_bots_total"]
+
+
+def iter_chat_rows(chats: dict, include_private: bool) -> Iterator[list]:
+    for chat in _tracked_chats(chats, include_private):
+        yield [
+            chat.chat_key, chat.chat_id_raw, chat.origin, chat.coverage_status,
+            chat.type, chat.name, chat.description, chat.created_at,
+            chat.created_by_login, chat.manual_confirmed, chat.ambiguous,
+            chat.incomplete, chat.is_thread, len(chat.members), chat.bots_count,
+            len(chat.groups), len(chat.departments)]
+
+
+def iter_member_rows(chats: dict, include_private: bool) -> Iterator[list]:
+    for chat in _tracked_chats(chats, include_private):
+        for member in chat.members.values():
+            yield [
+                chat.chat_key, chat.name, chat.type, member.login, member.uid,
+                member.full_name, member.position, member.role, member.added_at,
+                member.added_by_login, member.is_bot, member.bot_evidence,
+                member.identity_kind, member.source, member.confidence,
+                member.fio_source, member.resolve_status,
+                member.manual_confirmed, member.via]
+
+
+def iter_bot_rows(chats: dict, include_private: bool) -> Iterator[list]:
+    for chat in _tracked_chats(chats, include_private):
+        bots = chat.bots_count
+        if not bots:
+            continue
+        for member in chat.members.values():
+            if not member.is_bot:
                 continue
-            for member in chat.members.values():
-                if not member.is_bot:
-                    continue
-                writer.writerow([
-                    chat.chat_key, chat.name, chat.type, member.login,
-                    member.full_name, member.bot_evidence, member.role,
-                    member.added_at, member.added_by_login, member.source,
-                    member.resolve_status, len(chat.members), chat.bots_count])
+            yield [
+                chat.chat_key, chat.name, chat.type, member.login,
+                member.full_name, member.bot_evidence, member.role,
+                member.added_at, member.added_by_login, member.source,
+                member.resolve_status, len(chat.members), bots]
 
 
-def export_unresolved_uids(out_dir: str, chats: dict) -> None:
-    """Участники, у которых известен только номер, без логина."""
-    aggregated: dict[str, dict] = {}
+def iter_unresolved_uid_rows(chats: dict) -> Iterator[list]:
+    """Сводка по номерам без логина. Копится только по уникальным номерам,
+    а не по всем участникам."""
+    aggregated: dict[str, list] = {}
     for chat in chats.values():
         for member in chat.members.values():
             if member.uid and not member.login:
-                entry = aggregated.setdefault(member.uid, {
-                    "chats": 0, "sample_chat": chat.name or chat.chat_key,
-                    "sources": set(), "is_bot": False})
-                entry["chats"] += 1
-                entry["sources"].add(member.source)
-                entry["is_bot"] = entry["is_bot"] or member.is_bot
-
-    handle, writer = _writer(out_dir, "unresolved_uids.csv", [
-        "uid", "chats_count", "sample_chat", "is_bot", "sources"])
-    with handle:
-        for uid, data in sorted(aggregated.items(),
-                                key=lambda item: -item[1]["chats"]):
-            writer.writerow([uid, data["chats"], data["sample_chat"],
-                             data["is_bot"], ",".join(sorted(data["sources"]))])
+                entry = aggregated.get(member.uid)
+                if entry is None:
+                    entry = aggregated[member.uid] = [
+                        0, chat.name or chat.chat_key, set(), False]
+                entry[0] += 1
+                entry[2].add(member.source)
+                entry[3] = entry[3] or member.is_bot
+    for uid, (count, sample, sources, is_bot) in sorted(
+            aggregated.items(), key=lambda item: -item[1][0]):
+        yield [uid, count, sample, is_bot, ",".join(sorted(sources))]
+
+
+def export_chats(out_dir: str, chats: dict, include_private: bool,
+                 xlsx: bool = False, index=None) -> None:
+    """index — RunIndex запуска: строки попутно кладутся и в него."""
+    rows = iter_chat_rows(chats, include_private)
+    _write_rows(out_dir, "chats.csv", CHAT_HEADER,
+                index.tee_chats(rows) if index is not None else rows, xlsx)
+
+
+def export_members(out_dir: str, chats: dict, include_private: bool,
+                   xlsx: bool = False, index=None) -> None:
+    rows = iter_member_rows(chats, include_private)
+    _write_rows(out_dir, "members.csv", MEMBER_HEADER,
+                index.tee_members(rows) if index is not None else rows, xlsx)
+
+
+def export_bots(out_dir: str, chats: dict, include_private: bool,
+                xlsx: bool = False) -> None:
+    """Боты в чатах — главный отчёт для информационной безопасности."""
+    _write_rows(out_dir, "bots_in_chats.csv", BOT_HEADER,
+                iter_bot_rows(chats, include_private), xlsx)
+
+
+def export_unresolved_uids(out_dir: str, chats: dict, xlsx: bool = False) -> None:
+    """Участники, у которых известен только номер, без логина."""
+    _write_rows(out_dir, "unresolved_uids.csv",
+                ["uid", "chats_count", "sample_chat", "is_bot", "sources"],
+                iter_unresolved_uid_rows(chats), xlsx)
 
 
 def export_manual_issues(out_dir: str, manual) -> None:
@@ -265,6 +324,12 @@ manual_issues.csv
 run_diff.csv
     Что изменилось в составе чатов с прошлого запуска.
 
+*.xlsx
+    Если запуск делался с ключом --xlsx, рядом с chats.csv, members.csv,
+    bots_in_chats.csv и unresolved_uids.csv лежат такие же файлы Excel.
+    Больше миллиона строк Excel на одном листе не показывает — продолжение
+    на следующих листах.
+
 summary.json
     Сводные числа по прогону.
 
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from typing import Optional
 
 from clients import Api360Client, DirectoryClient
+from directory_store import DirectoryStore
 from http_base import HttpError
 from identity_store import IdentityStore
 
@@ -75,21 +77,30 @@ class DirectoryResolver:
 
     def __init__(self, directory: DirectoryClient, api360: Api360Client, org_id: int,
                  *, identity_store: IdentityStore | None = None,
-                 source_mode: str = "auto", fail_on_empty: bool = True):
+                 directory_store: DirectoryStore | None = None,
+                 source_mode: str = "auto", fail_on_empty: bool = True,
+                 expand_workers: int = 8, group_ttl_hours: float = 24):
         self.directory = directory
         self.api360 = api360
         self.org_id = org_id
         self.identity_store = identity_store
+        self.directory_store = directory_store
         self.source_mode = source_mode          # auto | cloud | api360 | none
         self.fail_on_empty = fail_on_empty
+        self.expand_workers = max(1, expand_workers)
+        self.group_ttl_hours = group_ttl_hours
 
         self._users: dict[str, UserInfo] = {}
         self._identity_to_uid: dict[str, str] = {}
-        self._dept_users: dict[str, list[str]] = {}
+        # подразделение -> сотрудники; словарь как упорядоченное множество:
+        # проверка «уже есть» за O(1), а порядок в отчётах прежний
+        self._dept_users: dict[str, dict[str, None]] = {}
         self._dept_children: dict[str, list[str]] = {}
         self._dept_name: dict[str, str] = {}
         self._group_name: dict[str, str] = {}
         self._group_cache: dict[str, list[str]] = {}
+        self._group_edges: dict[str, dict[str, list[str]]] = {}
+        self._dept_cache: dict[str, list[str]] = {}
 
         self.load_report: dict = {"cloud_api": 0, "api360": 0,
                                   "audit_log": 0, "cache": 0, "errors": []}
@@ -108,22 +119,25 @@ class DirectoryResolver:
                     setattr(existing, field_name, getattr(info, field_name))
             existing.is_robot = existing.is_robot or info.is_robot
         if info.department_id:
-            bucket = self._dept_users.setdefault(info.department_id, [])
+            bucket = self._dept_users.setdefault(info.department_id, {})
             if info.uid not in bucket:
-                bucket.append(info.uid)
+                bucket[info.uid] = None
+                if self._dept_cache:
+                    self._dept_cache.clear()
         for alias in aliases:
             if alias:
                 self._identity_to_uid.setdefault(str(alias).strip().casefold(),
                                                  info.uid)
         if self.identity_store:
-            self.identity_store.upsert_user(
+            # копится в памяти, в базу уходит пачкой при identity_store.commit()
+            self.identity_store.stage_user(
                 info.uid, login=info.login, full_name=info.full_name,
                 position=info.position, is_robot=info.is_robot,
                 is_dismissed=info.is_dismissed, source=info.source)
             for alias in aliases:
                 if alias:
-                    self.identity_store.upsert_alias(str(alias), info.uid,
-                                                     info.source)
+                    self.identity_store.stage_alias(str(alias), info.uid,
+                                                    info.source)
 
     # ------------------------------------------------------------------
     def preload_users(self, store=None) -> dict:
@@ -264,6 +278,7 @@ class DirectoryResolver:
     def _load_from_cache(self) -> None:
         if not self.identity_store:
             return
+        self.identity_store.flush()
         users, aliases = self.identity_store.load_all()
         count = 0
         for uid, row in users.items():
@@ -367,58 +382,194 @@ class DirectoryResolver:
         return self._group_name.get(str(group_id))
 
     def expand_department(self, dept_id: str) -> list[str]:
-        """Все сотрудники подразделения, включая вложенные."""
+        """Все сотрудники подразделения, включая вложенные. Результат
+        запоминается: одно подразделение бывает привязано к сотне чатов."""
+        did = str(dept_id)
+        if did in self._dept_cache:
+            return self._dept_cache[did]
         result: list[str] = []
         seen: set[str] = set()
-        stack = [str(dept_id)]
+        stack = [did]
         while stack:
             current = stack.pop()
             if current in seen:
                 continue
             seen.add(current)
-            result.extend(self._dept_users.get(current, []))
+            result.extend(self._dept_users.get(current, ()))
             stack.extend(self._dept_children.get(current, []))
-        return list(dict.fromkeys(result))
+        deduped = list(dict.fromkeys(result))
+        self._dept_cache[did] = deduped
+        return deduped
 
     def expand_group(self, group_id: str) -> list[str]:
         """Разворачивает группу в конкретных сотрудников, спускаясь во
         вложенные группы и подразделения. Есть защита от закольцованности."""
         gid = str(group_id)
-        if gid in self._group_cache:
-            return self._group_cache[gid]
-        result: list[str] = []
-        visited: set[str] = set()
-        self._group_cache[gid] = result
-
-        def walk(current: str) -> None:
-            if current in visited:
-                return
-            visited.add(current)
-            try:
-                body = self.api360.group_members(self.org_id, current)
-            except HttpError as exc:
-                log.warning("Состав группы %s получить не удалось: %s", current, exc)
-                return
-            for user in body.get("users") or []:
-                uid = str(user.get("id") or "")
-                if not uid:
+        if gid not in self._group_cache:
+            self._fetch_groups({gid})
+            self._close_groups({gid})
+        return self._group_cache[gid]
+
+    # ------------------------------------------------------------------
+    def plan_expansion(self, chats: dict) -> None:
+        """Готовит разворот всех групп и подразделений сразу.
+
+        Сначала собираются все различные группы и подразделения из всех
+        чатов. Составы групп запрашиваются параллельно, по уровням
+        вложенности, и только для тех групп, которых нет в свежем кэше.
+        Затем транзитивное замыкание считается один раз на всю организацию.
+        После этого expand_group и expand_department отвечают из памяти."""
+        group_ids = {str(gid) for chat in chats.values() for gid in chat.groups}
+        dept_ids = {str(did) for chat in chats.values() for did in chat.departments}
+        if not group_ids and not dept_ids:
+            return
+        self._fetch_groups(group_ids)
+        self._close_groups(group_ids)
+        for did in dept_ids:
+            self.expand_department(did)
+        log.info("Разворот подготовлен: групп в чатах %s (всего с вложенными "
+                 "%s), подразделений в чатах %s.", len(group_ids),
+                 len(self._group_edges), len(dept_ids))
+
+    def _fetch_groups(self, roots: set[str]) -> None:
+        """Загружает составы групп и всех вложенных в них. Запросы одного
+        уровня вложенности идут параллельно в expand_workers потоков;
+        регистрация сотрудников и запись в базу — в основном потоке."""
+        pending = {gid for gid in roots if gid not in self._group_edges}
+        fetched = cached = 0
+        while pending:
+            to_fetch: list[str] = []
+            for gid in sorted(pending):
+                body = None
+                if self.directory_store is not None:
+                    body = self.directory_store.get_group_members(
+                        self.org_id, gid, self.group_ttl_hours)
+                if body is None:
+                    to_fetch.append(gid)
+                else:
+                    self._absorb_group(gid, body)
+                    cached += 1
+
+            if to_fetch:
+                with ThreadPoolExecutor(max_workers=self.expand_workers,
+                                        thread_name_prefix="expand") as pool:
+                    futures = {pool.submit(self.api360.group_members,
+                                           self.org_id, gid): gid
+                               for gid in to_fetch}
+                    for future in as_completed(futures):
+                        gid = futures[future]
+                        try:
+                            body = future.result()
+                        except HttpError as exc:
+                            log.warning("Состав группы %s получить не удалось: %s",
+                                        gid, exc)
+                            body = {}
+                        else:
+                            fetched += 1
+                            if self.directory_store is not None:
+                                self.directory_store.put_group_members(
+                                    self.org_id, gid, body)
+                        self._absorb_group(gid, body)
+                if self.directory_store is not None:
+                    self.directory_store.commit()
+
+            pending = {nested for gid in pending
+                       for nested in self._group_edges[gid]["groups"]
+                       if nested not in self._group_edges}
+        if fetched or cached:
+            log.info("Составы групп: запрошено %s, взято из кэша %s.",
+                     fetched, cached)
+
+    def _absorb_group(self, gid: str, body: dict) -> None:
+        users: list[str] = []
+        for user in body.get("users") or []:
+            uid = str(user.get("id") or "")
+            if not uid:
+                continue
+            users.append(uid)
+            if uid not in self._users:
+                self._register(UserInfo(
+                    uid=uid, login=user.get("nickname") or user.get("email"),
+                    email=user.get("email"), full_name=_compose_full_name(user),
+                    position=user.get("position") or None,
+                    department_id=(str(user["departmentId"])
+                                   if user.get("departmentId") else None),
+                    source="api360"),
+                    [user.get("email"), user.get("nickname")])
+        self._group_edges[gid] = {
+            "users": users,
+            "departments": [str(dept.get("id")) for dept in
+                            body.get("departments") or []],
+            "groups": [str(nested.get("id")) for nested in
+                       body.get("groups") or []],
+        }
+
+    def _close_groups(self, roots: set[str]) -> None:
+        """Транзитивное замыкание по графу вложенности групп.
+
+        Закольцованные группы (A в B, B в A) склеиваются в одну компоненту
+        алгоритмом Тарьяна — получается граф без циклов. Компоненты выходят
+        в порядке «сначала вложенные», поэтому состав каждой считается один
+        раз из уже готовых составов вложенных."""
+        index: dict[str, int] = {}
+        low: dict[str, int] = {}
+        on_stack: set[str] = set()
+        stack: list[str] = []
+        counter = 0
+
+        def nested(gid: str):
+            return iter(self._group_edges.get(gid, {}).get("groups", []))
+
+        for root in sorted(roots):
+            if root in index or root in self._group_cache:
+                continue
+            work = [(root, nested(root))]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                advanced = False
+                for child in children:
+                    if child in self._group_cache:
+                        continue
+                    if child not in index:
+                        index[child] = low[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, nested(child)))
+                        advanced = True
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                if advanced:
                     continue
-                result.append(uid)
-                if uid not in self._users:
-                    self._register(UserInfo(
-                        uid=uid, login=user.get("nickname") or user.get("email"),
-                        email=user.get("email"), full_name=_compose_full_name(user),
-                        position=user.get("position") or None,
-                        department_id=(str(user["departmentId"])
-                                       if user.get("departmentId") else None),
-                        source="api360"),
-                        [user.get("email"), user.get("nickname")])
-            for dept in body.get("departments") or []:
-                result.extend(self.expand_department(str(dept.get("id"))))
-            for nested in body.get("groups") or []:
-                walk(str(nested.get("id")))
-
-        walk(gid)
-        deduped = list(dict.fromkeys(result))
-        self._group_cache[gid] = deduped
-        return deduped
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] != index[node]:
+                    continue
+                members: list[str] = []
+                while True:
+                    item = stack.pop()
+                    on_stack.discard(item)
+                    members.append(item)
+                    if item == node:
+                        break
+                members.reverse()
+                # вложенные компоненты уже посчитаны и лежат в _group_cache;
+                # группы своей компоненты туда ещё не попали и пропускаются
+                result: list[str] = []
+                for gid in members:
+                    edges = self._group_edges.get(gid, {})
+                    result.extend(edges.get("users", []))
+                    for did in edges.get("departments", []):
+                        result.extend(self.expand_department(did))
+                    for child in edges.get("groups", []):
+                        result.extend(self._group_cache.get(child, []))
+                deduped = list(dict.fromkeys(result))
+                for gid in members:
+                    self._group_cache[gid] = deduped
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import csv
+import logging
+import os
+import sqlite3
+from typing import Iterable, Iterator
+
+from report import CHAT_HEADER, DELIMITER, ENCODING, MEMBER_HEADER
+
+log = logging.getLogger("compare")
+
+# Чаты и участники запуска для сравнения — рядом с CSV, в папке запуска:
+# удаляется вместе с ней (prune_runs) и не зависит от базы событий.
+RUN_INDEX = "run_index.sqlite3"
+
+# Меняется вместе со схемой; устаревший файл пересобирается из CSV.
+RUN_INDEX_VERSION = "2"
+
+_BATCH = 5_000
+_MEMBER_COLUMNS = [name for name in MEMBER_HEADER if name != "chat_key"]
+_UID = MEMBER_HEADER.index("uid")
+_LOGIN = MEMBER_HEADER.index("login")
+
+
+def _quoted(names: list[str]) -> str:
+    return ", ".join(f'"{name}"' for name in names)
+
+
+def row_member_key(uid: str, login: str) -> str:
+    """Стабильный ключ участника — совпадает с логикой SCD2."""
+    if uid:
+        return f"uid::{uid}"
+    if login:
+        return f"login::{login.casefold()}"
+    return "anon::unknown"
+
+
+def _texts(row: list) -> list[str]:
+    """Значения так, как их видно после чтения CSV: пустое вместо None,
+    True/False и числа — строкой."""
+    return ["" if value is None else value if type(value) is str else str(value)
+            for value in row]
+
+
+class RunIndex:
+    """Чаты и участники одного запуска в SQLite с ключом по chat_key и
+    (chat_key, member_key). Сравнение двух запусков — соединение таких
+    файлов по первичному ключу, без чтения и сортировки CSV.
+
+    Значения хранятся строками в том виде, в каком их прочитал бы
+    csv.DictReader из chats.csv и members.csv, — поэтому файл, собранный
+    при выгрузке отчёта, и файл, собранный позже из CSV, совпадают."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self._init_schema()
+
+    @classmethod
+    def create(cls, run_path: str) -> "RunIndex":
+        path = os.path.join(run_path, RUN_INDEX)
+        if os.path.exists(path):
+            os.remove(path)
+        return cls(path)
+
+    def _init_schema(self) -> None:
+        chat_columns = ", ".join(f'"{name}" TEXT' for name in CHAT_HEADER[1:])
+        member_columns = ", ".join(f'"{name}" TEXT' for name in _MEMBER_COLUMNS)
+        self.conn.executescript(
+            f"""
+            PRAGMA journal_mode=OFF;
+            PRAGMA synchronous=OFF;
+            CREATE TABLE IF NOT EXISTS meta (
+                key   TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS chats (
+                chat_key TEXT PRIMARY KEY, {chat_columns}
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS members (
+                chat_key   TEXT NOT NULL,
+                member_key TEXT NOT NULL, {member_columns},
+                PRIMARY KEY (chat_key, member_key)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def tee_chats(self, rows: Iterable[list]) -> Iterator[list]:
+        """Пропускает строки chats.csv дальше, попутно складывая их в файл."""
+        sql = (f"INSERT OR REPLACE INTO chats ({_quoted(CHAT_HEADER)}) "
+               f"VALUES ({','.join('?' * len(CHAT_HEADER))})")
+        batch: list[list] = []
+        for row in rows:
+            yield row
+            if row[0]:
+                batch.append(_texts(row))
+            if len(batch) >= _BATCH:
+                self.conn.executemany(sql, batch)
+                batch.clear()
+        self.conn.executemany(sql, batch)
+
+    def tee_members(self, rows: Iterable[list]) -> Iterator[list]:
+        """То же для members.csv. При повторе ключа остаётся последняя
+        строка — как раньше при сборе в словарь."""
+        sql = (f"INSERT OR REPLACE INTO members "
+               f"(chat_key, member_key, {_quoted(_MEMBER_COLUMNS)}) "
+               f"VALUES ({','.join('?' * (len(MEMBER_HEADER) + 1))})")
+        batch: list[list] = []
+        for row in rows:
+            yield row
+            if not row[0]:
+                continue
+            values = _texts(row)
+            values.insert(1, row_member_key(values[_UID].strip(),
+                                            values[_LOGIN].strip()))
+            batch.append(values)
+            if len(batch) >= _BATCH:
+                self.conn.executemany(sql, batch)
+                batch.clear()
+        self.conn.executemany(sql, batch)
+
+    def finish(self) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES(?, ?)",
+                          ("version", RUN_INDEX_VERSION))
+        self.conn.commit()
+
+    def is_complete(self) -> bool:
+        try:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key='version'").fetchone()
+        except sqlite3.DatabaseError:
+            return False
+        return row is not None and row[0] == RUN_INDEX_VERSION
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def _read_csv_rows(path: str, header: list[str]) -> Iterator[list]:
+    if not os.path.isfile(path):
+        return
+    with open(path, "r", encoding=ENCODING, newline="") as handle:
+        for row in csv.DictReader(handle, delimiter=DELIMITER):
+            yield [row.get(name) for name in header]
+
+
+def ensure_run_index(run_path: str) -> str:
+    """Путь к файлу сравнения запуска. Запуски, сделанные до появления
+    файла, получают его один раз — из их chats.csv и members.csv."""
+    path = os.path.join(run_path, RUN_INDEX)
+    if os.path.isfile(path):
+        index = RunIndex(path)
+        try:
+            if index.is_complete():
+                return path
+        finally:
+            index.close()
+    log.info("Готовим запуск %s к сравнению: читаем его CSV один раз.",
+             os.path.basename(os.path.normpath(run_path)))
+    index = RunIndex.create(run_path)
+    try:
+        for _ in index.tee_chats(_read_csv_rows(
+                os.path.join(run_path, "chats.csv"), CHAT_HEADER)):
+            pass
+        for _ in index.tee_members(_read_csv_rows(
+                os.path.join(run_path, "members.csv"), MEMBER_HEADER)):
+            pass
+        index.finish()
+    finally:
+        index.close()
+    return path
@@ -15,6 +15,7 @@ RUN_DIR_RE = re.compile(r"^(analyze|validate|run)-(\d{8})-(\d{6})Z(?:_(.+))?$")
 MANIFEST = "manifest.json"
 LATEST_LINK = "latest"
 COMPARE_DIR = "_compare"
+BENCH_DIR = "_bench"
 
 
 @dataclass
@@ -44,6 +45,10 @@ class RunInfo:
     def flags(self) -> dict:
         return self.manifest.get("flags") or {}
 
+    @property
+    def perf(self) -> dict:
+        return self.manifest.get("perf") or {}
+
 
 # ---------------------------------------------------------------- создание
 def make_run_id(command: str, tag: str | None = None,
@@ -103,7 +108,7 @@ def sanitize_config(cfg) -> dict:
 def write_manifest(run: RunInfo, *, cfg=None, status: str = "ok",
                    metrics: dict | None = None, flags: dict | None = None,
                    inputs: dict | None = None, db: dict | None = None,
-                   errors: list | None = None) -> None:
+                   errors: list | None = None, perf: dict | None = None) -> None:
     run.finished_at = datetime.now(timezone.utc).isoformat()
     run.status = status
     run.manifest = {
@@ -118,6 +123,7 @@ def write_manifest(run: RunInfo, *, cfg=None, status: str = "ok",
         "db": db or {},
         "metrics": metrics or {},
         "errors": errors or [],
+        "perf": perf or {},
         "config": sanitize_config(cfg) if cfg else {},
     }
     with open(os.path.join(run.path, MANIFEST), "w", encoding="utf-8") as handle:
@@ -174,7 +180,7 @@ def list_runs(results_dir: str, command: str | None = None,
         return []
     runs: list[RunInfo] = []
     for entry in sorted(os.listdir(results_dir)):
-        if entry in (LATEST_LINK, COMPARE_DIR, "latest.txt"):
+        if entry in (LATEST_LINK, COMPARE_DIR, BENCH_DIR, "latest.txt"):
             continue
         full = os.path.join(results_dir, entry)
         if os.path.islink(full) or not os.path.isdir(full):
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import sqlite3
 import uuid
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from datetime import datetime, timezone
 
 
@@ -20,6 +20,11 @@ class RunDiff:
                 "removed": len(self.removed), "role_changed": len(self.role_changed)}
 
 
+# изменения состава, которые apply_changes переносит в membership_scd
+MEMBER_CHANGES = ("member_added", "bot_added", "member_removed", "bot_removed",
+                  "role_changed")
+
+
 def member_key(member) -> str:
     if member.uid:
         return f"uid::{member.uid}"
@@ -93,12 +98,35 @@ class SnapshotStore:
             );
             CREATE INDEX IF NOT EXISTS idx_chat_scd_open
                 ON chat_scd(chat_key, valid_to);
+            CREATE INDEX IF NOT EXISTS idx_scd_time
+                ON membership_scd(chat_key, valid_from, valid_to);
+            CREATE INDEX IF NOT EXISTS idx_scd_member
+                ON membership_scd(member_key, valid_from);
+            CREATE INDEX IF NOT EXISTS idx_scd_login
+                ON membership_scd(login COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS idx_chat_scd_time
+                ON chat_scd(chat_key, valid_from, valid_to);
+            CREATE INDEX IF NOT EXISTS idx_scd_open_bots
+                ON membership_scd(chat_key, member_key, scope)
+                WHERE is_bot=1 AND valid_to IS NULL;
             """
         )
         self.conn.commit()
 
     def apply_run(self, chats: dict, include_private: bool,
-                  scopes: tuple[str, ...] = ("audit",)) -> RunDiff:
+                  scopes: tuple[str, ...] = ("audit",), *,
+                  bulk: bool = True) -> RunDiff:
+        """Запоминает состав прогона и возвращает изменения.
+
+        bulk=True — прогон кладётся во временные таблицы и сравнивается
+        с открытыми версиями несколькими запросами на всё множество;
+        bulk=False — построчный путь, по запросу на чат и участника."""
+        if bulk:
+            return self._apply_run_bulk(chats, include_private, scopes)
+        return self._apply_run_rowwise(chats, include_private, scopes)
+
+    def _apply_run_rowwise(self, chats: dict, include_private: bool,
+                           scopes: tuple[str, ...]) -> RunDiff:
         run_id = str(uuid.uuid4())
         run_at = datetime.now(timezone.utc).isoformat()
         diff = RunDiff(run_id=run_id, run_at=run_at, scopes=scopes)
@@ -145,13 +173,192 @@ class SnapshotStore:
                     "UPDATE membership_scd SET last_run_id=? WHERE id=?",
                     (run_id, old["id"]))
 
+        self._record_run(diff, len(chats), len(current))
+        return diff
+
+    def _apply_run_bulk(self, chats: dict, include_private: bool,
+                        scopes: tuple[str, ...]) -> RunDiff:
+        run_id = str(uuid.uuid4())
+        run_at = datetime.now(timezone.utc).isoformat()
+        diff = RunDiff(run_id=run_id, run_at=run_at, scopes=scopes)
+        tracked = [chat for chat in chats.values()
+                   if include_private or chat.type != "private"]
+        current = self._load_run(tracked, scopes)
+        self._track_chats_bulk(run_at, run_id)
+
+        placeholders = ",".join("?" * len(scopes))
+        open_scd = (f"membership_scd.valid_to IS NULL "
+                    f"AND membership_scd.scope IN ({placeholders})")
+        in_run = ("SELECT 1 FROM run_members r WHERE "
+                  "r.chat_key=membership_scd.chat_key AND "
+                  "r.member_key=membership_scd.member_key AND "
+                  "r.scope=membership_scd.scope")
+
+        # добавленные: в прогоне есть, открытой версии нет
+        added = {tuple(row) for row in self.conn.execute(
+            "SELECT chat_key, member_key, scope FROM run_members r "
+            "WHERE NOT EXISTS (SELECT 1 FROM membership_scd s "
+            "WHERE s.chat_key=r.chat_key AND s.member_key=r.member_key "
+            "AND s.scope=r.scope AND s.valid_to IS NULL)")}
+
+        # удалённые: открытая версия есть, в прогоне нет
+        removed = self.conn.execute(
+            f"SELECT id, chat_key, member_key, login, role FROM membership_scd "
+            f"WHERE {open_scd} AND NOT EXISTS ({in_run})", scopes).fetchall()
+        diff.removed = [tuple(row)[1:] for row in removed]
+        self.conn.executemany(
+            "UPDATE membership_scd SET valid_to=? WHERE id=?",
+            ((run_at, row["id"]) for row in removed))
+
+        # сменилась роль: старую версию закрываем, first_run_id переносим
+        changed = {(row["chat_key"], row["member_key"], row["scope"]): row
+                   for row in self.conn.execute(
+                       "SELECT s.id, s.chat_key, s.member_key, s.scope, "
+                       "s.role, s.first_run_id FROM run_members r "
+                       "JOIN membership_scd s ON s.chat_key=r.chat_key "
+                       "AND s.member_key=r.member_key AND s.scope=r.scope "
+                       "AND s.valid_to IS NULL "
+                       "WHERE COALESCE(r.role, '') <> COALESCE(s.role, '')")}
+        self.conn.executemany(
+            "UPDATE membership_scd SET valid_to=? WHERE id=?",
+            ((run_at, row["id"]) for row in changed.values()))
+
+        # открытыми остались только совпавшие — отмечаем, что их видели
+        self.conn.execute(
+            f"UPDATE membership_scd SET last_run_id=? "
+            f"WHERE {open_scd} AND EXISTS ({in_run})", (run_id, *scopes))
+
+        # новые версии пишем в порядке прогона
+        fresh = []
+        for key, member in current.items():
+            if key in added:
+                diff.added.append((key[0], key[1], member.login, member.role))
+                fresh.append((key, member, run_id))
+            elif key in changed:
+                old = changed[key]
+                diff.role_changed.append(
+                    (key[0], key[1], member.login, old["role"], member.role))
+                fresh.append((key, member, old["first_run_id"] or run_id))
+        self.conn.executemany(
+            "INSERT INTO membership_scd(chat_key, member_key, scope, login, role, "
+            "source, confidence, is_bot, full_name, position, added_at, "
+            "added_by_login, valid_from, valid_to, first_run_id, last_run_id) "
+            "VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,NULL,?,?)",
+            ((key[0], key[1], key[2], member.login, member.role, member.source,
+              member.confidence, 1 if member.is_bot else 0,
+              member.full_name, member.position, member.added_at,
+              member.added_by_login, run_at, first_run_id, run_id)
+             for key, member, first_run_id in fresh))
+
+        self.conn.execute("DELETE FROM run_members")
+        self.conn.execute("DELETE FROM run_chats")
+        self._record_run(diff, len(chats), len(current))
+        return diff
+
+    def _load_run(self, chats: list, scopes: tuple[str, ...]) -> dict:
+        """Кладёт ключи прогона во временные таблицы.
+
+        В таблицу идут только ключ и роль — этого хватает для сравнения
+        с открытыми версиями. Остальные поля нужны лишь для новых версий,
+        их берём из возвращаемого словаря."""
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS run_chats ("
+            "chat_key TEXT PRIMARY KEY, seq INTEGER, name TEXT, "
+            "description TEXT, type TEXT)")
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS run_members ("
+            "chat_key TEXT NOT NULL, member_key TEXT NOT NULL, "
+            "scope TEXT NOT NULL, role TEXT, "
+            "PRIMARY KEY (chat_key, member_key, scope)) WITHOUT ROWID")
+        self.conn.execute("DELETE FROM run_chats")
+        self.conn.execute("DELETE FROM run_members")
+
+        current: dict[tuple[str, str, str], object] = {}
+        for chat in chats:
+            for member in chat.members.values():
+                scope = scope_of(member.source)
+                if scope in scopes:
+                    current[(chat.chat_key, member_key(member), scope)] = member
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO run_chats(chat_key, seq, name, description, "
+            "type) VALUES(?,?,?,?,?)",
+            ((chat.chat_key, seq, chat.name, chat.description, chat.type)
+             for seq, chat in enumerate(chats)))
+        self.conn.executemany(
+            "INSERT INTO run_members(chat_key, member_key, scope, role) "
+            "VALUES(?,?,?,?)",
+            ((*key, member.role) for key, member in current.items()))
+        return current
+
+    def _track_chats_bulk(self, run_at: str, run_id: str) -> None:
+        changed = ("SELECT 1 FROM run_chats r WHERE r.chat_key=chat_scd.chat_key "
+                   "AND (r.name IS NOT chat_scd.name "
+                   "OR r.description IS NOT chat_scd.description "
+                   "OR r.type IS NOT chat_scd.type)")
+        self.conn.execute(
+            f"UPDATE chat_scd SET valid_to=? "
+            f"WHERE valid_to IS NULL AND EXISTS ({changed})", (run_at,))
+        self.conn.execute(
+            "UPDATE chat_scd SET last_run_id=? WHERE valid_to IS NULL AND "
+            "EXISTS (SELECT 1 FROM run_chats r WHERE r.chat_key=chat_scd.chat_key)",
+            (run_id,))
+        self.conn.execute(
+            "INSERT INTO chat_scd(chat_key, name, description, type, valid_from, "
+            "valid_to, last_run_id) SELECT r.chat_key, r.name, r.description, "
+            "r.type, ?, NULL, ? FROM run_chats r WHERE NOT EXISTS ("
+            "SELECT 1 FROM chat_scd s WHERE s.chat_key=r.chat_key "
+            "AND s.valid_to IS NULL) ORDER BY r.seq", (run_at, run_id))
+
+    def apply_changes(self, changes: list, chats: list, run_id: str) -> None:
+        """Изменения состава по отдельным событиям (команда watch) — одной
+        короткой транзакцией, без сравнения с прошлым прогоном.
+
+        Пишется только scope audit и только участники-сотрудники: группы и
+        подразделения в людей здесь не разворачиваются. chats — затронутые
+        чаты в текущем состоянии, по ним обновляется chat_scd."""
+        first_seen: dict[str, str] = {}
+        for change in changes:
+            first_seen.setdefault(change.chat_key,
+                                  change.occurred_at or change.detected_at)
+        for chat in chats:
+            self._track_chat(chat, first_seen.get(chat.chat_key)
+                             or datetime.now(timezone.utc).isoformat(), run_id)
+        by_key = {chat.chat_key: chat for chat in chats}
+        for change in changes:
+            if not change.uid or change.change not in MEMBER_CHANGES:
+                continue
+            at = change.occurred_at or change.detected_at
+            key = (change.chat_key, member_key(change), "audit")
+            old = self.conn.execute(
+                "SELECT id, first_run_id, valid_from FROM membership_scd "
+                "WHERE chat_key=? AND member_key=? AND scope=? AND valid_to IS NULL",
+                key).fetchone()
+            if old is not None:
+                # версия из analyze открыта временем прогона; событие из окна
+                # перекрытия может быть старше — интервал не должен вывернуться
+                at = max(at, old["valid_from"])
+                self._close("membership_scd", old["id"], at)
+            if change.change in ("member_removed", "bot_removed"):
+                continue
+            member = (by_key.get(change.chat_key).members.get(change.uid)
+                      if change.chat_key in by_key else None)
+            if member is None:
+                continue
+            self._insert(key, replace(member, login=member.login or change.login),
+                         at, run_id,
+                         first_run_id=old["first_run_id"] if old is not None else None)
+        self.conn.commit()
+
+    def _record_run(self, diff: RunDiff, chats_total: int,
+                    members_total: int) -> None:
         self.conn.execute(
             "INSERT INTO runs(run_id, run_at, scopes, chats_total, members_total, "
             "added, removed, role_changed) VALUES(?,?,?,?,?,?,?,?)",
-            (run_id, run_at, ",".join(scopes), len(chats), len(current),
-             len(diff.added), len(diff.removed), len(diff.role_changed)))
+            (diff.run_id, diff.run_at, ",".join(diff.scopes), chats_total,
+             members_total, len(diff.added), len(diff.removed),
+             len(diff.role_changed)))
         self.conn.commit()
-        return diff
 
     def _track_chat(self, chat, run_at: str, run_id: str) -> None:
         row = self.conn.execute(
@@ -189,21 +396,99 @@ class SnapshotStore:
         self.conn.execute(f"UPDATE {table} SET valid_to=? WHERE id=?",
                           (valid_to, row_id))
 
+    _MEMBER_COLUMNS = ("m.member_key, m.login, m.role, m.source, m.scope, "
+                       "m.is_bot, m.added_at, m.full_name, m.position")
+
     def members_at(self, chat_key: str, at_iso: str) -> list[dict]:
         """Состав чата на момент времени: 'кто был в чате тогда'."""
+        return self.members_at_many([(chat_key, at_iso)])[(chat_key, at_iso)]
+
+    def chat_at(self, chat_key: str, at_iso: str) -> dict | None:
+        return self.chats_at_many([(chat_key, at_iso)])[(chat_key, at_iso)]
+
+    def members_at_many(self, points) -> dict[tuple[str, str], list[dict]]:
+        """Составы сразу для многих пар (chat_key, момент) одним запросом."""
+        points = self._load_points(points)
+        result: dict[tuple[str, str], list[dict]] = {point: [] for point in points}
+        cursor = self.conn.execute(
+            f"SELECT q.chat_key AS q_chat, q.at_iso AS q_at, "
+            f"{self._MEMBER_COLUMNS} FROM query_points q "
+            f"JOIN membership_scd m ON m.chat_key=q.chat_key "
+            f"AND m.valid_from<=q.at_iso "
+            f"AND (m.valid_to IS NULL OR m.valid_to>q.at_iso) "
+            f"ORDER BY q.seq, m.id")
+        for row in cursor:
+            item = dict(row)
+            result[(item.pop("q_chat"), item.pop("q_at"))].append(item)
+        return result
+
+    def chats_at_many(self, points) -> dict[tuple[str, str], dict | None]:
+        points = self._load_points(points)
+        result: dict[tuple[str, str], dict | None] = dict.fromkeys(points)
+        cursor = self.conn.execute(
+            "SELECT q.chat_key AS q_chat, q.at_iso AS q_at, c.name, "
+            "c.description, c.type FROM query_points q "
+            "JOIN chat_scd c ON c.chat_key=q.chat_key AND c.valid_from<=q.at_iso "
+            "AND (c.valid_to IS NULL OR c.valid_to>q.at_iso)")
+        for row in cursor:
+            item = dict(row)
+            result[(item.pop("q_chat"), item.pop("q_at"))] = item
+        return result
+
+    def members_between(self, chat_keys, from_iso: str,
+                        to_iso: str) -> dict[str, list[dict]]:
+        """Все версии участия, пересекающиеся с периодом [from_iso, to_iso).
+
+        Версия — это отрезок valid_from..valid_to с постоянной ролью, поэтому
+        по результату видно, кто был в чате в течение периода и когда
+        пришёл, ушёл или сменил роль."""
+        points = self._load_points((key, from_iso) for key in chat_keys)
+        result: dict[str, list[dict]] = {key: [] for key, _ in points}
         cursor = self.conn.execute(
-            "SELECT member_key, login, role, source, scope, is_bot, added_at, "
-            "full_name, position FROM membership_scd "
-            "WHERE chat_key=? AND valid_from<=? AND (valid_to IS NULL OR valid_to>?)",
-            (chat_key, at_iso, at_iso))
+            f"SELECT {self._MEMBER_COLUMNS}, m.chat_key, m.valid_from, "
+            f"m.valid_to FROM query_points q "
+            f"JOIN membership_scd m ON m.chat_key=q.chat_key "
+            f"AND m.valid_from<? AND (m.valid_to IS NULL OR m.valid_to>?) "
+            f"ORDER BY q.seq, m.valid_from, m.id", (to_iso, from_iso))
+        for row in cursor:
+            result[row["chat_key"]].append(dict(row))
+        return result
+
+    def member_timeline(self, member_keys) -> list[dict]:
+        """История участия сотрудника во всех чатах, по времени."""
+        keys = list(dict.fromkeys(member_keys))
+        if not keys:
+            return []
+        placeholders = ",".join("?" * len(keys))
+        cursor = self.conn.execute(
+            f"SELECT m.chat_key, {self._MEMBER_COLUMNS}, m.valid_from, "
+            f"m.valid_to, (SELECT c.name FROM chat_scd c "
+            f"WHERE c.chat_key=m.chat_key ORDER BY c.valid_from DESC LIMIT 1) "
+            f"AS chat_name, (SELECT c.type FROM chat_scd c "
+            f"WHERE c.chat_key=m.chat_key ORDER BY c.valid_from DESC LIMIT 1) "
+            f"AS chat_type FROM membership_scd m "
+            f"WHERE m.member_key IN ({placeholders}) "
+            f"ORDER BY m.valid_from, m.chat_key, m.id", keys)
         return [dict(row) for row in cursor]
 
-    def chat_at(self, chat_key: str, at_iso: str) -> dict | None:
-        row = self.conn.execute(
-            "SELECT name, description, type FROM chat_scd "
-            "WHERE chat_key=? AND valid_from<=? AND (valid_to IS NULL OR valid_to>?)",
-            (chat_key, at_iso, at_iso)).fetchone()
-        return dict(row) if row else None
+    def member_keys_for(self, login: str) -> list[str]:
+        """Ключи истории, под которыми записывался участник с этим логином."""
+        return [row["member_key"] for row in self.conn.execute(
+            "SELECT DISTINCT member_key FROM membership_scd "
+            "WHERE login=? COLLATE NOCASE", (login.strip(),))]
+
+    def _load_points(self, points) -> list[tuple[str, str]]:
+        """Кладёт запрошенные пары (chat_key, момент) во временную таблицу."""
+        points = list(dict.fromkeys((str(key), at) for key, at in points))
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS query_points ("
+            "seq INTEGER PRIMARY KEY, chat_key TEXT NOT NULL, at_iso TEXT NOT NULL)")
+        self.conn.execute("DELETE FROM query_points")
+        self.conn.executemany(
+            "INSERT INTO query_points(seq, chat_key, at_iso) VALUES(?,?,?)",
+            ((seq, key, at) for seq, (key, at) in enumerate(points)))
+        self.conn.commit()
+        return points
 
     def close(self) -> None:
         self.conn.close()
@@ -1,15 +1,219 @@
 from __future__ import annotations
 
+import gzip
+import itertools
 import json
 import logging
+import os
+import shutil
 import sqlite3
+import tempfile
+import zlib
+from collections import OrderedDict
 from datetime import datetime, timezone
+from pathlib import Path
 from typing import Iterable, Iterator, Optional
 
+from projection import EVENT_FIELDS, chat_partition, event_fields, event_from_fields
+
 log = logging.getLogger("store")
 
 BATCH = 500
 
+# Наблюдения пар uid -> логин: инициатор любого события и отдельно
+# инициатор личного чата (в событии создания есть partner_uid).
+OBS_INITIATOR = "initiator"
+OBS_PARTNER = "partner"
+_OBSERVATIONS_VERSION = "1"
+
+# json    — событие целиком в raw_events.payload (прежний формат);
+# compact — поля для проигрывания в отдельных колонках, само событие
+#           сжато в payload_z и нужно только для разбора спорных случаев.
+STORAGE_JSON = "json"
+STORAGE_COMPACT = "compact"
+
+# single  — все события в таблице raw_events основной базы;
+# monthly — по файлу на месяц occurred_at в папке рядом с базой
+#           (msgaudit.sqlite3 -> msgaudit.events/2026-03.sqlite3), список
+#           месяцев — в таблице event_partitions основной базы. Месяцы не
+#           пересекаются по времени, поэтому проигрывание по порядку — это
+#           файлы друг за другом, без общей сортировки.
+LAYOUT_SINGLE = "single"
+LAYOUT_MONTHLY = "monthly"
+
+# сколько помесячных файлов держать открытыми на запись одновременно
+_WRITERS_OPEN = 4
+
+_RAW_EVENTS_COMPACT = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        idempotency_id   TEXT PRIMARY KEY,
+        occurred_at      TEXT NOT NULL,
+        type             TEXT NOT NULL,
+        chat_id          TEXT,
+        uid              TEXT,
+        user_login       TEXT,
+        payload          TEXT,
+        object_uid       TEXT,
+        member_role      TEXT,
+        member_is_robot  INTEGER,
+        chat_name        TEXT,
+        chat_description TEXT,
+        chat_type        TEXT,
+        chat_is_thread   INTEGER,
+        group_id         TEXT,
+        department_id    TEXT,
+        payload_z        BLOB
+    );
+"""
+_INSERT_COMPACT = (
+    "INSERT OR IGNORE INTO {table} (idempotency_id, occurred_at, type, chat_id, "
+    "uid, user_login, " + ", ".join(EVENT_FIELDS) + ", payload_z) "
+    "VALUES (" + ",".join("?" * (7 + len(EVENT_FIELDS))) + ")")
+_COMPACT_COLUMNS = ("idempotency_id, occurred_at, type, chat_id, uid, user_login, "
+                    + ", ".join(EVENT_FIELDS) + ", payload_z")
+# индекс по (occurred_at, idempotency_id) отдаёт месяц уже в порядке проигрывания
+_PARTITION_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_events_chat ON raw_events(chat_id);
+    CREATE INDEX IF NOT EXISTS idx_events_order
+        ON raw_events(occurred_at, idempotency_id);
+"""
+_EVENT_PARTITIONS = """
+    CREATE TABLE IF NOT EXISTS event_partitions (
+        month           TEXT PRIMARY KEY,
+        events          INTEGER NOT NULL,
+        min_occurred_at TEXT,
+        max_occurred_at TEXT,
+        archived        INTEGER NOT NULL DEFAULT 0,
+        updated_at      TEXT NOT NULL
+    )
+"""
+_REPLAY_COLUMNS = ("idempotency_id, occurred_at, type, chat_id, uid, user_login, "
+                   + ", ".join(EVENT_FIELDS))
+
+
+# Событие аудит-лога — несколько сотен байт, и обычное сжатие почти не
+# находит в нём повторов. Словарь с типичными ключами и значениями сжимает
+# такие записи примерно вдвое лучше. Первый байт сжатой записи — номер
+# словаря: менять словарь можно только вместе с номером.
+_PAYLOAD_DICTS = {
+    1: json.dumps(
+        {"user_login": "@example.org", "user_name": "",
+         "event": {"uid": 1130000000000000, "org_id": 1,
+                   "occurred_at": "2026-01-01T00:00:00.000000+00:00",
+                   "type": "messenger_chat.member.added", "service": "Web",
+                   "idempotency_id": "", "status": "Success", "is_system": False,
+                   "ip": "", "request_id": "",
+                   "meta": {"chat_id": "", "revision": "",
+                            "chat_info": {"name": "", "type": "group",
+                                          "description": ""},
+                            "object_uid": "",
+                            "member_info": {"role": "member",
+                                            "is_robot": False}}}},
+        ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+}
+_PAYLOAD_DICT_VERSION = 1
+
+
+def pack_payload(enriched: dict) -> bytes:
+    # запись и словарь укладываются в окно 4 КБ; маленькое окно и memLevel
+    # заметно ускоряют создание упаковщика, которое здесь на каждое событие
+    packer = zlib.compressobj(6, zlib.DEFLATED, -12, 4, zlib.Z_DEFAULT_STRATEGY,
+                              _PAYLOAD_DICTS[_PAYLOAD_DICT_VERSION])
+    body = json.dumps(enriched, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+    return bytes([_PAYLOAD_DICT_VERSION]) + packer.compress(body) + packer.flush()
+
+
+def unpack_payload(blob: bytes) -> dict:
+    unpacker = zlib.decompressobj(-15, zdict=_PAYLOAD_DICTS[blob[0]])
+    body = unpacker.decompress(blob[1:]) + unpacker.flush()
+    return json.loads(body.decode("utf-8"))
+
+
+def _compact_row(enriched: dict) -> Optional[tuple]:
+    ev = enriched.get("event", {}) or {}
+    idem = ev.get("idempotency_id")
+    if not idem:
+        return None
+    return (
+        idem,
+        ev.get("occurred_at"),
+        ev.get("type"),
+        (ev.get("meta") or {}).get("chat_id"),
+        str(ev["uid"]) if ev.get("uid") is not None else None,
+        enriched.get("user_login"),
+        *event_fields(enriched),
+        pack_payload(enriched),
+    )
+
+
+def _json_row(enriched: dict) -> Optional[tuple]:
+    ev = enriched.get("event", {}) or {}
+    idem = ev.get("idempotency_id")
+    if not idem:
+        return None
+    return (
+        idem,
+        ev.get("occurred_at"),
+        ev.get("type"),
+        (ev.get("meta") or {}).get("chat_id"),
+        str(ev["uid"]) if ev.get("uid") is not None else None,
+        enriched.get("user_login"),
+        json.dumps(enriched, ensure_ascii=False),
+    )
+
+
+def _observations(enriched: dict) -> Iterator[tuple[str, str, str]]:
+    """Пары (uid, логин, вид), которые событие сообщает о своём инициаторе."""
+    ev = enriched.get("event", {}) or {}
+    login = enriched.get("user_login")
+    if ev.get("uid") is None or not login:
+        return
+    uid = str(ev["uid"])
+    yield uid, login, OBS_INITIATOR
+    if ev.get("type") == "messenger_chat.created":
+        info = (ev.get("meta") or {}).get("chat_info") or {}
+        if info.get("partner_uid"):
+            yield uid, login, OBS_PARTNER
+
+
+def _tally(observed: dict, enriched: dict, kinds: tuple[str, ...]) -> None:
+    """Копит наблюдения пачки: ключ (uid, логин, вид) -> [сколько, первое, последнее]."""
+    moment = (enriched.get("event") or {}).get("occurred_at")
+    for key in _observations(enriched):
+        if key[2] not in kinds:
+            continue
+        entry = observed.get(key)
+        if entry is None:
+            observed[key] = [1, moment, moment]
+        else:
+            entry[0] += 1
+            entry[1] = min(entry[1], moment)
+            entry[2] = max(entry[2], moment)
+
+
+def partitions_dir(db_path: str) -> str:
+    """Папка помесячных файлов базы db_path."""
+    return os.path.splitext(db_path)[0] + ".events"
+
+
+def month_of(occurred_at: str) -> str:
+    """'2026-03-05T10:00:00+00:00' -> '2026-03'."""
+    return occurred_at[:7]
+
+
+def shift_month(month: str, delta: int) -> str:
+    index = int(month[:4]) * 12 + int(month[5:7]) - 1 + delta
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _add_functions(conn: sqlite3.Connection) -> None:
+    conn.create_function("chat_partition", 2, chat_partition, deterministic=True)
+
 
 def parse_dt(value: str) -> datetime:
     """occurred_at: '2026-07-06T11:45:53.437000+00:00'."""
@@ -17,71 +221,440 @@ def parse_dt(value: str) -> datetime:
 
 
 class EventStore:
-    """Вечный event store. Дедуп по idempotency_id, чекпоинт по occurred_at."""
+    """Вечный event store. Дедуп по idempotency_id, чекпоинт по occurred_at.
+
+    Формат хранения событий определяется при создании базы (storage) и
+    дальше не меняется сам: база в формате json остаётся в нём, пока её не
+    переведут в compact методом migrate_to_compact. Так же с раскладкой
+    (layout): база в одном файле переводится в помесячные файлы методом
+    migrate_to_monthly; помесячные файлы всегда в формате compact.
 
-    def __init__(self, path: str):
-        self.conn = sqlite3.connect(path)
+    Соединения не привязаны к потоку: prefetch.py пишет события из рабочих
+    потоков asyncio.to_thread. Одновременно к хранилищу обращается не больше
+    одного потока — за этим следит вызывающий код."""
+
+    def __init__(self, path: str, storage: str = STORAGE_COMPACT,
+                 layout: str = LAYOUT_SINGLE):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
-        self._init_schema()
+        _add_functions(self.conn)
+        self.partition_dir = partitions_dir(path)
+        self._writers: OrderedDict[str, sqlite3.Connection] = OrderedDict()
+        self._unpacked: dict[str, str] = {}
+        self._unpack_dir: Optional[str] = None
+        self._init_schema(storage, layout)
 
-    def _init_schema(self) -> None:
+    def _init_schema(self, storage: str, layout: str) -> None:
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        tables = {row["name"] for row in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'")}
+        if (layout == LAYOUT_MONTHLY and "event_partitions" not in tables
+                and not ("raw_events" in tables and self.conn.execute(
+                    "SELECT 1 FROM raw_events LIMIT 1").fetchone())):
+            # раскладку выбирает только база, в которой ещё нет событий
+            self.conn.executescript("DROP TABLE IF EXISTS raw_events;"
+                                    + _EVENT_PARTITIONS + ";")
+            tables = (tables - {"raw_events"}) | {"event_partitions"}
+        self.layout = (LAYOUT_MONTHLY if "event_partitions" in tables
+                       else LAYOUT_SINGLE)
+        if self.layout == LAYOUT_SINGLE:
+            if "raw_events" not in tables and storage == STORAGE_COMPACT:
+                self.conn.executescript(_RAW_EVENTS_COMPACT.format(table="raw_events"))
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS raw_events (
+                    idempotency_id TEXT PRIMARY KEY,
+                    occurred_at    TEXT NOT NULL,
+                    type           TEXT NOT NULL,
+                    chat_id        TEXT,
+                    uid            TEXT,
+                    user_login     TEXT,
+                    payload        TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_events_chat ON raw_events(chat_id);
+                CREATE INDEX IF NOT EXISTS idx_events_time ON raw_events(occurred_at);
+                """
+            )
         self.conn.executescript(
             """
-            PRAGMA journal_mode=WAL;
-            CREATE TABLE IF NOT EXISTS raw_events (
-                idempotency_id TEXT PRIMARY KEY,
-                occurred_at    TEXT NOT NULL,
-                type           TEXT NOT NULL,
-                chat_id        TEXT,
-                uid            TEXT,
-                user_login     TEXT,
-                payload        TEXT NOT NULL
-            );
-            CREATE INDEX IF NOT EXISTS idx_events_chat ON raw_events(chat_id);
-            CREATE INDEX IF NOT EXISTS idx_events_time ON raw_events(occurred_at);
             CREATE TABLE IF NOT EXISTS checkpoint (
                 key TEXT PRIMARY KEY,
                 value TEXT NOT NULL
             );
+            CREATE TABLE IF NOT EXISTS uid_login_observations (
+                uid        TEXT NOT NULL,
+                login      TEXT NOT NULL,
+                kind       TEXT NOT NULL,
+                cnt        INTEGER NOT NULL,
+                first_seen TEXT,
+                last_seen  TEXT,
+                PRIMARY KEY (uid, login, kind)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_observations_kind
+                ON uid_login_observations(kind, cnt);
             """
         )
         self.conn.commit()
+        if self.layout == LAYOUT_MONTHLY:
+            self.storage = STORAGE_COMPACT
+        else:
+            columns = {row["name"] for row in
+                       self.conn.execute("PRAGMA table_info(raw_events)")}
+            self.storage = STORAGE_COMPACT if "payload_z" in columns else STORAGE_JSON
+        if self.get_value("observations_version") != _OBSERVATIONS_VERSION:
+            self._rebuild_observations()
 
     def upsert_events(self, enriched_events: Iterable[dict]) -> int:
-        before = self.conn.total_changes
+        """Кладёт новые события и тут же учитывает их пары uid -> логин
+        в uid_login_observations. Возвращает число новых событий."""
+        if self.storage == STORAGE_COMPACT:
+            sql, make_row = _INSERT_COMPACT.format(table="raw_events"), _compact_row
+        else:
+            sql = ("INSERT OR IGNORE INTO raw_events "
+                   "(idempotency_id, occurred_at, type, chat_id, uid, user_login, "
+                   "payload) VALUES (?,?,?,?,?,?,?)")
+            make_row = _json_row
+        inserted = 0
+        batch: list[dict] = []
+        for enriched in enriched_events:
+            batch.append(enriched)
+            if len(batch) >= BATCH:
+                inserted += self._upsert_batch(sql, make_row, batch)
+                batch.clear()
+        if batch:
+            inserted += self._upsert_batch(sql, make_row, batch)
+        return inserted
+
+    def _upsert_batch(self, sql: str, make_row, batch: list[dict]) -> int:
+        rows = [row for row in map(make_row, batch) if row]
+        if not rows:
+            return 0
+        if self.layout == LAYOUT_MONTHLY:
+            # у повторно пришедшего события то же occurred_at, значит и тот
+            # же месяц: дубли ловятся внутри одного файла
+            by_month: dict[str, list[tuple]] = {}
+            for row in rows:
+                if row[1]:
+                    by_month.setdefault(month_of(row[1]), []).append(row)
+            parts = [(self._writer(month), month, part)
+                     for month, part in by_month.items()]
+        else:
+            parts = [(self.conn, None, rows)]
+        seen: set[str] = set()
+        inserted = 0
+        for conn, month, part in parts:
+            ids = [row[0] for row in part]
+            # уже лежащие в базе события второй раз не считаются
+            seen.update(row[0] for row in conn.execute(
+                f"SELECT idempotency_id FROM raw_events "
+                f"WHERE idempotency_id IN ({','.join('?' * len(ids))})", ids))
+            before = conn.total_changes
+            conn.executemany(sql, part)
+            added = conn.total_changes - before
+            inserted += added
+            if month is not None:
+                conn.commit()
+                self._note_partition(month, added, part)
+        observed: dict[tuple[str, str, str], list] = {}
+        for enriched in batch:
+            idem = (enriched.get("event") or {}).get("idempotency_id")
+            if not idem or idem in seen:
+                continue
+            seen.add(idem)
+            _tally(observed, enriched, (OBS_INITIATOR, OBS_PARTNER))
+        self._record_observations(observed)
+        self.conn.commit()
+        return inserted
+
+    def _note_partition(self, month: str, added: int, rows: list[tuple]) -> None:
+        moments = [row[1] for row in rows]
+        self.conn.execute(
+            "INSERT INTO event_partitions(month, events, min_occurred_at, "
+            "max_occurred_at, archived, updated_at) VALUES(?,?,?,?,0,?) "
+            "ON CONFLICT(month) DO UPDATE SET events=events+excluded.events, "
+            "min_occurred_at=min(min_occurred_at, excluded.min_occurred_at), "
+            "max_occurred_at=max(max_occurred_at, excluded.max_occurred_at), "
+            "updated_at=excluded.updated_at",
+            (month, added, min(moments), max(moments), _now()))
+
+    def _record_observations(self, observed: dict) -> None:
+        rows = ((*key, cnt, first, last)
+                for key, (cnt, first, last) in observed.items())
+        self.conn.executemany(
+            "INSERT INTO uid_login_observations "
+            "(uid, login, kind, cnt, first_seen, last_seen) VALUES (?,?,?,?,?,?) "
+            "ON CONFLICT(uid, login, kind) DO UPDATE SET "
+            "cnt = cnt + excluded.cnt, "
+            "first_seen = min(first_seen, excluded.first_seen), "
+            "last_seen = max(last_seen, excluded.last_seen)", rows)
+
+    def _rebuild_observations(self) -> None:
+        """Заполняет uid_login_observations по уже лежащим событиям — один
+        раз для базы, созданной до появления таблицы."""
+        self.conn.execute("DELETE FROM uid_login_observations")
+        for conn in self._sources():
+            self._record_observations({
+                (row[0], row[1], OBS_INITIATOR): row[2:] for row in conn.execute(
+                    "SELECT uid, user_login, COUNT(*), MIN(occurred_at), "
+                    "MAX(occurred_at) FROM raw_events WHERE uid IS NOT NULL "
+                    "AND user_login IS NOT NULL AND user_login != '' "
+                    "GROUP BY uid, user_login")})
+        # partner_uid есть только внутри события, поэтому личные чаты
+        # приходится разобрать — один раз, дальше таблица растёт сама
+        partners: dict[tuple[str, str, str], list] = {}
+        for enriched in self.iter_payloads("messenger_chat.created"):
+            _tally(partners, enriched, (OBS_PARTNER,))
+        self._record_observations(partners)
+        self.set_value("observations_version", _OBSERVATIONS_VERSION)
+        total = self.conn.execute(
+            "SELECT COUNT(*) AS c FROM uid_login_observations").fetchone()["c"]
+        if total:
+            log.info("Пары uid -> логин собраны по накопленным событиям: %s.", total)
+
+    def identity_observations(self, kind: str = OBS_INITIATOR) -> Iterator[tuple]:
+        """(uid, логин, сколько раз встречалась пара) — самые частые первыми."""
+        cur = self.conn.execute(
+            "SELECT uid, login, cnt FROM uid_login_observations WHERE kind=? "
+            "ORDER BY cnt DESC, uid, login", (kind,))
+        cur.row_factory = None
+        return iter(cur)
+
+    def _insert_batched(self, sql: str, rows: Iterable[tuple],
+                        conn: Optional[sqlite3.Connection] = None) -> int:
+        conn = conn or self.conn
+        before = conn.total_changes
         batch: list[tuple] = []
 
         def flush() -> None:
             if batch:
-                self.conn.executemany(
-                    "INSERT OR IGNORE INTO raw_events "
-                    "(idempotency_id, occurred_at, type, chat_id, uid, user_login, payload) "
-                    "VALUES (?,?,?,?,?,?,?)",
-                    batch,
-                )
-                self.conn.commit()
+                conn.executemany(sql, batch)
+                conn.commit()
                 batch.clear()
 
-        for enriched in enriched_events:
-            ev = enriched.get("event", {}) or {}
-            meta = ev.get("meta") or {}
-            idem = ev.get("idempotency_id")
-            if not idem:
-                continue
-            batch.append((
-                idem,
-                ev.get("occurred_at"),
-                ev.get("type"),
-                meta.get("chat_id"),
-                str(ev["uid"]) if ev.get("uid") is not None else None,
-                enriched.get("user_login"),
-                json.dumps(enriched, ensure_ascii=False),
-            ))
+        for row in rows:
+            batch.append(row)
             if len(batch) >= BATCH:
                 flush()
         flush()
-        return self.conn.total_changes - before
+        return conn.total_changes - before
+
+    def migrate_to_compact(self) -> int:
+        """Переводит базу формата json в compact. Возвращает число событий.
+
+        Таблица пересобирается целиком: колонку payload в старой схеме
+        нельзя сделать необязательной, а место освобождается только после
+        VACUUM."""
+        if self.storage == STORAGE_COMPACT:
+            return 0
+        self.conn.execute("DROP TABLE IF EXISTS raw_events_compact")
+        self.conn.executescript(_RAW_EVENTS_COMPACT.format(table="raw_events_compact"))
+        migrated = self._insert_batched(
+            _INSERT_COMPACT.format(table="raw_events_compact"),
+            (_compact_row(json.loads(row["payload"])) for row in
+             self.conn.execute("SELECT payload FROM raw_events")))
+        self.conn.executescript(
+            """
+            BEGIN;
+            DROP TABLE raw_events;
+            ALTER TABLE raw_events_compact RENAME TO raw_events;
+            CREATE INDEX IF NOT EXISTS idx_events_chat ON raw_events(chat_id);
+            CREATE INDEX IF NOT EXISTS idx_events_time ON raw_events(occurred_at);
+            COMMIT;
+            VACUUM;
+            """
+        )
+        self.storage = STORAGE_COMPACT
+        log.info("База событий переведена в компактный формат: %s событий.",
+                 migrated)
+        return migrated
+
+    # ------------------------------------------------------------------
+    def migrate_to_monthly(self) -> int:
+        """Раскладывает события из raw_events по помесячным файлам.
+        Возвращает число событий.
+
+        Файлы пишутся во временную папку и занимают своё место, когда
+        записаны все; список месяцев появляется в одной транзакции с
+        удалением raw_events. Прерванный перевод можно просто повторить."""
+        if self.layout == LAYOUT_MONTHLY:
+            return 0
+        staging = self.partition_dir + ".tmp"
+        for leftover in (staging, self.partition_dir):    # от прерванного перевода
+            shutil.rmtree(leftover, ignore_errors=True)
+        os.makedirs(staging)
+        if self.storage == STORAGE_COMPACT:
+            rows = self.conn.execute(
+                f"SELECT {_COMPACT_COLUMNS} FROM raw_events "
+                f"ORDER BY occurred_at, idempotency_id")
+            rows.row_factory = None
+        else:
+            rows = (_compact_row(json.loads(row["payload"])) for row in
+                    self.conn.execute("SELECT payload FROM raw_events "
+                                      "ORDER BY occurred_at, idempotency_id"))
+        sql = _INSERT_COMPACT.format(table="raw_events")
+        catalog: list[tuple] = []
+        now = _now()
+        for month, part in itertools.groupby(
+                (row for row in rows if row and row[1]),
+                key=lambda row: month_of(row[1])):
+            conn = sqlite3.connect(os.path.join(staging, f"{month}.sqlite3"))
+            try:
+                conn.executescript(_RAW_EVENTS_COMPACT.format(table="raw_events"))
+                self._insert_batched(sql, part, conn)
+                conn.executescript(_PARTITION_INDEXES)
+                catalog.append((month, *conn.execute(
+                    "SELECT COUNT(*), MIN(occurred_at), MAX(occurred_at) "
+                    "FROM raw_events").fetchone(), now))
+            finally:
+                conn.close()
+        os.replace(staging, self.partition_dir)
+        self.conn.commit()
+        self.conn.execute("BEGIN")
+        self.conn.execute(_EVENT_PARTITIONS)
+        self.conn.executemany(
+            "INSERT INTO event_partitions(month, events, min_occurred_at, "
+            "max_occurred_at, archived, updated_at) VALUES(?,?,?,?,0,?)", catalog)
+        self.conn.execute("DROP TABLE raw_events")
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        self.layout, self.storage = LAYOUT_MONTHLY, STORAGE_COMPACT
+        migrated = sum(entry[1] for entry in catalog)
+        log.info("События разложены по месяцам: %s событий, месяцев %s.",
+                 migrated, len(catalog))
+        return migrated
+
+    def partitions(self) -> list[dict]:
+        """Месяцы помесячной базы: сколько событий, за какое время, в архиве ли."""
+        if self.layout != LAYOUT_MONTHLY:
+            return []
+        return [dict(row) for row in self.conn.execute(
+            "SELECT month, events, min_occurred_at, max_occurred_at, archived "
+            "FROM event_partitions ORDER BY month")]
+
+    def archive_months(self, hot_months: int,
+                       now: Optional[datetime] = None) -> list[tuple[str, int, int]]:
+        """Сжимает месяцы старше hot_months последних. -> [(месяц, байт до,
+        байт после)].
+
+        Файл месяца уплотняется (VACUUM), сжимается gzip и остаётся только
+        для чтения. События из него по-прежнему проигрываются: при чтении
+        файл распаковывается во временную папку. Если в такой месяц придёт
+        запоздавшее событие, месяц распакуется обратно и снова станет
+        обычным файлом."""
+        if self.layout != LAYOUT_MONTHLY:
+            return []
+        current = month_of((now or datetime.now(timezone.utc)).isoformat())
+        cutoff = shift_month(current, -(max(hot_months, 1) - 1))
+        done = []
+        for month, archived in self._months(last=shift_month(cutoff, -1)):
+            if archived:
+                continue
+            writer = self._writers.pop(month, None)
+            if writer is not None:
+                writer.close()
+            path = self._partition_path(month)
+            conn = sqlite3.connect(path)
+            try:
+                conn.execute("PRAGMA journal_mode=DELETE")
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+            size = os.path.getsize(path)
+            target = self._partition_path(month, archived=True)
+            with open(path, "rb") as src, \
+                    gzip.open(target + ".tmp", "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            os.replace(target + ".tmp", target)
+            os.chmod(target, 0o444)
+            self.conn.execute("UPDATE event_partitions SET archived=1, updated_at=? "
+                              "WHERE month=?", (_now(), month))
+            self.conn.commit()
+            os.remove(path)
+            done.append((month, size, os.path.getsize(target)))
+        return done
+
+    def _partition_path(self, month: str, archived: bool = False) -> str:
+        name = f"{month}.sqlite3" + (".gz" if archived else "")
+        return os.path.join(self.partition_dir, name)
+
+    def _months(self, first: Optional[str] = None,
+                last: Optional[str] = None) -> list[tuple[str, int]]:
+        return [(row["month"], row["archived"]) for row in self.conn.execute(
+            "SELECT month, archived FROM event_partitions "
+            "WHERE month >= ? AND month <= ? ORDER BY month",
+            (first or "", last or "9999-99"))]
+
+    def _writer(self, month: str) -> sqlite3.Connection:
+        conn = self._writers.get(month)
+        if conn is not None:
+            self._writers.move_to_end(month)
+            return conn
+        if any(archived for _, archived in self._months(month, month)):
+            self._restore(month)
+        os.makedirs(self.partition_dir, exist_ok=True)
+        conn = sqlite3.connect(self._partition_path(month),
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_RAW_EVENTS_COMPACT.format(table="raw_events")
+                           + _PARTITION_INDEXES)
+        self._writers[month] = conn
+        while len(self._writers) > _WRITERS_OPEN:
+            self._writers.popitem(last=False)[1].close()
+        return conn
+
+    def _restore(self, month: str) -> None:
+        """Возвращает сжатый месяц в обычный файл, чтобы дописать в него."""
+        source = self._partition_path(month, archived=True)
+        with gzip.open(source, "rb") as src, \
+                open(self._partition_path(month), "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        self.conn.execute("UPDATE event_partitions SET archived=0, updated_at=? "
+                          "WHERE month=?", (_now(), month))
+        self.conn.commit()
+        os.chmod(source, 0o644)
+        os.remove(source)
+        log.info("Пришли события за архивный месяц %s — месяц снова открыт "
+                 "для записи.", month)
+
+    def _unpack(self, month: str) -> str:
+        path = self._unpacked.get(month)
+        if path is None:
+            if self._unpack_dir is None:
+                self._unpack_dir = tempfile.mkdtemp(prefix="msgaudit-events-")
+            path = os.path.join(self._unpack_dir, f"{month}.sqlite3")
+            with gzip.open(self._partition_path(month, archived=True), "rb") as src, \
+                    open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            self._unpacked[month] = path
+        return path
+
+    def _sources(self, first: Optional[str] = None,
+                 last: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+        """Соединения с событиями месяцев first..last по порядку; для базы
+        в одном файле — она сама. Файл месяца открывается, только когда до
+        него дошла очередь, и закрывается сразу после."""
+        if self.layout == LAYOUT_SINGLE:
+            yield self.conn
+            return
+        for month, archived in self._months(first, last):
+            if archived:
+                uri = Path(self._unpack(month)).absolute().as_uri()
+                conn = sqlite3.connect(f"{uri}?mode=ro&immutable=1", uri=True)
+            else:
+                path = self._partition_path(month)
+                if not os.path.exists(path):
+                    raise FileNotFoundError(
+                        f"Нет файла событий за {month}: {path}")
+                conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            _add_functions(conn)
+            try:
+                yield conn
+            finally:
+                conn.close()
 
+    # ------------------------------------------------------------------
     def get_checkpoint(self) -> Optional[datetime]:
         row = self.conn.execute(
             "SELECT value FROM checkpoint WHERE key='last_occurred_at'"
@@ -96,19 +669,175 @@ class EventStore:
         )
         self.conn.commit()
 
+    def get_value(self, key: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT value FROM checkpoint WHERE key=?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_value(self, key: str, value: str) -> None:
+        self.conn.execute(
+            "INSERT INTO checkpoint(key, value) VALUES(?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (key, value))
+        self.conn.commit()
+
+    def keys_with_prefix(self, prefix: str) -> set[str]:
+        return {row["key"] for row in self.conn.execute(
+            "SELECT key FROM checkpoint WHERE substr(key, 1, ?) = ?",
+            (len(prefix), prefix))}
+
+    def delete_prefix(self, prefix: str) -> None:
+        self.conn.execute("DELETE FROM checkpoint WHERE substr(key, 1, ?) = ?",
+                          (len(prefix), prefix))
+        self.conn.commit()
+
     def max_occurred_at(self) -> Optional[datetime]:
-        row = self.conn.execute("SELECT MAX(occurred_at) AS m FROM raw_events").fetchone()
+        table, column = (("event_partitions", "max_occurred_at")
+                         if self.layout == LAYOUT_MONTHLY
+                         else ("raw_events", "occurred_at"))
+        row = self.conn.execute(f"SELECT MAX({column}) AS m FROM {table}").fetchone()
         return parse_dt(row["m"]) if row and row["m"] else None
 
     def count(self) -> int:
+        if self.layout == LAYOUT_MONTHLY:
+            return self.conn.execute("SELECT COALESCE(SUM(events), 0) AS c "
+                                     "FROM event_partitions").fetchone()["c"]
         return self.conn.execute("SELECT COUNT(*) AS c FROM raw_events").fetchone()["c"]
 
     def iter_all_events_ordered(self) -> Iterator[dict]:
-        cur = self.conn.execute(
-            "SELECT payload FROM raw_events ORDER BY occurred_at ASC, idempotency_id ASC"
-        )
-        for row in cur:
-            yield json.loads(row["payload"])
+        return self._iter_replay("", ())
+
+    def iter_events_partition(self, part: int, parts: int) -> Iterator[dict]:
+        """События чатов части part из parts (см. chat_partition) в порядке
+        iter_all_events_ordered. Отбор идёт в SQLite, поэтому события чужих
+        частей не собираются в словари."""
+        return self._iter_replay("WHERE chat_partition(chat_id, ?) = ? ",
+                                 (parts, part))
+
+    def iter_positions(self) -> Iterator[tuple[str, str]]:
+        """(occurred_at, idempotency_id) всех событий в порядке проигрывания."""
+        for conn in self._sources():
+            cur = conn.execute("SELECT occurred_at, idempotency_id FROM raw_events "
+                               "ORDER BY occurred_at ASC, idempotency_id ASC")
+            cur.row_factory = None
+            yield from cur
+
+    def iter_events_after(self, occurred_at: str,
+                          idempotency_id: str) -> Iterator[dict]:
+        """События строго после курсора (occurred_at, idempotency_id),
+        в том же порядке, что и iter_all_events_ordered."""
+        return self._iter_replay(
+            "WHERE occurred_at >= ? AND (occurred_at > ? OR idempotency_id > ?) ",
+            (occurred_at, occurred_at, idempotency_id), first=month_of(occurred_at))
+
+    def iter_events_window(self, after: Optional[tuple[str, str]], until_iso: str,
+                           chat_ids: Optional[Iterable[str]] = None) -> Iterator[dict]:
+        """События после курсора after (без него — с начала) по until_iso
+        включительно; с chat_ids — только событий этих чатов."""
+        where, params = self._window(after, until_iso)
+        if chat_ids is not None:
+            chat_ids = list(chat_ids)
+            if not chat_ids:
+                return iter(())
+            where += f" AND chat_id IN ({','.join('?' * len(chat_ids))})"
+            params += tuple(chat_ids)
+        return self._iter_replay(f"WHERE {where} ", params,
+                                 *self._window_months(after, until_iso))
+
+    def chat_ids_window(self, after: Optional[tuple[str, str]],
+                        until_iso: str) -> set[str]:
+        """Исходные chat_id событий в том же окне, что iter_events_window."""
+        where, params = self._window(after, until_iso)
+        return {row["chat_id"]
+                for conn in self._sources(*self._window_months(after, until_iso))
+                for row in conn.execute(
+                    f"SELECT DISTINCT chat_id FROM raw_events WHERE {where}", params)
+                if row["chat_id"]}
+
+    @staticmethod
+    def _window(after: Optional[tuple[str, str]], until_iso: str) -> tuple[str, tuple]:
+        if after is None:
+            return "occurred_at <= ?", (until_iso,)
+        return ("occurred_at <= ? AND occurred_at >= ? "
+                "AND (occurred_at > ? OR idempotency_id > ?)",
+                (until_iso, after[0], after[0], after[1]))
+
+    @staticmethod
+    def _window_months(after: Optional[tuple[str, str]],
+                       until_iso: str) -> tuple[Optional[str], str]:
+        return (month_of(after[0]) if after else None), month_of(until_iso)
+
+    def _iter_replay(self, where: str, params: tuple, first: Optional[str] = None,
+                     last: Optional[str] = None) -> Iterator[dict]:
+        order = "ORDER BY occurred_at ASC, idempotency_id ASC"
+        for conn in self._sources(first, last):
+            if self.storage == STORAGE_COMPACT:
+                cur = conn.execute(
+                    f"SELECT {_REPLAY_COLUMNS} FROM raw_events {where}{order}", params)
+                cur.row_factory = None
+                for row in cur:
+                    yield event_from_fields(*row)
+                continue
+            cur = conn.execute(
+                f"SELECT payload FROM raw_events {where}{order}", params)
+            for row in cur:
+                yield json.loads(row["payload"])
+
+    def iter_payloads(self, event_type: Optional[str] = None,
+                      limit: Optional[int] = None) -> Iterator[dict]:
+        """Исходные события целиком — для разбора, а не для проигрывания."""
+        column = "payload_z" if self.storage == STORAGE_COMPACT else "payload"
+        sql = f"SELECT {column} AS body FROM raw_events"
+        params: list = []
+        if event_type:
+            sql += " WHERE type=?"
+            params.append(event_type)
+        if limit:
+            sql += " LIMIT ?"
+        left = limit
+        for conn in self._sources():
+            for row in conn.execute(sql, params + [left] if limit else params):
+                yield self._decode(row["body"])
+                if limit:
+                    left -= 1
+            if limit and left <= 0:
+                return
+
+    def get_payload(self, idempotency_id: str) -> Optional[dict]:
+        column = "payload_z" if self.storage == STORAGE_COMPACT else "payload"
+        for conn in self._sources():
+            row = conn.execute(
+                f"SELECT {column} AS body FROM raw_events WHERE idempotency_id=?",
+                (idempotency_id,)).fetchone()
+            if row:
+                return self._decode(row["body"])
+        return None
+
+    def _decode(self, body) -> dict:
+        if self.storage == STORAGE_COMPACT:
+            return unpack_payload(body)
+        return json.loads(body)
+
+    def count_through(self, occurred_at: str, idempotency_id: str) -> int:
+        """Сколько событий лежит в базе до курсора включительно. В помесячной
+        базе прошлые месяцы берутся из списка месяцев, считается только месяц
+        курсора."""
+        sql = ("SELECT COUNT(*) AS c FROM raw_events "
+               "WHERE occurred_at <= ? AND (occurred_at < ? OR idempotency_id <= ?)")
+        params = (occurred_at, occurred_at, idempotency_id)
+        if self.layout == LAYOUT_SINGLE:
+            return self.conn.execute(sql, params).fetchone()["c"]
+        month = month_of(occurred_at)
+        before = self.conn.execute(
+            "SELECT COALESCE(SUM(events), 0) AS c FROM event_partitions "
+            "WHERE month < ?", (month,)).fetchone()["c"]
+        return before + sum(conn.execute(sql, params).fetchone()["c"]
+                            for conn in self._sources(month, month))
 
     def close(self) -> None:
+        for conn in self._writers.values():
+            conn.close()
+        self._writers.clear()
         self.conn.close()
+        if self._unpack_dir:
+            shutil.rmtree(self._unpack_dir, ignore_errors=True)
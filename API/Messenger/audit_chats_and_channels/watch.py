@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
+
+import httpx
+
+from projection import ChatState, event_fields, normalize_chat_id
+
+log = logging.getLogger("watch")
+
+# сколько неотправленных изменений держать, пока адрес для уведомлений
+# не отвечает; более старые отбрасываются
+WEBHOOK_BACKLOG = 10_000
+
+
+@dataclass
+class MembershipChange:
+    change: str                          # member_added | bot_added | member_removed |
+                                         # bot_removed | role_changed | chat_created |
+                                         # chat_changed | group_added | group_removed |
+                                         # department_added | department_removed
+    chat_key: str
+    detected_at: str
+    chat_name: Optional[str] = None
+    chat_type: Optional[str] = None
+    uid: Optional[str] = None
+    login: Optional[str] = None
+    role: Optional[str] = None
+    previous_role: Optional[str] = None
+    is_bot: bool = False
+    object_id: Optional[str] = None      # группа или подразделение
+    by_login: Optional[str] = None
+    occurred_at: Optional[str] = None    # пусто, если найдено сверкой состояний
+    idempotency_id: Optional[str] = None
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _member_change(added: bool, is_bot: bool) -> str:
+    if is_bot:
+        return "bot_added" if added else "bot_removed"
+    return "member_added" if added else "member_removed"
+
+
+def diff_chats(old: dict[str, ChatState], new: dict[str, ChatState],
+               detected_at: str) -> list[MembershipChange]:
+    """Отличия двух состояний — когда события докатить нельзя и состояние
+    пересобрано целиком. Без автора и времени события."""
+    changes: list[MembershipChange] = []
+    for key in dict.fromkeys([*old, *new]):
+        before, after = old.get(key), new.get(key)
+        chat = after or before
+        base = {"chat_key": key, "detected_at": detected_at,
+                "chat_name": chat.name, "chat_type": chat.type}
+        if before is None:
+            changes.append(MembershipChange(change="chat_created", **base))
+        before_members = before.members if before else {}
+        after_members = after.members if after else {}
+        for uid in dict.fromkeys([*before_members, *after_members]):
+            was, now = before_members.get(uid), after_members.get(uid)
+            if was is None:
+                changes.append(MembershipChange(
+                    change=_member_change(True, now.is_bot), uid=uid,
+                    role=now.role, is_bot=now.is_bot, **base))
+            elif now is None:
+                changes.append(MembershipChange(
+                    change=_member_change(False, was.is_bot), uid=uid,
+                    previous_role=was.role, is_bot=was.is_bot, **base))
+            elif (was.role or "") != (now.role or ""):
+                changes.append(MembershipChange(
+                    change="role_changed", uid=uid, role=now.role,
+                    previous_role=was.role, is_bot=now.is_bot, **base))
+    return changes
+
+
+class JsonlSink:
+    """Изменения построчно в файл JSONL; файл только дописывается."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def emit(self, changes: list[MembershipChange]) -> None:
+        with open(self.path, "a", encoding="utf-8") as handle:
+            for change in changes:
+                handle.write(change.to_json() + "\n")
+
+    def close(self) -> None:
+        pass
+
+
+class WebhookSink:
+    """Изменения POST-запросом {"changes": [...]} на адрес, обычно локальный.
+
+    Если адрес не ответил, изменения копятся и уходят со следующей пачкой:
+    наблюдение из-за этого не останавливается. При остановке делается
+    последняя попытка; что не ушло, сохраняется в spool (JSONL) и
+    отправляется со следующей пачкой следующего запуска."""
+
+    def __init__(self, url: str, *, timeout: float = 10.0,
+                 spool: Optional[str] = None):
+        self.url = url
+        self.http = httpx.Client(timeout=timeout)
+        self.spool = spool
+        self.pending: list[dict] = []
+        if spool and os.path.exists(spool):
+            with open(spool, encoding="utf-8") as handle:
+                self.pending = [json.loads(line) for line in handle if line.strip()]
+            log.info("С прошлого запуска не отправлено изменений: %s. "
+                     "Отправим с первой пачкой.", len(self.pending))
+
+    def emit(self, changes: list[MembershipChange]) -> None:
+        self.pending.extend(asdict(change) for change in changes)
+        if len(self.pending) > WEBHOOK_BACKLOG:
+            dropped = len(self.pending) - WEBHOOK_BACKLOG
+            del self.pending[:dropped]
+            log.warning("Адрес для уведомлений давно не отвечает: отбросили "
+                        "%s старых изменений.", dropped)
+        if self.pending:
+            self._send("Попробуем со следующей пачкой.")
+
+    def _send(self, then: str) -> bool:
+        try:
+            resp = self.http.post(self.url, json={"changes": self.pending})
+            resp.raise_for_status()
+        except httpx.HTTPError as exc:
+            log.warning("Не удалось отправить %s изменений на %s: %s. %s",
+                        len(self.pending), self.url, exc, then)
+            return False
+        self.pending.clear()
+        if self.spool and os.path.exists(self.spool):
+            os.remove(self.spool)
+        return True
+
+    def close(self) -> None:
+        try:
+            if self.pending and not self._send("Это была последняя попытка."):
+                self._save_pending()
+        finally:
+            self.http.close()
+
+    def _save_pending(self) -> None:
+        if not self.spool:
+            log.warning("Изменения не отправлены и потеряны: %s.",
+                        len(self.pending))
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.spool)), exist_ok=True)
+        tmp = f"{self.spool}.tmp"
+        with open(tmp, "w", encoding="utf-8") as handle:
+            for item in self.pending:
+                handle.write(json.dumps(item, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.spool)
+        log.warning("Изменения не отправлены: %s. Сохранили в %s, отправим "
+                    "при следующем запуске.", len(self.pending), self.spool)
+
+
+class ChangeWatcher:
+    """Состояние чатов в памяти, докатываемое по новым событиям.
+
+    poll() применяет события после сохранённого курсора, по каждому
+    событию сравнивает участника до и после и отдаёт изменения в sinks.
+    Затронутые чаты сохраняются в ProjectionStore, изменения состава —
+    в membership_scd; обе записи — короткие транзакции на один опрос.
+
+    Если состояние в базе сдвинул кто-то другой (analyze) или пришли
+    события раньше уже учтённых, состояние перечитывается, а изменения
+    находятся сверкой старого и нового."""
+
+    def __init__(self, store, projection, snapshots, identity_store,
+                 sinks: Iterable, *, include_private: bool = False,
+                 run_id: Optional[str] = None):
+        self.store = store
+        self.projection = projection
+        self.snapshots = snapshots
+        self.identity_store = identity_store
+        self.sinks = list(sinks)
+        self.include_private = include_private
+        self.run_id = run_id or f"watch-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}Z"
+        self.chats: dict[str, ChatState] = {}
+        self.applied = 0
+        self._pending: list[MembershipChange] = []
+
+    def start(self) -> None:
+        self.chats = self.projection.refresh(self.store)
+        self.applied = self.projection.applied()
+        log.info("Наблюдение начато: чатов %s, учтено событий %s.",
+                 len(self.chats), self.applied)
+
+    def poll(self) -> list[MembershipChange]:
+        """Применяет накопленные в базе новые события. -> изменения."""
+        self._pending = []
+        reason = self.projection.stale_reason(self.store)
+        if reason is None and self.projection.applied() != self.applied:
+            reason = "сохранённое состояние обновил другой запуск"
+        if reason:
+            log.info("Перечитываем состояние чатов: %s.", reason)
+            old = self.chats
+            self.chats = self.projection.refresh(self.store)
+            self._pending = diff_chats(old, self.chats, _now())
+        else:
+            self.projection.advance(self.store, self.chats, observe=self._observe)
+        self.applied = self.projection.applied()
+
+        changes = [change for change in self._pending if self._in_scope(change)]
+        if not changes:
+            return []
+        logins = self.identity_store.logins_for(
+            {change.uid for change in changes if change.uid})
+        for change in changes:
+            change.login = logins.get(change.uid) if change.uid else None
+        touched = [self.chats[key] for key in dict.fromkeys(
+            change.chat_key for change in changes) if key in self.chats]
+        self.snapshots.apply_changes(changes, touched, self.run_id)
+        for sink in self.sinks:
+            sink.emit(changes)
+        return changes
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+    def _in_scope(self, change: MembershipChange) -> bool:
+        chat = self.chats.get(change.chat_key)
+        chat_type = chat.type if chat else change.chat_type
+        return self.include_private or chat_type != "private"
+
+    def _observe(self, events: Iterable[dict]) -> Iterator[dict]:
+        """Сравнивает чат до и после каждого события (см. ProjectionStore.advance)."""
+        for enriched in events:
+            ev = enriched.get("event", {}) or {}
+            key = normalize_chat_id((ev.get("meta") or {}).get("chat_id"))
+            chat = self.chats.get(key)
+            etype = ev.get("type") or ""
+            uid, _, _, _, _, _, _, group_id, department_id = event_fields(enriched)
+            was = chat.members.get(uid) if chat and uid else None
+            was_role, was_bot = (was.role, was.is_bot) if was else (None, False)
+            existed = chat is not None
+            info = (chat.name, chat.description, chat.type) if chat else None
+
+            yield enriched
+
+            chat = self.chats.get(key)
+            if chat is None:
+                continue
+            base = {"chat_key": key, "detected_at": _now(), "chat_name": chat.name,
+                    "chat_type": chat.type, "by_login": enriched.get("user_login"),
+                    "occurred_at": ev.get("occurred_at"),
+                    "idempotency_id": ev.get("idempotency_id")}
+            if not existed or etype == "messenger_chat.created":
+                self._pending.append(MembershipChange(change="chat_created", **base))
+            elif info != (chat.name, chat.description, chat.type):
+                self._pending.append(MembershipChange(change="chat_changed", **base))
+
+            now = chat.members.get(uid) if uid else None
+            if uid and was is None and now is not None:
+                self._pending.append(MembershipChange(
+                    change=_member_change(True, now.is_bot), uid=uid,
+                    role=now.role, is_bot=now.is_bot, **base))
+            elif uid and was is not None and now is None:
+                self._pending.append(MembershipChange(
+                    change=_member_change(False, was_bot), uid=uid,
+                    previous_role=was_role, is_bot=was_bot, **base))
+            elif now is not None and (was_role or "") != (now.role or ""):
+                self._pending.append(MembershipChange(
+                    change="role_changed", uid=uid, role=now.role,
+                    previous_role=was_role, is_bot=now.is_bot, **base))
+            elif etype.startswith("messenger_chat.group_") and group_id:
+                self._pending.append(MembershipChange(
+                    change=etype.rsplit(".", 1)[-1], object_id=group_id, **base))
+            elif etype.startswith("messenger_chat.department_") and department_id:
+                self._pending.append(MembershipChange(
+                    change=etype.rsplit(".", 1)[-1], object_id=department_id, **base))